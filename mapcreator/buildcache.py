@@ -0,0 +1,133 @@
+"""
+A cache of the results of the build pipelines of a project, so unchanged pipelines aren't rebuilt.
+
+Every pipeline (height, OSM and satellite) is fingerprinted by its inputs: the path, size and
+modification time of its source files, the project settings it reads, the fingerprints of the
+pipelines it reads the results of, and the version of mapcreator and the GDAL bindings. After a
+successful build, the files the pipeline created are copied to the cache with its inputs. When the
+inputs of a later build are the same, the files are copied back instead of running the pipeline,
+so changing an area color only rebuilds the OSM pipeline.
+
+Whole pipelines are cached rather than single stages, as the stages of a pipeline pass each other
+build state in memory (parsed OSM data, virtual GDAL datasets), not files.
+"""
+import hashlib
+import json
+import shutil
+import uuid
+from functools import lru_cache
+from os import path, listdir, makedirs, rename
+from mapcreator import gdal_util
+from mapcreator.gdal_util import GdalinfoCache
+
+MANIFEST_FILE = 'manifest.json'
+FILES_DIR = 'files'
+TEMP_EXTENSION = 'tmp'
+
+# The project settings (State attributes) each pipeline's results depend on
+PIPELINE_SETTINGS = {
+    'height': (
+        'window', 'height_resolution', 'height_coordinatesystem', 'height_tiles', 'height_engine', 'height_encoding',
+        'height_lods', 'normal_map', 'hillshade', 'sky_view', 'terrain_mesh', 'contours', 'tile_cache',
+    ),
+    'osm': ('window', 'area_colors', 'vector_tile_zooms'),
+    'satellite': (
+        'window', 'satellite_resolution', 'satellite_coordinatesystem', 'satellite_encoding', 'satellite_mipmaps',
+        'satellite_palette', 'satellite_texture', 'optimized_satellite_files', 'tile_cache',
+    ),
+}
+
+@lru_cache(maxsize=1)
+def tool_version():
+    """Returns a digest of the mapcreator sources and the version of the GDAL bindings, if any."""
+    digest = hashlib.sha1()
+    package_dir = path.dirname(path.abspath(__file__))
+    for name in sorted(listdir(package_dir)):
+        if name.endswith('.py'):
+            with open(path.join(package_dir, name), 'rb') as f:
+                digest.update(f.read())
+    if gdal_util.has_gdal_bindings():
+        digest.update(gdal_util.gdal.__version__.encode('utf-8'))
+    return digest.hexdigest()
+
+def pipeline_inputs(pipeline, files, state, upstream = None):
+    """
+    Returns the inputs of pipeline building files, as a JSON-serializable dict.
+    upstream maps the names of the pipelines whose results it reads to their fingerprints.
+    """
+    settings = state.to_dict()
+    inputs = {
+        'sources': [[path.abspath(f), GdalinfoCache.fingerprint(f)] for f in files],
+        'tool_version': tool_version(),
+    }
+    for name in PIPELINE_SETTINGS[pipeline]:
+        inputs[name] = settings.get(name)
+    for name, upstream_fingerprint in sorted((upstream or {}).items()):
+        inputs['{} pipeline'.format(name)] = upstream_fingerprint
+    # As they would be read back from a manifest, with tuples as lists
+    return json.loads(json.dumps(inputs))
+
+def fingerprint(inputs):
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+def changed_inputs(old, new):
+    """Returns the names of the inputs that differ between two input dicts, in order."""
+    return sorted(name for name in set(old) | set(new) if old.get(name) != new.get(name))
+
+class BuildCache:
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def pipeline_dir(self, pipeline):
+        return path.join(self.directory, pipeline)
+
+    def load(self, pipeline):
+        """Returns the manifest of the cached build of pipeline, or None if there is none."""
+        try:
+            with open(path.join(self.pipeline_dir(pipeline), MANIFEST_FILE), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, pipeline, inputs, files, report):
+        """
+        Caches the files, (package name, path) pairs, created by a build of pipeline with the given inputs,
+        and its build report. The entry is written next to the cached one and renamed into place, so an
+        interrupted build never leaves a partial entry. Returns whether the files were cached.
+        """
+        if not all(path.isfile(fpath) for name, fpath in files):
+            return False
+        pipeline_dir = self.pipeline_dir(pipeline)
+        tempdir = '{}.{}.{}'.format(pipeline_dir, uuid.uuid4().hex, TEMP_EXTENSION)
+        for name, fpath in files:
+            cachepath = path.join(tempdir, FILES_DIR, *name.split('/'))
+            makedirs(path.dirname(cachepath), exist_ok=True)
+            shutil.copy2(fpath, cachepath)
+        manifest = {
+            'fingerprint': fingerprint(inputs),
+            'inputs': inputs,
+            'files': [name for name, fpath in files],
+            'report': report,
+        }
+        makedirs(tempdir, exist_ok=True)
+        with open(path.join(tempdir, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f)
+        if path.exists(pipeline_dir):
+            shutil.rmtree(pipeline_dir)
+        rename(tempdir, pipeline_dir)
+        return True
+
+    def restore(self, pipeline, manifest, directory):
+        """Copies the cached files of pipeline into directory. Returns their paths."""
+        outfiles = []
+        for name in manifest['files']:
+            outpath = path.join(directory, *name.split('/'))
+            makedirs(path.dirname(outpath), exist_ok=True)
+            shutil.copy2(path.join(self.pipeline_dir(pipeline), FILES_DIR, *name.split('/')), outpath)
+            outfiles.append(outpath)
+        return outfiles
+
+    def clear(self):
+        if path.exists(self.directory):
+            shutil.rmtree(self.directory)
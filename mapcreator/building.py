@@ -1,12 +1,23 @@
 import re
+import json
+import math
 import subprocess
 import shutil
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from os import path, listdir, makedirs, rename, remove, devnull
 from io import StringIO
+from collections import OrderedDict
 from xml.etree import ElementTree as ET
 from zipfile import ZipFile, ZIP_DEFLATED
-from mapcreator import persistence, osm, gdal_util
+from mapcreator import persistence, osm, gdal_util, vectortiles, resources, pyramid, heightcodec, png, resample, shading, rtin, contours, mipmap, optimize, gputexture, palette, scheduler
+from mapcreator.tilecache import TileCache
+from mapcreator.sourceindex import SourceIndex
 from mapcreator.osm import OSMData
+from mapcreator.envi import EnviRaster, header_path
+from mapcreator.trailgraph import TrailGraph
 
 BUILD_DIR = path.join(persistence.STATE_DIR, 'build')
 FINALIZED_DIR = path.join(BUILD_DIR, 'finalized')
@@ -14,11 +25,14 @@ FINALIZED_DIR = path.join(BUILD_DIR, 'finalized')
 OUTPUT_FILENAME_REGEX = re.compile(r'^\[(\d+)\](.*)')
 OUTPUT_FILENAME_FORMAT = '[{}]{}'
 
-INTERNAL_FORMAT = 'GTiff'
-INTERNAL_FILE_EXTENSION = 'tiff'
+INTERNAL_FORMAT = 'VRT'
+INTERNAL_FILE_EXTENSION = 'vrt'
 
 LATLON_DATUM_IDENTIFIER = 'EPSG:4326'
 PROJECTION_IDENTIFIER = 'EPSG:3857'
+WARP_RESAMPLING = 'bilinear'
+# Cached tiles are on the output grid already, so their pixels are copied as they are
+TILE_CACHE_RESAMPLING = 'near'
 
 HEIGHT_OUTPUT_FORMAT = 'ENVI'
 HEIGHT_OUTPUT_FILE_EXTENSION = 'bin'
@@ -27,13 +41,49 @@ SATELLITE_OUTPUT_FORMAT = 'PNG'
 OSM_FILE_EXTENSION = 'xml'
 SATELLITE_FILE_EXTENSION = 'tif'
 SATELLITE_OUTPUT_FILE_EXTENSION = 'png'
+# Satellite codec -> (GDAL driver, file extension, lowest quality, highest quality, default quality).
+# The quality of PNG is its zlib compression level, which doesn't affect the pixels.
+SATELLITE_CODECS = OrderedDict([
+    ('png', ('PNG', 'png', 0, 9, 6)),
+    ('jpeg', ('JPEG', 'jpg', 1, 100, 75)),
+    ('webp', ('WEBP', 'webp', 1, 100, 75)),
+])
+TRAIL_GRAPH_FILE_EXTENSION = 'bin'
 
+MOSAIC_HEIGHT_FILENAME = 'heightfile_mosaic.' + INTERNAL_FILE_EXTENSION
 INTERMEDIATE_HEIGHT_FILENAME = 'heightfile_intermediate.' + INTERNAL_FILE_EXTENSION
-INTERMEDIATE_SATELLITE_FORMAT = 'heightfile{}_satellite.' + SATELLITE_FILE_EXTENSION
+INTERMEDIATE_HEIGHT_TILE_FORMAT = 'heightfile{}_intermediate.' + INTERNAL_FILE_EXTENSION
+MOSAIC_SATELLITE_FORMAT = 'heightfile{}_satellite_mosaic.' + INTERNAL_FILE_EXTENSION
+# Reprojections linked from the tile cache, and the composite of them, named after the pipeline
+CACHED_TILE_FORMAT = '{}_cached_tile{}.tif'
+CACHED_TILES_FORMAT = '{}_cached_tiles.' + INTERNAL_FILE_EXTENSION
+INTERMEDIATE_SATELLITE_FORMAT = 'heightfile{}_satellite.' + INTERNAL_FILE_EXTENSION
 FINAL_HEIGHT_FILENAME_FORMAT = 'heightfile{}.' + HEIGHT_OUTPUT_FILE_EXTENSION
 FINAL_HEIGHT_METADATA_FORMAT = 'heightfile{}.' + HEIGHT_METADATA_FILE_EXTENSION
+HEIGHT_TILE_MANIFEST_FILENAME = 'heightfile_tiles.json'
+FINAL_HEIGHT_LOD_FORMAT = 'heightfile{}_lod{}.' + HEIGHT_OUTPUT_FILE_EXTENSION
+FINAL_HEIGHT_LOD_METADATA_FORMAT = 'heightfile{}_lod{}.' + HEIGHT_METADATA_FILE_EXTENSION
+HEIGHT_LOD_MANIFEST_FILENAME = 'heightfile_lods.json'
+FINAL_NORMAL_MAP_FORMAT = 'heightfile{}_normals.png'
+FINAL_HILLSHADE_FORMAT = 'heightfile{}_hillshade.png'
+FINAL_SKY_VIEW_FORMAT = 'heightfile{}_skyview.png'
+FINAL_MESH_VERTICES_FORMAT = 'heightfile{}_mesh.vtx'
+FINAL_MESH_INDICES_FORMAT = 'heightfile{}_mesh.idx'
+MESH_MANIFEST_FILENAME = 'heightfile_meshes.json'
+FINAL_CONTOURS_FORMAT = 'heightfile{}_contours.vtx'
+CONTOURS_MANIFEST_FILENAME = 'heightfile_contours.json'
 FINAL_OSM_FORMAT = 'heightfile{}_trails.' + OSM_FILE_EXTENSION
-FINAL_SATELLITE_FORMAT = 'heightfile{}_satellite.' + SATELLITE_OUTPUT_FILE_EXTENSION
+FINAL_SATELLITE_NAME_FORMAT = 'heightfile{}_satellite.{}'
+FINAL_SATELLITE_FORMAT = FINAL_SATELLITE_NAME_FORMAT.format('{}', SATELLITE_OUTPUT_FILE_EXTENSION)
+INTERMEDIATE_SATELLITE_RAW_FORMAT = 'heightfile{}_satellite_raw.' + HEIGHT_OUTPUT_FILE_EXTENSION
+INTERMEDIATE_SATELLITE_MIP_RAW_FORMAT = 'heightfile{}_satellite_mip{}_raw.' + HEIGHT_OUTPUT_FILE_EXTENSION
+FINAL_SATELLITE_MIP_FORMAT = 'heightfile{}_satellite_mip{}.{}'
+SATELLITE_MIPMAP_MANIFEST_FILENAME = 'heightfile_satellite_mipmaps.json'
+FINAL_SATELLITE_TEXTURE_FORMAT = 'heightfile{}_satellite.ktx'
+FINAL_TRAIL_GRAPH_FORMAT = 'heightfile{}_trailgraph.' + TRAIL_GRAPH_FILE_EXTENSION
+VECTOR_TILE_DIRNAME = 'tiles'
+VECTOR_TILE_TRAIL_LAYER = 'trails'
+VECTOR_TILE_AREA_LAYER = 'areas'
 
 OSM_RGB_KEY = "3dmapsrgb"
 OSM_RGB_VALUE_FORMAT = "{0[0]} {0[1]} {0[2]}"
@@ -46,6 +96,212 @@ def call_command(command, buildstatus, debug = False):
         if debug: buildstatus.output.write(stdout.decode('utf-8'))
         buildstatus.output.write(stderr.decode('utf-8'))
 
+def warp_in_process(buildstatus, cellsize, source_system = None, debug = False, sources = None, window = None, window_system = PROJECTION_IDENTIFIER, outpath = '', overview_level = None, resampling = WARP_RESAMPLING, mosaic = True):
+    """
+    Warps buildstatus.current_files (or the given sources) to the projection window on the cellsize grid
+    (or the given window in window_system) with the in-process GDAL engine. Returns a virtual dataset,
+    which is also written to outpath if given. overview_level is the gdalwarp -ovr value to warp with,
+    if not GDAL's default. See GdalEngine.warp for mosaic.
+    """
+    sources = sources or buildstatus.current_files
+    if debug: buildstatus.output.write('\n[in-process gdalwarp {}]\n'.format(' '.join(map(str, sources))))
+    return gdal_util.get_engine().warp(
+        sources, cellsize, window or get_aligned_window(buildstatus.state, cellsize),
+        window_system, PROJECTION_IDENTIFIER, source_system, buildstatus.output,
+        buildstatus.resource_settings, outpath, overview_level, resampling, mosaic
+    )
+
+def build_mosaic(buildstatus, mosaicpath, debug = False):
+    call_command('gdalbuildvrt {} {}'.format(mosaicpath, ' '.join(buildstatus.current_files)), buildstatus, debug)
+
+def overview_cmd(overview_level):
+    return '-ovr {} '.format(overview_level) if overview_level is not None else ''
+
+def warp_vrt(buildstatus, cellsize, source_system, sourcepath, outpath, window_string, window_system, debug = False, overview_level = None, resampling = WARP_RESAMPLING):
+    settings = buildstatus.resource_settings
+    command = 'gdalwarp {resource_cmd}{source_system_cmd}{overview_cmd}-of {internal_format} -tr {cellsize} {cellsize} -te_srs {window_system} -t_srs {projection_identifier} -r {resampling} -te {projection_window} {sourcepath} {outpath}'.format(
+        resource_cmd = settings.warp_options() if settings else '',
+        source_system_cmd = '-s_srs {} '.format(source_system) if source_system else '',
+        overview_cmd = overview_cmd(overview_level),
+        internal_format = INTERNAL_FORMAT,
+        cellsize = cellsize,
+        window_system = window_system,
+        projection_identifier = PROJECTION_IDENTIFIER,
+        resampling = resampling,
+        projection_window = window_string,
+        sourcepath = sourcepath,
+        outpath = outpath
+    )
+    call_command(command, buildstatus, debug)
+
+def warp_to_vrt(buildstatus, cellsize, source_system, mosaicpath, outpath, debug = False, overview_level = None, resampling = WARP_RESAMPLING):
+    """
+    Mosaics buildstatus.current_files into a VRT and warps that into another VRT covering the projection window
+    on the cellsize grid. Neither step writes any pixels: they are computed only when the result is translated
+    to its final format. With an overview_level the files are warped without the mosaic, which doesn't have
+    their overviews.
+    """
+    if overview_level is None:
+        build_mosaic(buildstatus, mosaicpath, debug)
+        sourcepath = mosaicpath
+    else:
+        sourcepath = ' '.join(buildstatus.current_files)
+    warp_vrt(
+        buildstatus, cellsize, source_system, sourcepath, outpath,
+        '{} {} {} {}'.format(*get_aligned_window(buildstatus.state, cellsize)), PROJECTION_IDENTIFIER,
+        debug, overview_level, resampling
+    )
+
+def reproject(buildstatus, cellsize, source_system, sourcepath, outpath, debug = False, overview_level = None):
+    """
+    Writes the whole of sourcepath reprojected to a GeoTIFF at outpath, its pixels aligned on multiples of cellsize.
+    The GeoTIFF has an alpha band masking the pixels outside the footprint of sourcepath.
+    """
+    engine = gdal_util.get_engine()
+    settings = buildstatus.resource_settings
+    if engine:
+        if debug: buildstatus.output.write('\n[in-process gdalwarp -tap {} {}]\n'.format(sourcepath, outpath))
+        engine.reproject(outpath, sourcepath, cellsize, PROJECTION_IDENTIFIER, source_system, buildstatus.output, settings, overview_level)
+        return
+    command = 'gdalwarp {resource_cmd}{source_system_cmd}{overview_cmd}-of GTiff {creation_cmd} -tr {cellsize} {cellsize} -tap -t_srs {projection_identifier} -r bilinear -dstalpha {sourcepath} {outpath}'.format(
+        resource_cmd = settings.warp_options() if settings else '',
+        source_system_cmd = '-s_srs {} '.format(source_system) if source_system else '',
+        overview_cmd = overview_cmd(overview_level),
+        creation_cmd = ' '.join('-co {}'.format(option) for option in gdal_util.REPROJECTED_CREATION_OPTIONS),
+        cellsize = cellsize,
+        projection_identifier = PROJECTION_IDENTIFIER,
+        sourcepath = sourcepath,
+        outpath = outpath
+    )
+    call_command(command, buildstatus, debug)
+
+def pull_from_tile_cache(buildstatus, prefix, cellsize, source_system, debug = False, overview_level = None):
+    """
+    Replaces buildstatus.current_files with a composite of their reprojections from the shared tile cache,
+    reprojecting the files that aren't cached yet. The reprojections are linked into the build directory
+    as files named after prefix, so that other builds evicting them from the cache don't affect this one.
+    Returns the coordinate system to warp the current files from.
+    If any of the files can't be cached, all of them are left as they are.
+    """
+    state = buildstatus.state
+    if not state.has_tile_cache(): return source_system
+    directory, max_mb = state.get_tile_cache()
+    cache = TileCache(directory, max_mb * 1024 * 1024)
+    keys = [cache.key(f, cellsize, source_system, PROJECTION_IDENTIFIER, overview_level) for f in buildstatus.current_files]
+    if None in keys: return source_system
+    tilepaths = [path.join(BUILD_DIR, CACHED_TILE_FORMAT.format(prefix, i)) for i in range(len(keys))]
+
+    def pull(sourcepath, key, tilepath):
+        return cache.pull(key, lambda outpath: reproject(buildstatus, cellsize, source_system, sourcepath, outpath, debug, overview_level), tilepath)
+
+    workers = resources.worker_count(state, len(keys))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(pull, buildstatus.current_files, keys, tilepaths))
+    if not all(written for written, cached in results):
+        buildstatus.tile_cache_report = 'not used, as some files could not be reprojected'
+        return source_system
+    cache.evict(keep=[cache.tile_path(key) for key in keys])
+    buildstatus.tile_cache_report = '{} of {} files reused from {}'.format(
+        sum(cached for written, cached in results), len(results), directory
+    )
+    buildstatus.current_files = [composite_tiles(
+        buildstatus, cellsize, tilepaths, path.join(BUILD_DIR, CACHED_TILES_FORMAT.format(prefix)), debug
+    )]
+    return None
+
+def composite_tiles(buildstatus, cellsize, tilepaths, outpath, debug = False):
+    """
+    Warps the reprojected tiles, which are on the output grid already, into a VRT at outpath covering the
+    projection window, and returns outpath. Unlike a mosaic, the warp takes the pixels of each tile only
+    within its alpha band, so the empty corners around the footprint of one tile don't cover another tile.
+    """
+    window = get_aligned_window(buildstatus.state, cellsize)
+    if gdal_util.has_gdal_bindings():
+        warp_in_process(
+            buildstatus, cellsize, None, debug, tilepaths, window, PROJECTION_IDENTIFIER, outpath,
+            resampling=TILE_CACHE_RESAMPLING, mosaic=False
+        )
+    else:
+        warp_vrt(
+            buildstatus, cellsize, None, ' '.join(tilepaths), outpath, '{} {} {} {}'.format(*window),
+            PROJECTION_IDENTIFIER, debug, resampling=TILE_CACHE_RESAMPLING
+        )
+    return outpath
+
+def translate(buildstatus, source, outpath, output_format, debug = False, creation_options = ()):
+    """
+    Translates source to outpath. Source is a path, or a dataset produced by the in-process engine.
+    creation_options are passed to the output format's driver.
+    """
+    engine = gdal_util.get_engine()
+    settings = buildstatus.resource_settings
+    if engine:
+        if debug: buildstatus.output.write('\n[in-process gdal_translate -of {} {}]\n'.format(output_format, outpath))
+        engine.translate(outpath, source, output_format, buildstatus.output, list(creation_options))
+    else:
+        command = 'gdal_translate {}-of {} {}{} {}'.format(
+            settings.config_options() if settings else '', output_format,
+            ''.join('-co {} '.format(option) for option in creation_options), source, outpath
+        )
+        call_command(command, buildstatus, debug)
+
+def translate_concurrently(buildstatus, jobs, output_format, debug = False):
+    """
+    Translates (source, outpath) jobs with a pool of workers. The pixels are computed by GDAL, either
+    in gdal_translate processes or in-process with the GIL released, so the jobs run in parallel.
+    """
+    workers = resources.worker_count(buildstatus.state, len(jobs))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(translate, buildstatus, source, outpath, output_format, debug) for source, outpath in jobs]
+        for future in futures:
+            future.result()
+
+def get_mercator_window(state):
+    """Returns the window as (minx, miny, maxx, maxy) in EPSG:3857."""
+    minlon, minlat, maxlon, maxlat = state.get_window_lowerleft_topright()
+    minx, miny = vectortiles.lonlat_to_mercator(min(minlon, maxlon), min(minlat, maxlat))
+    maxx, maxy = vectortiles.lonlat_to_mercator(max(minlon, maxlon), max(minlat, maxlat))
+    return (float(minx), float(miny), float(maxx), float(maxy))
+
+def get_aligned_window(state, cellsize):
+    """
+    Returns the window in EPSG:3857 grown to whole multiples of cellsize, the grid the tile cache reprojects
+    to, so that a window cut from the cached tiles takes their pixels as they are.
+    """
+    minx, miny, maxx, maxy = get_mercator_window(state)
+    return (
+        math.floor(round(minx / cellsize, 6)) * cellsize, math.floor(round(miny / cellsize, 6)) * cellsize,
+        math.ceil(round(maxx / cellsize, 6)) * cellsize, math.ceil(round(maxy / cellsize, 6)) * cellsize
+    )
+
+def split_window(bounds, cellsize, columns, rows):
+    """
+    Splits bounds (minx, miny, maxx, maxy) into a grid of columns x rows tiles whose edges fall on
+    whole cells, so that the tiles line up without gaps or overlap. Tiles are numbered row by row,
+    starting from the north-west corner.
+    """
+    minx, miny, maxx, maxy = bounds
+    width = int(math.ceil(round((maxx - minx) / cellsize, 6)))
+    height = int(math.ceil(round((maxy - miny) / cellsize, 6)))
+    xedges = [width * c // columns for c in range(columns + 1)]
+    yedges = [height * r // rows for r in range(rows + 1)]
+    tiles = []
+    for row in range(rows):
+        for column in range(columns):
+            if xedges[column] == xedges[column + 1] or yedges[row] == yedges[row + 1]: continue
+            tiles.append({
+                'index': len(tiles),
+                'column': column,
+                'row': row,
+                'bounds': [
+                    minx + xedges[column] * cellsize, maxy - yedges[row + 1] * cellsize,
+                    minx + xedges[column + 1] * cellsize, maxy - yedges[row] * cellsize
+                ],
+                'width': xedges[column + 1] - xedges[column],
+                'height': yedges[row + 1] - yedges[row],
+            })
+    return tiles
+
 def init_build():
     if temp_build_files_exist():
         cleanup()
@@ -54,22 +310,65 @@ def init_build():
 
 def check_projection_window(buildStatus, debug = False):
     if buildStatus.state.has_window():
-        for cf in buildStatus.current_files:
-            gdal_info = gdal_util.Gdalinfo.for_file(cf)
+        # Sources known to be outside the window are dropped without probing them
+        index = SourceIndex.load(persistence.source_index_path())
+        minx, miny, maxx, maxy = buildStatus.state.get_window_lowerleft_topright()
+        candidates = index.select(buildStatus.current_files, (min(minx, maxx), min(miny, maxy), max(minx, maxx), max(miny, maxy)))
+        cache = gdal_util.GdalinfoCache.load(persistence.gdalinfo_cache_path())
+        gdal_infos = cache.get_many(candidates, buildStatus.state.get_probe_threads())
+        for cf, gdal_info in zip(candidates, gdal_infos):
+            index.add(cf, gdal_info)
             cut_projection_window = buildStatus.state.get_window_string_lowerleft_topright_cut(gdal_info)
             if cut_projection_window:
                 buildStatus.add_next_file(cf)
+        cache.save()
+        index.save()
     buildStatus.next()
 
+def plan_resources(buildstatus, cellsize, pixel_bytes):
+    settings = resources.choose_settings(buildstatus.state, cellsize, pixel_bytes)
+    if gdal_util.has_gdal_bindings():
+        gdal_util.get_engine().reserve_cache(settings.cache_mb)
+    buildstatus.resource_settings = settings
+
+def get_package_name(f):
+    # Files in subdirectories of the finalized directory keep their relative path in the package
+    relative = path.relpath(f, FINALIZED_DIR)
+    if relative.startswith(path.pardir):
+        return path.basename(f)
+    return relative.replace(path.sep, '/')
+
 def package(package_name, files):
     with ZipFile(package_name, 'w', ZIP_DEFLATED) as package:
         for f in files:
-            package.write(f, path.basename(f))
+            package.write(f, get_package_name(f))
+
+def describe_files(files):
+    """
+    Returns a human readable listing of files. Files placed in subdirectories of
+    the finalized directory are summarized per directory.
+    """
+    names = []
+    directories = {}
+    for f in files:
+        name = get_package_name(f)
+        if '/' in name:
+            directory = name.split('/')[0]
+            if directory not in directories:
+                directories[directory] = 0
+                names.append(directory)
+            directories[directory] += 1
+        else:
+            names.append(name)
+    return ', '.join(
+        '{}/ ({} files)'.format(name, directories[name]) if name in directories else name for name in names
+    )
 
 def temp_build_files_exist():
     return path.exists(BUILD_DIR)
 
 def cleanup():
+    gdal_util.reset_engine()
     shutil.rmtree(BUILD_DIR)
 
 # HeightMap status and actions
@@ -83,6 +382,12 @@ class HeightMapStatus:
         self.next_files = []
         self.state = state
         self.result_files = []
+        self.resource_settings = None
+        self.tile_cache_report = None
+        self.tiles = []
+        self.encoding_reports = []
+        self.mesh_reports = []
+        self.contour_reports = []
     def add_next_file(self, f):
         self.next_files.append(f)
     def next(self):
@@ -107,9 +412,16 @@ class HeightMapStatus:
         else:
             lines.append('Build results for {}:'.format(', '.join(map(path.basename, self.original_files))))
             if self.result_files:
-                lines.append('-Files created: {}'.format(', '.join(map(path.basename, self.result_files))))
+                lines.append('-Files created: {}'.format(describe_files(self.result_files)))
             else:
                 lines.append('-No files were created')
+            if self.resource_settings:
+                lines.append('-GDAL resources: {}'.format(self.resource_settings))
+            if self.tile_cache_report:
+                lines.append('-Reprojected tile cache: {}'.format(self.tile_cache_report))
+            lines.extend(self.mesh_reports)
+            lines.extend(self.contour_reports)
+            lines.extend(self.encoding_reports)
             if self.output.getvalue():
                 lines.append('-Messages from GDAL:')
                 lines.extend(self.output.getvalue().split('\n'))
@@ -126,31 +438,295 @@ def get_output_path(input_path, new_extension = ''):
     new_filename += ('.' + new_extension if new_extension else '')
     return path.join(BUILD_DIR, new_filename)
 
-# Outputs only one combined file
+# Outputs only one combined file, as a virtual raster that is computed when translated
 def process_heightfiles_with_gdal(heightMapStatus, debug = False):
     if heightMapStatus.current_files:    
+        state = heightMapStatus.state
+        if process_heightfiles_natively(heightMapStatus, debug):
+            return
+        sources = heightMapStatus.current_files
+        source_system = pull_from_tile_cache(
+            heightMapStatus, 'heightfile', state.height_resolution,
+            state.height_coordinatesystem if state.has_height_system() else None, debug
+        )
+        resampling = TILE_CACHE_RESAMPLING if heightMapStatus.current_files is not sources else WARP_RESAMPLING
+        if state.has_height_tiles():
+            process_height_tiles(heightMapStatus, source_system, debug, resampling)
+            return
+        if gdal_util.has_gdal_bindings():
+            dataset = warp_in_process(heightMapStatus, state.height_resolution, source_system, debug, resampling=resampling)
+            heightMapStatus.add_next_file(dataset)
+            heightMapStatus.next()
+            return
         outpath = path.join(BUILD_DIR, INTERMEDIATE_HEIGHT_FILENAME)
-        command = 'gdalwarp {source_system_cmd}-tr {cellsize} {cellsize} -te_srs {latlon_datum_identifier} -t_srs {projection_identifier} -r bilinear -te {projection_window} {heightfiles} {outpath}'.format(
-            source_system_cmd = '-s_srs {} '.format(heightMapStatus.state.height_coordinatesystem) if heightMapStatus.state.has_height_system() else '', 
-            cellsize = heightMapStatus.state.height_resolution, 
-            latlon_datum_identifier = LATLON_DATUM_IDENTIFIER, 
-            projection_identifier = PROJECTION_IDENTIFIER, 
-            projection_window = heightMapStatus.state.get_window_string_lowerleft_topright(), 
-            heightfiles = ' '.join(heightMapStatus.current_files), 
-            outpath = outpath
+        warp_to_vrt(
+            heightMapStatus, state.height_resolution, source_system,
+            path.join(BUILD_DIR, MOSAIC_HEIGHT_FILENAME), outpath, debug, resampling=resampling
         )
-        call_command(command, heightMapStatus, debug)
         heightMapStatus.add_next_file(outpath)
         heightMapStatus.next()
     
+# Outputs a grid of tiles as virtual rasters, which are computed concurrently when translated
+def process_height_tiles(heightMapStatus, source_system, debug = False, resampling = WARP_RESAMPLING):
+    state = heightMapStatus.state
+    columns, rows = state.get_height_tiles()
+    tiles = split_window(get_aligned_window(state, state.height_resolution), state.height_resolution, columns, rows)
+    use_engine = gdal_util.has_gdal_bindings()
+    mosaicpath = path.join(BUILD_DIR, MOSAIC_HEIGHT_FILENAME)
+    if use_engine:
+        gdal_util.get_engine().mosaic(mosaicpath, heightMapStatus.current_files, heightMapStatus.output)
+    else:
+        build_mosaic(heightMapStatus, mosaicpath, debug)
+    for tile in tiles:
+        outpath = path.join(BUILD_DIR, INTERMEDIATE_HEIGHT_TILE_FORMAT.format(tile['index']))
+        if use_engine:
+            warp_in_process(
+                heightMapStatus, state.height_resolution, source_system, debug,
+                [mosaicpath], tile['bounds'], PROJECTION_IDENTIFIER, outpath, resampling=resampling
+            )
+        else:
+            warp_vrt(
+                heightMapStatus, state.height_resolution, source_system, mosaicpath, outpath,
+                '{} {} {} {}'.format(*tile['bounds']), PROJECTION_IDENTIFIER, debug, resampling=resampling
+            )
+        heightMapStatus.add_next_file(outpath)
+    heightMapStatus.tiles = tiles
+    heightMapStatus.next()
+
+# Resamples the height files with the built-in engine, straight into the final height files
+def process_heightfiles_natively(heightMapStatus, debug = False):
+    """Returns False, doing nothing, if the engine isn't chosen or the sources have to be left for GDAL."""
+    state = heightMapStatus.state
+    engine = state.get_height_engine()
+    if engine == 'gdal': return False
+    if state.has_height_system() and state.height_coordinatesystem not in gdal_util.GEOGRAPHIC_SYSTEMS:
+        mosaic = None
+    else:
+        mosaic = resample.open_mosaic(heightMapStatus.current_files)
+    if mosaic is None:
+        if engine == 'numpy':
+            heightMapStatus.output.write('The built-in engine can\'t read the height files, using GDAL instead\n')
+        return False
+    cellsize = state.height_resolution
+    if state.has_height_tiles():
+        columns, rows = state.get_height_tiles()
+        heightMapStatus.tiles = split_window(get_aligned_window(state, cellsize), cellsize, columns, rows)
+        windows = [(tile['index'], tile['bounds']) for tile in heightMapStatus.tiles]
+    else:
+        windows = [(0, get_aligned_window(state, cellsize))]
+    if debug: heightMapStatus.output.write('\n[built-in resampling of {}]\n'.format(' '.join(heightMapStatus.current_files)))
+    jobs = [(bounds, path.join(FINALIZED_DIR, FINAL_HEIGHT_FILENAME_FORMAT.format(index))) for index, bounds in windows]
+    workers = resources.worker_count(state, len(jobs))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(resample.resample_to_envi, mosaic, bounds, cellsize, outpath) for bounds, outpath in jobs]
+        for future in futures:
+            future.result()
+    for bounds, outpath in jobs:
+        heightMapStatus.add_next_file(outpath)
+    heightMapStatus.next()
+    return True
+
+def write_height_tile_manifest(heightMapStatus):
+    state = heightMapStatus.state
+    columns, rows = state.get_height_tiles()
+    manifest = {
+        'columns': columns,
+        'rows': rows,
+        'cellsize': state.height_resolution,
+        'projection': PROJECTION_IDENTIFIER,
+        'bounds': get_aligned_window(state, state.height_resolution),
+        'tiles': [dict(tile,
+            file = FINAL_HEIGHT_FILENAME_FORMAT.format(tile['index']),
+            header = FINAL_HEIGHT_METADATA_FORMAT.format(tile['index'])
+        ) for tile in heightMapStatus.tiles],
+    }
+    outpath = path.join(FINALIZED_DIR, HEIGHT_TILE_MANIFEST_FILENAME)
+    with open(outpath, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    heightMapStatus.add_result_file(outpath)
+
+def plan_height_resources(heightMapStatus, debug = False):
+    if heightMapStatus.current_files:
+        plan_resources(heightMapStatus, heightMapStatus.state.height_resolution, resources.HEIGHT_PIXEL_BYTES)
+
 def translate_heightfiles(heightMapStatus, debug = False):
+    jobs = []
     for ind, cf in enumerate(heightMapStatus.current_files):
         outpath = path.join(FINALIZED_DIR, FINAL_HEIGHT_FILENAME_FORMAT.format(ind))
         metapath = path.join(FINALIZED_DIR, FINAL_HEIGHT_METADATA_FORMAT.format(ind))
-        command = 'gdal_translate -of {} {} {}'.format(HEIGHT_OUTPUT_FORMAT, cf, outpath)
-        call_command(command, heightMapStatus, debug)
+        if cf == outpath:
+            pass # Already written by the built-in engine
+        elif heightMapStatus.tiles:
+            jobs.append((cf, outpath))
+        else:
+            translate(heightMapStatus, cf, outpath, HEIGHT_OUTPUT_FORMAT, debug)
         heightMapStatus.add_result_file(outpath)
         heightMapStatus.add_result_file(metapath)
+    if heightMapStatus.tiles:
+        if jobs: translate_concurrently(heightMapStatus, jobs, HEIGHT_OUTPUT_FORMAT, debug)
+        write_height_tile_manifest(heightMapStatus)
+
+# Writes normal maps, hillshades and sky-view factors of the height files, so the client doesn't have to shade the terrain itself
+def write_shading(heightMapStatus, debug = False):
+    state = heightMapStatus.state
+    if not state.has_normal_map() and not state.has_hillshade() and not state.has_sky_view(): return
+    heightpaths = [f for f in heightMapStatus.get_result_files() if f.endswith('.' + HEIGHT_OUTPUT_FILE_EXTENSION)]
+    for ind, heightpath in enumerate(heightpaths):
+        raster = EnviRaster.load(heightpath)
+        if not raster.has_map_info():
+            heightMapStatus.output.write('{} has no map info, it can\'t be shaded\n'.format(heightpath))
+            continue
+        images = []
+        if state.has_normal_map():
+            normal_vectors = shading.normals(raster, state.get_normal_map())
+            images.append((FINAL_NORMAL_MAP_FORMAT, shading.encode_normals(normal_vectors)))
+        if state.has_hillshade():
+            # Hillshades are meant to look right, so they are never exaggerated
+            normal_vectors = shading.normals(raster)
+            images.append((FINAL_HILLSHADE_FORMAT, shading.hillshade(normal_vectors, *state.get_hillshade())))
+        if state.has_sky_view():
+            directions, radius = state.get_sky_view()
+            bands = int(math.ceil(raster.lines / float(shading.SKY_VIEW_BAND_LINES)))
+            factors = shading.sky_view_factor(raster, directions, radius, resources.worker_count(state, bands))
+            images.append((FINAL_SKY_VIEW_FORMAT, shading.encode_sky_view(factors)))
+        for filename_format, image in images:
+            outpath = path.join(FINALIZED_DIR, filename_format.format(ind))
+            with open(outpath, 'wb') as f:
+                f.write(png.encode_png(image))
+            heightMapStatus.add_result_file(outpath)
+
+# Writes error-bounded adaptive meshes of the height files, so the client doesn't have to triangulate the dense grid
+def write_terrain_meshes(heightMapStatus, debug = False):
+    state = heightMapStatus.state
+    if not state.has_terrain_mesh(): return
+    max_error = state.get_terrain_mesh()
+    heightpaths = [f for f in heightMapStatus.get_result_files() if f.endswith('.' + HEIGHT_OUTPUT_FILE_EXTENSION)]
+    if not heightpaths: return
+    manifest = {'max_error': max_error, 'vertex_format': ['column:uint16', 'row:uint16', 'height:float32'], 'meshes': []}
+    for ind, heightpath in enumerate(heightpaths):
+        raster = EnviRaster.load(heightpath)
+        mesh = rtin.build_mesh(raster, max_error)
+        vertexpath = path.join(FINALIZED_DIR, FINAL_MESH_VERTICES_FORMAT.format(ind))
+        indexpath = path.join(FINALIZED_DIR, FINAL_MESH_INDICES_FORMAT.format(ind))
+        mesh.save(vertexpath, indexpath)
+        heightMapStatus.add_result_file(vertexpath)
+        heightMapStatus.add_result_file(indexpath)
+        dense_triangles = rtin.dense_triangle_count(raster.samples, raster.lines)
+        manifest['meshes'].append({
+            'file': path.basename(heightpath),
+            'vertices': path.basename(vertexpath),
+            'indices': path.basename(indexpath),
+            'index_type': 'uint16' if mesh.index_dtype().itemsize == 2 else 'uint32',
+            'vertex_count': len(mesh.vertices),
+            'triangle_count': mesh.triangle_count,
+            'dense_triangle_count': dense_triangles,
+        })
+        heightMapStatus.mesh_reports.append('-{} mesh: {} triangles instead of {} ({:.1%}), max error {} m'.format(
+            path.basename(heightpath), mesh.triangle_count, dense_triangles,
+            mesh.triangle_count / max(dense_triangles, 1), max_error
+        ))
+    outpath = path.join(FINALIZED_DIR, MESH_MANIFEST_FILENAME)
+    with open(outpath, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    heightMapStatus.add_result_file(outpath)
+
+# Writes contour lines of the height files as vertex buffers, so the client doesn't have to trace them every frame
+def write_contours(heightMapStatus, debug = False):
+    state = heightMapStatus.state
+    if not state.has_contours(): return
+    interval, tolerance = state.get_contours()
+    heightpaths = [f for f in heightMapStatus.get_result_files() if f.endswith('.' + HEIGHT_OUTPUT_FILE_EXTENSION)]
+    if not heightpaths: return
+    manifest = {
+        'interval': interval,
+        'tolerance': tolerance,
+        'vertex_format': ['column:float32', 'row:float32'],
+        'line_format': ['level', 'first_vertex', 'vertex_count'],
+        'contours': [],
+    }
+    for ind, heightpath in enumerate(heightpaths):
+        lines = contours.trace_contours(EnviRaster.load(heightpath), interval, tolerance)
+        vertexpath = path.join(FINALIZED_DIR, FINAL_CONTOURS_FORMAT.format(ind))
+        table = contours.save_contours(lines, vertexpath)
+        heightMapStatus.add_result_file(vertexpath)
+        vertex_count = sum(count for level, first, count in table)
+        manifest['contours'].append({
+            'file': path.basename(heightpath),
+            'vertices': path.basename(vertexpath),
+            'vertex_count': vertex_count,
+            'lines': table,
+        })
+        heightMapStatus.contour_reports.append('-{} contours: {} lines with {} vertices every {} m'.format(
+            path.basename(heightpath), len(table), vertex_count, interval
+        ))
+    outpath = path.join(FINALIZED_DIR, CONTOURS_MANIFEST_FILENAME)
+    with open(outpath, 'w') as f:
+        json.dump(manifest, f)
+    heightMapStatus.add_result_file(outpath)
+
+# Writes progressively downsampled copies of every height file, so the client can show a coarse level first
+def write_height_lods(heightMapStatus, debug = False):
+    state = heightMapStatus.state
+    if not state.has_height_lods(): return
+    levels, reduction = state.get_height_lods()
+    heightpaths = [f for f in heightMapStatus.get_result_files() if f.endswith('.' + HEIGHT_OUTPUT_FILE_EXTENSION)]
+    if not heightpaths: return
+    manifest = {'reduction': reduction, 'files': []}
+    for ind, heightpath in enumerate(heightpaths):
+        raster = EnviRaster.load(heightpath)
+        entry = {
+            'file': path.basename(heightpath),
+            'levels': [{'level': 0, 'file': path.basename(heightpath), 'samples': raster.samples, 'lines': raster.lines}],
+        }
+        for level, lod in enumerate(pyramid.build_pyramid(raster, levels, reduction), 1):
+            outpath = path.join(FINALIZED_DIR, FINAL_HEIGHT_LOD_FORMAT.format(ind, level))
+            lod.save(outpath)
+            heightMapStatus.add_result_file(outpath)
+            heightMapStatus.add_result_file(path.join(FINALIZED_DIR, FINAL_HEIGHT_LOD_METADATA_FORMAT.format(ind, level)))
+            entry['levels'].append({
+                'level': level, 'file': path.basename(outpath), 'samples': lod.samples, 'lines': lod.lines
+            })
+        manifest['files'].append(entry)
+    outpath = path.join(FINALIZED_DIR, HEIGHT_LOD_MANIFEST_FILENAME)
+    with open(outpath, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    heightMapStatus.add_result_file(outpath)
+
+def rename_in_manifests(heightMapStatus, oldname, newname):
+    """Replaces references to a renamed file in the JSON manifests among the result files."""
+    def rename(value):
+        if isinstance(value, dict):
+            return dict((key, rename(item)) for key, item in value.items())
+        if isinstance(value, list):
+            return [rename(item) for item in value]
+        return newname if value == oldname else value
+    for f in heightMapStatus.get_result_files():
+        if f.endswith('.json'):
+            with open(f) as infile:
+                manifest = json.load(infile)
+            with open(f, 'w') as outfile:
+                json.dump(rename(manifest), outfile, indent=2)
+
+# Re-encodes the height files (including levels of detail) in the project's height encoding
+def encode_heightfiles(heightMapStatus, debug = False):
+    encoding, max_error = heightMapStatus.state.get_height_encoding()
+    if encoding == heightcodec.ENCODING_FLOAT32: return
+    heightpaths = [f for f in heightMapStatus.get_result_files() if f.endswith('.' + HEIGHT_OUTPUT_FILE_EXTENSION)]
+    for heightpath in heightpaths:
+        raster = EnviRaster.load(heightpath)
+        encoded = heightcodec.encode(raster, encoding, max_error)
+        raw_size, encoded_size, load_seconds, decode_seconds = heightcodec.benchmark(raster, encoded)
+        datapath = encoded.save(heightpath)[0]
+        if datapath != heightpath:
+            remove(heightpath)
+            heightMapStatus.result_files[heightMapStatus.result_files.index(heightpath)] = datapath
+            rename_in_manifests(heightMapStatus, path.basename(heightpath), path.basename(datapath))
+        heightMapStatus.encoding_reports.append(
+            '-{} as {}: {} bytes deflated vs {} bytes as float32 ({:.0%}), max error {:.3g} m, decoded in {:.1f} ms vs {:.1f} ms as float32'.format(
+                path.basename(datapath), encoding, encoded_size, raw_size, encoded_size / max(raw_size, 1),
+                encoded.max_error, decode_seconds * 1000, load_seconds * 1000
+            )
+        )
 
 # Open Street Map (OSM) XML-file status and actions
 class OSMStatus:
@@ -174,7 +750,7 @@ class OSMStatus:
         if self.results:
             return 'Converted {} to {}'.format(
                 ', '.join(map(path.basename, self.paths)),
-                ', '.join(map(path.basename, self.results))
+                describe_files(self.results)
             )
         else:
             return 'No OSM files were processed.'
@@ -223,6 +799,50 @@ def write(osmstatus, debug = False):
     combined_osmdata.save(outpath)
     osmstatus.add_result_file(outpath)
 
+# Extracts the trail network into a routing graph, using the finished heightmap (if any) for elevation gain
+def load_heightmaps():
+    """Returns the finished height files, all the height tiles if the build has them, as EnviRasters."""
+    heightmaps = []
+    heightpath = path.join(FINALIZED_DIR, FINAL_HEIGHT_FILENAME_FORMAT.format(0))
+    while path.exists(header_path(heightpath)):
+        heightmaps.append(heightcodec.load(heightpath))
+        heightpath = path.join(FINALIZED_DIR, FINAL_HEIGHT_FILENAME_FORMAT.format(len(heightmaps)))
+    return heightmaps
+
+def write_trail_graph(osmstatus, debug = False):
+    if not osmstatus.osmdata: return
+    way_filters = [osm.trailFilter]
+    if osmstatus.state.has_window():
+        ulx, uly = osmstatus.state.get_window_upper_left()
+        lrx, lry = osmstatus.state.get_window_lower_right()
+        way_filters.append(osm.WayCoordinateFilter(min(ulx, lrx), max(ulx, lrx), min(uly, lry), max(uly, lry)).filter)
+    graph = TrailGraph.from_osmdata(osmstatus.osmdata, way_filters, load_heightmaps())
+    if graph.edge_count() == 0: return
+    outpath = path.join(FINALIZED_DIR, FINAL_TRAIL_GRAPH_FORMAT.format(0))
+    graph.save(outpath)
+    osmstatus.add_result_file(outpath)
+
+# Optionally cuts trails and areas into a pyramid of vector tiles covering the window
+def write_vector_tiles(osmstatus, debug = False):
+    state = osmstatus.state
+    if not (osmstatus.osmdata and state.has_vector_tiles() and state.has_window()): return
+    ulx, uly = state.get_window_upper_left()
+    lrx, lry = state.get_window_lower_right()
+    minx, miny = vectortiles.lonlat_to_mercator(min(ulx, lrx), min(uly, lry))
+    maxx, maxy = vectortiles.lonlat_to_mercator(max(ulx, lrx), max(uly, lry))
+    layers = [
+        (VECTOR_TILE_TRAIL_LAYER, vectortiles.features_from_osmdata(
+            osmstatus.osmdata, [osm.trailFilter], vectortiles.GEOM_LINESTRING
+        )),
+        (VECTOR_TILE_AREA_LAYER, vectortiles.features_from_osmdata(
+            osmstatus.osmdata, [osm.areaFilter], vectortiles.GEOM_POLYGON
+        )),
+    ]
+    min_zoom, max_zoom = state.vector_tile_zooms
+    outdir = path.join(FINALIZED_DIR, VECTOR_TILE_DIRNAME)
+    for f in vectortiles.write_pyramid(layers, (minx, miny, maxx, maxy), min_zoom, max_zoom, outdir):
+        osmstatus.add_result_file(f)
+
 # Satellite image status and actions
 class SatelliteStatus:
     def __init__(self, index, satellitefiles, state):
@@ -235,6 +855,10 @@ class SatelliteStatus:
         self.state = state
         self.intermediate_files = []
         self.result_files = []
+        self.resource_settings = None
+        self.optimized_report = None
+        self.tile_cache_report = None
+        self.encoding_reports = []
     def next(self):
         self.current_files = self.next_files
         self.next_files = []
@@ -252,46 +876,311 @@ class SatelliteStatus:
         else:
             lines.append('Build results for {}:'.format(', '.join(map(path.basename, self.original_files))))
             if self.result_files:
-                lines.append('-Files created: {}'.format(', '.join(map(path.basename, self.result_files))))
+                lines.append('-Files created: {}'.format(describe_files(self.result_files)))
             else:
                 lines.append('-No files were created')
+            if self.resource_settings:
+                lines.append('-GDAL resources: {}'.format(self.resource_settings))
+            if self.optimized_report:
+                lines.append('-Optimized sources: {}'.format(self.optimized_report))
+            if self.tile_cache_report:
+                lines.append('-Reprojected tile cache: {}'.format(self.tile_cache_report))
+            lines.extend(self.encoding_reports)
             if self.output.getvalue():
                 lines.append('-Messages from GDAL:')
                 lines.extend(self.output.getvalue().split('\n'))
         return '\n'.join(lines)
 
-# Outputs only one combined file
+def use_optimized_sources(satellitestatus):
+    """
+    Replaces the current files with their optimized copies, where those are up to date. Returns the
+    gdalwarp -ovr value to warp them with: the finest overview level any of them needs, or 'NONE' for
+    the full resolution. If some files have no up to date copy, None is returned to leave it to GDAL.
+    """
+    state = satellitestatus.state
+    if not state.has_optimized_satellite_files(): return None
+    copies = [state.get_optimized_satellite_file(f) for f in satellitestatus.current_files]
+    current = [optimize.is_current(copy, f) for copy, f in zip(copies, satellitestatus.current_files)]
+    if not any(current): return None
+    satellitestatus.current_files = [
+        copy['path'] if is_current else f for f, copy, is_current in zip(satellitestatus.current_files, copies, current)
+    ]
+    if not all(current):
+        satellitestatus.optimized_report = '{} of {} files'.format(sum(current), len(current))
+        return None
+    levels = [optimize.overview_level(copy['pixel_size'], state.satellite_resolution, copy['overviews']) for copy in copies]
+    overview_level = 'NONE' if None in levels else min(levels)
+    satellitestatus.optimized_report = '{0} of {0} files, warped from {1}'.format(
+        len(current), 'the full resolution' if overview_level == 'NONE' else 'overview level {}'.format(overview_level)
+    )
+    return overview_level
+
+# Outputs only one combined file, as a virtual raster that is computed when translated
 def process_satellite_with_gdal(satellitestatus, debug = False):
     if satellitestatus.current_files:
-        outpath = path.join(FINALIZED_DIR, INTERMEDIATE_SATELLITE_FORMAT.format(0))
-        command = 'gdalwarp {source_system_cmd}-tr {cellsize} {cellsize} -te_srs {latlon_datum_identifier} -t_srs {projection_identifier} -r bilinear -te {projection_window} {satfiles} {outpath}'.format(
-            source_system_cmd='-s_srs {} '.format(satellitestatus.state.satellite_coordinatesystem) if satellitestatus.state.has_satellite_system() else '', 
-            cellsize = satellitestatus.state.satellite_resolution, 
-            latlon_datum_identifier = LATLON_DATUM_IDENTIFIER, 
-            projection_identifier = PROJECTION_IDENTIFIER, 
-            projection_window=satellitestatus.state.get_window_string_lowerleft_topright(), 
-            satfiles=' '.join(satellitestatus.current_files), 
-            outpath=outpath
+        state = satellitestatus.state
+        overview_level = use_optimized_sources(satellitestatus)
+        sources = satellitestatus.current_files
+        source_system = pull_from_tile_cache(
+            satellitestatus, 'satellite', state.satellite_resolution,
+            state.satellite_coordinatesystem if state.has_satellite_system() else None, debug, overview_level
+        )
+        resampling = WARP_RESAMPLING
+        if satellitestatus.current_files is not sources:
+            overview_level = None # The cached reprojections are at the output resolution already
+            resampling = TILE_CACHE_RESAMPLING
+        if gdal_util.has_gdal_bindings():
+            dataset = warp_in_process(
+                satellitestatus, state.satellite_resolution, source_system, debug,
+                overview_level=overview_level, resampling=resampling
+            )
+            satellitestatus.add_next_file(dataset)
+            satellitestatus.next()
+            return
+        outpath = path.join(BUILD_DIR, INTERMEDIATE_SATELLITE_FORMAT.format(0))
+        warp_to_vrt(
+            satellitestatus, state.satellite_resolution, source_system,
+            path.join(BUILD_DIR, MOSAIC_SATELLITE_FORMAT.format(0)), outpath, debug, overview_level, resampling
         )
-        call_command(command, satellitestatus, debug)
         satellitestatus.add_next_file(outpath)
         satellitestatus.next()
 
-def translate_satellite_to_png(satellitestatus, debug = False):
+def plan_satellite_resources(satellitestatus, debug = False):
+    if satellitestatus.current_files:
+        plan_resources(satellitestatus, satellitestatus.state.satellite_resolution, resources.SATELLITE_PIXEL_BYTES)
+
+# Writes the satellite images with the chosen codec, reporting how long encoding took and how large the result is
+def encode_satellite(satellitestatus, debug = False):
+    codec, quality, extension = get_satellite_codec(satellitestatus.state)
+    if codec != 'png' and satellitestatus.state.has_satellite_palette():
+        satellitestatus.output.write('Palettes only apply to PNG images, the satellite images are written as {}\n'.format(codec))
+    engine = gdal_util.get_engine()
     for ind, cf in enumerate(satellitestatus.current_files):
-        outpath = path.join(FINALIZED_DIR, FINAL_SATELLITE_FORMAT.format(ind))
-        command = 'gdal_translate -of {} {} {}'.format(SATELLITE_OUTPUT_FORMAT, cf, outpath)
-        call_command(command, satellitestatus, debug)    
-        satellitestatus.add_result_file(outpath)    
+        outpath = path.join(FINALIZED_DIR, FINAL_SATELLITE_NAME_FORMAT.format(ind, extension))
+        rawpath = path.join(BUILD_DIR, INTERMEDIATE_SATELLITE_RAW_FORMAT.format(ind))
+        # The warped pixels are computed before encoding where the encoder reads them, so that only the encoding is timed
+        source, raster = cf, None
+        if needs_raw_satellite(satellitestatus.state) or (codec == 'png' and not engine):
+            translate(satellitestatus, cf, rawpath, HEIGHT_OUTPUT_FORMAT, debug, ['INTERLEAVE=BIP'])
+            source = rawpath
+            if path.exists(rawpath): raster = EnviRaster.load(rawpath, mmap=True)
+        elif codec == 'png':
+            raster = engine.read_raster(cf, satellitestatus.output)
+        native = codec == 'png' and raster is not None and encodes_png_natively(raster)
+        start = time.perf_counter()
+        if native:
+            encode_satellite_png(satellitestatus, raster, outpath, quality, debug)
+        else:
+            encode_with_gdal(satellitestatus, source, outpath, codec, quality, debug)
+        seconds = time.perf_counter() - start
+        satellitestatus.add_result_file(outpath)
+        if path.exists(outpath):
+            satellitestatus.encoding_reports.append('-{} as {} (quality {}): {} bytes, {} in {:.2f} s'.format(
+                path.basename(outpath), codec, quality, path.getsize(outpath),
+                'encoded' if native or source == rawpath else 'warped and encoded', seconds
+            ))
+            if native and satellitestatus.state.has_satellite_palette():
+                report_palette_reduction(satellitestatus, raster, outpath, quality)
+
+def needs_raw_satellite(state):
+    """Returns whether the mipmaps or GPU textures are built, which are made of raw ENVI copies of the satellite images."""
+    return state.has_satellite_mipmaps() or state.has_satellite_texture()
+
+def get_satellite_codec(state):
+    """Returns (codec, quality, file extension) of the satellite images."""
+    codec, quality = state.get_satellite_encoding()
+    output_format, extension, lowest, highest, default_quality = SATELLITE_CODECS[codec]
+    return (codec, default_quality if quality is None else quality, extension)
+
+def encode_satellite_image(satellitestatus, rawpath, outpath, codec, quality, debug = False):
+    """Encodes a raw ENVI image with the codec. Returns how many seconds encoding took."""
+    raster = EnviRaster.load(rawpath, mmap=True) if codec == 'png' and path.exists(rawpath) else None
+    start = time.perf_counter()
+    if raster is not None and encodes_png_natively(raster):
+        encode_satellite_png(satellitestatus, raster, outpath, quality, debug)
+    else:
+        encode_with_gdal(satellitestatus, rawpath, outpath, codec, quality, debug)
+    return time.perf_counter() - start
+
+def encode_with_gdal(satellitestatus, source, outpath, codec, quality, debug = False):
+    option = 'ZLEVEL' if codec == 'png' else 'QUALITY'
+    translate(satellitestatus, source, outpath, SATELLITE_CODECS[codec][0], debug, ['{}={}'.format(option, quality)])
+
+def satellite_image(raster):
+    """Returns the pixels of a raw satellite image as an array of shape (lines, samples) or (lines, samples, bands)."""
+    return raster.data if raster.data.ndim == 2 else np.moveaxis(raster.data, 0, -1)
+
+def encodes_png_natively(raster):
+    """Returns whether the built-in encoder supports the raw image: 8-bit, with 1 to 4 bands."""
+    bands = 1 if raster.data.ndim == 2 else raster.data.shape[0]
+    return raster.data.dtype == np.uint8 and bands in png.COLOR_TYPES
+
+def png_workers(satellitestatus, raster):
+    strips = int(math.ceil(raster.lines / float(png.STRIP_LINES)))
+    return resources.worker_count(satellitestatus.state, strips)
+
+def encode_satellite_png(satellitestatus, raster, outpath, level, debug = False):
+    """
+    Encodes an 8-bit image (an EnviRaster the built-in encoder supports, see encodes_png_natively) as a
+    PNG, compressing strips of it in parallel. If a palette is set, the image is quantized to it and
+    written as an indexed PNG, unfiltered.
+    """
+    workers = png_workers(satellitestatus, raster)
+    if debug: satellitestatus.output.write('\n[built-in PNG encoding of {} with {} workers]\n'.format(path.basename(outpath), workers))
+    state = satellitestatus.state
+    if state.has_satellite_palette():
+        indices, colors = palette.quantize(satellite_image(raster), *state.get_satellite_palette())
+        content = png.encode_png_strips(indices, level, workers, palette=colors, filtertype=png.FILTER_NONE)
+    else:
+        content = png.encode_png_strips(satellite_image(raster), level, workers)
+    with open(outpath, 'wb') as f:
+        f.write(content)
+
+def report_palette_reduction(satellitestatus, raster, outpath, level):
+    """Reports the size of an indexed PNG of raster against a 24-bit one, which is encoded only to measure it."""
+    truecolor_bytes = len(png.encode_png_strips(satellite_image(raster), level, png_workers(satellitestatus, raster)))
+    colors, method, dither = satellitestatus.state.get_satellite_palette()
+    satellitestatus.encoding_reports.append('-{} palette: {} colors ({}{}), {:.0f}% of the {} bytes of the 24-bit PNG'.format(
+        path.basename(outpath), colors, method, ', dithered' if dither else '',
+        100.0 * path.getsize(outpath) / truecolor_bytes, truecolor_bytes
+    ))
+
+# Writes the mip chain of the satellite images, so the client doesn't have to generate it when uploading the texture
+def write_satellite_mipmaps(satellitestatus, debug = False):
+    state = satellitestatus.state
+    if not state.has_satellite_mipmaps(): return
+    image_filter = state.get_satellite_mipmaps()
+    codec, quality, extension = get_satellite_codec(state)
+    manifest = {'filter': image_filter, 'codec': codec, 'files': []}
+    for ind in range(len(satellitestatus.current_files)):
+        rawpath = path.join(BUILD_DIR, INTERMEDIATE_SATELLITE_RAW_FORMAT.format(ind))
+        if not path.exists(rawpath): continue
+        raster = EnviRaster.load(rawpath, mmap=True)
+        if raster.data.dtype != np.uint8:
+            satellitestatus.output.write('Mipmaps are only built of 8-bit images, skipping {}\n'.format(path.basename(rawpath)))
+            continue
+        basename = FINAL_SATELLITE_NAME_FORMAT.format(ind, extension)
+        entry = {
+            'file': basename,
+            'levels': [{'level': 0, 'file': basename, 'samples': raster.samples, 'lines': raster.lines}],
+        }
+        total_bytes, seconds = 0, 0.0
+        for level, texels in enumerate(mipmap.build_mipmaps(satellite_image(raster), image_filter), 1):
+            lines, samples = texels.shape[:2]
+            bands = 1 if texels.ndim == 2 else texels.shape[2]
+            levelpath = path.join(BUILD_DIR, INTERMEDIATE_SATELLITE_MIP_RAW_FORMAT.format(ind, level))
+            header = EnviRaster.create_header(samples, lines, 'uint8', bands=bands)
+            EnviRaster(texels if bands == 1 else np.moveaxis(texels, -1, 0), header).save(levelpath)
+            outpath = path.join(FINALIZED_DIR, FINAL_SATELLITE_MIP_FORMAT.format(ind, level, extension))
+            seconds += encode_satellite_image(satellitestatus, levelpath, outpath, codec, quality, debug)
+            satellitestatus.add_result_file(outpath)
+            if path.exists(outpath): total_bytes += path.getsize(outpath)
+            entry['levels'].append({'level': level, 'file': path.basename(outpath), 'samples': samples, 'lines': lines})
+        manifest['files'].append(entry)
+        satellitestatus.encoding_reports.append('-{} mipmaps: {} levels ({} filter), {} bytes, encoded in {:.2f} s'.format(
+            basename, len(entry['levels']) - 1, image_filter, total_bytes, seconds
+        ))
+    outpath = path.join(FINALIZED_DIR, SATELLITE_MIPMAP_MANIFEST_FILENAME)
+    with open(outpath, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    satellitestatus.add_result_file(outpath)
+
+# Writes the satellite images as block-compressed GPU textures, with their mip chains if mipmaps are set
+def write_satellite_textures(satellitestatus, debug = False):
+    state = satellitestatus.state
+    if not state.has_satellite_texture(): return
+    texture_format = state.get_satellite_texture()
+    for ind in range(len(satellitestatus.current_files)):
+        rawpath = path.join(BUILD_DIR, INTERMEDIATE_SATELLITE_RAW_FORMAT.format(ind))
+        if not path.exists(rawpath): continue
+        raster = EnviRaster.load(rawpath, mmap=True)
+        if raster.data.dtype != np.uint8:
+            satellitestatus.output.write('GPU textures are only built of 8-bit images, skipping {}\n'.format(path.basename(rawpath)))
+            continue
+        image = satellite_image(raster)
+        images = [image]
+        if state.has_satellite_mipmaps():
+            images.extend(mipmap.build_mipmaps(image, state.get_satellite_mipmaps()))
+        start = time.perf_counter()
+        levels = []
+        for texels in images:
+            bands = int(math.ceil(texels.shape[0] / float(gputexture.BLOCK_SIZE * gputexture.BAND_BLOCK_ROWS)))
+            levels.append(gputexture.encode_texture(texels, texture_format, resources.worker_count(state, bands)))
+        seconds = time.perf_counter() - start
+        outpath = path.join(FINALIZED_DIR, FINAL_SATELLITE_TEXTURE_FORMAT.format(ind))
+        with open(outpath, 'wb') as f:
+            f.write(gputexture.ktx_bytes(levels, raster.samples, raster.lines, texture_format))
+        satellitestatus.add_result_file(outpath)
+        satellitestatus.encoding_reports.append('-{} as {}: {} levels, {} bytes ({} bytes as RGBA), encoded in {:.2f} s'.format(
+            path.basename(outpath), texture_format, len(levels), path.getsize(outpath),
+            sum(4 * texels.shape[0] * texels.shape[1] for texels in images), seconds
+        ))
 
 HEIGHTMAP_ACTIONS = (
-    check_projection_window, process_heightfiles_with_gdal, translate_heightfiles
+    check_projection_window, plan_height_resources, process_heightfiles_with_gdal, translate_heightfiles,
+    write_shading, write_terrain_meshes, write_contours, write_height_lods, encode_heightfiles
 )
 
 OSM_ACTIONS = (
-    load_osm, add_filters, apply_filters, insert_colors, prepare_write, write
+    load_osm, add_filters, apply_filters, insert_colors, prepare_write, write, write_trail_graph, write_vector_tiles
 )
 
 SATELLITE_ACTIONS = (
-    check_projection_window, process_satellite_with_gdal, translate_satellite_to_png
+    check_projection_window, plan_satellite_resources, process_satellite_with_gdal, encode_satellite, write_satellite_mipmaps,
+    write_satellite_textures
 )
+
+# The artifacts each action reads and writes, for the build scheduler. Names are of the pipeline
+# running the action unless they name another pipeline, as in 'height:heightmap'.
+# Actions not listed here read what the action before them wrote.
+ACTION_ARTIFACTS = {
+    check_projection_window: ((), ('sources in window',)),
+    plan_height_resources: (('sources in window',), ('resource settings',)),
+    process_heightfiles_with_gdal: (('sources in window', 'resource settings'), ('warped heights',)),
+    translate_heightfiles: (('warped heights',), ('height files',)),
+    write_shading: (('height files',), ('shading',)),
+    write_terrain_meshes: (('height files',), ('meshes',)),
+    write_contours: (('height files',), ('contours',)),
+    write_height_lods: (('height files',), ('height lods',)),
+    encode_heightfiles: (('height files', 'shading', 'meshes', 'contours', 'height lods'), ('heightmap',)),
+    load_osm: ((), ('osm data',)),
+    add_filters: (('osm data',), ('filters',)),
+    apply_filters: (('osm data', 'filters'), ('filtered osm data',)),
+    insert_colors: (('filtered osm data',), ('area colors',)),
+    prepare_write: (('filtered osm data', 'area colors'), ('prepared osm data',)),
+    write: (('prepared osm data',), ('osm file',)),
+    # Elevation gain is read from the finished heightmap
+    write_trail_graph: (('filtered osm data', 'height:heightmap'), ('trail graph',)),
+    write_vector_tiles: (('filtered osm data',), ('vector tiles',)),
+    plan_satellite_resources: (('sources in window',), ('resource settings',)),
+    process_satellite_with_gdal: (('sources in window', 'resource settings'), ('warped images',)),
+    # The raw images are the 8-bit ENVI copies the mipmaps and textures are made of, written only when they're built
+    encode_satellite: (('warped images',), ('images', 'raw images')),
+    write_satellite_mipmaps: (('raw images',), ('mipmaps',)),
+    write_satellite_textures: (('raw images',), ('textures',)),
+}
+
+# Resources an action holds while it runs, besides its pipeline's build status.
+# The source index and the gdalinfo cache are loaded, updated and saved by a single stage at a time.
+SOURCE_INDEX_RESOURCE = 'source index'
+ACTION_HOLDS = {
+    check_projection_window: (SOURCE_INDEX_RESOURCE,),
+}
+
+def artifact_name(pipeline, name):
+    return name if ':' in name else '{}:{}'.format(pipeline, name)
+
+def pipeline_stages(pipeline, buildstatus, actions, debug = False):
+    """Returns the scheduler stages running the actions of pipeline on its build status."""
+    stages = []
+    previous = ()
+    for action in actions:
+        inputs, outputs = ACTION_ARTIFACTS.get(action, (previous, (action.__name__,)))
+        inputs = [artifact_name(pipeline, a) for a in inputs]
+        outputs = [artifact_name(pipeline, a) for a in outputs]
+        stages.append(scheduler.Stage(
+            '{}:{}'.format(pipeline, action.__name__), partial(action, buildstatus, debug),
+            inputs, outputs, (pipeline,) + ACTION_HOLDS.get(action, ())
+        ))
+        previous = outputs
+    return stages
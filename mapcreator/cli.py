@@ -3,6 +3,7 @@ import subprocess
 from os import path
 from mapcreator import building
 from mapcreator import persistence
+from mapcreator import heightcodec, pyramid, resample, shading, contours, tilecache, mipmap, gputexture, palette, buildcache
 from mapcreator.cli_util import *
 from mapcreator.echoes import *
 from mapcreator.state import FileAddResult
@@ -43,10 +44,27 @@ def init(force):
     if init_or_error():
         success('Project initialized!')
 
+def source_file_options(command):
+    """Options for registering source files in bulk, shared by add_height_files and add_satellite_files."""
+    command = click.option('--directory', '-d', 'directories', multiple=True, help='Add all files in a directory (recursively)')(command)
+    command = click.option('--pattern', '-p', default='*', help='Only add files matching this pattern from directories. Default: *')(command)
+    command = click.option('--glob', '-g', 'patterns', multiple=True, help='Add all files matching a glob pattern')(command)
+    command = click.option('--manifest', '-m', 'manifests', multiple=True, help='Add all files listed in a manifest file, one per line')(command)
+    return command
+
 @click.command()
 @click.argument('files', nargs=-1)
-def add_height_files(files):
-    """Adds given height data files to the project"""
+@source_file_options
+def add_height_files(files, directories = (), pattern = '*', patterns = (), manifests = ()):
+    """
+    Adds given height data files to the project.
+    Files can also be added in bulk from directories, glob patterns and manifest files.
+    Their footprints are indexed, so that builds only process the files intersecting the window.
+
+    Usage example:
+    mapcreator add_height_files --directory dem --pattern "*.img"
+    """
+    files = expand_source_files(files, directories, patterns, manifests, pattern)
     if len(files) == 0:
         warn('No files were specified.')
         info('Try mapcreator add_height_files [file 1] [file 2] ... [file n]')
@@ -75,19 +93,66 @@ def clear_osm_files():
 
 @click.command()
 @click.argument('files', nargs=-1)
-def add_satellite_files(files):
-    """Adds given satellite image files to the project"""
+@source_file_options
+@click.option('--optimize', '-o', is_flag=True, help='Also write optimized copies of the files (see optimize_satellite_files)')
+def add_satellite_files(files, directories = (), pattern = '*', patterns = (), manifests = (), optimize = False):
+    """
+    Adds given satellite image files to the project.
+    Files can also be added in bulk from directories, glob patterns and manifest files.
+    Their footprints are indexed, so that builds only process the files intersecting the window.
+
+    Usage example:
+    mapcreator add_satellite_files --manifest naip_tiles.txt
+    """
+    files = expand_source_files(files, directories, patterns, manifests, pattern)
     if len(files) == 0:
         warn('No files were specified.')
         info('Try mapcreator add_satellite_files [file 1] [file 2] ... [file n]')
         return
     add_files(files, 'add_satellite_file')
+    if optimize:
+        state = load_or_error()
+        if not state: return
+        if optimize_satellite_sources(state, state.satellite_files):
+            success('Satellite/aerial files optimized!')
 
 @click.command()
 def clear_satellite_files():
     """Clears satellite/aerial image files"""
     clear_files('clear_satellite_files', 'satellite')
 
+@click.command()
+@click.option('--force', '-f', is_flag=True, help='Also optimize files whose copies are up to date')
+def optimize_satellite_files(force):
+    """
+    Writes copies of the satellite/aerial files as internally tiled, compressed GeoTIFFs with overviews
+    into the project directory. Builds read the copies at the overview closest to the satellite
+    resolution instead of warping the full resolution files. A copy is not used once its file changes,
+    until the file is optimized again.
+
+    Usage example:
+    mapcreator optimize_satellite_files
+    """
+    state = load_or_error()
+    if not state: return
+    if not state.has_satellite_files():
+        warn('No satellite/aerial files have been added! There\'s nothing to optimize.')
+        return
+    if optimize_satellite_sources(state, state.satellite_files, force):
+        success('Satellite/aerial files optimized!')
+
+@click.command()
+def clear_optimized_satellite_files():
+    """
+    Removes the optimized copies of the satellite/aerial files. Builds warp the files themselves again.
+    """
+    state = load_or_error()
+    if not state: return
+    info('Removing optimized satellite/aerial files')
+    clear_optimized_satellite_sources(state)
+    if save_or_error(state):
+        success('Optimized satellite/aerial files removed!')
+
 @click.command()
 @click.argument('tag')
 @click.argument('red', type=int)
@@ -312,12 +377,601 @@ def set_satellite_resolution(resolution):
     if save_or_error(state):
         success('Satellite/aerial image output resolution set to {} m'.format(resolution))
 
+@click.command()
+@click.argument('threads', type=int)
+def set_probe_threads(threads):
+    """
+    Specifies how many source files are probed for their metadata concurrently during
+    a build. Default value is 8. Values in the range 1-64 are valid.
+
+    Usage example:
+    mapcreator set_probe_threads 16
+    """
+    state = load_or_error()
+    if not state: return
+    if not validate_thread_count(threads, 1, 64): return
+    info('Setting source file probing threads to {}'.format(threads))
+    state.set_probe_threads(threads)
+    if save_or_error(state):
+        success('Source file probing threads set to {}'.format(threads))
+
+@click.command()
+@click.argument('workers', type=int)
+def set_build_workers(workers):
+    """
+    Specifies how many build stages run at once. The height, OSM and satellite pipelines
+    are built side by side, so their stages overlap. Default value is 3. Values in the
+    range 1-16 are valid; 1 builds the pipelines one after another.
+
+    Usage example:
+    mapcreator set_build_workers 2
+    """
+    state = load_or_error()
+    if not state: return
+    if not validate_thread_count(workers, 1, 16): return
+    info('Setting build workers to {}'.format(workers))
+    state.set_build_workers(workers)
+    if save_or_error(state):
+        success('Build workers set to {}'.format(workers))
+
+@click.command()
+@click.argument('columns', type=int)
+@click.argument('rows', type=int)
+def set_height_tiles(columns, rows):
+    """
+    Splits the height data output into a grid of COLUMNS x ROWS tiles (each between 1 and 32),
+    which are built concurrently. The tiles are written as heightfile0...heightfileN along with
+    a manifest (heightfile_tiles.json) describing their placement.
+
+    Usage example:
+    mapcreator set_height_tiles 4 4
+    """
+    state = load_or_error()
+    if not state: return
+    for count in (columns, rows):
+        if not validate_tile_count(count, 1, 32): return
+    info('Setting height file tiling to {}x{}'.format(columns, rows))
+    state.set_height_tiles(columns, rows)
+    if save_or_error(state):
+        success('Height files will be built in {}x{} tiles'.format(columns, rows))
+
+@click.command()
+def clear_height_tiles():
+    """
+    Builds the height data output as a single file again.
+    """
+    state = load_or_error()
+    if not state: return
+    info('Clearing height file tiling')
+    state.clear_height_tiles()
+    if save_or_error(state):
+        success('Height file tiling cleared!')
+
+@click.command()
+@click.argument('levels', type=int)
+@click.option('--reduction', '-r', type=click.Choice(sorted(pyramid.REDUCTIONS)), default=pyramid.DEFAULT_REDUCTION, help='How blocks of cells are reduced. Default: mean')
+def set_height_lods(levels, reduction):
+    """
+    Adds up to LEVELS (between 1 and 16) progressively downsampled levels of detail of every
+    height file to the package. Each level halves the resolution of the previous one.
+    The levels are written as heightfileN_lodL.bin/.hdr and listed in heightfile_lods.json.
+
+    Usage example:
+    mapcreator set_height_lods 4 --reduction max
+    """
+    state = load_or_error()
+    if not state: return
+    if not validate_lod_count(levels, 1, 16): return
+    info('Setting height file detail levels to {} ({} reduction)'.format(levels, reduction))
+    state.set_height_lods(levels, reduction)
+    if save_or_error(state):
+        success('Height file detail levels set to {} ({} reduction)'.format(levels, reduction))
+
+@click.command()
+def clear_height_lods():
+    """
+    Stops adding downsampled levels of detail of the height files to the package.
+    """
+    state = load_or_error()
+    if not state: return
+    info('Clearing height file detail levels')
+    state.clear_height_lods()
+    if save_or_error(state):
+        success('Height file detail levels cleared!')
+
+@click.command()
+@click.argument('encoding', type=click.Choice(heightcodec.ENCODINGS))
+@click.option('--max-error', '-e', type=float, default=None, help='Maximum vertical error in meters')
+def set_height_encoding(encoding, max_error):
+    """
+    Specifies how height files are encoded in the package. float32 is the raw GDAL output;
+    int16 and uint16 quantize heights with a scale and offset in the header, delta-zlib stores
+    quantized row differences compressed with zlib and terrain-rgb stores quantized heights in
+    the channels of a PNG. With --max-error, the quantization keeps the vertical error below it.
+
+    Usage example:
+    mapcreator set_height_encoding int16 --max-error 0.5
+    """
+    state = load_or_error()
+    if not state: return
+    if max_error is not None and max_error <= 0:
+        error('Invalid maximum error {}!'.format(max_error))
+        info('(Should be greater than 0)')
+        return
+    info('Setting height file encoding to {}'.format(encoding))
+    state.set_height_encoding(encoding, max_error)
+    if save_or_error(state):
+        success('Height file encoding set to {}'.format(encoding))
+
+@click.command()
+def clear_height_encoding():
+    """
+    Resets the height file encoding to raw float32.
+    """
+    state = load_or_error()
+    if not state: return
+    info('Clearing height file encoding')
+    state.clear_height_encoding()
+    if save_or_error(state):
+        success('Height file encoding reset to float32!')
+
+@click.command()
+@click.argument('codec', type=click.Choice(list(building.SATELLITE_CODECS)))
+@click.option('--quality', '-q', type=int, default=None, help='Quality (JPEG, WebP) or compression level (PNG)')
+def set_satellite_encoding(codec, quality):
+    """
+    Specifies how satellite/aerial images are encoded in the package. png is lossless, with
+    --quality as its compression level from 0 to 9 (default 6); jpeg and webp are lossy and much
+    smaller, with --quality from 1 to 100 (default 75). PNG images are compressed in strips in parallel.
+
+    Usage example:
+    mapcreator set_satellite_encoding jpeg --quality 85
+    """
+    state = load_or_error()
+    if not state: return
+    output_format, extension, lowest, highest, default_quality = building.SATELLITE_CODECS[codec]
+    if quality is not None and (quality < lowest or quality > highest):
+        error('Invalid quality {}!'.format(quality))
+        info('(Should be between {} and {} for {})'.format(lowest, highest, codec))
+        return
+    info('Setting satellite/aerial image encoding to {}'.format(codec))
+    state.set_satellite_encoding(codec, quality)
+    if save_or_error(state):
+        success('Satellite/aerial image encoding set to {}'.format(codec))
+
+@click.command()
+def clear_satellite_encoding():
+    """
+    Resets the satellite/aerial image encoding to PNG.
+    """
+    state = load_or_error()
+    if not state: return
+    info('Clearing satellite/aerial image encoding')
+    state.clear_satellite_encoding()
+    if save_or_error(state):
+        success('Satellite/aerial image encoding reset to png!')
+
+@click.command()
+@click.option('--filter', '-f', 'image_filter', type=click.Choice(mipmap.FILTERS), default=mipmap.DEFAULT_FILTER, help='Downsampling filter')
+def set_satellite_mipmaps(image_filter):
+    """
+    Adds the full mip chain of every satellite/aerial image to the package, so the client can
+    upload the levels instead of generating them. Each level halves the previous one down to
+    1x1 pixels, filtered with box (averaging) or lanczos (sharper), and is encoded like the image
+    itself as heightfileN_satellite_mipM. The levels are described in heightfile_satellite_mipmaps.json.
+
+    Usage example:
+    mapcreator set_satellite_mipmaps --filter lanczos
+    """
+    state = load_or_error()
+    if not state: return
+    info('Setting satellite/aerial image mipmaps to the {} filter'.format(image_filter))
+    state.set_satellite_mipmaps(image_filter)
+    if save_or_error(state):
+        success('Satellite/aerial image mipmaps enabled with the {} filter'.format(image_filter))
+
+@click.command()
+def clear_satellite_mipmaps():
+    """
+    Stops adding satellite/aerial image mipmaps to the package.
+    """
+    state = load_or_error()
+    if not state: return
+    info('Clearing satellite/aerial image mipmaps')
+    state.clear_satellite_mipmaps()
+    if save_or_error(state):
+        success('Satellite/aerial image mipmaps disabled!')
+
+@click.command()
+@click.argument('colors', type=int, default=palette.MAX_COLORS)
+@click.option('--method', '-m', type=click.Choice(list(palette.METHODS)), default=palette.DEFAULT_METHOD, help='How the palette is chosen')
+@click.option('--dither/--no-dither', default=False, help='Whether to apply ordered dithering')
+def set_satellite_palette(colors, method, dither):
+    """
+    Reduces satellite/aerial PNG images to an adaptive palette of up to 256 colors and writes them
+    as indexed PNGs. The palette is chosen from a sample of the pixels, by median cut or by k-means
+    starting from the median cut. Ordered dithering trades banding in smooth areas for a fine pattern.
+    The build reports the size of each image against a 24-bit PNG of it.
+
+    Usage example:
+    mapcreator set_satellite_palette 64 --method median-cut --dither
+    """
+    state = load_or_error()
+    if not state: return
+    if colors < 2 or colors > palette.MAX_COLORS:
+        error('Invalid number of colors {}!'.format(colors))
+        info('(Should be between 2 and {})'.format(palette.MAX_COLORS))
+        return
+    info('Setting satellite/aerial image palette to {} colors'.format(colors))
+    state.set_satellite_palette(colors, method, dither)
+    if save_or_error(state):
+        success('Satellite/aerial image palette set to {} colors ({}{})'.format(colors, method, ', dithered' if dither else ''))
+
+@click.command()
+def clear_satellite_palette():
+    """
+    Writes satellite/aerial PNG images in full color again.
+    """
+    state = load_or_error()
+    if not state: return
+    info('Clearing satellite/aerial image palette')
+    state.clear_satellite_palette()
+    if save_or_error(state):
+        success('Satellite/aerial image palette disabled!')
+
+@click.command()
+@click.option('--format', '-f', 'texture_format', type=click.Choice(list(gputexture.FORMATS)), default=gputexture.DEFAULT_FORMAT, help='Block-compressed texture format')
+def set_satellite_texture(texture_format):
+    """
+    Adds every satellite/aerial image to the package also as a block-compressed GPU texture in a
+    KTX container (heightfileN_satellite.ktx), which the client can upload as is. ETC2 RGB takes
+    a sixth of the memory of uncompressed RGB. If mipmaps are set, the texture includes them.
+
+    Usage example:
+    mapcreator set_satellite_texture --format etc2
+    """
+    state = load_or_error()
+    if not state: return
+    info('Setting satellite/aerial GPU texture to {}'.format(texture_format))
+    state.set_satellite_texture(texture_format)
+    if save_or_error(state):
+        success('Satellite/aerial GPU texture set to {}'.format(texture_format))
+
+@click.command()
+def clear_satellite_texture():
+    """
+    Stops adding satellite/aerial GPU textures to the package.
+    """
+    state = load_or_error()
+    if not state: return
+    info('Clearing satellite/aerial GPU texture')
+    state.clear_satellite_texture()
+    if save_or_error(state):
+        success('Satellite/aerial GPU texture disabled!')
+
+@click.command()
+@click.option('--exaggeration', '-x', type=float, default=1.0, help='Vertical exaggeration of the heights')
+def set_normal_map(exaggeration):
+    """
+    Adds a normal map of every height file to the package, so the client doesn't have to compute
+    surface normals when a map is opened. The normals are packed into the RGB channels of
+    heightfileN_normals.png as (east, north, up) components, 128 being zero.
+
+    Usage example:
+    mapcreator set_normal_map --exaggeration 1.5
+    """
+    state = load_or_error()
+    if not state: return
+    if exaggeration <= 0:
+        error('Invalid vertical exaggeration {}!'.format(exaggeration))
+        info('(Should be greater than 0)')
+        return
+    info('Setting normal map vertical exaggeration to {}'.format(exaggeration))
+    state.set_normal_map(exaggeration)
+    if save_or_error(state):
+        success('Normal map enabled with vertical exaggeration {}'.format(exaggeration))
+
+@click.command()
+def clear_normal_map():
+    """
+    Stops adding normal maps to the package.
+    """
+    state = load_or_error()
+    if not state: return
+    info('Clearing normal map')
+    state.clear_normal_map()
+    if save_or_error(state):
+        success('Normal map disabled!')
+
+@click.command()
+@click.option('--azimuth', '-a', type=float, default=shading.DEFAULT_AZIMUTH, help='Direction of the light in degrees clockwise from north')
+@click.option('--altitude', '-l', type=float, default=shading.DEFAULT_ALTITUDE, help='Angle of the light above the horizon in degrees')
+def set_hillshade(azimuth, altitude):
+    """
+    Adds a grayscale hillshade of every height file to the package as heightfileN_hillshade.png.
+
+    Usage example:
+    mapcreator set_hillshade --azimuth 270 --altitude 30
+    """
+    state = load_or_error()
+    if not state: return
+    if not validate_angle('azimuth', azimuth, 0, 360): return
+    if not validate_angle('altitude', altitude, 0, 90): return
+    info('Setting hillshade light to azimuth {} at altitude {}'.format(azimuth, altitude))
+    state.set_hillshade(azimuth, altitude)
+    if save_or_error(state):
+        success('Hillshade enabled with light from azimuth {} at altitude {}'.format(azimuth, altitude))
+
+@click.command()
+def clear_hillshade():
+    """
+    Stops adding hillshades to the package.
+    """
+    state = load_or_error()
+    if not state: return
+    info('Clearing hillshade')
+    state.clear_hillshade()
+    if save_or_error(state):
+        success('Hillshade disabled!')
+
+@click.command()
+@click.option('--directions', '-d', type=int, default=shading.DEFAULT_SKY_VIEW_DIRECTIONS, help='Number of directions the horizon is scanned in')
+@click.option('--radius', '-r', type=float, default=shading.DEFAULT_SKY_VIEW_RADIUS, help='How far the horizon is scanned, in meters')
+def set_sky_view(directions, radius):
+    """
+    Adds a sky-view factor map of every height file to the package as heightfileN_skyview.png,
+    for ambient occlusion on the client. 255 is open sky, darker cells see less of the sky
+    because of the surrounding terrain.
+
+    Usage example:
+    mapcreator set_sky_view --directions 32 --radius 2000
+    """
+    state = load_or_error()
+    if not state: return
+    if directions < 4 or directions > 360:
+        error('Invalid number of directions {}!'.format(directions))
+        info('(Should be between 4 and 360)')
+        return
+    if radius <= 0:
+        error('Invalid radius {}!'.format(radius))
+        info('(Should be greater than 0)')
+        return
+    info('Setting sky-view factor to {} directions within {} m'.format(directions, radius))
+    state.set_sky_view(directions, radius)
+    if save_or_error(state):
+        success('Sky-view factor enabled with {} directions within {} m'.format(directions, radius))
+
+@click.command()
+def clear_sky_view():
+    """
+    Stops adding sky-view factor maps to the package.
+    """
+    state = load_or_error()
+    if not state: return
+    info('Clearing sky-view factor')
+    state.clear_sky_view()
+    if save_or_error(state):
+        success('Sky-view factor disabled!')
+
+@click.command()
+@click.option('--max-error', '-e', type=float, default=1.0, help='Maximum vertical error in meters')
+def set_terrain_mesh(max_error):
+    """
+    Adds an adaptive triangle mesh of every height file to the package, so the client doesn't have
+    to triangulate the dense grid. Flat areas get large triangles and rough ones small triangles,
+    no point of the mesh being further than the maximum error from the height grid. The vertices
+    (column, row and height) are written to heightfileN_mesh.vtx, the triangles' vertex indices to
+    heightfileN_mesh.idx and both are described in heightfile_meshes.json.
+
+    Usage example:
+    mapcreator set_terrain_mesh --max-error 0.5
+    """
+    state = load_or_error()
+    if not state: return
+    if max_error < 0:
+        error('Invalid maximum error {}!'.format(max_error))
+        info('(Should be at least 0)')
+        return
+    info('Setting terrain mesh maximum error to {} m'.format(max_error))
+    state.set_terrain_mesh(max_error)
+    if save_or_error(state):
+        success('Terrain mesh enabled with maximum error {} m'.format(max_error))
+
+@click.command()
+def clear_terrain_mesh():
+    """
+    Stops adding terrain meshes to the package.
+    """
+    state = load_or_error()
+    if not state: return
+    info('Clearing terrain mesh')
+    state.clear_terrain_mesh()
+    if save_or_error(state):
+        success('Terrain mesh disabled!')
+
+@click.command()
+@click.argument('interval', type=float)
+@click.option('--tolerance', '-t', type=float, default=contours.DEFAULT_TOLERANCE, help='Simplification tolerance in cells')
+def set_contours(interval, tolerance):
+    """
+    Adds contour lines of every height file to the package, so the client can draw them as a vertex
+    buffer instead of computing them every frame. A line is traced at every multiple of the interval
+    (in meters) and simplified so that it stays within the tolerance (in height grid cells) of the
+    traced line. The vertices (column and row on the height grid) are written to
+    heightfileN_contours.vtx and the lines are described in heightfile_contours.json.
+
+    Usage example:
+    mapcreator set_contours 10 --tolerance 0.5
+    """
+    state = load_or_error()
+    if not state: return
+    if interval <= 0:
+        error('Invalid interval {}!'.format(interval))
+        info('(Should be greater than 0)')
+        return
+    if tolerance < 0:
+        error('Invalid tolerance {}!'.format(tolerance))
+        info('(Should be at least 0)')
+        return
+    info('Setting contour lines to every {} m'.format(interval))
+    state.set_contours(interval, tolerance)
+    if save_or_error(state):
+        success('Contour lines enabled every {} m'.format(interval))
+
+@click.command()
+def clear_contours():
+    """
+    Stops adding contour lines to the package.
+    """
+    state = load_or_error()
+    if not state: return
+    info('Clearing contour lines')
+    state.clear_contours()
+    if save_or_error(state):
+        success('Contour lines disabled!')
+
+@click.command()
+@click.argument('engine', type=click.Choice(resample.ENGINES))
+def set_height_engine(engine):
+    """
+    Specifies how height data is resampled into the output projection. numpy uses the built-in
+    engine, which reads geographic ENVI and uncompressed GeoTIFF sources directly and writes the
+    height files without GDAL; gdal (the default) always uses GDAL. auto uses the built-in engine
+    whenever the sources allow it. The built-in engine writes ENVI headers of its own, without
+    GDAL's coordinate system string and band names.
+
+    Usage example:
+    mapcreator set_height_engine gdal
+    """
+    state = load_or_error()
+    if not state: return
+    info('Setting height resampling engine to {}'.format(engine))
+    state.set_height_engine(engine)
+    if save_or_error(state):
+        success('Height resampling engine set to {}'.format(engine))
+
+@click.command()
+def clear_height_engine():
+    """
+    Resets the height resampling engine to gdal.
+    """
+    state = load_or_error()
+    if not state: return
+    info('Clearing height resampling engine')
+    state.clear_height_engine()
+    if save_or_error(state):
+        success('Height resampling engine reset to gdal!')
+
+@click.command()
+@click.option('--threads', '-t', type=int, default=None, help='Maximum number of threads GDAL may use')
+@click.option('--memory', '-m', type=int, default=None, help='Maximum amount of memory GDAL may use, in megabytes')
+def set_resource_budget(threads, memory):
+    """
+    Caps the threads and memory GDAL may use during a build. Without a budget, the build
+    chooses warp threads, warp memory and block cache size based on the available cores
+    and memory and the size of the output.
+
+    Usage example:
+    mapcreator set_resource_budget --threads 8 --memory 4096
+    """
+    state = load_or_error()
+    if not state: return
+    if threads is None and memory is None:
+        error('Give at least one of --threads and --memory!')
+        return
+    if threads is not None and not validate_thread_count(threads, 1, 1024): return
+    if memory is not None and not validate_memory(memory, 128, 1048576): return
+    info('Setting resource budget')
+    state.set_resource_budget(threads, memory)
+    if save_or_error(state):
+        success('Resource budget set to {} threads and {} memory'.format(
+            threads or 'unlimited', '{} MB'.format(memory) if memory else 'unlimited'
+        ))
+
+@click.command()
+def clear_resource_budget():
+    """
+    Clears the resource budget, letting the build use as much of the host as it sees fit.
+    """
+    state = load_or_error()
+    if not state: return
+    info('Clearing resource budget')
+    state.clear_resource_budget()
+    if save_or_error(state):
+        success('Resource budget cleared!')
+
+@click.command()
+@click.option('--directory', '-d', type=click.Path(file_okay=False), default=tilecache.DEFAULT_DIRECTORY, help='Cache directory, shared by projects')
+@click.option('--max-size', '-s', type=int, default=tilecache.DEFAULT_MAX_MB, help='Maximum size of the cache in megabytes')
+def set_tile_cache(directory, max_size):
+    """
+    Keeps the source files reprojected by GDAL in a cache directory shared by all projects, so
+    projects with different windows over the same sources don't warp the same pixels again.
+    Sources are cached per resolution and coordinate system. When the cache grows over its maximum
+    size, the sources used least recently are removed. The built-in resampling engine doesn't use it.
+
+    Usage example:
+    mapcreator set_tile_cache --directory ~/tile_cache --max-size 8192
+    """
+    state = load_or_error()
+    if not state: return
+    if not validate_memory(max_size, 16, 1048576 * 16): return
+    directory = path.abspath(path.expanduser(directory))
+    info('Setting reprojected tile cache to {}'.format(directory))
+    state.set_tile_cache(directory, max_size)
+    if save_or_error(state):
+        success('Reprojected tile cache set to {} (up to {} MB)'.format(directory, max_size))
+
+@click.command()
+def clear_tile_cache():
+    """
+    Stops using the reprojected tile cache. The cached files are left in place.
+    """
+    state = load_or_error()
+    if not state: return
+    info('Clearing reprojected tile cache')
+    state.clear_tile_cache()
+    if save_or_error(state):
+        success('Reprojected tile cache disabled!')
+
+@click.command()
+@click.argument('min_zoom', type=int)
+@click.argument('max_zoom', type=int)
+def set_vector_tiles(min_zoom, max_zoom):
+    """
+    Enables vector tile output. Trails and areas are additionally cut into a z/x/y pyramid
+    of Mapbox Vector Tiles on zoom levels MIN_ZOOM...MAX_ZOOM (both between 0 and 20).
+
+    Usage example:
+    mapcreator set_vector_tiles 10 16
+    """
+    state = load_or_error()
+    if not state: return
+    if not validate_zoom_range(min_zoom, max_zoom, 0, 20): return
+    info('Setting vector tile zoom levels to {}-{}'.format(min_zoom, max_zoom))
+    state.set_vector_tile_zooms(min_zoom, max_zoom)
+    if save_or_error(state):
+        success('Vector tiles enabled for zoom levels {}-{}'.format(min_zoom, max_zoom))
+
+@click.command()
+def clear_vector_tiles():
+    """
+    Disables vector tile output.
+    """
+    state = load_or_error()
+    if not state: return
+    info('Disabling vector tile output')
+    state.clear_vector_tiles()
+    if save_or_error(state):
+        success('Vector tile output disabled!')
+
 @click.command()
 @click.option('--output', '-o', default='3dmapdata.zip', help='Output file name. Default: 3dmapdata.zip')
 @click.option('--force', '-f', is_flag=True, help='Build even if output file already exists')
 @click.option('--debug', '-d', is_flag=True, help='Causes debug information to be printed during the build')
 @click.option('--clean/--no-clean', default=True, help='Specifies whether to clean temporary build files after building')
-def build(output, force, debug, clean):
+@click.option('--cache/--no-cache', default=True, help='Specifies whether to reuse the results of unchanged pipelines from the build cache')
+def build(output, force, debug, clean, cache):
     """
     Builds the project.
     Transforms and translates all output files to format used by the 3DMaps-application and packages them for easy transportation.
@@ -346,26 +1000,11 @@ def build(output, force, debug, clean):
     highlight('STARTING BUILD')
     info('Output file is {}'.format(output))
 
-    outfiles = []
-    has_errors = False
-
-    heightmap_outfiles, heightmap_has_errors = do_build(
-        state.height_files, building.HeightMapStatus, building.HEIGHTMAP_ACTIONS, state, debug
-        )
-    has_errors |= heightmap_has_errors
-    outfiles.extend(heightmap_outfiles)
-
-    osm_outfiles, osm_has_errors = do_build(
-        state.osm_files, building.OSMStatus, building.OSM_ACTIONS, state, debug
-    )
-    has_errors |= osm_has_errors
-    outfiles.extend(osm_outfiles)
-
-    satellite_outfiles, satellite_has_errors = do_build(
-        state.satellite_files, building.SatelliteStatus, building.SATELLITE_ACTIONS, state, debug
-    )
-    has_errors |= satellite_has_errors
-    outfiles.extend(satellite_outfiles)
+    outfiles, has_errors = do_builds([
+        ('height', state.height_files, building.HeightMapStatus, building.HEIGHTMAP_ACTIONS),
+        ('osm', state.osm_files, building.OSMStatus, building.OSM_ACTIONS),
+        ('satellite', state.satellite_files, building.SatelliteStatus, building.SATELLITE_ACTIONS),
+    ], state, debug, buildcache.BuildCache(persistence.build_cache_dir()) if cache else None)
 
     info('Building package...')
     try:
@@ -394,6 +1033,20 @@ def clean_temp_files():
     if build_clean_or_error():
         success('Cleaned up!')
 
+@click.command()
+def clear_build_cache():
+    """
+    Removes the cached results of earlier builds. The next build rebuilds every pipeline.
+    """
+    cache = buildcache.BuildCache(persistence.build_cache_dir())
+    info('Removing the build cache')
+    try:
+        cache.clear()
+    except OSError as e:
+        error('Unable to remove the build cache: {}'.format(e))
+        return
+    success('Build cache removed!')
+
 @click.command()
 def status():
     """Shows the status of the current project"""
@@ -403,6 +1056,7 @@ def status():
         state = persistence.load_state()
         for line in str(state).split('\n'):
             info(line)
+        show_source_metadata(state)
     else:
         info('No project found in current working directory.')
 
@@ -433,9 +1087,46 @@ cli.add_command(set_satellite_resolution)
 cli.add_command(reset)
 cli.add_command(build)
 cli.add_command(clean_temp_files)
+cli.add_command(clear_build_cache)
 cli.add_command(clear_area_colors)
 cli.add_command(clear_height_files)
 cli.add_command(clear_osm_files)
 cli.add_command(clear_satellite_files)
 cli.add_command(clear_height_system)
 cli.add_command(clear_satellite_system)
+cli.add_command(set_probe_threads)
+cli.add_command(set_build_workers)
+cli.add_command(set_vector_tiles)
+cli.add_command(clear_vector_tiles)
+cli.add_command(set_height_tiles)
+cli.add_command(clear_height_tiles)
+cli.add_command(set_height_lods)
+cli.add_command(clear_height_lods)
+cli.add_command(set_height_encoding)
+cli.add_command(clear_height_encoding)
+cli.add_command(set_satellite_encoding)
+cli.add_command(clear_satellite_encoding)
+cli.add_command(set_satellite_mipmaps)
+cli.add_command(clear_satellite_mipmaps)
+cli.add_command(set_normal_map)
+cli.add_command(clear_normal_map)
+cli.add_command(set_hillshade)
+cli.add_command(clear_hillshade)
+cli.add_command(set_sky_view)
+cli.add_command(clear_sky_view)
+cli.add_command(set_terrain_mesh)
+cli.add_command(clear_terrain_mesh)
+cli.add_command(set_contours)
+cli.add_command(clear_contours)
+cli.add_command(set_height_engine)
+cli.add_command(clear_height_engine)
+cli.add_command(set_resource_budget)
+cli.add_command(clear_resource_budget)
+cli.add_command(set_tile_cache)
+cli.add_command(clear_tile_cache)
+cli.add_command(optimize_satellite_files)
+cli.add_command(clear_optimized_satellite_files)
+cli.add_command(set_satellite_texture)
+cli.add_command(clear_satellite_texture)
+cli.add_command(set_satellite_palette)
+cli.add_command(clear_satellite_palette)
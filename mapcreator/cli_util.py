@@ -1,9 +1,23 @@
 import click
-import sys, traceback
+import traceback
+import glob
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatch
+from io import StringIO
+from os import path, walk, remove, curdir
 from mapcreator import building
 from mapcreator import persistence
 from mapcreator import echoes
+from mapcreator import gdal_util
+from mapcreator import optimize, resources, scheduler, buildcache
 from mapcreator.state import FileAddResult
+from mapcreator.sourceindex import SourceIndex
+
+# Files next to rasters that aren't sources themselves
+SIDECAR_EXTENSIONS = ('.aux.xml', '.hdr', '.ovr', '.prj', '.tfw', '.jgw', '.xml', '.txt', '.md5', '.json')
+# Sources whose footprints are indexed when added
+INDEXED_ADD_METHODS = ('add_height_file', 'add_satellite_file')
+ADD_METHOD_FILES = {'add_height_file': 'height_files', 'add_osm_file': 'osm_files', 'add_satellite_file': 'satellite_files'}
 
 
 """
@@ -66,24 +80,88 @@ def build_clean_or_error():
     else: 
         return True
 
+def glob_files(file_pattern):
+    """
+    Returns the files matching a glob pattern, sorted. ** matches any number of directories, like
+    glob.glob(recursive=True), which isn't there before Python 3.5.
+    """
+    if '**' not in file_pattern:
+        return sorted(glob.glob(file_pattern))
+    base, rest = file_pattern.split('**', 1)
+    rest = rest.lstrip('/' + path.sep) or '*'
+    bases = glob.glob(base) if glob.has_magic(base) else [base or curdir]
+    matches = set()
+    for directory in bases:
+        for root, dirnames, filenames in walk(directory):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')] # As glob skips hidden directories
+            matches.update(glob_files(path.join(root, rest) if base else path.normpath(path.join(root, rest))))
+    return sorted(matches)
+
+def expand_source_files(files, directories = (), patterns = (), manifests = (), pattern = '*'):
+    """
+    Returns the given files followed by the files found in the directories (recursively, matching pattern
+    and skipping sidecar files), the files matching the glob patterns and the files listed in the manifests
+    (one per line, relative to the manifest, # starting a comment).
+    """
+    result = list(files)
+    for directory in directories:
+        for root, dirnames, filenames in walk(directory):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if fnmatch(filename, pattern) and not filename.lower().endswith(SIDECAR_EXTENSIONS):
+                    result.append(path.join(root, filename))
+    for file_pattern in patterns:
+        result.extend(glob_files(file_pattern))
+    for manifest in manifests:
+        with open(manifest, 'r') as infile:
+            for line in infile:
+                line = line.split('#')[0].strip()
+                if line:
+                    result.append(path.join(path.dirname(manifest), line))
+    return tuple(result)
+
+def index_source_footprints(state, fpaths):
+    """Probes the footprints of newly added source files into the project's spatial source index."""
+    index = SourceIndex.load(persistence.source_index_path())
+    fpaths = [f for f in fpaths if path.exists(f) and not index.contains(f)]
+    if not fpaths: return
+    echoes.info('Indexing footprints of {} files...'.format(len(fpaths)))
+    cache = gdal_util.GdalinfoCache.load(persistence.gdalinfo_cache_path())
+    try:
+        for fpath, gdal_info in zip(fpaths, cache.get_many(fpaths, state.get_probe_threads())):
+            index.add(fpath, gdal_info)
+    except Exception as e:
+        echoes.warn('Unable to index the footprints of the added files: {}'.format(e))
+        echoes.info('(They will be probed when building instead)')
+    try:
+        cache.save()
+        index.save()
+    except Exception as e:
+        echoes.warn('Unable to save the source index: {}'.format(e))
+
 def add_files(files, add_method_name):
     state = load_or_error()
     if not state: return
     echoes.info('Adding files to project...')
-    count = 0
+    added = []
+    # Duplicates are looked up in one set of the added files, not by scanning the list for every file
+    fset = set(getattr(state, ADD_METHOD_FILES[add_method_name]))
     for fpath in files:
-        result = getattr(state, add_method_name)(fpath) # Call method whose name is add_method_name
+        result = getattr(state, add_method_name)(fpath, fset) # Call method whose name is add_method_name
         if result == FileAddResult.DOESNT_EXIST:
             echoes.error('File "{}" doesn\'t exist!'.format(fpath))
         elif result == FileAddResult.ALREADY_ADDED:
             echoes.warn('{} has already been added to this project'.format(fpath))
         elif result == FileAddResult.SUCCESS:
             echoes.info('"{}" added'.format(fpath))
-            count += 1
+            added.append(fpath)
         else:
             echoes.error('Unrecognized FileAddResult {} when trying to add {}!'.format(result, fpath))
+    count = len(added)
     if count > 0:
         if not save_or_error(state): return
+        if add_method_name in INDEXED_ADD_METHODS:
+            index_source_footprints(state, added)
         if count == len(files):
             echoes.success("{} files added to the project successfully!".format(len(files)))
         else:
@@ -100,6 +178,75 @@ def clear_files(clear_method_name, files_type):
         echoes.success('All {} files cleared successfully!'.format(files_type))
     
 
+def optimize_satellite_sources(state, fpaths, force = False):
+    """
+    Writes optimized copies of the satellite files that have no up to date copy (or of all of them, if
+    force is set) and records them in the state. Returns whether all the copies were written and saved.
+    """
+    if not force:
+        fpaths = [f for f in fpaths if not optimize.is_current(state.get_optimized_satellite_file(f), f)]
+    if not fpaths:
+        echoes.info('All satellite/aerial files are optimized already.')
+        return True
+    echoes.info('Optimizing {} satellite/aerial files...'.format(len(fpaths)))
+    cache = gdal_util.GdalinfoCache.load(persistence.gdalinfo_cache_path())
+    output = StringIO()
+    try:
+        gdal_infos = cache.get_many(fpaths, state.get_probe_threads())
+        with ThreadPoolExecutor(max_workers=resources.worker_count(state, len(fpaths))) as executor:
+            copies = list(executor.map(
+                lambda f, gdal_info: optimize.optimize_source(f, gdal_info, persistence.optimized_dir(), output),
+                fpaths, gdal_infos
+            ))
+    except Exception as e:
+        echoes.error('Unable to optimize the satellite/aerial files: {}'.format(e))
+        return False
+    try:
+        cache.save()
+    except Exception as e:
+        echoes.warn('Unable to save the metadata cache: {}'.format(e))
+    failed = []
+    for fpath, copy in zip(fpaths, copies):
+        if copy is None:
+            failed.append(fpath)
+        else:
+            state.set_optimized_satellite_file(fpath, copy)
+            echoes.info('"{}" optimized ({} overviews)'.format(fpath, len(copy['overviews'])))
+    for line in output.getvalue().split('\n'):
+        if line: echoes.warn(line)
+    for fpath in failed:
+        echoes.error('Unable to optimize "{}"!'.format(fpath))
+    if not save_or_error(state): return False
+    return not failed
+
+def clear_optimized_satellite_sources(state):
+    """Removes the optimized copies of the satellite files and forgets them."""
+    for fpath, copy in getattr(state, 'optimized_satellite_files', {}).items():
+        try:
+            remove(copy['path'])
+        except OSError:
+            pass # Already removed
+    state.clear_optimized_satellite_files()
+
+def show_source_metadata(state):
+    """
+    Shows the metadata of the project's height and satellite files.
+    The metadata comes from the gdalinfo cache, so only new or changed files get probed.
+    """
+    files = getattr(state, 'height_files', []) + getattr(state, 'satellite_files', [])
+    if not files: return
+    cache = gdal_util.GdalinfoCache.load(persistence.gdalinfo_cache_path())
+    echoes.info('-Source raster metadata:')
+    for fpath in files:
+        try:
+            echoes.info('--{}: {}'.format(path.basename(fpath), cache.get(fpath)))
+        except Exception as e:
+            echoes.warn('Unable to read metadata of {}: {}'.format(fpath, e))
+    try:
+        cache.save()
+    except Exception as e:
+        echoes.warn('Unable to save the metadata cache: {}'.format(e))
+
 def parse_color(line, debug = False):
     PARSER = [str, int, int, int]
     parts = line.split(' ')
@@ -133,27 +280,138 @@ def validate_resolution(reso, lower, upper):
         return False
     return True
 
+def validate_thread_count(threads, lower, upper):
+    if threads < lower or threads > upper:
+        echoes.error("Invalid thread count {}!".format(threads))
+        echoes.info("(Should be between {} and {})".format(lower, upper))
+        return False
+    return True
+
+def validate_tile_count(count, lower, upper):
+    if count < lower or count > upper:
+        echoes.error("Invalid tile count {}!".format(count))
+        echoes.info("(Should be between {} and {})".format(lower, upper))
+        return False
+    return True
+
+def validate_lod_count(levels, lower, upper):
+    if levels < lower or levels > upper:
+        echoes.error("Invalid number of detail levels {}!".format(levels))
+        echoes.info("(Should be between {} and {})".format(lower, upper))
+        return False
+    return True
+
+def validate_memory(memory, lower, upper):
+    if memory < lower or memory > upper:
+        echoes.error("Invalid amount of memory {} MB!".format(memory))
+        echoes.info("(Should be between {} and {} MB)".format(lower, upper))
+        return False
+    return True
+
+def validate_angle(name, angle, lower, upper):
+    if angle < lower or angle > upper:
+        echoes.error("Invalid {} {}!".format(name, angle))
+        echoes.info("(Should be between {} and {} degrees)".format(lower, upper))
+        return False
+    return True
+
+def validate_zoom_range(min_zoom, max_zoom, lower, upper):
+    for zoom in (min_zoom, max_zoom):
+        if zoom < lower or zoom > upper:
+            echoes.error("Invalid zoom level {}!".format(zoom))
+            echoes.info("(Should be between {} and {})".format(lower, upper))
+            return False
+    if min_zoom > max_zoom:
+        echoes.error("Minimum zoom level {} is greater than maximum zoom level {}!".format(min_zoom, max_zoom))
+        return False
+    return True
+
 def do_build(files, statusclass, actions, state, debug = False):
-    has_errors = False
-    outfiles = []
+    return do_builds([('build', files, statusclass, actions)], state, debug)
+
+def read_pipelines(name, stages):
+    """Returns the names of the other pipelines whose results the stages of pipeline name read."""
+    return set(a.split(':')[0] for stage in stages for a in stage.inputs) - {name}
+
+def check_build_cache(cache, name, files, state, stages, fingerprints):
+    """
+    Looks up the cached build of pipeline name, whose stages are given, and echoes whether it's reused.
+    Returns (inputs, cached outfiles), where inputs is None if the pipeline isn't cached and the
+    outfiles are None if it has to be rebuilt.
+    """
+    if cache is None or name not in buildcache.PIPELINE_SETTINGS or not files:
+        return (None, None)
+    upstream = dict((p, fingerprints[p]) for p in read_pipelines(name, stages) if p in fingerprints)
+    inputs = buildcache.pipeline_inputs(name, files, state, upstream)
+    fingerprints[name] = buildcache.fingerprint(inputs)
+    manifest = cache.load(name)
+    if manifest is not None and manifest['fingerprint'] == fingerprints[name]:
+        try:
+            outfiles = cache.restore(name, manifest, building.FINALIZED_DIR)
+        except OSError as e:
+            echoes.warn('Unable to restore the cached {} build: {}'.format(name, e))
+        else:
+            echoes.info('Reusing the cached {} build ({} stages)'.format(name, len(stages)))
+            for line in manifest['report'].split('\n'):
+                echoes.info(line)
+            return (inputs, outfiles)
+    if manifest is None:
+        reason = 'not built before'
+    else:
+        reason = '{} changed'.format(', '.join(buildcache.changed_inputs(manifest.get('inputs', {}), inputs)))
+    echoes.info('Rebuilding {} ({} stages): {}'.format(name, len(stages), reason))
+    return (inputs, None)
+
+def do_builds(pipelines, state, debug = False, cache = None):
+    """
+    Builds the pipelines, each (name, files, statusclass, actions), side by side with the build scheduler.
+    Pipelines whose inputs haven't changed since they were stored in cache (a BuildCache), if given,
+    are restored from it instead. Returns (outfiles, has_errors).
+    """
+    pipeline_outfiles = [[] for pipeline in pipelines]
+    built = [] # (index, buildstatus, inputs, stages) of the pipelines that are built
+    stages = []
+    fingerprints = {}
+    for index, (name, files, statusclass, actions) in enumerate(pipelines):
+        buildstatus = statusclass(0, files, state)
+        pipeline_stages = building.pipeline_stages(name, buildstatus, actions, debug)
+        inputs, cached_outfiles = check_build_cache(cache, name, files, state, pipeline_stages, fingerprints)
+        if cached_outfiles is not None:
+            pipeline_outfiles[index] = cached_outfiles
+            continue
+        built.append((index, buildstatus, inputs, pipeline_stages))
+        stages.extend(pipeline_stages)
+    # The pipelines built at once split the cores, memory and resource budget between them
+    busy_pipelines = sum(1 for index, buildstatus, inputs, pipeline_stages in built if pipelines[index][1])
+    state.set_build_share(max(1, min(state.get_build_workers(), busy_pipelines)))
     echoes.info('Processing...')
-    buildstatus = statusclass(0, files, state)
-    errors = []
-    with click.progressbar(actions, bar_template=echoes.PROGRESS_BAR_TEMPLATE, show_eta=False) as bar:
-        for action in bar:
-            try:
-                action(buildstatus, debug)
-            except Exception as e:
-                errors.append(e)
-                if debug:
-                    e_type, e_value, e_traceback = sys.exc_info()
-                    errors.extend(traceback.format_tb(e_traceback))
-                has_errors = True
-    if errors:
-        echoes.error('Exceptions caught:')
-        for e in errors:
-            echoes.error(e)
-    for line in str(buildstatus).split('\n'):
-        echoes.info(line)
-    outfiles.extend(buildstatus.get_result_files())
-    return (outfiles, has_errors)
\ No newline at end of file
+    with click.progressbar(length=len(stages), bar_template=echoes.PROGRESS_BAR_TEMPLATE, show_eta=False) as bar:
+        failures = scheduler.run_stages(stages, state.get_build_workers(), lambda stage: bar.update(1))
+    state.set_build_share(1)
+    failed = set(stage.name.split(':')[0] for stage, e in failures)
+    for index, buildstatus, inputs, pipeline_stages in built:
+        name = pipelines[index][0]
+        errors = []
+        for stage, e in failures:
+            if not stage.name.startswith(name + ':'): continue
+            errors.append(e)
+            if debug:
+                errors.extend(traceback.format_tb(e.__traceback__))
+        if errors:
+            echoes.error('Exceptions caught:')
+            for e in errors:
+                echoes.error(e)
+        for line in str(buildstatus).split('\n'):
+            echoes.info(line)
+        pipeline_outfiles[index] = buildstatus.get_result_files()
+        # A pipeline reading the results of a failed one would be cached with its failure
+        if inputs is not None and not failed.intersection({name} | read_pipelines(name, pipeline_stages)):
+            store_build(cache, name, inputs, buildstatus)
+    return ([f for outfiles in pipeline_outfiles for f in outfiles], len(failures) > 0)
+
+def store_build(cache, name, inputs, buildstatus):
+    files = [(building.get_package_name(f), f) for f in buildstatus.get_result_files()]
+    try:
+        cache.store(name, inputs, files, str(buildstatus))
+    except OSError as e:
+        echoes.warn('Unable to cache the {} build: {}'.format(name, e))
@@ -0,0 +1,186 @@
+"""
+Contour lines of height grids, traced with marching squares.
+
+Each square of four neighbouring cells is classified by which of its corners are at or above the
+contour level, for all squares of the grid at once, and the contour crosses the square's edges at
+linearly interpolated points. Segments sharing an edge crossing are then joined into polylines,
+which are simplified with the Douglas-Peucker algorithm.
+
+Positions are in cell units of the height grid: (column, row), whole numbers being cell centers.
+Squares touching a nodata cell have no contours.
+"""
+import math
+import numpy as np
+
+DEFAULT_TOLERANCE = 0.25 # Cells
+
+# Square edges: top, right, bottom and left
+TOP, RIGHT, BOTTOM, LEFT = range(4)
+
+# Corner bits: top left 8, top right 4, bottom right 2, bottom left 1 -> the edge pairs the contour crosses.
+# The saddles 5 and 10 are listed with the center below the level; with it above, SADDLES is used.
+SEGMENTS = {
+    1: [(LEFT, BOTTOM)], 2: [(BOTTOM, RIGHT)], 3: [(LEFT, RIGHT)], 4: [(TOP, RIGHT)],
+    5: [(TOP, RIGHT), (LEFT, BOTTOM)], 6: [(TOP, BOTTOM)], 7: [(TOP, LEFT)], 8: [(TOP, LEFT)],
+    9: [(TOP, BOTTOM)], 10: [(TOP, LEFT), (BOTTOM, RIGHT)], 11: [(TOP, RIGHT)], 12: [(LEFT, RIGHT)],
+    13: [(BOTTOM, RIGHT)], 14: [(LEFT, BOTTOM)],
+}
+SADDLES = {
+    5: [(TOP, LEFT), (BOTTOM, RIGHT)],
+    10: [(TOP, RIGHT), (LEFT, BOTTOM)],
+}
+
+def contour_levels(heights, interval):
+    """
+    Returns the multiples of interval strictly between the lowest and the highest of heights (NaN being nodata).
+    A contour at either extreme would only outline single cells or plateaus.
+    """
+    if np.all(np.isnan(heights)):
+        return np.array([])
+    low, high = np.nanmin(heights), np.nanmax(heights)
+    return np.arange(math.floor(low / interval) + 1, math.ceil(high / interval)) * interval
+
+def edge_crossings(corners, rows, columns, edges, level, samples):
+    """
+    Returns (keys, points) of where the contour crosses the given edges of the squares at rows, columns.
+    Keys identify an edge of the grid, so that the squares on both sides of it agree on them.
+    """
+    tl, tr, br, bl = (corner[rows, columns] for corner in corners)
+    starts = np.choose(edges, [tl, tr, bl, tl])
+    ends = np.choose(edges, [tr, br, br, bl])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(ends != starts, (level - starts) / (ends - starts), 0.5)
+    horizontal = (edges == TOP) | (edges == BOTTOM)
+    edge_rows = rows + (edges == BOTTOM)
+    edge_columns = columns + (edges == RIGHT)
+    points = np.stack([
+        np.where(horizontal, columns + t, edge_columns),
+        np.where(horizontal, edge_rows, rows + t),
+    ], axis=-1)
+    keys = ((edge_rows * (samples + 1) + edge_columns) * 2 + ~horizontal).astype(np.int64)
+    return keys, points
+
+def marching_squares(heights, level):
+    """
+    Returns the contour segments at level as (keys, points): keys of shape (segments, 2) identifying
+    the edges the segments end on and points of shape (segments, 2, 2) with their positions.
+    """
+    samples = heights.shape[1]
+    corners = (heights[:-1, :-1], heights[:-1, 1:], heights[1:, 1:], heights[1:, :-1])
+    above = [corner >= level for corner in corners]
+    cases = above[0] * 8 + above[1] * 4 + above[2] * 2 + above[3] * 1
+    cases[np.isnan(sum(corners))] = 0
+    center_above = sum(corners) / 4 >= level
+    selections = [(SEGMENTS[case], cases == case) for case in SEGMENTS if case not in SADDLES]
+    for case in SADDLES:
+        selections.append((SEGMENTS[case], (cases == case) & ~center_above))
+        selections.append((SADDLES[case], (cases == case) & center_above))
+    all_keys, all_points = [], []
+    for pairs, selected in selections:
+        rows, columns = np.nonzero(selected)
+        if not len(rows): continue
+        for pair in pairs:
+            crossings = [edge_crossings(corners, rows, columns, np.full(len(rows), edge), level, samples) for edge in pair]
+            all_keys.append(np.stack([keys for keys, points in crossings], axis=1))
+            all_points.append(np.stack([points for keys, points in crossings], axis=1))
+    if not all_keys:
+        return np.zeros((0, 2), dtype=np.int64), np.zeros((0, 2, 2))
+    return np.concatenate(all_keys), np.concatenate(all_points)
+
+def join_segments(keys, points):
+    """Joins segments sharing an end into polylines. Closed rings end at their first point."""
+    ends = {}
+    for index, (first, second) in enumerate(keys.tolist()):
+        ends.setdefault(first, []).append(index)
+        ends.setdefault(second, []).append(index)
+    used = np.zeros(len(keys), dtype=bool)
+    polylines = []
+
+    def walk(key):
+        """Follows unused segments from key until the line ends or closes. Returns the points passed."""
+        chain = []
+        while True:
+            others = [i for i in ends[key] if not used[i]]
+            if not others: return chain
+            index = others[0]
+            used[index] = True
+            end = 1 if keys[index, 0] == key else 0
+            chain.append(points[index, end])
+            key = keys[index, end]
+
+    # Open lines start from an end with only one segment, rings from anywhere
+    order = sorted(range(len(keys)), key=lambda i: min(len(ends[keys[i, 0]]), len(ends[keys[i, 1]])))
+    for index in order:
+        if used[index]: continue
+        used[index] = True
+        first, second = keys[index]
+        if len(ends[first]) > 1 and len(ends[second]) == 1:
+            first, second = second, first
+            start, end = points[index, 1], points[index, 0]
+        else:
+            start, end = points[index, 0], points[index, 1]
+        forward = walk(second)
+        backward = walk(first)
+        line = backward[::-1] + [start, end] + forward
+        polylines.append(np.array(line))
+    return polylines
+
+def simplify(points, tolerance):
+    """Simplifies a polyline with the Douglas-Peucker algorithm, keeping its end points."""
+    if len(points) < 3 or tolerance <= 0:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    closed = np.array_equal(points[0], points[-1])
+    stack = [(0, len(points) - 1)]
+    if closed and len(points) > 3:
+        # A ring's ends coincide, so split it at its furthest point first
+        furthest = int(np.argmax(np.sum((points - points[0]) ** 2, axis=1)))
+        keep[furthest] = True
+        stack = [(0, furthest), (furthest, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2: continue
+        start, end = points[first], points[last]
+        direction = end - start
+        length = math.hypot(*direction)
+        offsets = points[first + 1:last] - start
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(direction[0] * offsets[:, 1] - direction[1] * offsets[:, 0]) / length
+        worst = int(np.argmax(distances))
+        if distances[worst] > tolerance:
+            middle = first + 1 + worst
+            keep[middle] = True
+            stack.append((first, middle))
+            stack.append((middle, last))
+    return points[keep]
+
+def trace_contours(raster, interval, tolerance = DEFAULT_TOLERANCE):
+    """Returns the contours of a single band EnviRaster every interval meters as a list of (level, polyline) pairs."""
+    heights = raster.data.astype(np.float64)
+    if raster.nodata is not None:
+        heights[raster.data == raster.nodata] = np.nan
+    contours = []
+    if min(heights.shape) < 2:
+        return contours
+    for level in contour_levels(heights, interval):
+        keys, points = marching_squares(heights, level)
+        for polyline in join_segments(keys, points):
+            contours.append((float(level), simplify(polyline, tolerance)))
+    return contours
+
+def save_contours(contours, vertexpath):
+    """
+    Writes the vertices of all the contours one after another as float32 (column, row) pairs.
+    Returns the [level, first vertex, vertex count] of each contour.
+    """
+    table = []
+    first = 0
+    for level, polyline in contours:
+        table.append([level, first, len(polyline)])
+        first += len(polyline)
+    vertices = np.concatenate([p for level, p in contours]) if contours else np.zeros((0, 2))
+    vertices.astype('<f4').tofile(vertexpath)
+    return table
@@ -0,0 +1,224 @@
+"""
+Reading and writing of ENVI rasters: a raw binary data file (.bin) accompanied by a
+plain text header (.hdr). This is the format of the height data in the output package.
+"""
+import numpy as np
+from collections import OrderedDict
+from os import path
+
+# ENVI data type codes -> numpy type (without byte order)
+DATA_TYPES = {
+    1: 'u1',
+    2: 'i2',
+    3: 'i4',
+    4: 'f4',
+    5: 'f8',
+    12: 'u2',
+    13: 'u4',
+    14: 'i8',
+    15: 'u8',
+}
+DATA_TYPE_CODES = {np.dtype(v).str[1:]: k for k, v in DATA_TYPES.items()}
+
+HEADER_MAGIC = 'ENVI'
+
+def header_path(binpath):
+    return path.splitext(binpath)[0] + '.hdr'
+
+def parse_list(value):
+    """Parses an ENVI list value such as '{a, b, c}' into a list of stripped strings."""
+    value = value.strip()
+    if value.startswith('{') and value.endswith('}'):
+        value = value[1:-1]
+    return [part.strip() for part in value.split(',')]
+
+def read_header(hdrpath):
+    """
+    Reads an ENVI header into an OrderedDict. Keys are lowercased,
+    values are left as strings (with braces kept for list values).
+    """
+    header = OrderedDict()
+    with open(hdrpath, 'r') as infile:
+        lines = infile.read().split('\n')
+    if not lines or lines[0].strip() != HEADER_MAGIC:
+        raise ValueError('{} is not an ENVI header!'.format(hdrpath))
+    key = None
+    value = ''
+    for line in lines[1:]:
+        if key is not None:
+            # Continuation of a multi-line {...} value
+            value += '\n' + line
+        elif '=' in line:
+            key, value = (part.strip() for part in line.split('=', 1))
+            key = key.lower()
+        else:
+            continue
+        if value.count('{') <= value.count('}'):
+            header[key] = value.strip()
+            key = None
+    return header
+
+def write_header(hdrpath, header):
+    with open(hdrpath, 'w') as outfile:
+        outfile.write(HEADER_MAGIC + '\n')
+        for key, value in header.items():
+            outfile.write('{} = {}\n'.format(key, value))
+
+def format_map_info(projection_name, ulx, uly, pixel_width, pixel_height, extra = ('WGS-84', 'units=Meters')):
+    return '{{{}, 1, 1, {!r}, {!r}, {!r}, {!r}, {}}}'.format(
+        projection_name, float(ulx), float(uly), float(pixel_width), float(pixel_height), ', '.join(extra)
+    )
+
+class EnviRaster:
+    """
+    An ENVI raster. The pixel data is available as a numpy array in self.data
+    (shape (lines, samples) for single band rasters and (bands, lines, samples) otherwise).
+    """
+
+    def __init__(self, data, header):
+        self.data = data
+        self.header = header
+
+    @classmethod
+    def load(cls, binpath, mmap = False):
+        header = read_header(header_path(binpath))
+        samples = int(header['samples'])
+        lines = int(header['lines'])
+        bands = int(header.get('bands', 1))
+        offset = int(header.get('header offset', 0))
+        dtype = EnviRaster.dtype_for_header(header)
+        interleave = header.get('interleave', 'bsq').lower()
+        if interleave == 'bsq':
+            shape = (bands, lines, samples)
+        elif interleave == 'bil':
+            shape = (lines, bands, samples)
+        elif interleave == 'bip':
+            shape = (lines, samples, bands)
+        else:
+            raise ValueError('Unsupported ENVI interleave "{}"'.format(interleave))
+        if mmap:
+            data = np.memmap(binpath, dtype=dtype, mode='r', offset=offset, shape=shape)
+        else:
+            with open(binpath, 'rb') as infile:
+                infile.seek(offset)
+                data = np.fromfile(infile, dtype=dtype, count=bands * lines * samples).reshape(shape)
+        if interleave == 'bil':
+            data = data.transpose(1, 0, 2)
+        elif interleave == 'bip':
+            data = data.transpose(2, 0, 1)
+        if bands == 1:
+            data = data[0]
+        return EnviRaster(data, header)
+
+    @classmethod
+    def dtype_for_header(cls, header):
+        code = int(header.get('data type', 4))
+        if code not in DATA_TYPES:
+            raise ValueError('Unsupported ENVI data type {}'.format(code))
+        byteorder = '>' if header.get('byte order', '0').strip() == '1' else '<'
+        return np.dtype(byteorder + DATA_TYPES[code])
+
+    @classmethod
+    def create_header(cls, samples, lines, dtype, map_info = None, bands = 1, nodata = None):
+        dtype = np.dtype(dtype)
+        if dtype.str[1:] not in DATA_TYPE_CODES:
+            raise ValueError('Data type {} can\'t be stored in an ENVI file'.format(dtype))
+        header = OrderedDict()
+        header['samples'] = str(samples)
+        header['lines'] = str(lines)
+        header['bands'] = str(bands)
+        header['header offset'] = '0'
+        header['file type'] = 'ENVI Standard'
+        header['data type'] = str(DATA_TYPE_CODES[dtype.str[1:]])
+        header['interleave'] = 'bsq'
+        header['byte order'] = '1' if dtype.byteorder == '>' else '0'
+        if map_info is not None:
+            header['map info'] = map_info
+        if nodata is not None:
+            header['data ignore value'] = repr(float(nodata))
+        return header
+
+    def save(self, binpath):
+        data = self.data
+        dtype = np.dtype(self.header_dtype())
+        np.ascontiguousarray(data, dtype=dtype).tofile(binpath)
+        write_header(header_path(binpath), self.header)
+
+    def header_dtype(self):
+        return EnviRaster.dtype_for_header(self.header)
+
+    @property
+    def samples(self):
+        return int(self.header['samples'])
+
+    @property
+    def lines(self):
+        return int(self.header['lines'])
+
+    @property
+    def nodata(self):
+        if 'data ignore value' in self.header:
+            return float(self.header['data ignore value'])
+        return None
+
+    def has_map_info(self):
+        return 'map info' in self.header
+
+    def get_geotransform(self):
+        """
+        Returns (ulx, pixel_width, uly, pixel_height) of the raster's upper left pixel corner,
+        pixel_height being positive for north-up rasters.
+        """
+        if not self.has_map_info():
+            raise ValueError('ENVI raster has no map info')
+        info = parse_list(self.header['map info'])
+        refx, refy, easting, northing, pixel_width, pixel_height = map(float, info[1:7])
+        ulx = easting - (refx - 1) * pixel_width
+        uly = northing + (refy - 1) * pixel_height
+        return (ulx, pixel_width, uly, pixel_height)
+
+    def get_projection_name(self):
+        return parse_list(self.header['map info'])[0] if self.has_map_info() else None
+
+    def get_bounds(self):
+        """Returns (minx, miny, maxx, maxy) in map coordinates."""
+        ulx, pw, uly, ph = self.get_geotransform()
+        return (ulx, uly - ph * self.lines, ulx + pw * self.samples, uly)
+
+    def map_to_pixel(self, x, y):
+        """Converts map coordinates to fractional (column, row) pixel coordinates of pixel corners."""
+        ulx, pw, uly, ph = self.get_geotransform()
+        return ((np.asarray(x) - ulx) / pw, (uly - np.asarray(y)) / ph)
+
+    def sample_bilinear(self, x, y):
+        """
+        Samples the (single band) raster at the given map coordinates with bilinear interpolation.
+        Returns NaN for points outside the raster or touching nodata pixels.
+        """
+        col, row = self.map_to_pixel(x, y)
+        # Pixel values are located at pixel centers
+        col = np.atleast_1d(col - 0.5).astype(np.float64)
+        row = np.atleast_1d(row - 0.5).astype(np.float64)
+        data = self.data
+        height, width = data.shape
+        inside = (col >= -0.5) & (col <= width - 0.5) & (row >= -0.5) & (row <= height - 0.5)
+        col = np.clip(col, 0, width - 1)
+        row = np.clip(row, 0, height - 1)
+        c0 = np.minimum(np.floor(col).astype(np.int64), max(width - 2, 0))
+        r0 = np.minimum(np.floor(row).astype(np.int64), max(height - 2, 0))
+        c1 = np.minimum(c0 + 1, width - 1)
+        r1 = np.minimum(r0 + 1, height - 1)
+        fc = col - c0
+        fr = row - r0
+        nodata = self.nodata
+        def corner(r, c):
+            values = np.asarray(data[r, c], dtype=np.float64)
+            if nodata is not None:
+                values[values == nodata] = np.nan
+            return values
+        result = (
+            corner(r0, c0) * (1 - fc) * (1 - fr) + corner(r0, c1) * fc * (1 - fr) +
+            corner(r1, c0) * (1 - fc) * fr + corner(r1, c1) * fc * fr
+        )
+        result[~inside] = np.nan
+        return result
@@ -1,29 +1,718 @@
 import json
+import math
+import struct
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os import path, stat, makedirs
+from mapcreator import envi
+from mapcreator.mercator import mercator_to_lonlat
+
+try:
+    from osgeo import gdal
+except ImportError:
+    gdal = None
+
+def has_gdal_bindings():
+    return gdal is not None
 
 class Gdalinfo:
+    """
+    Metadata of a raster file: its WGS84 extent (minX, minY, maxX, maxY), coordinate system
+    (as WKT, or as an EPSG code when read natively), size in pixels, pixel size in the file's own
+    coordinate system, band information and nodata value.
+    """
+
+    FIELDS = ('minX', 'minY', 'maxX', 'maxY', 'crs', 'size', 'pixel_size', 'bands', 'nodata')
+
+    def __init__(self):
+        self.crs = None
+        self.size = None
+        self.pixel_size = None
+        self.bands = []
+        self.nodata = None
+
     @classmethod
     def for_file(cls, path):
+        gdal_info = read_native_header(path)
+        if gdal_info is not None:
+            return gdal_info
+        if has_gdal_bindings():
+            return Gdalinfo.from_dict(get_engine().info(path))
         with subprocess.Popen(['gdalinfo', '-json', path], stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
             stdout, stderr = process.communicate()
-            gdal_info_dict = json.loads(stdout.decode('utf-8'))
-            gdal_info = Gdalinfo()
-            gdal_info_coordinates = gdal_info_dict['wgs84Extent']['coordinates'][0]
-            minX = gdal_info_coordinates[0][0]
-            minY = gdal_info_coordinates[0][1]
-            maxX = gdal_info_coordinates[0][0]
-            maxY = gdal_info_coordinates[0][1]
-            for coord in gdal_info_coordinates:
-                minX = min(minX, coord[0])
-                maxX = max(maxX, coord[0])
-                minY = min(minY, coord[1])
-                maxY = max(maxY, coord[1])
-            
-            gdal_info.minX = minX
-            gdal_info.minY = minY
-            gdal_info.maxX = maxX
-            gdal_info.maxY = maxY
+            return Gdalinfo.from_dict(json.loads(stdout.decode('utf-8')))
 
-            return gdal_info
-        
+    @classmethod
+    def from_dict(cls, gdal_info_dict):
+        gdal_info = Gdalinfo()
+        gdal_info_coordinates = gdal_info_dict['wgs84Extent']['coordinates'][0]
+        minX = gdal_info_coordinates[0][0]
+        minY = gdal_info_coordinates[0][1]
+        maxX = gdal_info_coordinates[0][0]
+        maxY = gdal_info_coordinates[0][1]
+        for coord in gdal_info_coordinates:
+            minX = min(minX, coord[0])
+            maxX = max(maxX, coord[0])
+            minY = min(minY, coord[1])
+            maxY = max(maxY, coord[1])
+
+        gdal_info.minX = minX
+        gdal_info.minY = minY
+        gdal_info.maxX = maxX
+        gdal_info.maxY = maxY
+
+        gdal_info.crs = gdal_info_dict.get('coordinateSystem', {}).get('wkt') or None
+        gdal_info.size = gdal_info_dict.get('size')
+        if 'geoTransform' in gdal_info_dict:
+            geotransform = gdal_info_dict['geoTransform']
+            gdal_info.pixel_size = [geotransform[1], geotransform[5]]
+        for band in gdal_info_dict.get('bands', []):
+            gdal_info.bands.append({
+                'type': band.get('type'),
+                'nodata': band.get('noDataValue'),
+                'overviews': [overview['size'] for overview in band.get('overviews', [])],
+            })
+        if gdal_info.bands:
+            gdal_info.nodata = gdal_info.bands[0]['nodata']
+
+        return gdal_info
+
+    @classmethod
+    def from_geotransform(cls, crs, size, ulx, pixel_width, uly, pixel_height, bands):
+        """
+        Creates a Gdalinfo for a north-up raster. The corners are converted to WGS84 when the
+        coordinate system is one that can be handled natively, otherwise None is returned.
+        pixel_height is negative for north-up rasters, as in GDAL geotransforms.
+        """
+        xs = (ulx, ulx + size[0] * pixel_width)
+        ys = (uly, uly + size[1] * pixel_height)
+        corners = [to_wgs84(crs, x, y) for x in xs for y in ys]
+        if None in corners:
+            return None
+        gdal_info = Gdalinfo()
+        gdal_info.minX = min(lon for lon, lat in corners)
+        gdal_info.maxX = max(lon for lon, lat in corners)
+        gdal_info.minY = min(lat for lon, lat in corners)
+        gdal_info.maxY = max(lat for lon, lat in corners)
+        gdal_info.crs = crs
+        gdal_info.size = list(size)
+        gdal_info.pixel_size = [pixel_width, pixel_height]
+        gdal_info.bands = bands
+        if bands:
+            gdal_info.nodata = bands[0]['nodata']
+        return gdal_info
+
+    def to_dict(self):
+        return dict((field, getattr(self, field)) for field in Gdalinfo.FIELDS)
+
+    @classmethod
+    def from_cache_dict(cls, d):
+        gdal_info = Gdalinfo()
+        for field in Gdalinfo.FIELDS:
+            setattr(gdal_info, field, d.get(field))
+        gdal_info.bands = gdal_info.bands or []
+        return gdal_info
+
+    def __str__(self):
+        parts = ['extent ({:.6f}, {:.6f}) - ({:.6f}, {:.6f})'.format(self.minX, self.minY, self.maxX, self.maxY)]
+        if self.size:
+            parts.append('{0[0]}x{0[1]} pixels'.format(self.size))
+        if self.pixel_size:
+            parts.append('pixel size {:g} x {:g}'.format(self.pixel_size[0], abs(self.pixel_size[1])))
+        if self.bands:
+            parts.append('{} x {}'.format(len(self.bands), self.bands[0]['type']))
+        if self.nodata is not None:
+            parts.append('nodata {}'.format(self.nodata))
+        return ', '.join(parts)
+
+# Native header readers
+#
+# For the formats we usually get as input, the metadata needed for a build can be read straight
+# from the file headers, which is orders of magnitude faster than running gdalinfo.
+# Every reader returns None for anything it doesn't fully understand, so that gdalinfo is used instead.
+
+GEOGRAPHIC_SYSTEMS = ('EPSG:4326', 'EPSG:4269') # WGS 84 and NAD83, which differ by less than a pixel
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+UTM_SCALE = 0.9996
+
+def utm_zone(crs):
+    """Returns (zone, is_south) for WGS 84 and NAD83 UTM systems, None otherwise."""
+    if not crs or not crs.startswith('EPSG:'): return None
+    code = int(crs[5:])
+    if 32601 <= code <= 32660: return (code - 32600, False)
+    if 32701 <= code <= 32760: return (code - 32700, True)
+    if 26901 <= code <= 26923: return (code - 26900, False)
+    return None
+
+def utm_to_lonlat(x, y, zone, south = False):
+    """Inverse transverse Mercator projection (Snyder's series), accurate to well below a meter."""
+    e2 = WGS84_F * (2 - WGS84_F)
+    ep2 = e2 / (1 - e2)
+    x -= 500000.0
+    if south: y -= 10000000.0
+    mu = y / UTM_SCALE / (WGS84_A * (1 - e2 / 4 - 3 * e2 ** 2 / 64 - 5 * e2 ** 3 / 256))
+    e1 = (1 - math.sqrt(1 - e2)) / (1 + math.sqrt(1 - e2))
+    phi1 = (
+        mu + (3 * e1 / 2 - 27 * e1 ** 3 / 32) * math.sin(2 * mu) +
+        (21 * e1 ** 2 / 16 - 55 * e1 ** 4 / 32) * math.sin(4 * mu) +
+        (151 * e1 ** 3 / 96) * math.sin(6 * mu) + (1097 * e1 ** 4 / 512) * math.sin(8 * mu)
+    )
+    sin1, cos1, tan1 = math.sin(phi1), math.cos(phi1), math.tan(phi1)
+    n1 = WGS84_A / math.sqrt(1 - e2 * sin1 ** 2)
+    t1 = tan1 ** 2
+    c1 = ep2 * cos1 ** 2
+    r1 = WGS84_A * (1 - e2) / (1 - e2 * sin1 ** 2) ** 1.5
+    d = x / (n1 * UTM_SCALE)
+    lat = phi1 - (n1 * tan1 / r1) * (
+        d ** 2 / 2 - (5 + 3 * t1 + 10 * c1 - 4 * c1 ** 2 - 9 * ep2) * d ** 4 / 24 +
+        (61 + 90 * t1 + 298 * c1 + 45 * t1 ** 2 - 252 * ep2 - 3 * c1 ** 2) * d ** 6 / 720
+    )
+    lon = (
+        d - (1 + 2 * t1 + c1) * d ** 3 / 6 +
+        (5 - 2 * c1 + 28 * t1 - 3 * c1 ** 2 + 8 * ep2 + 24 * t1 ** 2) * d ** 5 / 120
+    ) / cos1
+    return (math.degrees(lon) + (zone - 1) * 6 - 177, math.degrees(lat))
+
+def to_wgs84(crs, x, y):
+    """Converts a point to WGS84 (lon, lat), or returns None if the coordinate system isn't supported."""
+    if crs in GEOGRAPHIC_SYSTEMS:
+        return (x, y)
+    if crs == 'EPSG:3857':
+        lon, lat = mercator_to_lonlat(x, y)
+        return (float(lon), float(lat))
+    zone = utm_zone(crs)
+    if zone:
+        return utm_to_lonlat(x, y, *zone)
+    return None
+
+def read_native_header(fpath):
+    """Returns a Gdalinfo read directly from the file's header, or None if that isn't possible."""
+    try:
+        with open(fpath, 'rb') as infile:
+            magic = infile.read(16)
+        if magic[:4] in (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+'):
+            return read_geotiff_header(fpath)
+        if magic.startswith(b'EHFA_HEADER_TAG'):
+            return read_hfa_header(fpath)
+        if magic.startswith(b'ENVI'):
+            return None # A header given instead of the data file
+        hdrpath = envi.header_path(fpath)
+        if not path.exists(hdrpath):
+            hdrpath = fpath + '.hdr'
+        if path.exists(hdrpath):
+            return read_envi_header(hdrpath)
+    except (IOError, OSError, ValueError, KeyError, IndexError, struct.error):
+        pass
+    return None
+
+# GeoTIFF
+
+TIFF_TYPES = {
+    1: 'B', 2: 's', 3: 'H', 4: 'I', 5: 'II', 6: 'b', 7: 'B', 8: 'h', 9: 'i', 10: 'ii',
+    11: 'f', 12: 'd', 16: 'Q', 17: 'q', 18: 'Q',
+}
+TIFF_TAG_SUBFILE_TYPE = 254
+TIFF_TAG_WIDTH = 256
+TIFF_TAG_HEIGHT = 257
+TIFF_TAG_BITS_PER_SAMPLE = 258
+TIFF_TAG_SAMPLES_PER_PIXEL = 277
+TIFF_TAG_SAMPLE_FORMAT = 339
+TIFF_TAG_PIXEL_SCALE = 33550
+TIFF_TAG_TIEPOINT = 33922
+TIFF_TAG_TRANSFORMATION = 34264
+TIFF_TAG_GEOKEY_DIRECTORY = 34735
+TIFF_TAG_GDAL_NODATA = 42113
+GEOKEY_MODEL_TYPE = 1024
+GEOKEY_RASTER_TYPE = 1025
+GEOKEY_GEOGRAPHIC_TYPE = 2048
+GEOKEY_PROJECTED_TYPE = 3072
+MODEL_TYPE_PROJECTED = 1
+MODEL_TYPE_GEOGRAPHIC = 2
+RASTER_PIXEL_IS_POINT = 2
+USER_DEFINED = 32767
+# (sample format, bits) -> GDAL type name
+TIFF_SAMPLE_TYPES = {
+    (1, 8): 'Byte', (1, 16): 'UInt16', (1, 32): 'UInt32', (2, 8): 'Int8', (2, 16): 'Int16',
+    (2, 32): 'Int32', (3, 32): 'Float32', (3, 64): 'Float64',
+}
+
+def read_tiff_ifds(infile):
+    """Reads all image file directories of a (Big)TIFF file as a list of {tag: values} dicts."""
+    byteorder = '<' if infile.read(2) == b'II' else '>'
+    version = struct.unpack(byteorder + 'H', infile.read(2))[0]
+    if version == 43:
+        infile.read(4)
+        offset_format, count_format, entry_size = 'Q', 'Q', 20
+    else:
+        offset_format, count_format, entry_size = 'I', 'H', 12
+    offset_size = struct.calcsize(offset_format)
+    offset = struct.unpack(byteorder + offset_format, infile.read(offset_size))[0]
+    ifds = []
+    while offset and len(ifds) < 64:
+        infile.seek(offset)
+        count = struct.unpack(byteorder + count_format, infile.read(struct.calcsize(count_format)))[0]
+        entries = infile.read(count * entry_size)
+        next_offset = struct.unpack(byteorder + offset_format, infile.read(offset_size))[0]
+        ifd = {}
+        for i in range(count):
+            entry = entries[i * entry_size:(i + 1) * entry_size]
+            tag, valuetype = struct.unpack(byteorder + 'HH', entry[:4])
+            valuecount = struct.unpack(byteorder + count_format.replace('H', 'I'), entry[4:4 + offset_size])[0]
+            if valuetype not in TIFF_TYPES: continue
+            item_format = TIFF_TYPES[valuetype]
+            if valuetype == 2:
+                size = valuecount
+                value_format = '{}s'.format(valuecount)
+            else:
+                value_format = item_format * valuecount
+                size = struct.calcsize(byteorder + value_format)
+            inline = entry[4 + offset_size:]
+            if size <= offset_size:
+                data = inline[:size]
+            else:
+                position = infile.tell()
+                infile.seek(struct.unpack(byteorder + offset_format, inline)[0])
+                data = infile.read(size)
+                infile.seek(position)
+            values = struct.unpack(byteorder + value_format, data)
+            if valuetype == 2:
+                values = values[0].rstrip(b'\x00').decode('ascii', 'replace')
+            elif valuetype in (5, 10):
+                values = tuple(values[j] / values[j + 1] for j in range(0, len(values), 2))
+            ifd[tag] = values
+        ifds.append(ifd)
+        offset = next_offset
+    return ifds
+
+def read_geotiff_header(fpath):
+    with open(fpath, 'rb') as infile:
+        ifds = read_tiff_ifds(infile)
+    ifd = ifds[0]
+    if TIFF_TAG_GEOKEY_DIRECTORY not in ifd:
+        return None
+    directory = ifd[TIFF_TAG_GEOKEY_DIRECTORY]
+    geokeys = {}
+    for i in range(1, directory[3] + 1):
+        keyid, location, count, value = directory[4 * i:4 * i + 4]
+        if location == 0: # Only short values stored in the directory itself are needed
+            geokeys[keyid] = value
+    model_type = geokeys.get(GEOKEY_MODEL_TYPE)
+    if model_type == MODEL_TYPE_GEOGRAPHIC:
+        code = geokeys.get(GEOKEY_GEOGRAPHIC_TYPE)
+    elif model_type == MODEL_TYPE_PROJECTED:
+        code = geokeys.get(GEOKEY_PROJECTED_TYPE)
+    else:
+        return None
+    if code is None or code == USER_DEFINED:
+        return None
+    crs = 'EPSG:{}'.format(code)
+
+    if TIFF_TAG_TRANSFORMATION in ifd:
+        matrix = ifd[TIFF_TAG_TRANSFORMATION]
+        if matrix[1] != 0 or matrix[4] != 0:
+            return None # Rotated rasters are left for GDAL
+        pixel_width, ulx, pixel_height, uly = matrix[0], matrix[3], matrix[5], matrix[7]
+    elif TIFF_TAG_TIEPOINT in ifd and TIFF_TAG_PIXEL_SCALE in ifd:
+        i, j, k, x, y, z = ifd[TIFF_TAG_TIEPOINT][:6]
+        scale_x, scale_y = ifd[TIFF_TAG_PIXEL_SCALE][:2]
+        pixel_width, pixel_height = scale_x, -scale_y
+        ulx, uly = x - i * scale_x, y + j * scale_y
+    else:
+        return None
+    if geokeys.get(GEOKEY_RASTER_TYPE) == RASTER_PIXEL_IS_POINT:
+        # Like GDAL, report the extent of the pixel areas
+        ulx -= pixel_width / 2
+        uly -= pixel_height / 2
+
+    size = (ifd[TIFF_TAG_WIDTH][0], ifd[TIFF_TAG_HEIGHT][0])
+    samples = ifd.get(TIFF_TAG_SAMPLES_PER_PIXEL, (1,))[0]
+    bits = ifd.get(TIFF_TAG_BITS_PER_SAMPLE, (1,))[0]
+    sample_format = ifd.get(TIFF_TAG_SAMPLE_FORMAT, (1,))[0]
+    datatype = TIFF_SAMPLE_TYPES.get((sample_format, bits))
+    if datatype is None:
+        return None
+    nodata = None
+    if TIFF_TAG_GDAL_NODATA in ifd:
+        nodata = float(ifd[TIFF_TAG_GDAL_NODATA].strip())
+    overviews = [
+        [o[TIFF_TAG_WIDTH][0], o[TIFF_TAG_HEIGHT][0]] for o in ifds[1:]
+        if o.get(TIFF_TAG_SUBFILE_TYPE, (0,))[0] & 1 and TIFF_TAG_WIDTH in o
+    ]
+    bands = [{'type': datatype, 'nodata': nodata, 'overviews': overviews} for b in range(samples)]
+    return Gdalinfo.from_geotransform(crs, size, ulx, pixel_width, uly, pixel_height, bands)
+
+# ERDAS Imagine (HFA)
+
+HFA_PIXEL_TYPES = {
+    3: 'Byte', 4: 'Int8', 5: 'UInt16', 6: 'Int16', 7: 'UInt32', 8: 'Int32', 9: 'Float32', 10: 'Float64',
+}
+HFA_VALUE_FORMATS = {3: 'B', 4: 'b', 5: 'H', 6: 'h', 7: 'I', 8: 'i', 9: 'f', 10: 'd'}
+HFA_GEOGRAPHIC_PROJECTION = 'Geographic (Lat/Lon)'
+HFA_DATUMS = {'WGS 84': 'EPSG:4326', 'WGS84': 'EPSG:4326', 'NAD83': 'EPSG:4269'}
+
+def read_hfa_entries(infile):
+    """Reads the HFA entry tree into a list of (name, type, data offset, parent offset) tuples."""
+    infile.seek(16)
+    header_pointer = struct.unpack('<I', infile.read(4))[0]
+    infile.seek(header_pointer)
+    version, free_list, root_pointer = struct.unpack('<iII', infile.read(12))
+    entries = []
+    stack = [(root_pointer, 0)]
+    while stack and len(entries) < 10000:
+        pointer, parent = stack.pop()
+        while pointer:
+            infile.seek(pointer)
+            nextptr, prevptr, parentptr, childptr, dataptr, datasize = struct.unpack('<6I', infile.read(24))
+            name = infile.read(64).split(b'\x00')[0].decode('ascii', 'replace')
+            entrytype = infile.read(32).split(b'\x00')[0].decode('ascii', 'replace')
+            entries.append((name, entrytype, dataptr, parent, pointer))
+            if childptr:
+                stack.append((childptr, pointer))
+            pointer = nextptr
+    return entries
+
+def read_hfa_string(infile):
+    """Reads a pointer-to-char field: a count, an offset and the characters themselves."""
+    count, offset = struct.unpack('<II', infile.read(8))
+    return infile.read(count).split(b'\x00')[0].decode('ascii', 'replace')
+
+def read_hfa_header(fpath):
+    with open(fpath, 'rb') as infile:
+        entries = read_hfa_entries(infile)
+        layers = [e for e in entries if e[1] == 'Eimg_Layer']
+        if not layers:
+            return None
+        layer = layers[0]
+        infile.seek(layer[2])
+        width, height, layertype, pixeltype = struct.unpack('<iiHH', infile.read(12))
+        datatype = HFA_PIXEL_TYPES.get(pixeltype)
+        children = [e for e in entries if e[3] == layer[4]]
+        mapinfos = [e for e in children if e[1] == 'Eprj_MapInfo']
+        projections = [e for e in children if e[1] == 'Eprj_ProParameters']
+        if datatype is None or not mapinfos or not projections:
+            return None
+        infile.seek(mapinfos[0][2])
+        projection_name = read_hfa_string(infile)
+        infile.read(8)
+        ulx, uly = struct.unpack('<dd', infile.read(16))
+        infile.read(8)
+        infile.read(16) # Lower right center
+        infile.read(8)
+        pixel_width, pixel_height = struct.unpack('<dd', infile.read(16))
+        if projection_name != HFA_GEOGRAPHIC_PROJECTION:
+            return None
+        datums = [e for e in entries if e[3] == projections[0][4] and e[1] == 'Eprj_Datum']
+        if not datums:
+            return None
+        infile.seek(datums[0][2])
+        crs = HFA_DATUMS.get(read_hfa_string(infile))
+        if crs is None:
+            return None
+        nodata = None
+        nodatas = [e for e in children if e[1] == 'Eimg_NonInitializedValue']
+        if nodatas:
+            infile.seek(nodatas[0][2] + 8)
+            rows, columns, valuetype, objecttype = struct.unpack('<iiHH', infile.read(12))
+            if valuetype in HFA_VALUE_FORMATS:
+                value_format = '<' + HFA_VALUE_FORMATS[valuetype]
+                nodata = float(struct.unpack(value_format, infile.read(struct.calcsize(value_format)))[0])
+    bands = [{'type': datatype, 'nodata': nodata, 'overviews': []} for layer in layers]
+    # The map info refers to the center of the upper left pixel
+    return Gdalinfo.from_geotransform(
+        crs, (width, height), ulx - pixel_width / 2, pixel_width, uly + pixel_height / 2, -pixel_height, bands
+    )
+
+# ENVI
+
+ENVI_GDAL_TYPES = {1: 'Byte', 2: 'Int16', 3: 'Int32', 4: 'Float32', 5: 'Float64', 12: 'UInt16', 13: 'UInt32'}
+ENVI_DATUMS = {'WGS-84': ('EPSG:4326', 32600, 32700), 'North America 1983': ('EPSG:4269', 26900, None)}
+
+def read_envi_header(hdrpath):
+    header = envi.read_header(hdrpath)
+    if 'map info' not in header:
+        return None
+    info = envi.parse_list(header['map info'])
+    projection_name = info[0]
+    refx, refy, easting, northing, pixel_width, pixel_height = map(float, info[1:7])
+    if projection_name == 'Geographic Lat/Lon' and len(info) > 7:
+        datum = ENVI_DATUMS.get(info[7])
+        crs = datum[0] if datum else None
+    elif projection_name == 'UTM' and len(info) > 9:
+        datum = ENVI_DATUMS.get(info[9])
+        south = info[8].lower() == 'south'
+        base = datum and (datum[2] if south else datum[1])
+        crs = 'EPSG:{}'.format(base + int(info[7])) if base else None
+    else:
+        crs = None
+    if crs is None:
+        return None
+    datatype = ENVI_GDAL_TYPES.get(int(header.get('data type', 4)))
+    if datatype is None:
+        return None
+    nodata = float(header['data ignore value']) if 'data ignore value' in header else None
+    bands = [{'type': datatype, 'nodata': nodata, 'overviews': []} for b in range(int(header.get('bands', 1)))]
+    size = (int(header['samples']), int(header['lines']))
+    ulx = easting - (refx - 1) * pixel_width
+    uly = northing + (refy - 1) * pixel_height
+    return Gdalinfo.from_geotransform(crs, size, ulx, pixel_width, uly, -pixel_height, bands)
+
+class GdalinfoCache:
+    """
+    A persistent cache of Gdalinfo probes. Entries are keyed by the absolute path of the file
+    and are only valid as long as the file's size and modification time stay the same.
+    """
+
+    def __init__(self, cachepath):
+        self.cachepath = cachepath
+        self.entries = {}
+        self.changed = False
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, cachepath):
+        cache = GdalinfoCache(cachepath)
+        if path.exists(cachepath):
+            try:
+                with open(cachepath, 'r') as infile:
+                    cache.entries = json.load(infile)
+            except ValueError:
+                cache.entries = {} # A corrupted cache is simply rebuilt
+        return cache
+
+    @classmethod
+    def fingerprint(cls, fpath):
+        try:
+            st = stat(fpath)
+        except OSError:
+            return None
+        return [st.st_size, st.st_mtime]
+
+    def get(self, fpath):
+        """Returns the Gdalinfo of the file, probing it only if it's not cached or has changed."""
+        key = path.abspath(fpath)
+        fingerprint = GdalinfoCache.fingerprint(key)
+        with self.lock:
+            entry = self.entries.get(key)
+        if fingerprint is not None and entry is not None and entry['fingerprint'] == fingerprint:
+            return Gdalinfo.from_cache_dict(entry['info'])
+        gdal_info = Gdalinfo.for_file(fpath)
+        if fingerprint is not None:
+            with self.lock:
+                self.entries[key] = {'fingerprint': fingerprint, 'info': gdal_info.to_dict()}
+                self.changed = True
+        return gdal_info
+
+    def get_many(self, fpaths, max_workers = 1):
+        """
+        Returns the Gdalinfos of the files in the given order. Files needing a probe are probed
+        concurrently in at most max_workers threads, as probing is subprocess or I/O bound.
+        """
+        fpaths = list(fpaths)
+        if max_workers <= 1 or len(fpaths) <= 1:
+            return [self.get(fpath) for fpath in fpaths]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(fpaths))) as executor:
+            return list(executor.map(self.get, fpaths))
+
+    def save(self):
+        if not self.changed: return
+        directory = path.dirname(self.cachepath)
+        if directory and not path.exists(directory):
+            makedirs(directory)
+        with open(self.cachepath, 'w') as outfile:
+            json.dump(self.entries, outfile)
+        self.changed = False
+
+# Reprojected sources are kept around in the tile cache, so they're written tiled and compressed
+REPROJECTED_CREATION_OPTIONS = ['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER']
+
+class GdalEngine:
+    """
+    Runs GDAL in-process through its Python bindings instead of spawning the command line tools.
+    Source datasets are opened once per thread, as GDAL datasets can't be used by several threads
+    at once, and kept open until the engine is closed. Files that are only probed are closed right
+    away, so large catalogs don't run out of file descriptors. Sources are mosaicked and warped into
+    virtual datasets, so no pixels are computed or written until the result is translated.
+    """
+
+    def __init__(self):
+        gdal.UseExceptions()
+        self.datasets = {}
+        self.virtual_datasets = []
+        self.cache_mb = 0
+        self.lock = threading.Lock()
+
+    def open(self, path):
+        """Returns the dataset of path for the calling thread, opening it the first time."""
+        key = (threading.get_ident(), path)
+        with self.lock:
+            dataset = self.datasets.get(key)
+        if dataset is None:
+            # Opened outside the lock, so threads opening different files don't wait for each other
+            dataset = gdal.Open(path)
+            with self.lock:
+                self.datasets[key] = dataset
+        return dataset
+
+    def info(self, path):
+        dataset = gdal.Open(path)
+        info = gdal.Info(dataset, format='json')
+        del dataset # Closes the file
+        return info
+
+    def mosaic(self, outpath, sources, output = None):
+        """Writes a VRT mosaic of the sources (paths) to outpath."""
+        result = self.run(output, gdal.BuildVRT, outpath, list(sources))
+        result.FlushCache()
+        return result
+
+    def warp(self, sources, cellsize, window, window_system, target_system, source_system = None, output = None, settings = None, outpath = '', overview_level = None, resampling = 'bilinear', mosaic = True):
+        """
+        Warps a mosaic of the sources (paths or datasets) into a virtual dataset.
+        window is (minx, miny, maxx, maxy) in window_system.
+        GDAL's messages are written to output (a file-like object), if given.
+        settings are the ResourceSettings for the warp, if any.
+        The virtual dataset is also written to outpath, if given; there must be a single source then,
+        unless mosaic is False.
+        overview_level is the source overview level to warp from, as for gdalwarp -ovr, if not GDAL's choice.
+        resampling is the gdalwarp -r method.
+        Without mosaic the sources are warped as they are, each within its own alpha band or nodata.
+        """
+        if outpath and mosaic and len(sources) != 1:
+            raise ValueError('A warp written to {} takes a single source, not {}'.format(outpath, len(sources)))
+        options = gdal.WarpOptions(
+            format = 'VRT',
+            xRes = cellsize,
+            yRes = cellsize,
+            outputBounds = window,
+            outputBoundsSRS = window_system,
+            srcSRS = source_system,
+            dstSRS = target_system,
+            resampleAlg = resampling,
+            **dict(GdalEngine.resource_options(settings), **GdalEngine.overview_options(overview_level))
+        )
+        datasets = [self.open(s) if isinstance(s, str) else s for s in sources]
+        if not mosaic or overview_level is not None:
+            source = datasets # A mosaic has none of the overviews of its sources to warp from
+        elif outpath:
+            source = datasets[0]
+        else:
+            source = self.run(output, gdal.BuildVRT, '', datasets)
+        warped = self.run(output, gdal.Warp, outpath, source, options=options)
+        if outpath: warped.FlushCache()
+        # The virtual datasets refer to each other, so they're kept alive as long as the engine
+        self.virtual_datasets.extend((source, warped))
+        return warped
+
+    def reproject(self, outpath, source, cellsize, target_system, source_system = None, output = None, settings = None, overview_level = None):
+        """
+        Writes the whole source (a path) reprojected to target_system as a GeoTIFF to outpath.
+        The pixels are aligned on multiples of cellsize, so that any window on that grid can be cut from it,
+        and an alpha band masks the pixels outside the footprint of the source.
+        """
+        options = gdal.WarpOptions(
+            format = 'GTiff',
+            xRes = cellsize,
+            yRes = cellsize,
+            targetAlignedPixels = True,
+            dstAlpha = True,
+            srcSRS = source_system,
+            dstSRS = target_system,
+            resampleAlg = 'bilinear',
+            creationOptions = REPROJECTED_CREATION_OPTIONS,
+            **dict(GdalEngine.resource_options(settings), **GdalEngine.overview_options(overview_level))
+        )
+        result = self.run(output, gdal.Warp, outpath, self.open(source), options=options)
+        if result is not None:
+            result.FlushCache()
+        return result
+
+    def translate(self, outpath, source, output_format, output = None, creation_options = None):
+        """Writes the source (a path or a dataset) to outpath in the given format, with the driver's creation_options."""
+        dataset = self.open(source) if isinstance(source, str) else source
+        options = {'format': output_format}
+        if creation_options:
+            options['creationOptions'] = creation_options
+        result = self.run(output, gdal.Translate, outpath, dataset, **options)
+        result.FlushCache()
+        return result
+
+    def read_raster(self, source, output = None):
+        """Computes the pixels of the source (a path or a dataset) into memory. Returns an EnviRaster without map info."""
+        dataset = self.open(source) if isinstance(source, str) else source
+        data = self.run(output, dataset.ReadAsArray)
+        header = envi.EnviRaster.create_header(dataset.RasterXSize, dataset.RasterYSize, data.dtype, bands=dataset.RasterCount)
+        return envi.EnviRaster(data, header)
+
+    def optimize(self, outpath, source, creation_options, factors, resampling, output = None):
+        """
+        Writes the source (a path) to outpath as a GeoTIFF with the creation_options and internal overviews
+        at the reduction factors. Returns whether both the copy and its overviews were written.
+        """
+        result = self.run(output, gdal.Translate, outpath, self.open(source), format='GTiff', creationOptions=creation_options)
+        if result is None:
+            return False
+        if factors and self.run(output, result.BuildOverviews, resampling.upper(), list(factors)) != gdal.CE_None:
+            return False
+        # Not returned, so that the file is closed and complete once this returns
+        result.FlushCache()
+        return True
+
+    def reserve_cache(self, cache_mb):
+        """
+        Adds cache_mb megabytes to GDAL's block cache, which is process-wide and shared by the
+        pipelines built at once, and sets the cache to the total reserved by them.
+        """
+        with self.lock:
+            self.cache_mb += cache_mb
+            gdal.SetCacheMax(self.cache_mb * 1024 * 1024)
+
+    def close(self):
+        self.virtual_datasets = []
+        self.datasets = {}
+
+    @classmethod
+    def resource_options(cls, settings):
+        """Returns the WarpOptions for the ResourceSettings, if any."""
+        if not settings: return {}
+        return {
+            'multithread': True,
+            'warpOptions': ['NUM_THREADS={}'.format(settings.threads)],
+            'warpMemoryLimit': settings.warp_memory_bytes(),
+        }
+
+    @classmethod
+    def overview_options(cls, overview_level):
+        """Returns the WarpOptions selecting the overview level, if any."""
+        if overview_level is None: return {}
+        return {'options': ['-ovr', str(overview_level)]}
+
+    @classmethod
+    def run(cls, output, function, *args, **kwargs):
+        def handler(error_class, error_number, message):
+            if output is not None:
+                output.write('{}\n'.format(message))
+        gdal.PushErrorHandler(handler)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            gdal.PopErrorHandler()
+
+_engine = None
+
+def get_engine():
+    """Returns the shared in-process engine, or None if the GDAL Python bindings aren't available."""
+    global _engine
+    if not has_gdal_bindings():
+        return None
+    if _engine is None:
+        _engine = GdalEngine()
+    return _engine
 
+def reset_engine():
+    """Closes all datasets held by the shared engine."""
+    global _engine
+    if _engine is not None:
+        _engine.close()
+    _engine = None
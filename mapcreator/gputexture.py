@@ -0,0 +1,199 @@
+"""
+Block-compressed GPU textures of satellite images, in KTX containers.
+
+ETC2 RGB compresses every 4x4 block of texels into 64 bits, a sixth of 8-bit RGB, and is decoded by
+the GPU itself, so a client can upload the texture as is. The encoder only produces the ETC1
+compatible modes of ETC2: each block is split into two halves, side by side or stacked (the flip
+bit), and each half gets a base color and one of eight tables of intensity modifiers, every texel
+picking the modifier closest to it. Base colors are stored as 5-bit colors, the second one as a
+3-bit difference from the first, or as two 4-bit colors when they're too far apart for that.
+In the differential mode, the difference never overflows, as ETC2 would read that as another mode.
+
+All the blocks are encoded at once with numpy: every table and modifier is tried for every texel.
+The image is split into bands of block rows, which are encoded in a pool of worker threads if
+workers is more than one. numpy releases the GIL while it works on the blocks, and threads don't
+fork the build process while GDAL and the other pipelines run in it.
+
+KTX 1.1 files hold the compressed image and, optionally, its mip levels.
+"""
+import struct
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Format name -> (glInternalFormat, glBaseInternalFormat) of its KTX files
+FORMATS = OrderedDict([
+    ('etc2', (0x9274, 0x1907)), # GL_COMPRESSED_RGB8_ETC2, GL_RGB
+])
+DEFAULT_FORMAT = 'etc2'
+
+BLOCK_SIZE = 4
+# Block rows each job encodes, and blocks encoded at once within a job, which bounds memory use
+BAND_BLOCK_ROWS = 32
+CHUNK_BLOCKS = 1024
+
+# Intensity modifier tables, the columns in the order of the texel index values
+MODIFIERS = np.array([
+    [2, 8, -2, -8], [5, 17, -5, -17], [9, 29, -9, -29], [13, 42, -13, -42],
+    [18, 60, -18, -60], [24, 80, -24, -80], [33, 106, -33, -106], [47, 183, -47, -183],
+])
+
+# Texels of a block are numbered column by column, x * 4 + y, as in the index bits.
+# The texels of both halves of a block, with the flip bit unset (side by side) and set (stacked).
+HALVES = (
+    np.array([[i for i in range(16) if i // 4 < 2], [i for i in range(16) if i // 4 >= 2]]),
+    np.array([[i for i in range(16) if i % 4 < 2], [i for i in range(16) if i % 4 >= 2]]),
+)
+
+KTX_IDENTIFIER = b'\xabKTX 11\xbb\r\n\x1a\n'
+KTX_ENDIANNESS = 0x04030201
+
+def rgb(image):
+    """Returns an 8-bit image of shape (lines, samples), or with 1, 3 or 4 channels, as RGB. Alpha is dropped."""
+    image = np.asarray(image, dtype=np.uint8)
+    if image.ndim == 2:
+        image = image[:, :, None]
+    if image.shape[2] == 1:
+        return np.repeat(image, 3, axis=2)
+    return image[:, :, :3]
+
+def to_blocks(image):
+    """Returns the 4x4 blocks of an RGB image as an array of shape (block rows, block columns, 16, 3), edges padded."""
+    lines, samples = image.shape[:2]
+    padded = np.pad(image, ((0, -lines % BLOCK_SIZE), (0, -samples % BLOCK_SIZE), (0, 0)), mode='edge')
+    rows, columns = padded.shape[0] // BLOCK_SIZE, padded.shape[1] // BLOCK_SIZE
+    blocks = padded.reshape(rows, BLOCK_SIZE, columns, BLOCK_SIZE, 3).transpose(0, 2, 3, 1, 4)
+    return blocks.reshape(rows, columns, 16, 3)
+
+def from_blocks(blocks, lines, samples):
+    """Returns the image of lines x samples texels made of blocks of shape (block rows, block columns, 16, 3)."""
+    rows, columns = blocks.shape[:2]
+    image = blocks.reshape(rows, columns, BLOCK_SIZE, BLOCK_SIZE, 3).transpose(0, 3, 1, 2, 4)
+    return image.reshape(rows * BLOCK_SIZE, columns * BLOCK_SIZE, 3)[:lines, :samples]
+
+def expand(values, bits):
+    """Expands colors of the given bits to 8 bits by repeating their high bits."""
+    return (values << (8 - bits)) | (values >> (2 * bits - 8))
+
+def encode_halves(texels, flip):
+    """
+    Encodes blocks of shape (blocks, 16, 3) with the given flip bit. Returns (squared errors, words).
+    """
+    halves = texels[:, HALVES[flip]] # (blocks, 2, 8, 3)
+    average = halves.mean(axis=2)
+    high5 = np.clip(np.round(average * 31 / 255.0), 0, 31).astype(np.int64)
+    delta = high5[:, 1] - high5[:, 0]
+    differential = np.all((delta >= -4) & (delta <= 3), axis=1)
+    high4 = np.clip(np.round(average * 15 / 255.0), 0, 15).astype(np.int64)
+    base = np.where(differential[:, None, None], expand(high5, 5), expand(high4, 4))
+    # Every table and modifier for every texel: (blocks, halves, tables, texels, modifiers)
+    candidates = np.clip(base[:, :, None, None, :] + MODIFIERS[None, None, :, :, None], 0, 255)
+    differences = halves[:, :, None, :, None, :] - candidates[:, :, :, None, :, :]
+    errors = np.sum(differences * differences, axis=-1)
+    indices = np.argmin(errors, axis=-1)
+    table_errors = np.take_along_axis(errors, indices[..., None], axis=-1)[..., 0].sum(axis=-1)
+    tables = np.argmin(table_errors, axis=-1)
+    error = np.take_along_axis(table_errors, tables[..., None], axis=-1)[..., 0].sum(axis=-1)
+    indices = np.take_along_axis(indices, tables[:, :, None, None], axis=2)[:, :, 0] # (blocks, halves, 8)
+    colors = np.where(
+        differential[:, None],
+        (high5[:, 0] << np.array([27, 19, 11])) | ((delta & 7) << np.array([24, 16, 8])),
+        (high4[:, 0] << np.array([28, 20, 12])) | (high4[:, 1] << np.array([24, 16, 8])),
+    )
+    high = np.bitwise_or.reduce(colors, axis=1) | (tables[:, 0] << 5) | (tables[:, 1] << 2) | (differential << 1) | flip
+    positions = HALVES[flip].reshape(-1)
+    indices = indices.reshape(len(texels), -1)
+    low = np.bitwise_or.reduce(((indices >> 1) << (16 + positions)) | ((indices & 1) << positions), axis=1)
+    return error, (high.astype(np.uint64) << np.uint64(32)) | low.astype(np.uint64)
+
+def encode_blocks(texels):
+    """Encodes blocks of shape (blocks, 16, 3) as ETC2 words, using the flip bit that fits each block better."""
+    texels = texels.astype(np.int64)
+    words = np.zeros(len(texels), dtype=np.uint64)
+    for first in range(0, len(texels), CHUNK_BLOCKS):
+        chunk = texels[first:first + CHUNK_BLOCKS]
+        (side_error, side_words), (stacked_error, stacked_words) = encode_halves(chunk, 0), encode_halves(chunk, 1)
+        words[first:first + CHUNK_BLOCKS] = np.where(stacked_error < side_error, stacked_words, side_words)
+    return words
+
+def encode_band(blocks):
+    """Encodes blocks of shape (block rows, block columns, 16, 3). Returns the compressed bytes in row order."""
+    return encode_blocks(blocks.reshape(-1, 16, 3)).astype('>u8').tobytes()
+
+def encode_etc2(image, workers = 1):
+    """Returns an 8-bit image of shape (lines, samples) or (lines, samples, channels) compressed as ETC2 RGB."""
+    blocks = to_blocks(rgb(image))
+    jobs = [blocks[first:first + BAND_BLOCK_ROWS] for first in range(0, blocks.shape[0], BAND_BLOCK_ROWS)]
+    if workers > 1 and len(jobs) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            bands = list(executor.map(encode_band, jobs))
+    else:
+        bands = [encode_band(job) for job in jobs]
+    return b''.join(bands)
+
+def encode_texture(image, texture_format = DEFAULT_FORMAT, workers = 1):
+    """Returns an 8-bit image compressed in one of FORMATS."""
+    if texture_format == 'etc2':
+        return encode_etc2(image, workers)
+    raise ValueError('Unknown texture format {}'.format(texture_format))
+
+def decode_etc2(data, samples, lines):
+    """
+    Decodes ETC2 RGB data of an image of samples x lines texels into an array of shape (lines, samples, 3).
+    Only the ETC1 compatible modes, which encode_etc2 produces, are decoded.
+    """
+    rows, columns = -(-lines // BLOCK_SIZE), -(-samples // BLOCK_SIZE)
+    words = np.frombuffer(data, dtype='>u8', count=rows * columns).astype(np.uint64)
+    high = (words >> np.uint64(32)).astype(np.int64)
+    low = (words & np.uint64(0xffffffff)).astype(np.int64)
+    differential = (high >> 1) & 1
+    flip = high & 1
+    tables = np.stack([(high >> 5) & 7, (high >> 2) & 7], axis=1)
+    shifts = np.array([24, 16, 8])
+    first5 = (high[:, None] >> (shifts + 3)) & 31
+    delta = (high[:, None] >> shifts) & 7
+    second5 = first5 + np.where(delta >= 4, delta - 8, delta)
+    first4 = (high[:, None] >> (shifts + 4)) & 15
+    second4 = (high[:, None] >> shifts) & 15
+    base = np.where(
+        differential[:, None, None] == 1,
+        np.stack([expand(first5, 5), expand(second5, 5)], axis=1),
+        np.stack([expand(first4, 4), expand(second4, 4)], axis=1),
+    ) # (blocks, halves, 3)
+    positions = np.arange(16)
+    indices = (((low[:, None] >> (16 + positions)) & 1) << 1) | ((low[:, None] >> positions) & 1)
+    half = np.where(flip[:, None] == 1, positions % 4 >= 2, positions // 4 >= 2).astype(np.int64)
+    block_index = np.arange(len(words))[:, None]
+    modifiers = MODIFIERS[tables[block_index, half], indices]
+    texels = np.clip(base[block_index, half] + modifiers[:, :, None], 0, 255).astype(np.uint8)
+    return from_blocks(texels.reshape(rows, columns, 16, 3), lines, samples)
+
+def ktx_bytes(levels, samples, lines, texture_format = DEFAULT_FORMAT):
+    """
+    Returns a KTX 1.1 file of a texture of samples x lines texels. levels are the compressed
+    mip levels, starting from the full size.
+    """
+    internal_format, base_format = FORMATS[texture_format]
+    header = KTX_IDENTIFIER + struct.pack(
+        '<13I', KTX_ENDIANNESS, 0, 1, 0, internal_format, base_format, samples, lines, 0, 0, 1, len(levels), 0
+    )
+    parts = [header]
+    for data in levels:
+        parts.append(struct.pack('<I', len(data)))
+        parts.append(data)
+        parts.append(b'\0' * (-len(data) % 4))
+    return b''.join(parts)
+
+def read_ktx(content):
+    """Returns (glInternalFormat, samples, lines, levels) of a KTX 1.1 file written by ktx_bytes."""
+    if content[:12] != KTX_IDENTIFIER:
+        raise ValueError('Not a KTX 1.1 file')
+    fields = struct.unpack('<13I', content[12:64])
+    internal_format, samples, lines, level_count, key_value_bytes = fields[4], fields[6], fields[7], fields[11], fields[12]
+    offset = 64 + key_value_bytes
+    levels = []
+    for level in range(max(1, level_count)):
+        size, = struct.unpack('<I', content[offset:offset + 4])
+        levels.append(content[offset + 4:offset + 4 + size])
+        offset += 4 + size + (-size % 4)
+    return internal_format, samples, lines, levels
@@ -0,0 +1,212 @@
+"""
+Compact encodings of height grids for the package.
+
+float32      The raw ENVI output of GDAL.
+int16/uint16 Heights quantized to 16-bit integers. The standard ENVI 'data gain values' and
+             'data offset values' header fields give height = raw * gain + offset.
+delta-zlib   Heights quantized to 32-bit integers, each row stored as differences to the previous
+             cell (the first cell as is) and the whole grid compressed with zlib.
+terrain-rgb  Heights quantized to 24 bits and stored in the red, green and blue channels of a PNG,
+             height = offset + (R * 65536 + G * 256 + B) * gain. By default gain is 0.1 m and
+             offset -10000 m, as in Mapbox Terrain-RGB.
+
+All but float32 are lossy: the vertical error is at most half of the quantization step (gain).
+Given a maximum error, the step is chosen to keep the error below it, and encoding fails if the
+range of heights can't be represented with that step. The encoding is recorded in the
+'height encoding' header field; nodata cells are stored as a reserved raw value.
+"""
+import time
+import zlib
+import numpy as np
+from collections import OrderedDict
+from mapcreator import png
+from mapcreator.envi import EnviRaster, read_header, write_header, header_path
+
+ENCODING_FLOAT32 = 'float32'
+ENCODING_INT16 = 'int16'
+ENCODING_UINT16 = 'uint16'
+ENCODING_DELTA_ZLIB = 'delta-zlib'
+ENCODING_TERRAIN_RGB = 'terrain-rgb'
+ENCODINGS = (ENCODING_FLOAT32, ENCODING_INT16, ENCODING_UINT16, ENCODING_DELTA_ZLIB, ENCODING_TERRAIN_RGB)
+
+ENCODING_KEY = 'height encoding'
+GAIN_KEY = 'data gain values'
+OFFSET_KEY = 'data offset values'
+NODATA_KEY = 'data ignore value'
+
+# (dtype, smallest valid raw value, largest valid raw value, nodata raw value)
+INTEGER_RANGES = {
+    ENCODING_INT16: ('<i2', -32767, 32767, -32768),
+    ENCODING_UINT16: ('<u2', 1, 65535, 0),
+    ENCODING_DELTA_ZLIB: ('<i4', 0, 2 ** 31 - 1, -1),
+    ENCODING_TERRAIN_RGB: (None, 1, 2 ** 24 - 1, 0),
+}
+DEFAULT_DELTA_STEP = 0.01 # One centimeter
+TERRAIN_RGB_GAIN = 0.1
+TERRAIN_RGB_OFFSET = -10000.0
+ZLIB_LEVEL = 9
+
+
+class EncodedHeights:
+    """An encoded height grid: the header and the payload of the data file, and the data file's extension."""
+
+    def __init__(self, encoding, header, payload, extension, max_error):
+        self.encoding = encoding
+        self.header = header
+        self.payload = payload
+        self.extension = extension
+        self.max_error = max_error
+
+    def save(self, binpath):
+        """
+        Saves the encoded heights in place of the ENVI file binpath. Returns the paths written,
+        the data file's extension being replaced by self.extension.
+        """
+        datapath = data_path(binpath, self.extension)
+        with open(datapath, 'wb') as outfile:
+            outfile.write(self.payload)
+        write_header(header_path(binpath), self.header)
+        return [datapath, header_path(binpath)]
+
+def data_path(binpath, extension):
+    base, dot, old_extension = binpath.rpartition('.')
+    return '{}.{}'.format(base if dot else binpath, extension)
+
+def heights_with_nan(raster):
+    """Returns the heights of a raster as float64, nodata cells being NaN."""
+    data = raster.data.astype(np.float64)
+    if raster.nodata is not None:
+        data[raster.data == raster.nodata] = np.nan
+    return data
+
+def choose_step(heights, encoding, max_error = None):
+    """
+    Returns (gain, offset) for quantizing heights. The step keeps the error below max_error
+    (if given), otherwise it's the finest one that fits the range of heights.
+    """
+    dtype, lowest, highest, nodata = INTEGER_RANGES[encoding]
+    valid = heights[~np.isnan(heights)]
+    minimum, maximum = (float(valid.min()), float(valid.max())) if valid.size else (0.0, 0.0)
+    steps = highest - lowest
+    if encoding == ENCODING_TERRAIN_RGB and (max_error is None or max_error >= TERRAIN_RGB_GAIN / 2):
+        gain, offset = TERRAIN_RGB_GAIN, TERRAIN_RGB_OFFSET
+        if minimum < offset + gain * lowest or maximum > offset + gain * highest:
+            raise ValueError('Heights {}...{} don\'t fit the default Terrain-RGB range'.format(minimum, maximum))
+        return (gain, offset)
+    if max_error is not None:
+        gain = 2.0 * max_error
+        if (maximum - minimum) / gain > steps:
+            raise ValueError('Heights {}...{} can\'t be stored as {} with an error below {} m'.format(
+                minimum, maximum, encoding, max_error
+            ))
+    elif encoding == ENCODING_DELTA_ZLIB:
+        gain = DEFAULT_DELTA_STEP
+    else:
+        gain = (maximum - minimum) / steps if maximum > minimum else 1.0
+    return (gain, minimum - lowest * gain)
+
+def quantize(heights, encoding, gain, offset):
+    dtype, lowest, highest, nodata = INTEGER_RANGES[encoding]
+    nan = np.isnan(heights)
+    raw = np.rint((np.where(nan, offset, heights) - offset) / gain)
+    raw = np.clip(raw, lowest, highest).astype(np.int64)
+    raw[nan] = nodata
+    return raw
+
+def quantized_header(raster, encoding, gain, offset, dtype):
+    header = EnviRaster.create_header(raster.samples, raster.lines, dtype)
+    for key, value in raster.header.items():
+        if key not in header and key not in (NODATA_KEY, GAIN_KEY, OFFSET_KEY):
+            header[key] = value
+    header[GAIN_KEY] = '{{{!r}}}'.format(gain)
+    header[OFFSET_KEY] = '{{{!r}}}'.format(offset)
+    header[NODATA_KEY] = str(INTEGER_RANGES[encoding][3])
+    header[ENCODING_KEY] = encoding
+    return header
+
+def encode(raster, encoding, max_error = None):
+    """Encodes a single band EnviRaster. Returns EncodedHeights."""
+    if encoding not in ENCODINGS:
+        raise ValueError('Unknown height encoding {}'.format(encoding))
+    if encoding == ENCODING_FLOAT32:
+        data = np.ascontiguousarray(raster.data, dtype=raster.header_dtype())
+        return EncodedHeights(encoding, raster.header, data.tobytes(), 'bin', 0.0)
+    heights = heights_with_nan(raster)
+    gain, offset = choose_step(heights, encoding, max_error)
+    raw = quantize(heights, encoding, gain, offset)
+    if encoding in (ENCODING_INT16, ENCODING_UINT16):
+        dtype = INTEGER_RANGES[encoding][0]
+        header = quantized_header(raster, encoding, gain, offset, dtype)
+        payload = raw.astype(dtype).tobytes()
+        extension = 'bin'
+    elif encoding == ENCODING_DELTA_ZLIB:
+        dtype = INTEGER_RANGES[encoding][0]
+        header = quantized_header(raster, encoding, gain, offset, dtype)
+        deltas = np.diff(raw, axis=1, prepend=0)
+        payload = zlib.compress(deltas.astype(dtype).tobytes(), ZLIB_LEVEL)
+        extension = 'bin'
+    else:
+        header = quantized_header(raster, encoding, gain, offset, np.uint8)
+        header['bands'] = '3'
+        header['interleave'] = 'bip'
+        rgb = np.stack([(raw >> 16) & 0xff, (raw >> 8) & 0xff, raw & 0xff], axis=-1).astype(np.uint8)
+        payload = png.encode_png(rgb, ZLIB_LEVEL)
+        extension = 'png'
+    return EncodedHeights(encoding, header, payload, extension, gain / 2)
+
+def decode(header, payload):
+    """Decodes a payload written by encode into float32 heights, nodata cells being NaN."""
+    encoding = header.get(ENCODING_KEY, ENCODING_FLOAT32)
+    samples, lines = int(header['samples']), int(header['lines'])
+    if encoding == ENCODING_FLOAT32:
+        data = np.frombuffer(payload, dtype=EnviRaster.dtype_for_header(header)).reshape(lines, samples)
+        heights = data.astype(np.float32)
+        if NODATA_KEY in header:
+            heights[data == float(header[NODATA_KEY])] = np.nan
+        return heights
+    if encoding not in INTEGER_RANGES:
+        raise ValueError('Unknown height encoding {}'.format(encoding))
+    dtype, lowest, highest, nodata = INTEGER_RANGES[encoding]
+    if encoding in (ENCODING_INT16, ENCODING_UINT16):
+        raw = np.frombuffer(payload, dtype=dtype).reshape(lines, samples).astype(np.int64)
+    elif encoding == ENCODING_DELTA_ZLIB:
+        deltas = np.frombuffer(zlib.decompress(payload), dtype=dtype).reshape(lines, samples)
+        raw = np.cumsum(deltas, axis=1, dtype=np.int64)
+    else:
+        rgb = png.decode_png(payload).astype(np.int64)
+        raw = (rgb[:, :, 0] << 16) | (rgb[:, :, 1] << 8) | rgb[:, :, 2]
+    gain = float(header[GAIN_KEY].strip('{} '))
+    offset = float(header[OFFSET_KEY].strip('{} '))
+    heights = (raw * gain + offset).astype(np.float32)
+    heights[raw == nodata] = np.nan
+    return heights
+
+def load(binpath):
+    """
+    Loads the heights saved in place of the ENVI file binpath, whatever their encoding.
+    Returns a float32 EnviRaster with NaN for nodata.
+    """
+    header = read_header(header_path(binpath))
+    extension = 'png' if header.get(ENCODING_KEY) == ENCODING_TERRAIN_RGB else 'bin'
+    with open(data_path(binpath, extension), 'rb') as infile:
+        payload = infile.read()
+    heights = decode(header, payload)
+    float_header = EnviRaster.create_header(heights.shape[1], heights.shape[0], np.float32)
+    if 'map info' in header:
+        float_header['map info'] = header['map info']
+    return EnviRaster(heights, float_header)
+
+def benchmark(raster, encoded):
+    """
+    Compares encoded heights to raw float32 ones. Returns (float32 size, encoded size, float32 load seconds,
+    decode seconds), sizes being those after deflating, as in the package, and load seconds those taken
+    to inflate the deflated float32 heights into an array.
+    """
+    raw = zlib.compress(np.ascontiguousarray(raster.data, dtype=np.float32).tobytes())
+    start = time.perf_counter()
+    np.frombuffer(zlib.decompress(raw), dtype=np.float32).reshape(raster.data.shape)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    decode(encoded.header, encoded.payload)
+    decode_seconds = time.perf_counter() - start
+    return (len(raw), len(zlib.compress(encoded.payload)), load_seconds, decode_seconds)
@@ -0,0 +1,34 @@
+"""
+Conversions between WGS84 longitude/latitude and the spherical Web Mercator projection (EPSG:3857),
+which is the coordinate system of all raster output.
+
+All functions accept either plain floats or numpy arrays.
+"""
+import numpy as np
+
+EARTH_RADIUS = 6378137.0
+MAX_LATITUDE = 85.0511287798066
+
+def lonlat_to_mercator(lon, lat):
+    lat = np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE)
+    x = EARTH_RADIUS * np.radians(lon)
+    y = EARTH_RADIUS * np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+    return (x, y)
+
+def mercator_to_lonlat(x, y):
+    lon = np.degrees(np.asarray(x) / EARTH_RADIUS)
+    lat = np.degrees(2 * np.arctan(np.exp(np.asarray(y) / EARTH_RADIUS)) - np.pi / 2)
+    return (lon, lat)
+
+def scale_factor(lat):
+    """
+    Returns the ratio of ground distance to projected distance at the given latitude.
+    One projected meter near latitude lat covers scale_factor(lat) meters on the ground.
+    """
+    return np.cos(np.radians(lat))
+
+def haversine_distance(lon1, lat1, lon2, lat2):
+    """Great circle distance in meters between two WGS84 points."""
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
@@ -0,0 +1,82 @@
+"""
+Mipmap chains of satellite textures.
+
+Level n of a texture of samples x lines texels is max(1, samples >> n) x max(1, lines >> n), down
+to 1 x 1, as GPUs expect. Each level is filtered from the previous one, one axis at a time, every
+texel being a weighted sum of the texels under its footprint:
+
+box      Area-weighted averaging, which also handles odd sizes exactly.
+lanczos  Lanczos-3, sharper than box but with slight ringing at hard edges.
+
+Weights are normalized per texel and texels beyond the edges are clamped to the edge.
+"""
+import math
+import numpy as np
+
+FILTERS = ('box', 'lanczos')
+DEFAULT_FILTER = 'box'
+LANCZOS_LOBES = 3
+
+def level_sizes(samples, lines):
+    """Returns the (samples, lines) of every level of the chain, starting from the full size."""
+    sizes = [(samples, lines)]
+    while sizes[-1] != (1, 1):
+        samples, lines = max(1, samples // 2), max(1, lines // 2)
+        sizes.append((samples, lines))
+    return sizes
+
+def lanczos(x):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        values = np.sinc(x) * np.sinc(x / LANCZOS_LOBES)
+    return np.where(np.abs(x) < LANCZOS_LOBES, values, 0.0)
+
+def filter_weights(old_size, new_size, image_filter = DEFAULT_FILTER):
+    """
+    Returns (indices, weights), both of shape (new_size, taps): the texels of an axis of old_size texels
+    each texel of the new axis is computed from, and their weights.
+    """
+    scale = old_size / float(new_size)
+    # Texel centers of the new axis in texel coordinates of the old one
+    centers = (np.arange(new_size) + 0.5) * scale - 0.5
+    support = scale / 2 if image_filter == 'box' else LANCZOS_LOBES * max(scale, 1.0)
+    taps = int(math.ceil(2 * support)) + 2
+    first = np.floor(centers - support).astype(np.int64)
+    indices = first[:, None] + np.arange(taps)[None, :]
+    offsets = indices - centers[:, None]
+    if image_filter == 'box':
+        # The overlap of each texel with the footprint
+        weights = np.clip(np.minimum(offsets + 0.5, support) - np.maximum(offsets - 0.5, -support), 0, None)
+    elif image_filter == 'lanczos':
+        weights = lanczos(offsets / max(scale, 1.0))
+    else:
+        raise ValueError('Unknown filter {}'.format(image_filter))
+    weights /= weights.sum(axis=1)[:, None]
+    return np.clip(indices, 0, old_size - 1), weights
+
+def resize_axis(data, new_size, image_filter, axis):
+    """Resizes axis (0 for rows, 1 for columns) of a float array of shape (lines, samples) or (lines, samples, channels)."""
+    indices, weights = filter_weights(data.shape[axis], new_size, image_filter)
+    shape = [1] * data.ndim
+    shape[axis] = new_size
+    result = 0
+    for tap in range(weights.shape[1]):
+        result = result + np.take(data, indices[:, tap], axis=axis) * weights[:, tap].reshape(shape)
+    return result
+
+def build_mipmaps(image, image_filter = DEFAULT_FILTER):
+    """
+    Returns the levels below an 8-bit image of shape (lines, samples) or (lines, samples, channels),
+    down to 1 x 1, as 8-bit arrays.
+    """
+    if image_filter not in FILTERS:
+        raise ValueError('Unknown filter {}'.format(image_filter))
+    levels = []
+    data = np.asarray(image, dtype=np.float32)
+    for samples, lines in level_sizes(image.shape[1], image.shape[0])[1:]:
+        if lines != data.shape[0]:
+            data = resize_axis(data, lines, image_filter, 0).astype(np.float32)
+        if samples != data.shape[1]:
+            data = resize_axis(data, samples, image_filter, 1).astype(np.float32)
+        # Lanczos overshoots at edges, which is clipped, but the unrounded level is filtered further
+        levels.append(np.round(np.clip(data, 0, 255)).astype(np.uint8))
+    return levels
@@ -0,0 +1,124 @@
+"""
+Optimized copies of satellite/aerial source images.
+
+Sources such as NAIP GeoTIFFs are usually organized in strips and stored only at full resolution,
+so a build warping them to a much coarser satellite resolution still reads every source pixel.
+Optimizing rewrites a source as an internally tiled, compressed GeoTIFF with overviews, each half
+the resolution of the previous one down to the first that fits in a single tile. Builds then warp
+from the coarsest overview that is still at least as fine as the output resolution.
+
+Copies are named after the absolute path of their source. Each copy records the size and
+modification time of its source, and once the source changes the copy is no longer used.
+"""
+import hashlib
+import subprocess
+import uuid
+from os import path, makedirs, remove, replace
+from mapcreator import gdal_util
+from mapcreator.gdal_util import GdalinfoCache
+from mapcreator.mercator import lonlat_to_mercator
+
+BLOCK_SIZE = 512
+CREATION_OPTIONS = [
+    'TILED=YES', 'BLOCKXSIZE={}'.format(BLOCK_SIZE), 'BLOCKYSIZE={}'.format(BLOCK_SIZE),
+    'COMPRESS=DEFLATE', 'PREDICTOR=2', 'BIGTIFF=IF_SAFER',
+]
+OVERVIEW_RESAMPLING = 'average'
+COPY_EXTENSION = 'tif'
+TEMP_EXTENSION = 'tmp'
+
+def copy_path(sourcepath, directory):
+    """Returns the path of the optimized copy of sourcepath in directory."""
+    sourcepath = path.abspath(sourcepath)
+    stem = path.splitext(path.basename(sourcepath))[0]
+    # Sources with the same name in different directories get different copies
+    digest = hashlib.sha1(sourcepath.encode('utf-8')).hexdigest()[:10]
+    return path.join(directory, '{}_{}.{}'.format(stem, digest, COPY_EXTENSION))
+
+def overview_factors(samples, lines, block_size = BLOCK_SIZE):
+    """Returns the reduction factors of the overviews of a raster: 2, 4, 8... until one fits in a single block."""
+    factors = []
+    factor = 2
+    while max(samples, lines) > block_size * factor // 2:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+def mercator_pixel_size(gdal_info):
+    """
+    Returns the width of the pixels of a raster in EPSG:3857 meters, the unit of the output resolution,
+    from its WGS84 extent. The extent of a rotated raster is a little wider, which errs on the finer side.
+    """
+    minx, _ = lonlat_to_mercator(gdal_info.minX, 0)
+    maxx, _ = lonlat_to_mercator(gdal_info.maxX, 0)
+    return float(maxx - minx) / gdal_info.size[0]
+
+def overview_level(pixel_size, cellsize, factors):
+    """
+    Returns the index of the coarsest of the overviews (reduction factors) of a raster with pixels of
+    pixel_size that is still at least as fine as cellsize, or None if only the full resolution is.
+    """
+    level = None
+    for index, factor in enumerate(factors):
+        if pixel_size * factor <= cellsize:
+            level = index
+    return level
+
+def run_command(arguments, output = None):
+    """Runs a GDAL utility, writing its errors to output. Returns whether it succeeded."""
+    with subprocess.Popen(arguments, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+        stdout, stderr = process.communicate()
+        if output is not None: output.write(stderr.decode('utf-8'))
+        return process.returncode == 0
+
+def write_copy(sourcepath, outpath, factors, output = None):
+    """
+    Writes sourcepath to outpath as a tiled GeoTIFF with internal overviews at the reduction factors.
+    Returns whether both the copy and its overviews were written.
+    """
+    engine = gdal_util.get_engine()
+    if engine:
+        return engine.optimize(outpath, sourcepath, CREATION_OPTIONS, factors, OVERVIEW_RESAMPLING, output)
+    creation_arguments = []
+    for option in CREATION_OPTIONS:
+        creation_arguments.extend(['-co', option])
+    if not run_command(['gdal_translate', '-of', 'GTiff'] + creation_arguments + [sourcepath, outpath], output):
+        return False
+    if factors:
+        return run_command(['gdaladdo', '-r', OVERVIEW_RESAMPLING, outpath] + [str(f) for f in factors], output)
+    return True
+
+def optimize_source(sourcepath, gdal_info, directory, output = None):
+    """
+    Writes an optimized copy of sourcepath, whose Gdalinfo is gdal_info, into directory.
+    The copy is written to a temporary file that is renamed into place, so an interrupted run never
+    leaves a partial copy. Returns the record of the copy (see State.set_optimized_satellite_file),
+    or None if it couldn't be written.
+    """
+    fingerprint = GdalinfoCache.fingerprint(sourcepath)
+    if fingerprint is None or not gdal_info.size: return None
+    factors = overview_factors(*gdal_info.size)
+    outpath = copy_path(sourcepath, directory)
+    if not path.exists(directory):
+        makedirs(directory, exist_ok=True)
+    temppath = '{}.{}.{}'.format(outpath, uuid.uuid4().hex, TEMP_EXTENSION)
+    try:
+        written = write_copy(sourcepath, temppath, factors, output)
+    except RuntimeError as e: # Raised by the in-process engine
+        if output is not None: output.write('{}\n'.format(e))
+        written = False
+    if not written or not path.exists(temppath):
+        if path.exists(temppath):
+            remove(temppath)
+        return None
+    replace(temppath, outpath)
+    return {
+        'path': outpath,
+        'fingerprint': fingerprint,
+        'pixel_size': mercator_pixel_size(gdal_info),
+        'overviews': factors,
+    }
+
+def is_current(copy, sourcepath):
+    """Returns whether the optimized copy exists and its source hasn't changed since it was written."""
+    return copy is not None and path.exists(copy['path']) and copy['fingerprint'] == GdalinfoCache.fingerprint(sourcepath)
@@ -0,0 +1,106 @@
+"""
+Adaptive palettes of satellite images, for indexed PNG output.
+
+The palette is chosen from a sample of the pixels, which is plenty for the few hundred colors
+of a palette and keeps quantizing large images fast:
+
+median-cut  Splits the color box with the widest channel at the median of that channel,
+            until there are as many boxes as colors, and takes the mean color of each box.
+kmeans      Refines the median cut palette with a few rounds of k-means (Lloyd's algorithm).
+
+Every pixel then gets the index of its nearest palette color. With ordered dithering, a Bayer
+matrix offset is added to the pixels first, about as large as the spacing between palette colors,
+so that smooth gradients turn into fine patterns instead of bands.
+"""
+import numpy as np
+from mapcreator.gputexture import rgb
+
+METHODS = ('median-cut', 'kmeans')
+DEFAULT_METHOD = 'kmeans'
+MAX_COLORS = 256
+SAMPLE_PIXELS = 65536
+KMEANS_ITERATIONS = 8
+# Pixels matched against the palette at once, which bounds memory use
+CHUNK_PIXELS = 16384
+
+def bayer_matrix(size = 8):
+    """Returns the size x size Bayer threshold matrix, scaled to [-0.5, 0.5)."""
+    matrix = np.zeros((1, 1))
+    while matrix.shape[0] < size:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+    return (matrix + 0.5) / matrix.size - 0.5
+
+def sample_pixels(pixels, count = SAMPLE_PIXELS):
+    """Returns up to count pixels of an array of shape (pixels, 3), spread evenly over it."""
+    if len(pixels) <= count:
+        return pixels
+    return pixels[np.linspace(0, len(pixels) - 1, count).astype(np.int64)]
+
+def median_cut(pixels, colors):
+    """Returns a palette of up to colors colors for pixels of shape (pixels, 3), as floats."""
+    boxes = [pixels.astype(np.float64)]
+    while len(boxes) < colors:
+        ranges = [np.ptp(box, axis=0) if len(box) > 1 else np.zeros(3) for box in boxes]
+        widest = int(np.argmax([r.max() for r in ranges]))
+        if ranges[widest].max() == 0:
+            break # Every box is a single color
+        box = boxes.pop(widest)
+        channel = int(np.argmax(ranges[widest]))
+        box = box[np.argsort(box[:, channel], kind='stable')]
+        middle = len(box) // 2
+        boxes.extend([box[:middle], box[middle:]])
+    return np.array([box.mean(axis=0) for box in boxes])
+
+def nearest(pixels, palette):
+    """Returns the index of the nearest palette color of every pixel of shape (pixels, 3)."""
+    palette = palette.astype(np.float32)
+    norms = np.sum(palette * palette, axis=1)
+    indices = np.empty(len(pixels), dtype=np.int64)
+    for first in range(0, len(pixels), CHUNK_PIXELS):
+        chunk = pixels[first:first + CHUNK_PIXELS].astype(np.float32)
+        # |p - c|^2 = |p|^2 - 2 p.c + |c|^2, of which |p|^2 doesn't affect the nearest color
+        indices[first:first + CHUNK_PIXELS] = np.argmin(norms[None, :] - 2 * chunk.dot(palette.T), axis=1)
+    return indices
+
+def kmeans(pixels, colors, iterations = KMEANS_ITERATIONS):
+    """Returns a palette of up to colors colors for pixels of shape (pixels, 3), starting from the median cut one."""
+    palette = median_cut(pixels, colors)
+    pixels = pixels.astype(np.float64)
+    for _ in range(iterations):
+        indices = nearest(pixels, palette)
+        counts = np.bincount(indices, minlength=len(palette))
+        sums = np.stack([np.bincount(indices, weights=pixels[:, c], minlength=len(palette)) for c in range(3)], axis=1)
+        used = counts > 0
+        # Colors no pixel is nearest to any more are left where they are
+        palette[used] = sums[used] / counts[used, None]
+    return palette
+
+def choose_palette(image, colors = MAX_COLORS, method = DEFAULT_METHOD):
+    """Returns the palette of an 8-bit image of shape (lines, samples) or (lines, samples, channels) as (colors, 3) uint8."""
+    if not 2 <= colors <= MAX_COLORS:
+        raise ValueError('A palette has 2 to {} colors, not {}'.format(MAX_COLORS, colors))
+    pixels = sample_pixels(rgb(image).reshape(-1, 3))
+    if method == 'median-cut':
+        palette = median_cut(pixels, colors)
+    elif method == 'kmeans':
+        palette = kmeans(pixels, colors)
+    else:
+        raise ValueError('Unknown quantization method {}'.format(method))
+    return np.clip(np.round(palette), 0, 255).astype(np.uint8)
+
+def apply_palette(image, palette, dither = False):
+    """Returns the palette index of every pixel of an 8-bit image as an array of shape (lines, samples)."""
+    pixels = rgb(image).astype(np.float32)
+    lines, samples = pixels.shape[:2]
+    if dither:
+        matrix = bayer_matrix()
+        thresholds = np.tile(matrix, (lines // len(matrix) + 1, samples // len(matrix) + 1))[:lines, :samples]
+        # About the distance between neighbouring colors of an evenly spread palette
+        spread = 256.0 / len(palette) ** (1 / 3.0)
+        pixels = np.clip(pixels + thresholds[:, :, None] * spread, 0, 255)
+    return nearest(pixels.reshape(-1, 3), palette).astype(np.uint8).reshape(lines, samples)
+
+def quantize(image, colors = MAX_COLORS, method = DEFAULT_METHOD, dither = False):
+    """Returns (indices of shape (lines, samples), palette of shape (colors, 3)) of an 8-bit image."""
+    palette = choose_palette(image, colors, method)
+    return apply_palette(image, palette, dither), palette
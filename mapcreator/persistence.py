@@ -5,6 +5,10 @@ from mapcreator.state import State
 
 STATE_DIR = '.mapcreator'
 STATE_FILE = 'state.json'
+GDALINFO_CACHE_FILE = 'gdalinfo_cache.json'
+SOURCE_INDEX_FILE = 'source_index.json'
+OPTIMIZED_DIR = 'optimized'
+BUILD_CACHE_DIR = 'build_cache'
 
 def init_state():
     initial_state = State()
@@ -14,6 +18,18 @@ def init_state():
 def state_path():
     return path.join(STATE_DIR, STATE_FILE)
 
+def gdalinfo_cache_path():
+    return path.join(STATE_DIR, GDALINFO_CACHE_FILE)
+
+def source_index_path():
+    return path.join(STATE_DIR, SOURCE_INDEX_FILE)
+
+def optimized_dir():
+    return path.join(STATE_DIR, OPTIMIZED_DIR)
+
+def build_cache_dir():
+    return path.join(STATE_DIR, BUILD_CACHE_DIR)
+
 def state_exists():
     return path.exists(state_path())
 
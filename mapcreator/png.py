@@ -0,0 +1,146 @@
+"""
+A minimal encoder and decoder of 8-bit PNG images, grayscale, RGB or indexed, with or without alpha.
+
+Rows are filtered with Up, the difference to the row above, which suits the smooth gradients of
+heights and satellite images, and large images are deflated in strips in parallel.
+"""
+import struct
+import zlib
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+SIGNATURE = b'\x89PNG\r\n\x1a\n'
+FILTER_NONE = 0
+FILTER_UP = 2
+FILTERS = (FILTER_NONE, FILTER_UP)
+COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6} # Channels -> PNG color type (grayscale, gray + alpha, RGB, RGBA)
+COLOR_TYPE_PALETTE = 3
+STRIP_LINES = 256 # Rows deflated at a time by encode_png_strips
+ADLER_BASE = 65521
+LEVEL = 9
+
+def png_chunk(chunktype, data):
+    return struct.pack('>I', len(data)) + chunktype + data + struct.pack('>I', zlib.crc32(chunktype + data) & 0xffffffff)
+
+def encode_png(rgb, level = LEVEL):
+    """
+    Encodes an 8-bit RGB array of shape (lines, samples, 3), or a grayscale one of shape (lines, samples),
+    as a PNG, using the Up filter on every row.
+    """
+    return encode_png_strips(rgb, level, strip_lines = max(len(rgb), 1))
+
+def encode_png_strips(image, level = LEVEL, workers = 1, strip_lines = STRIP_LINES, palette = None, filtertype = FILTER_UP):
+    """
+    Encodes an 8-bit array of shape (lines, samples, channels) or (lines, samples) as a PNG like
+    encode_png, compressing strips of strip_lines rows in a pool of workers, as pigz does. Every strip
+    is deflated on its own and flushed to a byte boundary, so that the strips concatenate into a single
+    zlib stream. The image may be memory-mapped: it's read one strip at a time.
+    If palette, an 8-bit array of shape (colors, 3), is given, the image is of indices into it and is
+    written as an indexed PNG. filtertype is the filter of the rows, FILTER_UP or FILTER_NONE; differences
+    between palette indices don't compress any better than the indices, so indexed images are best
+    left unfiltered.
+    """
+    if filtertype not in FILTERS:
+        raise ValueError('Unsupported PNG filter: {}'.format(filtertype))
+    if image.ndim == 2:
+        image = image[:, :, None]
+    lines, samples, channels = image.shape
+    strips = [(first, min(first + strip_lines, lines)) for first in range(0, lines, strip_lines)]
+    jobs = [(image, first, last, level, last == lines, filtertype) for first, last in strips]
+    if workers > 1 and len(jobs) > 1:
+        # zlib releases the GIL while compressing, so threads compress in parallel
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            deflated = list(executor.map(deflate_png_strip, *zip(*jobs)))
+    else:
+        deflated = [deflate_png_strip(*job) for job in jobs]
+    checksum = 1
+    for data, strip_checksum, length in deflated:
+        checksum = adler32_combine(checksum, strip_checksum, length)
+    stream = zlib_header(level) + b''.join(data for data, strip_checksum, length in deflated) + struct.pack('>I', checksum)
+    colortype = COLOR_TYPES[channels] if palette is None else COLOR_TYPE_PALETTE
+    header = struct.pack('>IIBBBBB', samples, lines, 8, colortype, 0, 0, 0)
+    chunks = [png_chunk(b'IHDR', header)]
+    if palette is not None:
+        chunks.append(png_chunk(b'PLTE', np.asarray(palette, dtype=np.uint8).tobytes()))
+    return SIGNATURE + b''.join(chunks) + png_chunk(b'IDAT', stream) + png_chunk(b'IEND', b'')
+
+def png_scanlines(image, first, last, filtertype = FILTER_UP):
+    """
+    Returns rows first to last of an image as PNG scanlines, filtered with Up but for the first row of
+    the image, or not at all if filtertype is FILTER_NONE.
+    """
+    if filtertype == FILTER_NONE:
+        rows = np.asarray(image[first:last]).reshape(last - first, image.shape[1] * image.shape[2])
+        return np.hstack([np.full((last - first, 1), FILTER_NONE, dtype=np.uint8), rows]).tobytes()
+    rows = np.asarray(image[max(first - 1, 0):last]).reshape(-1, image.shape[1] * image.shape[2])
+    filtered = np.empty((last - first, rows.shape[1]), dtype=np.uint8)
+    filtertypes = np.full((last - first, 1), FILTER_UP, dtype=np.uint8)
+    if first == 0:
+        filtered[0] = rows[0]
+        filtertypes[0] = FILTER_NONE
+        filtered[1:] = rows[1:] - rows[:-1] # Wraps around modulo 256, as the filter requires
+    else:
+        filtered[:] = rows[1:] - rows[:-1]
+    return np.hstack([filtertypes, filtered]).tobytes()
+
+def deflate_png_strip(image, first, last, level, final, filtertype = FILTER_UP):
+    """Returns (raw deflate data, Adler-32 checksum, length) of the scanlines of rows first to last."""
+    scanlines = png_scanlines(image, first, last, filtertype)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    data = compressor.compress(scanlines) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+    return data, zlib.adler32(scanlines), len(scanlines)
+
+def zlib_header(level):
+    flevel = 0 if level < 2 else 1 if level < 6 else 2 if level == 6 else 3
+    cmf, flg = 0x78, flevel << 6
+    return bytes([cmf, flg + 31 - (cmf * 256 + flg) % 31])
+
+def adler32_combine(first, second, second_length):
+    """Returns the Adler-32 checksum of two pieces of data from their checksums, as zlib's adler32_combine."""
+    remainder = second_length % ADLER_BASE
+    sum1 = first & 0xffff
+    sum2 = (remainder * sum1) % ADLER_BASE
+    sum1 += (second & 0xffff) + ADLER_BASE - 1
+    sum2 += ((first >> 16) & 0xffff) + ((second >> 16) & 0xffff) + ADLER_BASE - remainder
+    if sum1 >= ADLER_BASE: sum1 -= ADLER_BASE
+    if sum1 >= ADLER_BASE: sum1 -= ADLER_BASE
+    if sum2 >= 2 * ADLER_BASE: sum2 -= 2 * ADLER_BASE
+    if sum2 >= ADLER_BASE: sum2 -= ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+def decode_png(content):
+    """
+    Decodes an 8-bit PNG written by encode_png or encode_png_strips, grayscale ones into 2D arrays
+    and indexed ones into RGB arrays. Other filters than None and Up aren't supported.
+    """
+    if not content.startswith(SIGNATURE):
+        raise ValueError('Not a PNG file')
+    position = len(SIGNATURE)
+    idat = []
+    palette = None
+    while position < len(content):
+        length, chunktype = struct.unpack_from('>I4s', content, position)
+        data = content[position + 8:position + 8 + length]
+        if chunktype == b'IHDR':
+            samples, lines, depth, colortype = struct.unpack_from('>IIBB', data)
+            channels = 1 if colortype == COLOR_TYPE_PALETTE else dict((v, k) for k, v in COLOR_TYPES.items()).get(colortype)
+            if depth != 8 or channels is None:
+                raise ValueError('Only 8-bit grayscale, RGB and indexed PNG files, with or without alpha, are supported')
+        elif chunktype == b'PLTE':
+            palette = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+        elif chunktype == b'IDAT':
+            idat.append(data)
+        position += 12 + length
+    scanlines = np.frombuffer(zlib.decompress(b''.join(idat)), dtype=np.uint8).reshape(lines, samples * channels + 1)
+    filtertypes = scanlines[:, 0]
+    if np.any((filtertypes != FILTER_NONE) & (filtertypes != FILTER_UP)):
+        raise ValueError('Unsupported PNG filter')
+    rows = scanlines[:, 1:].copy()
+    # Rows filtered with Up are cumulative sums of the differences since the last unfiltered row
+    starts = sorted(set([0] + np.flatnonzero(filtertypes == FILTER_NONE).tolist()))
+    ends = starts[1:] + [lines]
+    for start, end in zip(starts, ends):
+        rows[start:end] = np.cumsum(rows[start:end], axis=0, dtype=np.uint8)
+    if colortype == COLOR_TYPE_PALETTE:
+        return palette[rows]
+    return rows.reshape(lines, samples, channels) if channels > 1 else rows
@@ -0,0 +1,68 @@
+"""
+Level-of-detail pyramids of height grids.
+
+Each level halves the resolution of the previous one by reducing blocks of 2x2 cells into one.
+Nodata cells are ignored; a cell becomes nodata only if its whole block is.
+"""
+import warnings
+import numpy as np
+from mapcreator.envi import EnviRaster, parse_list
+
+REDUCTIONS = {
+    'mean': np.nanmean,
+    'min': np.nanmin,
+    'max': np.nanmax,
+}
+DEFAULT_REDUCTION = 'mean'
+
+def downsample(data, reduction = DEFAULT_REDUCTION, nodata = None):
+    """
+    Reduces every 2x2 block of a 2D array into one cell. Odd-sized grids are padded with nodata,
+    so the last row and column of the result cover one cell of data plus padding.
+    """
+    values = data.astype(np.float64)
+    if nodata is not None:
+        values[data == nodata] = np.nan
+    lines, samples = values.shape
+    padded = np.full((lines + lines % 2, samples + samples % 2), np.nan)
+    padded[:lines, :samples] = values
+    blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # All-nodata blocks
+        reduced = REDUCTIONS[reduction](blocks, axis=(1, 3))
+    if nodata is not None:
+        reduced[np.isnan(reduced)] = nodata
+    return reduced.astype(data.dtype)
+
+def level_header(header, samples, lines, factor):
+    """Returns a copy of header for a level with the given size, its cells factor times the original size."""
+    new_header = EnviRaster.create_header(samples, lines, EnviRaster.dtype_for_header(header), nodata=None)
+    for key, value in header.items():
+        if key not in new_header and key != 'band names':
+            new_header[key] = value
+    if 'map info' in header:
+        info = parse_list(header['map info'])
+        refx, refy, easting, northing, pixel_width, pixel_height = map(float, info[1:7])
+        ulx = easting - (refx - 1) * pixel_width
+        uly = northing + (refy - 1) * pixel_height
+        info[1:7] = ['1', '1', repr(ulx), repr(uly), repr(pixel_width * factor), repr(pixel_height * factor)]
+        new_header['map info'] = '{' + ', '.join(info) + '}'
+    return new_header
+
+def build_pyramid(raster, levels, reduction = DEFAULT_REDUCTION):
+    """
+    Returns EnviRasters for up to the given number of levels below raster, each half the
+    resolution of the previous. Stops early when the grid can't be halved anymore.
+    """
+    if reduction not in REDUCTIONS:
+        raise ValueError('Unknown reduction {}'.format(reduction))
+    results = []
+    data = raster.data
+    factor = 1
+    for level in range(levels):
+        if min(data.shape) < 2: break
+        data = downsample(data, reduction, raster.nodata)
+        factor *= 2
+        header = level_header(raster.header, data.shape[1], data.shape[0], factor)
+        results.append(EnviRaster(data, header))
+    return results
@@ -0,0 +1,311 @@
+"""
+A built-in engine for resampling geographic (lon/lat) height rasters into EPSG:3857 with bilinear
+interpolation, writing the ENVI output directly.
+
+This covers the common case of the height pipeline without GDAL: the sources are read natively as
+a mosaic, and the output is computed one strip of rows at a time into a memory-mapped file, so memory
+use stays bounded whatever the size of the window. Since longitude only depends on the output column
+and latitude only on the output row, the inverse Web Mercator mapping and the interpolation weights
+are computed once per column and once per row, and the interpolation is done as two separable passes.
+
+Like gdalwarp -r bilinear, the kernel is widened when the output cells are larger than the source
+pixels, and nodata pixels are left out of the weighted average.
+"""
+import math
+import numpy as np
+from abc import ABCMeta, abstractmethod
+from mapcreator import gdal_util
+from mapcreator.envi import EnviRaster, format_map_info, header_path, write_header
+from mapcreator.mercator import mercator_to_lonlat
+
+# Budget of float64 cells the arrays of one strip may use, about 32 megabytes
+STRIP_CELLS = 4 * 1024 * 1024
+# Pixels of neighbouring sources this much apart are considered to be on the same grid
+ALIGNMENT_TOLERANCE = 1e-3
+
+OUTPUT_PROJECTION_NAME = 'Pseudo Mercator'
+
+ENGINES = ('auto', 'numpy', 'gdal')
+
+# GDAL data type name -> numpy type (without byte order)
+NUMPY_TYPES = {
+    'Byte': 'u1', 'Int8': 'i1', 'UInt16': 'u2', 'Int16': 'i2',
+    'UInt32': 'u4', 'Int32': 'i4', 'Float32': 'f4', 'Float64': 'f8',
+}
+
+TIFF_TAG_COMPRESSION = 259
+TIFF_TAG_STRIP_OFFSETS = 273
+TIFF_TAG_ROWS_PER_STRIP = 278
+TIFF_TAG_TILE_WIDTH = 322
+TIFF_TAG_TILE_LENGTH = 323
+TIFF_TAG_TILE_OFFSETS = 324
+TIFF_COMPRESSION_NONE = 1
+
+class RasterSource(metaclass=ABCMeta):
+    """
+    A single band, north-up source raster in geographic coordinates, read in blocks.
+    ulx, uly is the upper left corner of the upper left pixel. Subclasses implement read.
+    """
+
+    def __init__(self, ulx, uly, pixel_width, pixel_height, samples, lines, dtype, nodata = None):
+        self.ulx = ulx
+        self.uly = uly
+        self.pixel_width = pixel_width
+        self.pixel_height = pixel_height
+        self.samples = samples
+        self.lines = lines
+        self.dtype = np.dtype(dtype)
+        self.nodata = nodata
+
+    @classmethod
+    def geometry(cls, gdal_info):
+        """Returns the pixel grid and nodata value of a geographic raster from its Gdalinfo, as keyword arguments."""
+        pixel_width, pixel_height = gdal_info.pixel_size
+        return dict(
+            ulx = gdal_info.minX, uly = gdal_info.maxY, pixel_width = abs(pixel_width),
+            pixel_height = abs(pixel_height), nodata = gdal_info.nodata
+        )
+
+    @abstractmethod
+    def read(self, row0, row1, col0, col1):
+        """Returns the pixels of rows row0:row1 and columns col0:col1."""
+
+class ArraySource(RasterSource):
+    """A source whose pixels are in an array, such as a memory-mapped ENVI file."""
+
+    def __init__(self, data, **kwargs):
+        RasterSource.__init__(self, samples = data.shape[1], lines = data.shape[0], dtype = data.dtype, **kwargs)
+        self.data = data
+
+    def read(self, row0, row1, col0, col1):
+        return np.asarray(self.data[row0:row1, col0:col1])
+
+class TiffSource(RasterSource):
+    """An uncompressed, single band (Geo)TIFF, organized in strips or tiles."""
+
+    def __init__(self, fpath, ifd, byteorder, **kwargs):
+        RasterSource.__init__(self, **kwargs)
+        self.dtype = self.dtype.newbyteorder(byteorder)
+        self.buffer = np.memmap(fpath, dtype=np.uint8, mode='r')
+        if TIFF_TAG_TILE_OFFSETS in ifd:
+            self.block_width = ifd[TIFF_TAG_TILE_WIDTH][0]
+            self.block_height = ifd[TIFF_TAG_TILE_LENGTH][0]
+            self.offsets = ifd[TIFF_TAG_TILE_OFFSETS]
+        else:
+            self.block_width = self.samples
+            self.block_height = min(ifd.get(TIFF_TAG_ROWS_PER_STRIP, (self.lines,))[0], self.lines)
+            self.offsets = ifd[TIFF_TAG_STRIP_OFFSETS]
+        self.blocks_across = -(-self.samples // self.block_width)
+
+    def read_tiff_block(self, index):
+        cells = self.block_width * self.block_height
+        start = self.offsets[index]
+        block = np.frombuffer(self.buffer[start:start + cells * self.dtype.itemsize], dtype=self.dtype)
+        if block.size < cells: # The last strip is allowed to be short
+            block = np.concatenate([block, np.zeros(cells - block.size, dtype=self.dtype)])
+        return block.reshape(self.block_height, self.block_width)
+
+    def read(self, row0, row1, col0, col1):
+        result = np.empty((row1 - row0, col1 - col0), dtype=self.dtype)
+        for block_row in range(row0 // self.block_height, (row1 - 1) // self.block_height + 1):
+            for block_col in range(col0 // self.block_width, (col1 - 1) // self.block_width + 1):
+                block = self.read_tiff_block(block_row * self.blocks_across + block_col)
+                top, left = block_row * self.block_height, block_col * self.block_width
+                r0, r1 = max(row0, top), min(row1, top + self.block_height)
+                c0, c1 = max(col0, left), min(col1, left + self.block_width)
+                result[r0 - row0:r1 - row0, c0 - col0:c1 - col0] = block[r0 - top:r1 - top, c0 - left:c1 - left]
+        return result
+
+def open_tiff(fpath, gdal_info):
+    with open(fpath, 'rb') as infile:
+        byteorder = '<' if infile.read(2) == b'II' else '>'
+        infile.seek(0)
+        ifd = gdal_util.read_tiff_ifds(infile)[0]
+    if ifd.get(TIFF_TAG_COMPRESSION, (TIFF_COMPRESSION_NONE,))[0] != TIFF_COMPRESSION_NONE:
+        return None
+    if TIFF_TAG_TILE_OFFSETS not in ifd and TIFF_TAG_STRIP_OFFSETS not in ifd:
+        return None
+    return TiffSource(
+        fpath, ifd, byteorder, samples = gdal_info.size[0], lines = gdal_info.size[1],
+        dtype = NUMPY_TYPES[gdal_info.bands[0]['type']], **RasterSource.geometry(gdal_info)
+    )
+
+def open_envi(fpath, gdal_info):
+    return ArraySource(EnviRaster.load(fpath, mmap=True).data, **RasterSource.geometry(gdal_info))
+
+def open_source(fpath):
+    """
+    Opens a geographic, single band raster whose pixels can be read natively (ENVI, or uncompressed
+    GeoTIFF). Returns None for anything else, which is left for GDAL.
+    """
+    gdal_info = gdal_util.read_native_header(fpath)
+    if gdal_info is None or gdal_info.crs not in gdal_util.GEOGRAPHIC_SYSTEMS or len(gdal_info.bands) != 1:
+        return None
+    if gdal_info.bands[0]['type'] not in NUMPY_TYPES:
+        return None
+    try:
+        with open(fpath, 'rb') as infile:
+            magic = infile.read(4)
+        if magic in (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+'):
+            return open_tiff(fpath, gdal_info)
+        if magic.startswith(b'EHFA'):
+            return None
+        return open_envi(fpath, gdal_info)
+    except (IOError, OSError, ValueError, KeyError, IndexError):
+        return None
+
+class SourceMosaic:
+    """
+    Sources on a common pixel grid, read as one raster. Like in a GDAL VRT mosaic, later sources are
+    drawn over earlier ones, except where their pixels are nodata.
+    """
+
+    def __init__(self, sources):
+        first = sources[0]
+        self.sources = sources
+        self.pixel_width = first.pixel_width
+        self.pixel_height = first.pixel_height
+        self.ulx = min(s.ulx for s in sources)
+        self.uly = max(s.uly for s in sources)
+        self.dtype = first.dtype
+        self.nodata = next((s.nodata for s in sources if s.nodata is not None), None)
+        self.offsets = []
+        for source in sources:
+            column = (source.ulx - self.ulx) / self.pixel_width
+            row = (self.uly - source.uly) / self.pixel_height
+            if not SourceMosaic.aligned(source, self, column, row):
+                raise ValueError('Sources aren\'t on a common pixel grid')
+            self.offsets.append((int(round(row)), int(round(column))))
+        self.samples = max(c + s.samples for (r, c), s in zip(self.offsets, sources))
+        self.lines = max(r + s.lines for (r, c), s in zip(self.offsets, sources))
+
+    @classmethod
+    def aligned(cls, source, mosaic, column, row):
+        return (
+            abs(source.pixel_width - mosaic.pixel_width) <= ALIGNMENT_TOLERANCE * mosaic.pixel_width and
+            abs(source.pixel_height - mosaic.pixel_height) <= ALIGNMENT_TOLERANCE * mosaic.pixel_height and
+            abs(column - round(column)) <= ALIGNMENT_TOLERANCE and abs(row - round(row)) <= ALIGNMENT_TOLERANCE
+        )
+
+    def read_block(self, row0, row1, col0, col1):
+        """Returns rows row0:row1 and columns col0:col1 as float64, NaN where there is no data."""
+        block = np.full((row1 - row0, col1 - col0), np.nan)
+        for (top, left), source in zip(self.offsets, self.sources):
+            r0, r1 = max(row0, top), min(row1, top + source.lines)
+            c0, c1 = max(col0, left), min(col1, left + source.samples)
+            if r0 >= r1 or c0 >= c1: continue
+            values = source.read(r0 - top, r1 - top, c0 - left, c1 - left).astype(np.float64)
+            valid = ~np.isnan(values)
+            if source.nodata is not None:
+                valid &= values != source.nodata
+            target = block[r0 - row0:r1 - row0, c0 - col0:c1 - col0]
+            target[valid] = values[valid]
+        return block
+
+def open_mosaic(fpaths):
+    """Returns a SourceMosaic of the files, or None if any of them has to be left for GDAL."""
+    sources = [open_source(f) for f in fpaths]
+    if not sources or None in sources:
+        return None
+    try:
+        return SourceMosaic(sources)
+    except ValueError:
+        return None
+
+def kernel(positions, scale, size):
+    """
+    Returns (first tap, weights) of a bilinear (triangle) kernel scale pixels wide on each side, centered
+    at each of the positions (in pixel coordinates, pixel centers being whole numbers). Taps outside
+    0..size - 1 get no weight. weights has one row per position.
+    """
+    taps = int(math.ceil(2 * scale)) + 1
+    first = np.floor(positions - scale).astype(np.int64) + 1
+    distances = positions[:, None] - (first[:, None] + np.arange(taps)[None, :])
+    weights = np.maximum(0.0, 1 - np.abs(distances) / scale)
+    indices = first[:, None] + np.arange(taps)[None, :]
+    weights[(indices < 0) | (indices >= size)] = 0
+    return first, weights
+
+def sampling_scale(positions):
+    """Source pixels per output cell along an axis, never less than one."""
+    if len(positions) < 2:
+        return 1.0
+    return max(1.0, float(np.max(np.abs(np.diff(positions)))))
+
+def gather(block, first, weights, block_start, axis):
+    """Applies the kernel along axis of block (0 for rows, 1 for columns), returning the weighted sums."""
+    result = 0
+    for tap in range(weights.shape[1]):
+        indices = np.clip(first + tap - block_start, 0, block.shape[axis] - 1)
+        taken = np.take(block, indices, axis=axis)
+        w = weights[:, tap]
+        result = result + taken * (w[:, None] if axis == 0 else w[None, :])
+    return result
+
+def output_size(bounds, cellsize):
+    """Returns (samples, lines) of the output for bounds (minx, miny, maxx, maxy), as gdalwarp -te -tr computes them."""
+    minx, miny, maxx, maxy = bounds
+    return (int((maxx - minx + cellsize / 2.0) / cellsize), int((maxy - miny + cellsize / 2.0) / cellsize))
+
+def rows_per_strip(samples, column_taps, column_scale, row_scale):
+    """Returns how many output rows to compute at once within STRIP_CELLS."""
+    cells_per_source_row = samples * (column_taps + column_scale + 1)
+    source_rows = STRIP_CELLS // max(1, cells_per_source_row)
+    return max(1, int(source_rows / max(row_scale, 1.0)) - int(math.ceil(2 * row_scale)) - 1)
+
+def resample_to_envi(mosaic, bounds, cellsize, outpath):
+    """
+    Resamples mosaic into EPSG:3857 over bounds (minx, miny, maxx, maxy) with cellsize meter cells,
+    anchored at the north-west corner, and writes it as an ENVI file to outpath.
+    Returns the written EnviRaster, its data memory-mapped.
+    """
+    minx, miny, maxx, maxy = bounds
+    samples, lines = output_size(bounds, cellsize)
+    nodata = mosaic.nodata
+    header = EnviRaster.create_header(
+        samples, lines, mosaic.dtype.newbyteorder('<'),
+        format_map_info(OUTPUT_PROJECTION_NAME, minx, maxy, cellsize, cellsize), nodata=nodata
+    )
+    output = np.memmap(outpath, dtype=EnviRaster.dtype_for_header(header), mode='w+', shape=(lines, samples))
+
+    lons, _ = mercator_to_lonlat(minx + (np.arange(samples) + 0.5) * cellsize, 0)
+    columns = (np.atleast_1d(lons) - mosaic.ulx) / mosaic.pixel_width - 0.5
+    column_scale = sampling_scale(columns)
+    column_first, column_weights = kernel(columns, column_scale, mosaic.samples)
+    column_inside = (columns >= -0.5) & (columns <= mosaic.samples - 0.5)
+    col0 = int(max(0, column_first.min()))
+    col1 = int(min(mosaic.samples, column_first.max() + column_weights.shape[1]))
+
+    _, lats = mercator_to_lonlat(0, maxy - (np.arange(lines) + 0.5) * cellsize)
+    rows = (mosaic.uly - np.atleast_1d(lats)) / mosaic.pixel_height - 0.5
+    row_scale = sampling_scale(rows)
+    strip = rows_per_strip(samples, column_weights.shape[1], column_scale, row_scale)
+
+    fill = nodata if nodata is not None else 0
+    for start in range(0, lines, strip):
+        strip_rows = rows[start:start + strip]
+        result = np.full((len(strip_rows), samples), float(fill))
+        row_first, row_weights = kernel(strip_rows, row_scale, mosaic.lines)
+        row0 = int(max(0, row_first.min()))
+        row1 = int(min(mosaic.lines, row_first.max() + row_weights.shape[1]))
+        if row0 < row1 and col0 < col1:
+            block = mosaic.read_block(row0, row1, col0, col1)
+            valid = ~np.isnan(block)
+            block[~valid] = 0
+            # Both the weighted sum of the values and the sum of the weights of valid pixels are separable
+            values = gather(gather(block, column_first, column_weights, col0, 1), row_first, row_weights, row0, 0)
+            weights = gather(gather(valid.astype(np.float64), column_first, column_weights, col0, 1), row_first, row_weights, row0, 0)
+            row_inside = (strip_rows >= -0.5) & (strip_rows <= mosaic.lines - 0.5)
+            known = (weights > 1e-12) & row_inside[:, None] & column_inside[None, :]
+            result[known] = values[known] / weights[known]
+        output[start:start + len(strip_rows)] = store(result, output.dtype)
+    output.flush()
+    write_header(header_path(outpath), header)
+    return EnviRaster(output, header)
+
+def store(values, dtype):
+    """Converts computed heights to the output type, rounding and clamping them for integer types."""
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        return np.clip(np.floor(values + 0.5), info.min, info.max).astype(dtype)
+    return values.astype(dtype)
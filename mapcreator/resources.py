@@ -0,0 +1,118 @@
+"""
+Chooses how much of the build host GDAL may use when warping and translating rasters.
+
+The settings are based on the available cores and memory, the estimated size of the output
+and an optional per-project budget (see State.set_resource_budget).
+"""
+import math
+import multiprocessing
+import os
+from mapcreator.mercator import lonlat_to_mercator
+
+MEGABYTE = 1024 * 1024
+# Share of the available memory GDAL may use when there's no budget
+MEMORY_SHARE = 0.5
+MIN_WARP_MEMORY_MB = 64
+MIN_CACHE_MB = 64
+# Memory assumed to be available if it can't be detected
+FALLBACK_MEMORY_MB = 2048
+# Output size per warp thread below which extra threads don't pay off
+OUTPUT_MB_PER_THREAD = 16
+
+# Bytes per output pixel
+HEIGHT_PIXEL_BYTES = 4 # One float32 band
+SATELLITE_PIXEL_BYTES = 3 # Three byte bands
+
+class ResourceSettings:
+
+    def __init__(self, threads, warp_memory_mb, cache_mb, output_mb):
+        self.threads = threads
+        self.warp_memory_mb = warp_memory_mb
+        self.cache_mb = cache_mb
+        self.output_mb = output_mb
+
+    # GDAL reads small values of -wm and GDAL_CACHEMAX as megabytes and large ones as bytes,
+    # so they're always given in bytes, which are never small enough to be mistaken for megabytes
+    def warp_memory_bytes(self):
+        return self.warp_memory_mb * MEGABYTE
+
+    def cache_bytes(self):
+        return self.cache_mb * MEGABYTE
+
+    def warp_options(self):
+        """Returns the options for the gdalwarp command line, ending with a space."""
+        return '-multi -wo NUM_THREADS={} -wm {} {}'.format(self.threads, self.warp_memory_bytes(), self.config_options())
+
+    def config_options(self):
+        """Returns the configuration options for any GDAL command line tool, ending with a space."""
+        return '--config GDAL_CACHEMAX {} '.format(self.cache_bytes())
+
+    def __str__(self):
+        return '{} warp threads, {} MB warp memory, {} MB block cache (estimated output {} MB)'.format(
+            self.threads, self.warp_memory_mb, self.cache_mb, self.output_mb
+        )
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError: # Not available on all platforms
+        try:
+            return multiprocessing.cpu_count() # os.cpu_count is only there from Python 3.4
+        except NotImplementedError:
+            return 1
+
+def available_memory_mb():
+    """Returns the memory available for new processes in megabytes, or None if it can't be detected."""
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // MEGABYTE
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def estimate_output_mb(state, cellsize, pixel_bytes):
+    """Estimates the size of the warped window in megabytes."""
+    if not state.has_window(): return 0
+    minlon, minlat, maxlon, maxlat = state.get_window_lowerleft_topright()
+    minx, miny = lonlat_to_mercator(minlon, minlat)
+    maxx, maxy = lonlat_to_mercator(maxlon, maxlat)
+    pixels = math.ceil(abs(maxx - minx) / cellsize) * math.ceil(abs(maxy - miny) / cellsize)
+    return int(math.ceil(pixels * pixel_bytes / MEGABYTE))
+
+def shared(value, share):
+    """Returns a pipeline's part of value, or None if it's None, when share pipelines are built at once."""
+    if value is None: return None
+    return max(1, value // share)
+
+def choose_settings(state, cellsize, pixel_bytes, cores = None, memory_mb = None):
+    """
+    Returns ResourceSettings for warping the state's window with the given output cell size.
+    cores and memory_mb override the detected values of the host. The host and the budget
+    are split evenly between the pipelines being built at once (see State.set_build_share).
+    """
+    share = state.get_build_share()
+    cores = shared(cores or available_cores(), share)
+    memory_mb = shared(memory_mb or available_memory_mb() or FALLBACK_MEMORY_MB, share)
+    budget_threads, budget_memory_mb = (shared(value, share) for value in state.get_resource_budget())
+    output_mb = estimate_output_mb(state, cellsize, pixel_bytes)
+
+    threads = min(cores, budget_threads or cores, max(1, output_mb // OUTPUT_MB_PER_THREAD))
+    usable_mb = int(memory_mb * MEMORY_SHARE)
+    if budget_memory_mb:
+        usable_mb = min(usable_mb, budget_memory_mb)
+    # Warping gets half of the memory and the block cache the rest, but neither needs more than the whole output
+    warp_memory_mb = max(MIN_WARP_MEMORY_MB, min(usable_mb // 2, output_mb))
+    cache_mb = max(MIN_CACHE_MB, min(usable_mb - warp_memory_mb, output_mb))
+    return ResourceSettings(threads, warp_memory_mb, cache_mb, output_mb)
+
+def worker_count(state, jobs, cores = None):
+    """Returns how many jobs to run at once: one per core, capped by the budget, both split between pipelines."""
+    share = state.get_build_share()
+    cores = shared(cores or available_cores(), share)
+    budget_threads = shared(state.get_resource_budget()[0], share)
+    return max(1, min(jobs, cores, budget_threads or cores))
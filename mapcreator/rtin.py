@@ -0,0 +1,170 @@
+"""
+Error-bounded adaptive terrain meshes, as right-triangulated irregular networks (RTIN).
+
+The grid is recursively split into right triangles, each split adding a vertex at the middle of the
+hypotenuse, as in the Martini library. The error of a vertex is how far the terrain there is from
+the hypotenuse it splits, maximized with the errors of the vertices below it in the hierarchy, so
+that cutting the hierarchy at a maximum error gives a mesh without cracks.
+
+Instead of iterating triangles one by one, the errors are computed one level at a time: the vertices
+of a level form a regular lattice on the grid, so each level is a handful of array operations.
+Levels alternate between square centers (splitting the diagonal of a square, the diagonals going
+in a checkerboard pattern) and edge midpoints (splitting an edge shared by two squares).
+
+The grid has to be 2^k + 1 cells wide. Other rasters are padded, the triangles reaching into the
+padding are always split and the ones in the padding are left out of the mesh.
+"""
+import numpy as np
+
+# A vertex: its column and row on the height grid and its height
+VERTEX_DTYPE = np.dtype([('column', '<u2'), ('row', '<u2'), ('height', '<f4')])
+MAX_GRID_SIZE = 32769 # Columns and rows are stored as 16-bit integers
+
+def grid_size(samples, lines):
+    """Returns the smallest 2^k + 1 grid that covers a raster of the given size."""
+    size = 2
+    while size + 1 < max(samples, lines, 2):
+        size *= 2
+    return size + 1
+
+def lattice(start, stop, step):
+    return np.arange(start, stop, step)
+
+def take(grid, rows, columns):
+    """Returns grid values at the lattice rows x columns, zero where outside the grid."""
+    size = grid.shape[0]
+    inside = ((rows >= 0) & (rows < size))[:, None] & ((columns >= 0) & (columns < size))[None, :]
+    values = grid[np.ix_(np.clip(rows, 0, size - 1), np.clip(columns, 0, size - 1))]
+    return np.where(inside, values, 0)
+
+def straddles(low, high, edge):
+    """Returns True where the span from low to high crosses edge, the last row or column of the raster."""
+    return (low < edge) & (edge < high)
+
+def compute_errors(heights, samples = None, lines = None):
+    """
+    Returns the error of every vertex of a square 2^k + 1 height grid. If the raster only covers the
+    first samples columns and lines rows of the grid, vertices splitting triangles that reach outside
+    it get infinite errors, so those triangles are always split.
+    """
+    size = heights.shape[0]
+    tile = size - 1
+    last_column = (samples or size) - 1
+    last_row = (lines or size) - 1
+    errors = np.zeros((size, size))
+    step = 2
+    while step <= tile:
+        half = step // 2
+        quarter = step // 4
+        # Edge midpoints: splitting edges of length step, shared by the squares on both sides
+        for horizontal in (True, False):
+            if horizontal:
+                rows, columns = lattice(0, size, step), lattice(half, size, step)
+                ends = (take(heights, rows, columns - half), take(heights, rows, columns + half))
+            else:
+                rows, columns = lattice(half, size, step), lattice(0, size, step)
+                ends = (take(heights, rows - half, columns), take(heights, rows + half, columns))
+            middle = np.abs((ends[0] + ends[1]) / 2 - heights[np.ix_(rows, columns)])
+            if quarter:
+                # The centers of the quarter squares around the midpoint
+                for dy in (-quarter, quarter):
+                    for dx in (-quarter, quarter):
+                        middle = np.maximum(middle, take(errors, rows + dy, columns + dx))
+            if horizontal:
+                across = straddles(columns - half, columns + half, last_column)[None, :]
+                up_down = straddles(rows - half, rows, last_row) | straddles(rows, rows + half, last_row)
+                forced = across | up_down[:, None]
+            else:
+                across = straddles(rows - half, rows + half, last_row)[:, None]
+                left_right = straddles(columns - half, columns, last_column) | straddles(columns, columns + half, last_column)
+                forced = across | left_right[None, :]
+            middle[forced] = np.inf
+            errors[np.ix_(rows, columns)] = middle
+        # Square centers: splitting the diagonals of squares of side step
+        rows, columns = lattice(half, size, step), lattice(half, size, step)
+        main = ((np.arange(len(rows))[:, None] + np.arange(len(columns))[None, :]) % 2) == 0
+        main_diagonal = (heights[np.ix_(rows - half, columns - half)] + heights[np.ix_(rows + half, columns + half)]) / 2
+        anti_diagonal = (heights[np.ix_(rows - half, columns + half)] + heights[np.ix_(rows + half, columns - half)]) / 2
+        middle = np.abs(np.where(main, main_diagonal, anti_diagonal) - heights[np.ix_(rows, columns)])
+        # The midpoints of the square's edges
+        for dy, dx in ((-half, 0), (half, 0), (0, -half), (0, half)):
+            middle = np.maximum(middle, errors[np.ix_(rows + dy, columns + dx)])
+        forced = (
+            straddles(columns - half, columns + half, last_column)[None, :] |
+            straddles(rows - half, rows + half, last_row)[:, None]
+        )
+        middle[forced] = np.inf
+        errors[np.ix_(rows, columns)] = middle
+        step *= 2
+    return errors
+
+def extract(errors, max_error, samples = None, lines = None):
+    """
+    Cuts the hierarchy at max_error. Returns the triangles as an array of shape (triangles, 3, 2) of
+    (column, row) vertex positions, leaving out the ones outside the first samples x lines of the grid.
+    """
+    size = errors.shape[0]
+    tile = size - 1
+    # (a, b, c): the hypotenuse from a to b, the right angle at c
+    triangles = np.array([
+        [[0, 0], [tile, tile], [tile, 0]],
+        [[tile, tile], [0, 0], [0, tile]],
+    ])
+    finished = []
+    while len(triangles):
+        a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+        middle = (a + b) // 2
+        splittable = np.abs(a - c).sum(axis=1) > 1
+        split = splittable & (errors[middle[:, 1], middle[:, 0]] > max_error)
+        finished.append(triangles[~split])
+        a, b, c, middle = a[split], b[split], c[split], middle[split]
+        triangles = np.concatenate([np.stack([c, a, middle], axis=1), np.stack([b, c, middle], axis=1)])
+    result = np.concatenate(finished)
+    inside = (result[:, :, 0] <= (samples or size) - 1).all(axis=1) & (result[:, :, 1] <= (lines or size) - 1).all(axis=1)
+    return result[inside]
+
+class TerrainMesh:
+    """An indexed triangle mesh: a vertex buffer of VERTEX_DTYPE and a buffer of vertex index triplets."""
+
+    def __init__(self, vertices, indices):
+        self.vertices = vertices
+        self.indices = indices
+
+    @property
+    def triangle_count(self):
+        return len(self.indices) // 3
+
+    def index_dtype(self):
+        return np.dtype('<u2') if len(self.vertices) <= 65536 else np.dtype('<u4')
+
+    def save(self, vertexpath, indexpath):
+        self.vertices.tofile(vertexpath)
+        self.indices.astype(self.index_dtype()).tofile(indexpath)
+
+def dense_triangle_count(samples, lines):
+    """Returns how many triangles a full triangulation of the grid has."""
+    return 2 * max(samples - 1, 0) * max(lines - 1, 0)
+
+def build_mesh(raster, max_error):
+    """
+    Returns a TerrainMesh of a single band EnviRaster, no vertex further than max_error from the terrain.
+    Nodata cells are meshed at the lowest height of the raster.
+    """
+    samples, lines = raster.samples, raster.lines
+    size = grid_size(samples, lines)
+    if size > MAX_GRID_SIZE:
+        raise ValueError('A {}x{} raster is too large for a single mesh'.format(samples, lines))
+    heights = raster.data.astype(np.float64)
+    if raster.nodata is not None:
+        valid = raster.data != raster.nodata
+        heights[~valid] = heights[valid].min() if valid.any() else 0
+    grid = np.pad(heights, ((0, size - lines), (0, size - samples)), mode='edge')
+    errors = compute_errors(grid, samples, lines)
+    triangles = extract(errors, max_error, samples, lines)
+    keys = triangles[:, :, 1] * size + triangles[:, :, 0]
+    unique, indices = np.unique(keys.ravel(), return_inverse=True)
+    vertices = np.empty(len(unique), dtype=VERTEX_DTYPE)
+    vertices['column'] = unique % size
+    vertices['row'] = unique // size
+    vertices['height'] = grid[vertices['row'], vertices['column']]
+    return TerrainMesh(vertices, indices.astype(np.uint32))
@@ -0,0 +1,82 @@
+"""
+Runs the stages of a build as a graph instead of one after another.
+
+Each stage runs one action of a pipeline (height, OSM or satellite) and declares the artifacts it
+reads and writes. A stage starts once every stage writing its inputs is done, so the stages of
+different pipelines run side by side in a pool of worker threads, and a build takes about as long
+as its longest pipeline. The actions mostly wait on GDAL, numpy, zlib and subprocesses, all of
+which release the GIL.
+
+A stage also names the resources it holds while it runs, and doesn't start while another running
+stage holds one of them. The stages of a pipeline all hold the pipeline, as they share its build
+status. Among the stages that can start, the one declared first starts first.
+
+A failing stage doesn't stop the build: its exception is returned, and the stages reading its
+outputs still run, as they did when the pipelines ran one action after another.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+DEFAULT_WORKERS = 3
+
+class Stage:
+    def __init__(self, name, run, inputs = (), outputs = (), holds = ()):
+        """run is called without arguments. inputs and outputs are artifact names, holds are resource names."""
+        self.name = name
+        self.run = run
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.holds = tuple(holds)
+
+    def __repr__(self):
+        return 'Stage({})'.format(self.name)
+
+def dependencies(stages):
+    """
+    Returns the indices of the stages each stage waits for, as a list of sets.
+    Inputs that no stage writes, such as the source files, are there from the start.
+    Raises ValueError if two stages write the same artifact or the stages wait for each other in a cycle.
+    """
+    writers = {}
+    for index, stage in enumerate(stages):
+        for artifact in stage.outputs:
+            if artifact in writers:
+                raise ValueError('Both {} and {} write {}'.format(stages[writers[artifact]].name, stage.name, artifact))
+            writers[artifact] = index
+    waits = [set(writers[a] for a in stage.inputs if a in writers) for stage in stages]
+    ordered = set()
+    while len(ordered) < len(stages):
+        ready = [i for i in range(len(stages)) if i not in ordered and waits[i] <= ordered]
+        if not ready:
+            raise ValueError('Stages wait for each other: {}'.format(
+                ', '.join(stages[i].name for i in range(len(stages)) if i not in ordered)
+            ))
+        ordered.update(ready)
+    return waits
+
+def run_stages(stages, workers = DEFAULT_WORKERS, on_done = None):
+    """
+    Runs the stages, up to workers at a time. on_done, if given, is called with each stage as it
+    finishes, in the calling thread. Returns a list of (stage, exception) of the stages that failed.
+    """
+    waits = dependencies(stages)
+    workers = max(1, workers)
+    done = set()
+    running = {} # Future -> index of its stage
+    failures = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while len(done) < len(stages):
+            held = set(resource for index in running.values() for resource in stages[index].holds)
+            for index, stage in enumerate(stages):
+                if len(running) >= workers: break
+                if index in done or index in running.values(): continue
+                if not waits[index] <= done or held.intersection(stage.holds): continue
+                running[executor.submit(stage.run)] = index
+                held.update(stage.holds)
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index = running.pop(future)
+                done.add(index)
+                if future.exception() is not None:
+                    failures.append((stages[index], future.exception()))
+                if on_done: on_done(stages[index])
+    return failures
@@ -0,0 +1,119 @@
+"""
+Surface normals, hillshading and sky-view factors of final height grids.
+
+Height files are in EPSG:3857, where a cell covers cellsize * cos(latitude) meters on the ground in
+both directions, so the slopes are computed with finite differences over that ground distance.
+Normals are unit vectors (east, north, up), packed into 8-bit RGB as round((n + 1) / 2 * 255) per
+component, so that a flat cell is (128, 128, 255). Nodata cells and their neighbours are left flat.
+"""
+import math
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from mapcreator.mercator import mercator_to_lonlat, scale_factor
+
+DEFAULT_AZIMUTH = 315.0 # Light from the north-west, as in gdaldem hillshade
+DEFAULT_ALTITUDE = 45.0
+DEFAULT_SKY_VIEW_DIRECTIONS = 16
+DEFAULT_SKY_VIEW_RADIUS = 1000.0 # Meters
+# Rows of the grid each sky-view job computes
+SKY_VIEW_BAND_LINES = 128
+
+def ground_spacing(raster):
+    """Returns the ground distance in meters covered by a cell on each row of a EPSG:3857 raster."""
+    ulx, pixel_width, uly, pixel_height = raster.get_geotransform()
+    _, lats = mercator_to_lonlat(0, uly - (np.arange(raster.lines) + 0.5) * pixel_height)
+    return pixel_width * scale_factor(np.atleast_1d(lats))
+
+def normals(raster, exaggeration = 1.0):
+    """
+    Returns the unit surface normals of a EPSG:3857 height raster as an array of shape (lines, samples, 3),
+    heights being multiplied by exaggeration.
+    """
+    heights = raster.data.astype(np.float64) * exaggeration
+    if raster.nodata is not None:
+        heights[raster.data == raster.nodata] = np.nan
+    spacing = ground_spacing(raster)[:, None]
+    if min(heights.shape) < 2:
+        east = north = np.zeros(heights.shape)
+    else:
+        # Central differences inside the grid, one-sided ones on its edges. Rows run southwards.
+        east = np.gradient(heights, axis=1) / spacing
+        north = -np.gradient(heights, axis=0) / spacing
+    unknown = np.isnan(east) | np.isnan(north) | np.isnan(heights)
+    east[unknown] = 0
+    north[unknown] = 0
+    result = np.dstack([-east, -north, np.ones(heights.shape)])
+    return result / np.sqrt(np.sum(result ** 2, axis=2))[:, :, None]
+
+def encode_normals(normal_vectors):
+    """Packs unit normals into an 8-bit RGB array."""
+    return np.round((normal_vectors + 1) / 2 * 255).astype(np.uint8)
+
+def decode_normals(rgb):
+    return rgb.astype(np.float64) / 255 * 2 - 1
+
+def hillshade(normal_vectors, azimuth = DEFAULT_AZIMUTH, altitude = DEFAULT_ALTITUDE):
+    """
+    Returns an 8-bit grayscale hillshade of the normals, lit from azimuth (degrees clockwise from north)
+    at altitude (degrees above the horizon). Cells facing away from the light are black.
+    """
+    azimuth, altitude = np.radians(azimuth), np.radians(altitude)
+    light = np.array([np.sin(azimuth) * np.cos(altitude), np.cos(azimuth) * np.cos(altitude), np.sin(altitude)])
+    return np.round(np.clip(normal_vectors.dot(light), 0, 1) * 255).astype(np.uint8)
+
+def sky_view_band(padded, spacing, margin, directions, steps):
+    """
+    Computes the sky-view factor of the cells in the middle of padded, which has margin cells of
+    NaN-padded neighbours on every side. spacing is the ground size of a cell on each middle row.
+    Runs in worker threads, so it only reads its arguments.
+    """
+    lines, samples = padded.shape[0] - 2 * margin, padded.shape[1] - 2 * margin
+    center = padded[margin:margin + lines, margin:margin + samples]
+    occlusion = np.zeros((lines, samples))
+    for direction in range(directions):
+        angle = 2 * math.pi * direction / directions
+        # The steepest slope to any cell along the direction, never below the horizontal
+        horizon = np.zeros((lines, samples))
+        previous = None
+        for step in range(1, steps + 1):
+            dx = int(round(step * math.sin(angle)))
+            dy = -int(round(step * math.cos(angle))) # Rows run southwards
+            if (dx, dy) == previous: continue
+            previous = (dx, dy)
+            other = padded[margin + dy:margin + dy + lines, margin + dx:margin + dx + samples]
+            horizon = np.fmax(horizon, (other - center) / (math.hypot(dx, dy) * spacing[:, None]))
+        occlusion += np.sin(np.arctan(horizon))
+    return 1 - occlusion / directions
+
+def sky_view_factor(raster, directions = DEFAULT_SKY_VIEW_DIRECTIONS, radius = DEFAULT_SKY_VIEW_RADIUS, workers = 1):
+    """
+    Returns the sky-view factor of every cell of a EPSG:3857 height raster: the share of the sky
+    hemisphere not hidden by terrain within radius meters, from 0 (fully occluded) to 1 (open).
+    The horizon is scanned in the given number of directions, one cell at a time. The grid is split
+    into bands of rows, which are computed in a pool of worker threads if workers is more than one:
+    numpy releases the GIL while it works on whole rows, and the build runs GDAL in other threads,
+    which makes forking worker processes unsafe.
+    Nodata cells, and the terrain beyond the edges of the grid, don't occlude anything.
+    """
+    heights = raster.data.astype(np.float64)
+    if raster.nodata is not None:
+        heights[raster.data == raster.nodata] = np.nan
+    spacing = ground_spacing(raster)
+    steps = max(1, int(math.ceil(radius / float(np.min(spacing)))))
+    padded = np.pad(heights, steps, mode='constant', constant_values=np.nan)
+    jobs = []
+    for first in range(0, raster.lines, SKY_VIEW_BAND_LINES):
+        last = min(first + SKY_VIEW_BAND_LINES, raster.lines)
+        jobs.append((padded[first:last + 2 * steps], spacing[first:last], steps, directions, steps))
+    if workers > 1 and len(jobs) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            bands = list(executor.map(sky_view_band, *zip(*jobs)))
+    else:
+        bands = [sky_view_band(*job) for job in jobs]
+    result = np.vstack(bands)
+    result[np.isnan(heights)] = 1
+    return result
+
+def encode_sky_view(factors):
+    """Scales sky-view factors into an 8-bit grayscale array, 255 being open sky."""
+    return np.round(np.clip(factors, 0, 1) * 255).astype(np.uint8)
@@ -0,0 +1,99 @@
+"""
+A persistent spatial index of the WGS84 footprints of source rasters.
+
+With large catalogs, a build can pick the sources intersecting the window from the index
+without opening or probing the rest. Footprints are only trusted as long as the file's size
+and modification time stay the same; unknown or changed files have to be probed again.
+"""
+import json
+import math
+from os import path, makedirs
+from mapcreator.gdal_util import GdalinfoCache
+
+# Size of the grid cells footprints are bucketed into, in degrees
+CELL_SIZE = 1.0
+
+class SourceIndex:
+
+    def __init__(self, indexpath):
+        self.indexpath = indexpath
+        self.entries = {}
+        self.cells = {}
+        self.changed = False
+
+    @classmethod
+    def load(cls, indexpath):
+        index = SourceIndex(indexpath)
+        if path.exists(indexpath):
+            try:
+                with open(indexpath, 'r') as infile:
+                    entries = json.load(infile)
+            except ValueError:
+                entries = {} # A corrupted index is simply rebuilt
+            for key, entry in entries.items():
+                index.entries[key] = entry
+                index.add_to_cells(key, entry['bounds'])
+        return index
+
+    @classmethod
+    def cells_for_bounds(cls, bounds):
+        minx, miny, maxx, maxy = bounds
+        for i in range(int(math.floor(minx / CELL_SIZE)), int(math.floor(maxx / CELL_SIZE)) + 1):
+            for j in range(int(math.floor(miny / CELL_SIZE)), int(math.floor(maxy / CELL_SIZE)) + 1):
+                yield (i, j)
+
+    def add_to_cells(self, key, bounds):
+        for cell in SourceIndex.cells_for_bounds(bounds):
+            self.cells.setdefault(cell, set()).add(key)
+
+    def remove_from_cells(self, key, bounds):
+        for cell in SourceIndex.cells_for_bounds(bounds):
+            self.cells.get(cell, set()).discard(key)
+
+    def add(self, fpath, gdal_info):
+        """Adds or updates the footprint of a file from its Gdalinfo."""
+        key = path.abspath(fpath)
+        fingerprint = GdalinfoCache.fingerprint(key)
+        if fingerprint is None: return
+        if key in self.entries:
+            self.remove_from_cells(key, self.entries[key]['bounds'])
+        bounds = [gdal_info.minX, gdal_info.minY, gdal_info.maxX, gdal_info.maxY]
+        self.entries[key] = {'fingerprint': fingerprint, 'bounds': bounds}
+        self.add_to_cells(key, bounds)
+        self.changed = True
+
+    def contains(self, fpath):
+        """Returns True if the index has an up to date footprint of the file."""
+        key = path.abspath(fpath)
+        entry = self.entries.get(key)
+        return entry is not None and entry['fingerprint'] == GdalinfoCache.fingerprint(key)
+
+    def query(self, bounds):
+        """Returns the absolute paths of the indexed files whose footprints intersect bounds (minx, miny, maxx, maxy)."""
+        minx, miny, maxx, maxy = bounds
+        candidates = set()
+        for cell in SourceIndex.cells_for_bounds(bounds):
+            candidates.update(self.cells.get(cell, ()))
+        result = set()
+        for key in candidates:
+            fminx, fminy, fmaxx, fmaxy = self.entries[key]['bounds']
+            if fminx < maxx and minx < fmaxx and fminy < maxy and miny < fmaxy:
+                result.add(key)
+        return result
+
+    def select(self, fpaths, bounds):
+        """
+        Returns the files that may intersect bounds, in the given order: those whose up to date
+        footprint intersects it, and those that aren't indexed (or have changed) and need a probe.
+        """
+        intersecting = self.query(bounds)
+        return [f for f in fpaths if path.abspath(f) in intersecting or not self.contains(f)]
+
+    def save(self):
+        if not self.changed: return
+        directory = path.dirname(self.indexpath)
+        if directory and not path.exists(directory):
+            makedirs(directory)
+        with open(self.indexpath, 'w') as outfile:
+            json.dump(self.entries, outfile)
+        self.changed = False
@@ -1,5 +1,8 @@
 from os import path
 
+DEFAULT_PROBE_THREADS = 8
+DEFAULT_BUILD_WORKERS = 3
+
 # Makeshift enum, as enums were introduced only in 3.4 and are reasonably usable from 3.6 onwards
 class FileAddResult:
     SUCCESS = 'SUCCESS'
@@ -25,33 +28,58 @@ class State:
     def has_satellite_files(self):
         return hasattr(self, 'satellite_files') and len(self.satellite_files) > 0
     
-    def add_height_file(self, fpath):
-        return State.add_file(fpath, self.height_files)
+    def add_height_file(self, fpath, fset = None):
+        return State.add_file(fpath, self.height_files, fset)
     
     def clear_height_files(self):
         self.height_files = []
 
-    def add_osm_file(self, fpath):
-        return State.add_file(fpath, self.osm_files)
+    def add_osm_file(self, fpath, fset = None):
+        return State.add_file(fpath, self.osm_files, fset)
     
     def clear_osm_files(self):
         self.osm_files = []
 
-    def add_satellite_file(self, fpath):
-        return State.add_file(fpath, self.satellite_files)
+    def add_satellite_file(self, fpath, fset = None):
+        return State.add_file(fpath, self.satellite_files, fset)
     
     def clear_satellite_files(self):
         self.satellite_files = []
 
+    def set_optimized_satellite_file(self, fpath, copy):
+        """
+        Records an optimized copy of the satellite file fpath: a dict with the 'path' of the copy, the
+        'fingerprint' of fpath when it was written, the 'pixel_size' of fpath in EPSG:3857 meters and
+        the reduction factors of the copy's 'overviews'.
+        """
+        if not hasattr(self, 'optimized_satellite_files'):
+            self.optimized_satellite_files = {}
+        self.optimized_satellite_files[fpath] = copy
+
+    def has_optimized_satellite_files(self):
+        return hasattr(self, 'optimized_satellite_files') and len(self.optimized_satellite_files) > 0
+
+    def get_optimized_satellite_file(self, fpath):
+        """Returns the record of the optimized copy of fpath, or None if it has none."""
+        return getattr(self, 'optimized_satellite_files', {}).get(fpath)
+
+    def clear_optimized_satellite_files(self):
+        self.optimized_satellite_files = {}
+
     @classmethod
-    def add_file(cls, fpath, flist):
+    def add_file(cls, fpath, flist, fset = None):
+        """
+        Adds the absolute path of fpath to flist. fset, if given, is a set of the paths in flist to
+        look duplicates up in, which is kept up to date; adding many files shares one set.
+        """
         truepath = path.abspath(fpath)
         if not path.exists(truepath):
             return FileAddResult.DOESNT_EXIST
-        if truepath in flist:
+        if truepath in (flist if fset is None else fset):
             return FileAddResult.ALREADY_ADDED
         else:
             flist.append(truepath)
+            if fset is not None: fset.add(truepath)
             return FileAddResult.SUCCESS
     
     def has_area_colors(self):
@@ -86,9 +114,14 @@ class State:
         if not self.has_window(): return ''
         return '{0[0]} {0[1]} {1[0]} {1[1]}'.format(self.get_window_upper_left(), self.get_window_lower_right())
     
+    def get_window_lowerleft_topright(self):
+        if not self.has_window(): return None
+        (ulx, uly), (lrx, lry) = self.get_window_upper_left(), self.get_window_lower_right()
+        return (ulx, lry, lrx, uly)
+
     def get_window_string_lowerleft_topright(self):
         if not self.has_window(): return ''
-        return '{0[0]} {1[1]} {1[0]} {0[1]}'.format(self.get_window_upper_left(), self.get_window_lower_right())
+        return '{} {} {} {}'.format(*self.get_window_lowerleft_topright())
 
     def get_window_string_lowerleft_topright_cut(self, gdal_info):
         if not self.has_window(): return ''
@@ -127,6 +160,263 @@ class State:
     def set_satellite_resolution(self, satellite_resolution):
         self.satellite_resolution = satellite_resolution
 
+    def set_probe_threads(self, probe_threads):
+        self.probe_threads = probe_threads
+
+    def get_probe_threads(self):
+        return getattr(self, 'probe_threads', DEFAULT_PROBE_THREADS)
+
+    def set_build_workers(self, build_workers):
+        self.build_workers = build_workers
+
+    def get_build_workers(self):
+        return getattr(self, 'build_workers', DEFAULT_BUILD_WORKERS)
+
+    def set_build_share(self, pipelines):
+        # How many pipelines are being built at once, splitting the host between them. Not persisted.
+        self._build_share = pipelines
+
+    def get_build_share(self):
+        return getattr(self, '_build_share', 1)
+
+    def set_vector_tile_zooms(self, min_zoom, max_zoom):
+        self.vector_tile_zooms = [min_zoom, max_zoom]
+
+    def has_vector_tiles(self):
+        return hasattr(self, 'vector_tile_zooms') and len(self.vector_tile_zooms) > 0
+
+    def clear_vector_tiles(self):
+        self.vector_tile_zooms = []
+
+    def set_height_tiles(self, columns, rows):
+        self.height_tiles = [columns, rows]
+
+    def has_height_tiles(self):
+        return hasattr(self, 'height_tiles') and len(self.height_tiles) > 0
+
+    def get_height_tiles(self):
+        if not self.has_height_tiles(): return (1, 1)
+        return tuple(self.height_tiles)
+
+    def clear_height_tiles(self):
+        self.height_tiles = []
+
+    def set_height_lods(self, levels, reduction):
+        self.height_lods = {
+            'levels': levels,
+            'reduction': reduction,
+        }
+
+    def has_height_lods(self):
+        return hasattr(self, 'height_lods') and len(self.height_lods) > 0
+
+    def get_height_lods(self):
+        if not self.has_height_lods(): return None
+        return (self.height_lods['levels'], self.height_lods['reduction'])
+
+    def clear_height_lods(self):
+        self.height_lods = {}
+
+    def set_height_encoding(self, encoding, max_error):
+        self.height_encoding = {
+            'encoding': encoding,
+            'max_error': max_error,
+        }
+
+    def has_height_encoding(self):
+        return hasattr(self, 'height_encoding') and len(self.height_encoding) > 0
+
+    def get_height_encoding(self):
+        """Returns (encoding, maximum vertical error in meters or None). Raw float32 by default."""
+        if not self.has_height_encoding(): return ('float32', None)
+        return (self.height_encoding['encoding'], self.height_encoding['max_error'])
+
+    def clear_height_encoding(self):
+        self.height_encoding = {}
+
+    def set_satellite_encoding(self, codec, quality):
+        self.satellite_encoding = {
+            'codec': codec,
+            'quality': quality,
+        }
+
+    def has_satellite_encoding(self):
+        return hasattr(self, 'satellite_encoding') and len(self.satellite_encoding) > 0
+
+    def get_satellite_encoding(self):
+        """Returns (codec, quality or None for the codec's default). PNG by default."""
+        if not self.has_satellite_encoding(): return ('png', None)
+        return (self.satellite_encoding['codec'], self.satellite_encoding['quality'])
+
+    def clear_satellite_encoding(self):
+        self.satellite_encoding = {}
+
+    def set_satellite_mipmaps(self, image_filter):
+        self.satellite_mipmaps = {'filter': image_filter}
+
+    def has_satellite_mipmaps(self):
+        return hasattr(self, 'satellite_mipmaps') and len(self.satellite_mipmaps) > 0
+
+    def get_satellite_mipmaps(self):
+        """Returns the filter the mip levels are downsampled with."""
+        return self.satellite_mipmaps['filter']
+
+    def clear_satellite_mipmaps(self):
+        self.satellite_mipmaps = {}
+
+    def set_satellite_palette(self, colors, method, dither):
+        self.satellite_palette = {
+            'colors': colors,
+            'method': method,
+            'dither': dither,
+        }
+
+    def has_satellite_palette(self):
+        return hasattr(self, 'satellite_palette') and len(self.satellite_palette) > 0
+
+    def get_satellite_palette(self):
+        """Returns (number of colors, quantization method, whether to dither) of the palette."""
+        return (self.satellite_palette['colors'], self.satellite_palette['method'], self.satellite_palette['dither'])
+
+    def clear_satellite_palette(self):
+        self.satellite_palette = {}
+
+    def set_satellite_texture(self, texture_format):
+        self.satellite_texture = {'format': texture_format}
+
+    def has_satellite_texture(self):
+        return hasattr(self, 'satellite_texture') and len(self.satellite_texture) > 0
+
+    def get_satellite_texture(self):
+        """Returns the block-compressed GPU format of the satellite textures."""
+        return self.satellite_texture['format']
+
+    def clear_satellite_texture(self):
+        self.satellite_texture = {}
+
+    def set_normal_map(self, exaggeration):
+        self.normal_map = {'exaggeration': exaggeration}
+
+    def has_normal_map(self):
+        return hasattr(self, 'normal_map') and len(self.normal_map) > 0
+
+    def get_normal_map(self):
+        """Returns the vertical exaggeration the normals are computed with."""
+        return self.normal_map['exaggeration']
+
+    def clear_normal_map(self):
+        self.normal_map = {}
+
+    def set_hillshade(self, azimuth, altitude):
+        self.hillshade = {
+            'azimuth': azimuth,
+            'altitude': altitude,
+        }
+
+    def has_hillshade(self):
+        return hasattr(self, 'hillshade') and len(self.hillshade) > 0
+
+    def get_hillshade(self):
+        """Returns (azimuth, altitude) of the light in degrees."""
+        return (self.hillshade['azimuth'], self.hillshade['altitude'])
+
+    def clear_hillshade(self):
+        self.hillshade = {}
+
+    def set_sky_view(self, directions, radius):
+        self.sky_view = {
+            'directions': directions,
+            'radius': radius,
+        }
+
+    def has_sky_view(self):
+        return hasattr(self, 'sky_view') and len(self.sky_view) > 0
+
+    def get_sky_view(self):
+        """Returns (number of directions, radius in meters) of the horizon scan."""
+        return (self.sky_view['directions'], self.sky_view['radius'])
+
+    def clear_sky_view(self):
+        self.sky_view = {}
+
+    def set_terrain_mesh(self, max_error):
+        self.terrain_mesh = {'max_error': max_error}
+
+    def has_terrain_mesh(self):
+        return hasattr(self, 'terrain_mesh') and len(self.terrain_mesh) > 0
+
+    def get_terrain_mesh(self):
+        """Returns the maximum vertical error of the mesh in meters."""
+        return self.terrain_mesh['max_error']
+
+    def clear_terrain_mesh(self):
+        self.terrain_mesh = {}
+
+    def set_contours(self, interval, tolerance):
+        self.contours = {
+            'interval': interval,
+            'tolerance': tolerance,
+        }
+
+    def has_contours(self):
+        return hasattr(self, 'contours') and len(self.contours) > 0
+
+    def get_contours(self):
+        """Returns (interval in meters, simplification tolerance in cells) of the contour lines."""
+        return (self.contours['interval'], self.contours['tolerance'])
+
+    def clear_contours(self):
+        self.contours = {}
+
+    def set_height_engine(self, engine):
+        self.height_engine = engine
+
+    def has_height_engine(self):
+        return hasattr(self, 'height_engine') and len(self.height_engine) > 0
+
+    def get_height_engine(self):
+        """
+        Returns 'gdal' (the default), 'numpy' or 'auto', which uses the built-in engine whenever it can.
+        The built-in engine writes its own ENVI headers, so projects opt in to it.
+        """
+        return self.height_engine if self.has_height_engine() else 'gdal'
+
+    def clear_height_engine(self):
+        self.height_engine = ''
+
+    def set_resource_budget(self, threads, memory):
+        """Caps the threads and memory (in megabytes) GDAL may use. None means no cap."""
+        self.resource_budget = {
+            'threads': threads,
+            'memory': memory,
+        }
+
+    def has_resource_budget(self):
+        return hasattr(self, 'resource_budget') and len(self.resource_budget) > 0
+
+    def get_resource_budget(self):
+        if not self.has_resource_budget(): return (None, None)
+        return (self.resource_budget['threads'], self.resource_budget['memory'])
+
+    def clear_resource_budget(self):
+        self.resource_budget = {}
+
+    def set_tile_cache(self, directory, max_mb):
+        """Shares reprojected sources through the cache in directory, kept under max_mb megabytes."""
+        self.tile_cache = {
+            'directory': directory,
+            'max_mb': max_mb,
+        }
+
+    def has_tile_cache(self):
+        return hasattr(self, 'tile_cache') and len(self.tile_cache) > 0
+
+    def get_tile_cache(self):
+        return (self.tile_cache['directory'], self.tile_cache['max_mb'])
+
+    def clear_tile_cache(self):
+        self.tile_cache = {}
+
     @classmethod
     def from_dict(cls, d):
         new_state = State()
@@ -134,7 +424,8 @@ class State:
         return new_state
     
     def to_dict(self):
-        return self.__dict__
+        # Attributes starting with an underscore are caches that aren't persisted
+        return dict((key, value) for key, value in self.__dict__.items() if not key.startswith('_'))
     
     @classmethod
     def file_list_to_lines(cls, flist):
@@ -160,6 +451,8 @@ class State:
             lines.extend(State.file_list_to_lines(self.satellite_files))
         else:
             lines.append('-No satellite/aerial files added')
+        if self.has_optimized_satellite_files():
+            lines.append('-Optimized satellite/aerial files: {}'.format(len(self.optimized_satellite_files)))
         if self.has_window():
             lines.append('-Window:')
             lines.append('--Upper left corner:  x={0[0]}, y={0[1]}'.format(self.get_window_upper_left()))
@@ -168,10 +461,54 @@ class State:
             lines.append('-No projection window set')
         lines.append('-Height file output resolution: {} m'.format(self.height_resolution))
         lines.append('-Satellite/aerial image output resolution: {} m'.format(self.satellite_resolution))
+        if self.has_height_tiles():
+            lines.append('-Height files are built in {0[0]}x{0[1]} tiles'.format(self.height_tiles))
+        if self.has_height_encoding():
+            encoding, max_error = self.get_height_encoding()
+            lines.append('-Height file encoding: {}{}'.format(
+                encoding, ' (max error {} m)'.format(max_error) if max_error is not None else ''
+            ))
+        if self.has_satellite_encoding():
+            codec, quality = self.get_satellite_encoding()
+            lines.append('-Satellite/aerial image encoding: {}{}'.format(
+                codec, ' (quality {})'.format(quality) if quality is not None else ''
+            ))
+        if self.has_satellite_mipmaps():
+            lines.append('-Satellite/aerial image mipmaps: {} filter'.format(self.get_satellite_mipmaps()))
+        if self.has_satellite_palette():
+            colors, method, dither = self.get_satellite_palette()
+            lines.append('-Satellite/aerial image palette: {} colors ({}{})'.format(colors, method, ', dithered' if dither else ''))
+        if self.has_satellite_texture():
+            lines.append('-Satellite/aerial GPU texture: {} in KTX'.format(self.get_satellite_texture()))
+        if self.has_normal_map():
+            lines.append('-Normal map: vertical exaggeration {}'.format(self.get_normal_map()))
+        if self.has_hillshade():
+            lines.append('-Hillshade: light from azimuth {} at altitude {}'.format(*self.get_hillshade()))
+        if self.has_sky_view():
+            lines.append('-Sky-view factor: {} directions within {} m'.format(*self.get_sky_view()))
+        if self.has_terrain_mesh():
+            lines.append('-Terrain mesh: max error {} m'.format(self.get_terrain_mesh()))
+        if self.has_contours():
+            lines.append('-Contour lines: every {} m, simplified within {} cells'.format(*self.get_contours()))
+        if self.has_height_engine():
+            lines.append('-Height resampling engine: {}'.format(self.get_height_engine()))
+        if self.has_height_lods():
+            lines.append('-Height file detail levels: {} ({} reduction)'.format(*self.get_height_lods()))
+        lines.append('-Source file probing threads: {}'.format(self.get_probe_threads()))
+        lines.append('-Build stages run at once: {}'.format(self.get_build_workers()))
         if self.has_height_system():
             lines.append('-Forced source height file coordinate system: {}'.format(self.height_coordinatesystem))
         if self.has_satellite_system():
             lines.append('-Forced source satellite/aerial file coordinate system: {}'.format(self.satellite_coordinatesystem))        
+        if self.has_vector_tiles():
+            lines.append('-Vector tiles: zoom levels {0[0]}-{0[1]}'.format(self.vector_tile_zooms))
+        if self.has_resource_budget():
+            threads, memory = self.get_resource_budget()
+            lines.append('-Resource budget: {} threads, {} memory'.format(
+                threads or 'unlimited', '{} MB'.format(memory) if memory else 'unlimited'
+            ))
+        if self.has_tile_cache():
+            lines.append('-Reprojected tile cache: {} (up to {} MB)'.format(*self.get_tile_cache()))
         if self.has_area_colors():
             if len(self.area_colors) > 5:
                 lines.append('-There are {} area colors set'.format(len(self.area_colors)))
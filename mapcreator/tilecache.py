@@ -0,0 +1,156 @@
+"""
+A cache of source rasters already reprojected to EPSG:3857, shared by all the projects of a user.
+
+Projects with different windows over the same sources would otherwise each warp the same source
+pixels. Instead, every source is reprojected whole onto a grid aligned on multiples of the cell
+size, so that the result serves any window, and the window is cut from the cached copies.
+
+Entries are keyed by the source's path, size and modification time and by the warp parameters.
+They are written to a temporary file that is renamed into place, so readers only ever see complete
+files, even with several builds sharing the cache. Using an entry updates its modification time,
+which is what the least recently used entries are evicted by once the cache outgrows its size cap.
+Builds read entries through hard links (or copies) of their own, which another build evicting the
+entries doesn't remove.
+"""
+import json
+import hashlib
+import shutil
+import time
+import uuid
+from os import path, link, makedirs, remove, replace, stat, utime, walk
+from mapcreator.gdal_util import GdalinfoCache
+
+DEFAULT_DIRECTORY = path.join(path.expanduser('~'), '.mapcreator', 'tile_cache')
+DEFAULT_MAX_MB = 4096
+RESAMPLING = 'bilinear'
+# Entries have an alpha band masking the pixels outside the source's footprint
+ALPHA = True
+TILE_EXTENSION = 'tif'
+TEMP_EXTENSION = 'tmp'
+# Temporary files this old are left over from builds that were interrupted
+STALE_TEMP_SECONDS = 24 * 60 * 60
+
+class TileCache:
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, sourcepath, cellsize, source_system, target_system, overview_level = None):
+        """
+        Returns the key of a reprojection of sourcepath, warped from the gdalwarp -ovr overview_level
+        if given, or None if the file can't be fingerprinted.
+        """
+        sourcepath = path.abspath(sourcepath)
+        fingerprint = GdalinfoCache.fingerprint(sourcepath)
+        if fingerprint is None: return None
+        parameters = [sourcepath, fingerprint, cellsize, RESAMPLING, source_system, target_system, overview_level, ALPHA]
+        return hashlib.sha1(json.dumps(parameters).encode('utf-8')).hexdigest()
+
+    def tile_path(self, key):
+        # Entries are spread over subdirectories, so that no directory gets too large
+        return path.join(self.directory, key[:2], '{}.{}'.format(key, TILE_EXTENSION))
+
+    def get(self, key):
+        """Returns the path of the entry, marking it used, or None if it isn't cached."""
+        tilepath = self.tile_path(key)
+        try:
+            utime(tilepath)
+        except OSError:
+            return None
+        return tilepath
+
+    def put(self, key, write):
+        """
+        Creates the entry by calling write with the path of a temporary file to write it to.
+        Returns the path of the entry, or None if write didn't create the file.
+        """
+        tilepath = self.tile_path(key)
+        directory = path.dirname(tilepath)
+        if not path.exists(directory):
+            makedirs(directory, exist_ok=True)
+        temppath = '{}.{}.{}'.format(tilepath, uuid.uuid4().hex, TEMP_EXTENSION)
+        write(temppath)
+        if not path.exists(temppath):
+            return None
+        # Another build may have created the same entry meanwhile, which is simply replaced
+        replace(temppath, tilepath)
+        return tilepath
+
+    def get_or_put(self, key, write):
+        """Returns (path of the entry or None, whether it was cached already)."""
+        tilepath = self.get(key)
+        if tilepath is not None:
+            return tilepath, True
+        return self.put(key, write), False
+
+    def pull(self, key, write, outpath):
+        """
+        Links the entry to outpath, creating it with write (see put) if it isn't cached. The build
+        reads outpath, which evicting the entry doesn't remove. Returns (whether outpath was written,
+        whether the entry was cached already).
+        """
+        tilepath = self.get(key)
+        if tilepath is not None and TileCache.link(tilepath, outpath):
+            return True, True
+        tilepath = self.put(key, write)
+        return tilepath is not None and TileCache.link(tilepath, outpath), False
+
+    @classmethod
+    def link(cls, tilepath, outpath):
+        """Hard-links tilepath to outpath, or copies it where links aren't supported. Returns whether outpath was written."""
+        TileCache.discard(outpath)
+        try:
+            link(tilepath, outpath)
+            return True
+        except OSError:
+            pass
+        try:
+            shutil.copyfile(tilepath, outpath)
+            return True
+        except OSError:
+            return False # Evicted by another build
+
+    def entries(self):
+        """Returns (last use, size, path) of every entry."""
+        result = []
+        for dirpath, dirnames, filenames in walk(self.directory):
+            for filename in filenames:
+                fpath = path.join(dirpath, filename)
+                try:
+                    st = stat(fpath)
+                except OSError:
+                    continue # Evicted by another build
+                if filename.endswith('.' + TILE_EXTENSION):
+                    result.append((st.st_mtime, st.st_size, fpath))
+                elif filename.endswith('.' + TEMP_EXTENSION) and time.time() - st.st_mtime > STALE_TEMP_SECONDS:
+                    TileCache.discard(fpath)
+        return result
+
+    def size(self):
+        return sum(size for last_use, size, fpath in self.entries())
+
+    def evict(self, keep = ()):
+        """
+        Removes the least recently used entries until the cache fits its size cap, never removing
+        the paths in keep. Returns the paths of the removed entries.
+        """
+        entries = sorted(self.entries())
+        total = sum(size for last_use, size, fpath in entries)
+        keep = set(path.abspath(k) for k in keep)
+        removed = []
+        for last_use, size, fpath in entries:
+            if total <= self.max_bytes: break
+            if path.abspath(fpath) in keep: continue
+            if TileCache.discard(fpath):
+                removed.append(fpath)
+            total -= size
+        return removed
+
+    @classmethod
+    def discard(cls, fpath):
+        try:
+            remove(fpath)
+            return True
+        except OSError:
+            return False # Already removed by another build
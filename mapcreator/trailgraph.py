@@ -0,0 +1,222 @@
+"""
+Extraction of a routable trail network from OSM data.
+
+The graph contains only junction nodes (way end points and nodes shared by several ways
+or visited several times by one way). The ways between junctions become edges that carry
+their length and, if a heightmap is available, the ascent and descent along them.
+
+The graph is saved in a compact little-endian binary format:
+
+    Header
+      4s      magic b'3DTG'
+      uint16  format version (1)
+      uint16  flags (bit 0: elevation data present)
+      uint32  node count N
+      uint32  edge count E
+    Nodes
+      int64[N]    OSM node ids
+      float64[N]  longitudes
+      float64[N]  latitudes
+      float32[N]  elevations in meters (NaN if unknown)
+    Adjacency in CSR form (every edge is listed for both of its end nodes)
+      uint32[N+1] row offsets
+      uint32[2E]  neighbour node indices
+      uint32[2E]  edge indices
+    Edges
+      uint32[E]   start node indices
+      uint32[E]   end node indices
+      int64[E]    OSM way ids
+      float32[E]  lengths in meters
+      float32[E]  ascent in meters when going from start to end node
+      float32[E]  descent in meters when going from start to end node
+"""
+import struct
+import numpy as np
+from mapcreator.osm import OSMData
+from mapcreator.mercator import lonlat_to_mercator, haversine_distance
+
+MAGIC = b'3DTG'
+FORMAT_VERSION = 1
+HEADER_FORMAT = '<4sHHII'
+FLAG_ELEVATION = 1
+
+class TrailGraph:
+
+    def __init__(self):
+        self.node_ids = []
+        self.node_lons = []
+        self.node_lats = []
+        self.node_elevations = []
+        self.edge_from = []
+        self.edge_to = []
+        self.edge_way_ids = []
+        self.edge_lengths = []
+        self.edge_ascents = []
+        self.edge_descents = []
+        self.has_elevation = False
+        self.node_index = {}
+
+    @classmethod
+    def from_osmdata(cls, osmdatas, way_filters = (), heightmap = None):
+        """
+        Builds a graph from the ways of the given OSMData instances that are included
+        and pass all given way filters (functions of form f(elem, osmdata), like in OSMData).
+        heightmap is an optional EnviRaster in EPSG:3857 used to compute elevation gain, or a list of
+        them, such as the height tiles of a build. Each node is sampled from the first one covering it.
+        """
+        graph = TrailGraph()
+        nodes = {}
+        ways = []
+        for data in osmdatas:
+            nodes.update(data.nodes)
+            for wayid in sorted(data.included_ways):
+                way = data.ways[wayid]
+                if all(f(way, data) for f in way_filters):
+                    ways.append((wayid, way))
+        way_refs = []
+        for wayid, way in ways:
+            refs = []
+            for nd in way.iter(OSMData.TAG_WAY_NODE):
+                ref = int(nd.get(OSMData.ATTRIB_REF))
+                if ref not in nodes: continue # Skip references to nodes missing from the data
+                if refs and refs[-1] == ref: continue
+                refs.append(ref)
+            if len(refs) >= 2:
+                way_refs.append((wayid, refs))
+        if not way_refs:
+            return graph
+
+        coordinates = {}
+        for _, refs in way_refs:
+            for ref in refs:
+                if ref not in coordinates:
+                    node = nodes[ref]
+                    coordinates[ref] = (float(node.get(OSMData.ATTRIB_LON)), float(node.get(OSMData.ATTRIB_LAT)))
+        elevations = TrailGraph.sample_elevations(coordinates, heightmap)
+        graph.has_elevation = elevations is not None
+
+        visits = {}
+        for _, refs in way_refs:
+            for ref in refs:
+                visits[ref] = visits.get(ref, 0) + 1
+        for wayid, refs in way_refs:
+            start = refs[0]
+            length = ascent = descent = 0.0
+            for i in range(1, len(refs)):
+                prev, ref = refs[i - 1], refs[i]
+                lon1, lat1 = coordinates[prev]
+                lon2, lat2 = coordinates[ref]
+                length += float(haversine_distance(lon1, lat1, lon2, lat2))
+                if elevations is not None:
+                    diff = elevations[ref] - elevations[prev]
+                    if diff > 0: ascent += diff
+                    elif diff < 0: descent -= diff
+                if i == len(refs) - 1 or visits[ref] > 1:
+                    graph.add_edge(
+                        graph.get_or_add_node(start, coordinates, elevations),
+                        graph.get_or_add_node(ref, coordinates, elevations),
+                        wayid, length, ascent, descent
+                    )
+                    start = ref
+                    length = ascent = descent = 0.0
+        return graph
+
+    @classmethod
+    def sample_elevations(cls, coordinates, heightmap):
+        """Returns a dict of node id -> elevation, or None if there's no heightmap."""
+        heightmaps = heightmap if isinstance(heightmap, (list, tuple)) else [heightmap] if heightmap is not None else []
+        if not heightmaps:
+            return None
+        refs = list(coordinates)
+        lons = np.array([coordinates[ref][0] for ref in refs])
+        lats = np.array([coordinates[ref][1] for ref in refs])
+        x, y = lonlat_to_mercator(lons, lats)
+        values = np.full(len(refs), np.nan)
+        for raster in heightmaps:
+            missing = np.isnan(values)
+            if not missing.any(): break
+            values[missing] = raster.sample_bilinear(x[missing], y[missing])
+        return dict(zip(refs, values.tolist()))
+
+    def get_or_add_node(self, ref, coordinates, elevations):
+        if ref not in self.node_index:
+            self.node_index[ref] = len(self.node_ids)
+            self.node_ids.append(ref)
+            self.node_lons.append(coordinates[ref][0])
+            self.node_lats.append(coordinates[ref][1])
+            self.node_elevations.append(elevations[ref] if elevations is not None else float('nan'))
+        return self.node_index[ref]
+
+    def add_edge(self, start, end, wayid, length, ascent, descent):
+        self.edge_from.append(start)
+        self.edge_to.append(end)
+        self.edge_way_ids.append(wayid)
+        self.edge_lengths.append(length)
+        self.edge_ascents.append(ascent)
+        self.edge_descents.append(descent)
+
+    def node_count(self):
+        return len(self.node_ids)
+
+    def edge_count(self):
+        return len(self.edge_from)
+
+    def to_csr(self):
+        """
+        Returns the adjacency as (offsets, neighbours, edges) numpy arrays.
+        The neighbours of node i are neighbours[offsets[i]:offsets[i + 1]], reached via
+        the edges with the same slice of edges.
+        """
+        starts = np.array(self.edge_from + self.edge_to, dtype=np.uint32)
+        ends = np.array(self.edge_to + self.edge_from, dtype=np.uint32)
+        edge_indices = np.tile(np.arange(self.edge_count(), dtype=np.uint32), 2)
+        order = np.argsort(starts, kind='stable')
+        offsets = np.zeros(self.node_count() + 1, dtype=np.uint32)
+        offsets[1:] = np.cumsum(np.bincount(starts, minlength=self.node_count()))
+        return (offsets, ends[order], edge_indices[order])
+
+    def save(self, path):
+        offsets, neighbours, edges = self.to_csr()
+        with open(path, 'wb') as outfile:
+            outfile.write(struct.pack(
+                HEADER_FORMAT, MAGIC, FORMAT_VERSION, FLAG_ELEVATION if self.has_elevation else 0,
+                self.node_count(), self.edge_count()
+            ))
+            for values, dtype in (
+                (self.node_ids, '<i8'), (self.node_lons, '<f8'), (self.node_lats, '<f8'), (self.node_elevations, '<f4'),
+                (offsets, '<u4'), (neighbours, '<u4'), (edges, '<u4'),
+                (self.edge_from, '<u4'), (self.edge_to, '<u4'), (self.edge_way_ids, '<i8'),
+                (self.edge_lengths, '<f4'), (self.edge_ascents, '<f4'), (self.edge_descents, '<f4')
+            ):
+                outfile.write(np.asarray(values, dtype=dtype).tobytes())
+
+    @classmethod
+    def load(cls, path):
+        graph = TrailGraph()
+        with open(path, 'rb') as infile:
+            content = infile.read()
+        magic, version, flags, nodecount, edgecount = struct.unpack_from(HEADER_FORMAT, content)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('{} is not a version {} trail graph file'.format(path, FORMAT_VERSION))
+        graph.has_elevation = bool(flags & FLAG_ELEVATION)
+        position = struct.calcsize(HEADER_FORMAT)
+        def read(dtype, count):
+            nonlocal position
+            values = np.frombuffer(content, dtype=dtype, count=count, offset=position)
+            position += values.nbytes
+            return values.tolist()
+        graph.node_ids = read('<i8', nodecount)
+        graph.node_lons = read('<f8', nodecount)
+        graph.node_lats = read('<f8', nodecount)
+        graph.node_elevations = read('<f4', nodecount)
+        read('<u4', nodecount + 1) # The adjacency is derived from the edges
+        read('<u4', 2 * edgecount)
+        read('<u4', 2 * edgecount)
+        graph.edge_from = read('<u4', edgecount)
+        graph.edge_to = read('<u4', edgecount)
+        graph.edge_way_ids = read('<i8', edgecount)
+        graph.edge_lengths = read('<f4', edgecount)
+        graph.edge_ascents = read('<f4', edgecount)
+        graph.edge_descents = read('<f4', edgecount)
+        graph.node_index = {ref: i for i, ref in enumerate(graph.node_ids)}
+        return graph
@@ -0,0 +1,372 @@
+"""
+Cutting of OSM ways into a z/x/y pyramid of Mapbox Vector Tiles (version 2.1 of the spec).
+
+Tiles follow the standard XYZ tiling of EPSG:3857 (tile 0/0/0 covers the whole
+projection, y grows southwards). Per zoom level, geometries are simplified with a
+tolerance of one tile unit, clipped to the (buffered) tile and quantized to the tile extent.
+The protobuf encoding is done by hand, so no protobuf dependency is needed.
+"""
+import json
+import struct
+import numpy as np
+from os import path, makedirs
+from mapcreator.osm import OSMData
+from mapcreator.mercator import lonlat_to_mercator, mercator_to_lonlat, EARTH_RADIUS
+
+EXTENT = 4096
+BUFFER = 64
+WORLD_HALF_SIZE = np.pi * EARTH_RADIUS
+TILE_FILENAME_FORMAT = path.join('{}', '{}', '{}.mvt')
+TILE_URL_TEMPLATE = '{z}/{x}/{y}.mvt'
+METADATA_FILENAME = 'metadata.json'
+
+GEOM_LINESTRING = 2
+GEOM_POLYGON = 3
+
+CMD_MOVE_TO = 1
+CMD_LINE_TO = 2
+CMD_CLOSE_PATH = 7
+
+WIRE_VARINT = 0
+WIRE_LENGTH_DELIMITED = 2
+
+class Feature:
+    """A way projected to EPSG:3857. coordinates is an (n, 2) numpy array."""
+
+    def __init__(self, featureid, geomtype, coordinates, properties):
+        self.id = featureid
+        self.type = geomtype
+        self.coordinates = coordinates
+        self.properties = properties
+        self.bounds = (
+            coordinates[:, 0].min(), coordinates[:, 1].min(),
+            coordinates[:, 0].max(), coordinates[:, 1].max()
+        )
+
+    def intersects(self, bounds):
+        return not (
+            self.bounds[2] < bounds[0] or self.bounds[0] > bounds[2] or
+            self.bounds[3] < bounds[1] or self.bounds[1] > bounds[3]
+        )
+
+def features_from_osmdata(osmdatas, way_filters, geomtype):
+    """
+    Returns Features for all included ways of the given OSMData instances passing all way_filters.
+    Polygons are only created from closed ways.
+    """
+    features = []
+    for data in osmdatas:
+        for wayid in sorted(data.included_ways):
+            way = data.ways[wayid]
+            if not all(f(way, data) for f in way_filters): continue
+            refs = [int(nd.get(OSMData.ATTRIB_REF)) for nd in way.iter(OSMData.TAG_WAY_NODE)]
+            refs = [ref for ref in refs if ref in data.nodes]
+            if len(refs) < 2: continue
+            if geomtype == GEOM_POLYGON and (len(refs) < 4 or refs[0] != refs[-1]): continue
+            lons = np.array([float(data.nodes[ref].get(OSMData.ATTRIB_LON)) for ref in refs])
+            lats = np.array([float(data.nodes[ref].get(OSMData.ATTRIB_LAT)) for ref in refs])
+            x, y = lonlat_to_mercator(lons, lats)
+            properties = {}
+            for tag in way.findall(OSMData.TAG_TAG):
+                properties[tag.get(OSMData.ATTRIB_KEY)] = tag.get(OSMData.ATTRIB_VALUE)
+            features.append(Feature(wayid, geomtype, np.column_stack((x, y)), properties))
+    return features
+
+# Tile grid
+
+def tile_size(zoom):
+    return 2 * WORLD_HALF_SIZE / (1 << zoom)
+
+def tile_bounds(zoom, x, y):
+    """Returns (minx, miny, maxx, maxy) of the tile in EPSG:3857."""
+    size = tile_size(zoom)
+    minx = -WORLD_HALF_SIZE + x * size
+    maxy = WORLD_HALF_SIZE - y * size
+    return (minx, maxy - size, minx + size, maxy)
+
+def tiles_for_bounds(bounds, zoom):
+    """Yields (x, y) of all tiles on the zoom level intersecting the given EPSG:3857 bounds."""
+    size = tile_size(zoom)
+    count = 1 << zoom
+    def clamp(value):
+        return min(max(int(value), 0), count - 1)
+    minx = clamp(np.floor((bounds[0] + WORLD_HALF_SIZE) / size))
+    maxx = clamp(np.floor((bounds[2] + WORLD_HALF_SIZE) / size))
+    miny = clamp(np.floor((WORLD_HALF_SIZE - bounds[3]) / size))
+    maxy = clamp(np.floor((WORLD_HALF_SIZE - bounds[1]) / size))
+    for x in range(minx, maxx + 1):
+        for y in range(miny, maxy + 1):
+            yield (x, y)
+
+# Geometry processing
+
+def simplify(points, tolerance):
+    """Douglas-Peucker simplification of an (n, 2) array, keeping the end points."""
+    if len(points) <= 2 or tolerance <= 0:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2: continue
+        start = points[first]
+        direction = points[last] - start
+        interior = points[first + 1:last] - start
+        length = np.hypot(*direction)
+        if length == 0:
+            distances = np.hypot(interior[:, 0], interior[:, 1])
+        else:
+            distances = np.abs(direction[0] * interior[:, 1] - direction[1] * interior[:, 0]) / length
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            index = first + 1 + farthest
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return points[keep]
+
+def clip_line(points, bounds):
+    """Clips a polyline to the bounds (Liang-Barsky per segment). Returns a list of parts."""
+    minx, miny, maxx, maxy = bounds
+    parts = []
+    current = []
+    for (x0, y0), (x1, y1) in zip(points[:-1], points[1:]):
+        dx, dy = x1 - x0, y1 - y0
+        t0, t1 = 0.0, 1.0
+        visible = True
+        for p, q in ((-dx, x0 - minx), (dx, maxx - x0), (-dy, y0 - miny), (dy, maxy - y0)):
+            if p == 0:
+                if q < 0:
+                    visible = False
+                    break
+                continue
+            t = q / p
+            if p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+            if t0 > t1:
+                visible = False
+                break
+        if not visible:
+            if len(current) > 1: parts.append(current)
+            current = []
+            continue
+        start = (x0 + t0 * dx, y0 + t0 * dy)
+        end = (x0 + t1 * dx, y0 + t1 * dy)
+        if not current or current[-1] != start:
+            if len(current) > 1: parts.append(current)
+            current = [start]
+        current.append(end)
+        if t1 < 1.0:
+            parts.append(current)
+            current = []
+    if len(current) > 1: parts.append(current)
+    return [np.array(part) for part in parts]
+
+def clip_polygon(points, bounds):
+    """Clips a closed ring to the bounds (Sutherland-Hodgman). Returns the clipped ring or None."""
+    minx, miny, maxx, maxy = bounds
+    ring = [tuple(p) for p in points[:-1]]
+    edges = (
+        (lambda p: p[0] >= minx, lambda a, b: (minx, a[1] + (b[1] - a[1]) * (minx - a[0]) / (b[0] - a[0]))),
+        (lambda p: p[0] <= maxx, lambda a, b: (maxx, a[1] + (b[1] - a[1]) * (maxx - a[0]) / (b[0] - a[0]))),
+        (lambda p: p[1] >= miny, lambda a, b: (a[0] + (b[0] - a[0]) * (miny - a[1]) / (b[1] - a[1]), miny)),
+        (lambda p: p[1] <= maxy, lambda a, b: (a[0] + (b[0] - a[0]) * (maxy - a[1]) / (b[1] - a[1]), maxy)),
+    )
+    for inside, intersection in edges:
+        if not ring: return None
+        result = []
+        previous = ring[-1]
+        for point in ring:
+            if inside(point):
+                if not inside(previous):
+                    result.append(intersection(previous, point))
+                result.append(point)
+            elif inside(previous):
+                result.append(intersection(previous, point))
+            previous = point
+        ring = result
+    if len(ring) < 3: return None
+    ring.append(ring[0])
+    return np.array(ring)
+
+def quantize(points, bounds):
+    """Converts EPSG:3857 coordinates to integer tile coordinates (y pointing down)."""
+    minx, miny, maxx, maxy = bounds
+    x = np.round((points[:, 0] - minx) / (maxx - minx) * EXTENT).astype(np.int64)
+    y = np.round((maxy - points[:, 1]) / (maxy - miny) * EXTENT).astype(np.int64)
+    quantized = np.column_stack((x, y))
+    # Drop consecutive duplicates produced by the rounding
+    keep = np.ones(len(quantized), dtype=bool)
+    keep[1:] = np.any(quantized[1:] != quantized[:-1], axis=1)
+    return quantized[keep]
+
+def ring_area(points):
+    """Signed area (shoelace formula) of a closed ring."""
+    x, y = points[:, 0], points[:, 1]
+    return 0.5 * float(np.sum(x[:-1] * y[1:] - x[1:] * y[:-1]))
+
+# Protobuf encoding
+
+def encode_varint(value):
+    if value < 0:
+        raise ValueError('Varints are unsigned, {} must be zigzag-encoded'.format(value))
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+def encode_key(field, wiretype):
+    return encode_varint((field << 3) | wiretype)
+
+def encode_bytes_field(field, content):
+    return encode_key(field, WIRE_LENGTH_DELIMITED) + encode_varint(len(content)) + content
+
+def encode_varint_field(field, value):
+    return encode_key(field, WIRE_VARINT) + encode_varint(value)
+
+def encode_packed_field(field, values):
+    return encode_bytes_field(field, b''.join(encode_varint(v) for v in values))
+
+def command(cmdid, count):
+    return (cmdid & 0x7) | (count << 3)
+
+def encode_geometry(geomtype, parts):
+    """Encodes integer tile coordinate parts into MVT geometry commands."""
+    geometry = []
+    cx = cy = 0
+    for part in parts:
+        if geomtype == GEOM_POLYGON:
+            part = part[:-1] # Closing point is implied by ClosePath
+        geometry.append(command(CMD_MOVE_TO, 1))
+        for index, (x, y) in enumerate(part):
+            x, y = int(x), int(y)
+            if index == 1:
+                geometry.append(command(CMD_LINE_TO, len(part) - 1))
+            geometry.append(zigzag(x - cx))
+            geometry.append(zigzag(y - cy))
+            cx, cy = x, y
+        if geomtype == GEOM_POLYGON:
+            geometry.append(command(CMD_CLOSE_PATH, 1))
+    return geometry
+
+def encode_value(value):
+    if isinstance(value, bool):
+        return encode_varint_field(7, int(value))
+    if isinstance(value, int):
+        return encode_varint_field(6, zigzag(value))
+    if isinstance(value, float):
+        return encode_key(3, 1) + struct.pack('<d', value)
+    return encode_bytes_field(1, str(value).encode('utf-8'))
+
+def encode_layer(name, features):
+    """features is a list of (Feature, parts) with parts in integer tile coordinates."""
+    keys = []
+    key_index = {}
+    values = []
+    value_index = {}
+    encoded_features = []
+    for feature, parts in features:
+        tags = []
+        for key, value in sorted(feature.properties.items()):
+            if key not in key_index:
+                key_index[key] = len(keys)
+                keys.append(key)
+            if value not in value_index:
+                value_index[value] = len(values)
+                values.append(value)
+            tags.extend((key_index[key], value_index[value]))
+        # Ids are unsigned and optional, so the negative ids of new, unsaved OSM ways are left out
+        content = encode_varint_field(1, feature.id) if feature.id > 0 else b''
+        if tags:
+            content += encode_packed_field(2, tags)
+        content += encode_varint_field(3, feature.type)
+        content += encode_packed_field(4, encode_geometry(feature.type, parts))
+        encoded_features.append(encode_bytes_field(2, content))
+    layer = encode_varint_field(15, 2) + encode_bytes_field(1, name.encode('utf-8'))
+    layer += b''.join(encoded_features)
+    layer += b''.join(encode_bytes_field(3, key.encode('utf-8')) for key in keys)
+    layer += b''.join(encode_bytes_field(4, encode_value(value)) for value in values)
+    layer += encode_varint_field(5, EXTENT)
+    return layer
+
+def encode_tile(layers):
+    """layers is a list of (name, features) as in encode_layer. Empty layers are left out."""
+    return b''.join(encode_bytes_field(3, encode_layer(name, features)) for name, features in layers if features)
+
+# Pyramid
+
+def tile_features(features, bounds, tolerance):
+    """Simplifies, clips and quantizes features for one tile. Returns a list of (Feature, parts)."""
+    size = bounds[2] - bounds[0]
+    margin = size * BUFFER / EXTENT
+    clip_bounds = (bounds[0] - margin, bounds[1] - margin, bounds[2] + margin, bounds[3] + margin)
+    result = []
+    for feature, simplified in features:
+        if not feature.intersects(clip_bounds): continue
+        parts = []
+        if feature.type == GEOM_POLYGON:
+            ring = clip_polygon(simplified, clip_bounds)
+            if ring is not None:
+                ring = quantize(ring, bounds)
+                area = ring_area(ring)
+                if len(ring) >= 4 and area != 0:
+                    # Exterior rings must be clockwise in tile coordinates (positive area with y pointing down)
+                    parts.append(ring if area > 0 else ring[::-1])
+        else:
+            for part in clip_line(simplified, clip_bounds):
+                part = quantize(part, bounds)
+                if len(part) >= 2:
+                    parts.append(part)
+        if parts:
+            result.append((feature, parts))
+    return result
+
+def write_pyramid(layers, bounds, min_zoom, max_zoom, outdir):
+    """
+    Writes all tiles intersecting bounds (minx, miny, maxx, maxy in EPSG:3857) on zoom levels
+    min_zoom...max_zoom into outdir/z/x/y.mvt, along with a metadata file.
+    layers is a list of (name, features). Returns the paths of the written files.
+    """
+    written = []
+    for zoom in range(min_zoom, max_zoom + 1):
+        tolerance = tile_size(zoom) / EXTENT
+        simplified_layers = [
+            (name, [(f, simplify(f.coordinates, tolerance)) for f in features]) for name, features in layers
+        ]
+        for x, y in tiles_for_bounds(bounds, zoom):
+            tbounds = tile_bounds(zoom, x, y)
+            tile_layers = [(name, tile_features(features, tbounds, tolerance)) for name, features in simplified_layers]
+            content = encode_tile(tile_layers)
+            if not content: continue
+            outpath = path.join(outdir, TILE_FILENAME_FORMAT.format(zoom, x, y))
+            if not path.exists(path.dirname(outpath)):
+                makedirs(path.dirname(outpath))
+            with open(outpath, 'wb') as outfile:
+                outfile.write(content)
+            written.append(outpath)
+    metapath = path.join(outdir, METADATA_FILENAME)
+    minlon, minlat = mercator_to_lonlat(bounds[0], bounds[1])
+    maxlon, maxlat = mercator_to_lonlat(bounds[2], bounds[3])
+    with open(metapath, 'w') as outfile:
+        json.dump({
+            'format': 'pbf',
+            'scheme': 'xyz',
+            'tiles': [TILE_URL_TEMPLATE],
+            'minzoom': min_zoom,
+            'maxzoom': max_zoom,
+            'bounds': [float(minlon), float(minlat), float(maxlon), float(maxlat)],
+            'vector_layers': [{'id': name} for name, features in layers],
+        }, outfile, indent=2)
+    written.append(metapath)
+    return written
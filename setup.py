@@ -8,6 +8,7 @@ setup(
     install_requires=[
         'Click',
         'Colorama',
+        'numpy',
     ],
     entry_points='''
         [console_scripts]
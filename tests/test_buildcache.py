@@ -0,0 +1,67 @@
+import os
+import shutil
+from os import path
+from mapcreator import buildcache
+from mapcreator.buildcache import BuildCache
+from mapcreator.state import State
+
+TEMP_DIR = '.test_buildcache'
+CACHE_DIR = path.join(TEMP_DIR, 'build_cache')
+
+def setup_function(function):
+    if not path.exists(TEMP_DIR):
+        os.mkdir(TEMP_DIR)
+
+def teardown_function(function):
+    if path.exists(TEMP_DIR):
+        shutil.rmtree(TEMP_DIR)
+
+def write(name, content):
+    fpath = path.join(TEMP_DIR, *name.split('/'))
+    os.makedirs(path.dirname(fpath), exist_ok=True)
+    with open(fpath, 'w') as f:
+        f.write(content)
+    return fpath
+
+def test_pipeline_inputs():
+    source = write('trails.osm', 'trails')
+    state = State()
+    state.set_window(0, 7, 2, 1)
+    state.add_area_color('forest', 0, 255, 0)
+    inputs = buildcache.pipeline_inputs('osm', [source], state, {'height': 'abc'})
+    assert inputs['sources'] == [[path.abspath(source), [path.getsize(source), path.getmtime(source)]]]
+    assert inputs['area_colors'] == {'forest': [0, 255, 0]}
+    assert inputs['height pipeline'] == 'abc'
+    assert inputs['tool_version'] == buildcache.tool_version()
+    # Settings of the other pipelines don't matter
+    fingerprint = buildcache.fingerprint(inputs)
+    state.set_satellite_resolution(5)
+    assert buildcache.fingerprint(buildcache.pipeline_inputs('osm', [source], state, {'height': 'abc'})) == fingerprint
+    state.add_area_color('forest', 0, 200, 0)
+    changed = buildcache.pipeline_inputs('osm', [source], state, {'height': 'abc'})
+    assert buildcache.fingerprint(changed) != fingerprint
+    assert buildcache.changed_inputs(inputs, changed) == ['area_colors']
+
+def test_store_and_restore():
+    files = [('heightfile0.bin', write('build/heightfile0.bin', 'heights')), ('tiles/0/0/0.mvt', write('build/tiles/0/0/0.mvt', 'tile'))]
+    cache = BuildCache(CACHE_DIR)
+    assert cache.load('height') is None
+    assert cache.store('height', {'window': [0, 1]}, files, 'Build results')
+    manifest = cache.load('height')
+    assert manifest['fingerprint'] == buildcache.fingerprint({'window': [0, 1]})
+    assert manifest['files'] == ['heightfile0.bin', 'tiles/0/0/0.mvt']
+    assert manifest['report'] == 'Build results'
+    assert os.listdir(CACHE_DIR) == ['height']
+    outdir = path.join(TEMP_DIR, 'restored')
+    outfiles = cache.restore('height', manifest, outdir)
+    assert outfiles == [path.join(outdir, 'heightfile0.bin'), path.join(outdir, 'tiles', '0', '0', '0.mvt')]
+    with open(outfiles[1]) as f:
+        assert f.read() == 'tile'
+    cache.clear()
+    assert not path.exists(CACHE_DIR)
+
+def test_store_with_missing_files():
+    cache = BuildCache(CACHE_DIR)
+    assert not cache.store('height', {}, [('heightfile0.bin', path.join(TEMP_DIR, 'missing.bin'))], '')
+    assert cache.load('height') is None
+    assert not path.exists(CACHE_DIR)
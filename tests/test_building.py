@@ -1,18 +1,30 @@
+import json
 import mock
 import shutil
 import subprocess
+import numpy as np
 from os import path
-from mapcreator import building
+from mapcreator import building, gdal_util, resources, png, gputexture, scheduler, vectortiles
 from mapcreator.building import HeightMapStatus, OSMStatus, SatelliteStatus
 from mapcreator.state import State
 from mapcreator.gdal_util import Gdalinfo
 from mapcreator.osm import OSMData
+from mapcreator.envi import EnviRaster, format_map_info
+from mapcreator.trailgraph import TrailGraph
 from util import get_resource_path, assert_xml_equal
 from test_persistence import DummyState
 
+ORIGINAL_GDAL = gdal_util.gdal
+
 def setup_module(module):
     building.BUILD_DIR = '.test_mapcreator_build'
     building.FINALIZED_DIR = path.join(building.BUILD_DIR, 'finalized')
+    # Most tests check the command line tool fallback, so the GDAL bindings are hidden by default
+    gdal_util.gdal = None
+
+def teardown_module(module):
+    gdal_util.gdal = ORIGINAL_GDAL
+    gdal_util.reset_engine()
 
 @mock.patch('subprocess.Popen')
 def test_call_command_with_debug(mock_popen):
@@ -99,6 +111,55 @@ def test_no_projection_windows(mock_forfile, mock_call):
     mock_forfile.assert_called_once_with('test.txt')
     assert status.current_files == []
 
+@mock.patch('mapcreator.gdal_util.Gdalinfo.for_file')
+def test_check_projection_window_uses_cache(mock_forfile):
+    building.init_build()
+    ginfo_for_testing = Gdalinfo()
+    ginfo_for_testing.minX = -99
+    ginfo_for_testing.minY = -99
+    ginfo_for_testing.maxX = 99
+    ginfo_for_testing.maxY = 3
+    mock_forfile.return_value = ginfo_for_testing
+    source = path.join(building.BUILD_DIR, 'source.tif')
+    open(source, 'w').close()
+    state = State()
+    state.set_window(0, 7, 2, 1)
+    with mock.patch('mapcreator.persistence.gdalinfo_cache_path', lambda: path.join(building.BUILD_DIR, 'cache.json')), \
+         mock.patch('mapcreator.persistence.source_index_path', lambda: path.join(building.BUILD_DIR, 'index.json')):
+        for i in range(2):
+            status = HeightMapStatus(0, [source], state)
+            building.check_projection_window(status)
+            assert status.current_files == [source]
+    mock_forfile.assert_called_once_with(source)
+
+@mock.patch('mapcreator.gdal_util.Gdalinfo.for_file')
+def test_check_projection_window_skips_indexed_sources_outside_window(mock_forfile):
+    building.init_build()
+    def footprint(fpath):
+        gdal_info = Gdalinfo()
+        gdal_info.minX, gdal_info.maxX = (0, 1) if fpath.endswith('inside.tif') else (10, 11)
+        gdal_info.minY, gdal_info.maxY = 0, 1
+        return gdal_info
+    mock_forfile.side_effect = footprint
+    sources = [path.join(building.BUILD_DIR, name) for name in ('inside.tif', 'outside.tif')]
+    for source in sources:
+        open(source, 'w').close()
+    state = State()
+    state.set_window(0, 1, 1, 0)
+    indexpath = path.join(building.BUILD_DIR, 'index.json')
+    with mock.patch('mapcreator.persistence.gdalinfo_cache_path', lambda: path.join(building.BUILD_DIR, 'cache.json')), \
+         mock.patch('mapcreator.persistence.source_index_path', lambda: indexpath):
+        status = HeightMapStatus(0, sources, state)
+        building.check_projection_window(status)
+        assert status.current_files == [sources[0]]
+        assert path.exists(indexpath)
+        # The outside source is no longer even looked up in the gdalinfo cache
+        with mock.patch('mapcreator.gdal_util.GdalinfoCache.get_many', return_value=[footprint(sources[0])]) as mock_get:
+            status = HeightMapStatus(0, sources, state)
+            building.check_projection_window(status)
+            mock_get.assert_called_once_with([sources[0]], state.get_probe_threads())
+        assert status.current_files == [sources[0]]
+
 @mock.patch('mapcreator.building.call_command')
 def test_check_projection_window_when_no_window(mock_call):
     status = HeightMapStatus(0, ['test.txt', 'test2.txt'], State())
@@ -113,8 +174,14 @@ def test_process_heightfiles_with_gdal(mock_call):
     status = HeightMapStatus(0, ['test.txt'], state)
     building.process_heightfiles_with_gdal(status)
     outpath = path.join(building.BUILD_DIR, building.INTERMEDIATE_HEIGHT_FILENAME)
-    expected_command = 'gdalwarp -tr 10 10 -te_srs EPSG:4326 -t_srs EPSG:3857 -r bilinear -te 0 1 2 7 test.txt {}'.format(outpath)
-    mock_call.assert_called_once_with(expected_command, status, False)
+    mosaicpath = path.join(building.BUILD_DIR, building.MOSAIC_HEIGHT_FILENAME)
+    expected_command = 'gdalwarp -of VRT -tr 10 10 -te_srs EPSG:3857 -t_srs EPSG:3857 -r bilinear -te {0[0]} {0[1]} {0[2]} {0[3]} {1} {2}'.format(
+        building.get_aligned_window(state, 10), mosaicpath, outpath
+    )
+    assert mock_call.call_args_list == [
+        mock.call('gdalbuildvrt {} test.txt'.format(mosaicpath), status, False),
+        mock.call(expected_command, status, False)
+    ]
     assert status.current_files == [outpath]
 
 @mock.patch('mapcreator.building.call_command')
@@ -125,8 +192,14 @@ def test_process_heightfiles_with_gdal_reso30(mock_call):
     status = HeightMapStatus(0, ['test.txt'], state)
     building.process_heightfiles_with_gdal(status)
     outpath = path.join(building.BUILD_DIR, building.INTERMEDIATE_HEIGHT_FILENAME)
-    expected_command = 'gdalwarp -tr 30 30 -te_srs EPSG:4326 -t_srs EPSG:3857 -r bilinear -te 0 1 2 7 test.txt {}'.format(outpath)
-    mock_call.assert_called_once_with(expected_command, status, False)
+    mosaicpath = path.join(building.BUILD_DIR, building.MOSAIC_HEIGHT_FILENAME)
+    expected_command = 'gdalwarp -of VRT -tr 30 30 -te_srs EPSG:3857 -t_srs EPSG:3857 -r bilinear -te {0[0]} {0[1]} {0[2]} {0[3]} {1} {2}'.format(
+        building.get_aligned_window(state, 30), mosaicpath, outpath
+    )
+    assert mock_call.call_args_list == [
+        mock.call('gdalbuildvrt {} test.txt'.format(mosaicpath), status, False),
+        mock.call(expected_command, status, False)
+    ]
     assert status.current_files == [outpath]
 
 @mock.patch('mapcreator.building.call_command')
@@ -146,10 +219,428 @@ def test_process_heightfiles_with_forced_coordinate_system(mock_call):
     status = HeightMapStatus(0, ['test.txt'], state)
     building.process_heightfiles_with_gdal(status)
     outpath = path.join(building.BUILD_DIR, building.INTERMEDIATE_HEIGHT_FILENAME)
-    expected_command = 'gdalwarp -s_srs EPSG:9876 -tr 10 10 -te_srs EPSG:4326 -t_srs EPSG:3857 -r bilinear -te 0 1 2 7 test.txt {}'.format(outpath)
-    mock_call.assert_called_once_with(expected_command, status, False)
+    mosaicpath = path.join(building.BUILD_DIR, building.MOSAIC_HEIGHT_FILENAME)
+    expected_command = 'gdalwarp -s_srs EPSG:9876 -of VRT -tr 10 10 -te_srs EPSG:3857 -t_srs EPSG:3857 -r bilinear -te {0[0]} {0[1]} {0[2]} {0[3]} {1} {2}'.format(
+        building.get_aligned_window(state, 10), mosaicpath, outpath
+    )
+    assert mock_call.call_args_list == [
+        mock.call('gdalbuildvrt {} test.txt'.format(mosaicpath), status, False),
+        mock.call(expected_command, status, False)
+    ]
     assert status.current_files == [outpath]
 
+@mock.patch('mapcreator.building.call_command')
+def test_process_heightfiles_with_resource_settings(mock_call):
+    state = State()
+    state.set_window(0, 7, 2, 1)
+    status = HeightMapStatus(0, ['test.txt'], state)
+    with mock.patch('mapcreator.resources.choose_settings', return_value=resources.ResourceSettings(4, 256, 512, 1000)):
+        building.plan_height_resources(status)
+    building.process_heightfiles_with_gdal(status)
+    outpath = path.join(building.BUILD_DIR, building.INTERMEDIATE_HEIGHT_FILENAME)
+    mosaicpath = path.join(building.BUILD_DIR, building.MOSAIC_HEIGHT_FILENAME)
+    expected_command = 'gdalwarp -multi -wo NUM_THREADS=4 -wm 268435456 --config GDAL_CACHEMAX 536870912 -of VRT -tr 10 10 -te_srs EPSG:3857 -t_srs EPSG:3857 -r bilinear -te {0[0]} {0[1]} {0[2]} {0[3]} {1} {2}'.format(
+        building.get_aligned_window(state, 10), mosaicpath, outpath
+    )
+    mock_call.assert_called_with(expected_command, status, False)
+    building.translate_heightfiles(status)
+    finalpath = path.join(building.FINALIZED_DIR, building.FINAL_HEIGHT_FILENAME_FORMAT.format(0))
+    mock_call.assert_called_with('gdal_translate --config GDAL_CACHEMAX 536870912 -of ENVI {} {}'.format(outpath, finalpath), status, False)
+    assert '-GDAL resources: 4 warp threads' in str(status)
+
+def fake_reprojection(command, buildstatus, debug = False):
+    # Stands in for gdalwarp writing the reprojected source
+    if ' -tap ' in command:
+        with open(command.split()[-1], 'w') as f:
+            f.write('reprojected')
+
+@mock.patch('mapcreator.building.call_command', side_effect=fake_reprojection)
+def test_process_heightfiles_with_tile_cache(mock_call):
+    building.init_build()
+    sourcepath = path.join(building.BUILD_DIR, 'source.tif')
+    with open(sourcepath, 'w') as f:
+        f.write('source')
+    cachedir = path.join(building.BUILD_DIR, 'tile_cache')
+    state = State()
+    state.set_window(0, 7, 2, 1)
+    state.set_height_system('EPSG:9876')
+    state.set_tile_cache(cachedir, 100)
+    status = HeightMapStatus(0, [sourcepath], state)
+    building.process_heightfiles_with_gdal(status)
+    reprojection = mock_call.call_args_list[0][0][0]
+    assert reprojection.startswith('gdalwarp -s_srs EPSG:9876 -of GTiff -co TILED=YES -co COMPRESS=DEFLATE -co BIGTIFF=IF_SAFER -tr 10 10 -tap -t_srs EPSG:3857 -r bilinear -dstalpha {} '.format(sourcepath))
+    tilepath = path.join(building.BUILD_DIR, building.CACHED_TILE_FORMAT.format('heightfile', 0))
+    compositepath = path.join(building.BUILD_DIR, building.CACHED_TILES_FORMAT.format('heightfile'))
+    mosaicpath = path.join(building.BUILD_DIR, building.MOSAIC_HEIGHT_FILENAME)
+    # The reprojected source is already in EPSG:3857, so the forced system isn't applied again
+    assert mock_call.call_args_list[1] == mock.call('gdalwarp -of VRT -tr 10 10 -te_srs EPSG:3857 -t_srs EPSG:3857 -r near -te {0[0]} {0[1]} {0[2]} {0[3]} {1} {2}'.format(
+        building.get_aligned_window(state, 10), tilepath, compositepath
+    ), status, False)
+    assert mock_call.call_args_list[2] == mock.call('gdalbuildvrt {} {}'.format(mosaicpath, compositepath), status, False)
+    assert mock_call.call_args_list[3][0][0].startswith('gdalwarp -of VRT -tr 10 10')
+    assert '-Reprojected tile cache: 0 of 1 files reused from {}'.format(cachedir) in str(status)
+
+    # Another project over the same source pulls it from the cache
+    state.set_window(0.5, 6, 1.5, 2)
+    status = HeightMapStatus(0, [sourcepath], state)
+    mock_call.reset_mock()
+    building.process_heightfiles_with_gdal(status)
+    assert mock_call.call_count == 3
+    assert mock_call.call_args_list[1] == mock.call('gdalbuildvrt {} {}'.format(mosaicpath, compositepath), status, False)
+    assert '-Reprojected tile cache: 1 of 1 files reused from {}'.format(cachedir) in str(status)
+
+@mock.patch('mapcreator.building.call_command', side_effect=fake_reprojection)
+def test_cached_tiles_are_composited_within_their_alpha(mock_call):
+    building.init_build()
+    sourcepaths = [path.join(building.BUILD_DIR, name) for name in ('a.tif', 'b.tif')]
+    for sourcepath in sourcepaths:
+        with open(sourcepath, 'w') as f:
+            f.write(sourcepath)
+    state = State()
+    state.set_window(0, 7, 2, 1)
+    state.set_tile_cache(path.join(building.BUILD_DIR, 'tile_cache'), 100)
+    status = HeightMapStatus(0, sourcepaths, state)
+    building.process_heightfiles_with_gdal(status)
+    commands = [c[0][0] for c in mock_call.call_args_list]
+    # Both tiles have an alpha band masking the empty border around their footprint...
+    assert all(' -dstalpha ' in command for command in commands[:2])
+    # ...and are warped together, which skips the masked pixels, rather than stacked in a mosaic,
+    # where the empty border of the second tile would cover the first one as a seam
+    tilepaths = [path.join(building.BUILD_DIR, building.CACHED_TILE_FORMAT.format('heightfile', i)) for i in range(2)]
+    compositepath = path.join(building.BUILD_DIR, building.CACHED_TILES_FORMAT.format('heightfile'))
+    assert commands[2].startswith('gdalwarp -of VRT ')
+    assert commands[2].endswith(' {} {} {}'.format(tilepaths[0], tilepaths[1], compositepath))
+    assert not any(command.startswith('gdalbuildvrt') and tilepaths[0] in command for command in commands)
+    assert all(open(tilepath).read() == 'reprojected' for tilepath in tilepaths)
+
+def test_cached_tiles_are_composited_within_their_alpha_in_process():
+    building.init_build()
+    sourcepaths = [path.join(building.BUILD_DIR, name) for name in ('a.tif', 'b.tif')]
+    for sourcepath in sourcepaths:
+        with open(sourcepath, 'w') as f:
+            f.write(sourcepath)
+    state = State()
+    state.set_window(0, 7, 2, 1)
+    state.set_tile_cache(path.join(building.BUILD_DIR, 'tile_cache'), 100)
+    status = HeightMapStatus(0, sourcepaths, state)
+    mock_gdal = mock.MagicMock()
+    def fake_warp(outpath, source, **kwargs):
+        if outpath.endswith('.tmp'):
+            with open(outpath, 'w') as f:
+                f.write('reprojected')
+        return mock.MagicMock()
+    mock_gdal.Warp.side_effect = fake_warp
+    with mock.patch('mapcreator.gdal_util.gdal', mock_gdal):
+        gdal_util.reset_engine()
+        building.process_heightfiles_with_gdal(status)
+        gdal_util.reset_engine()
+    reprojections = [c for c in mock_gdal.WarpOptions.call_args_list if c[1].get('targetAlignedPixels')]
+    assert len(reprojections) == 2 and all(c[1]['dstAlpha'] for c in reprojections)
+    compositepath = path.join(building.BUILD_DIR, building.CACHED_TILES_FORMAT.format('heightfile'))
+    composite = [c for c in mock_gdal.Warp.call_args_list if c[0][0] == compositepath]
+    assert len(composite) == 1 and len(composite[0][0][1]) == 2
+
+@mock.patch('mapcreator.building.call_command')
+def test_process_heightfiles_with_tile_cache_when_reprojection_fails(mock_call):
+    building.init_build()
+    sourcepath = path.join(building.BUILD_DIR, 'source.tif')
+    with open(sourcepath, 'w') as f:
+        f.write('source')
+    state = State()
+    state.set_window(0, 7, 2, 1)
+    state.set_tile_cache(path.join(building.BUILD_DIR, 'tile_cache'), 100)
+    status = HeightMapStatus(0, [sourcepath], state)
+    building.process_heightfiles_with_gdal(status)
+    mosaicpath = path.join(building.BUILD_DIR, building.MOSAIC_HEIGHT_FILENAME)
+    assert mock_call.call_args_list[1] == mock.call('gdalbuildvrt {} {}'.format(mosaicpath, sourcepath), status, False)
+    assert '-Reprojected tile cache: not used, as some files could not be reprojected' in str(status)
+
+@mock.patch('mapcreator.building.call_command', side_effect=fake_reprojection)
+def test_tile_cache_cuts_the_same_grid_as_uncached_builds(mock_call):
+    building.init_build()
+    sourcepath = path.join(building.BUILD_DIR, 'source.tif')
+    with open(sourcepath, 'w') as f:
+        f.write('source')
+    state = State()
+    state.set_window(0, 7, 2, 1)
+    status = HeightMapStatus(0, [sourcepath], state)
+    building.process_heightfiles_with_gdal(status)
+    uncached = mock_call.call_args_list[-1][0][0].split()
+    state.set_tile_cache(path.join(building.BUILD_DIR, 'tile_cache'), 100)
+    status = HeightMapStatus(0, [sourcepath], state)
+    mock_call.reset_mock()
+    building.process_heightfiles_with_gdal(status)
+    cached = mock_call.call_args_list[-1][0][0].split()
+    # The cached tiles are on the output grid, so their pixels are copied without resampling them again
+    assert cached[cached.index('-r') + 1] == 'near'
+    assert uncached[uncached.index('-r') + 1] == 'bilinear'
+    del cached[cached.index('-r'):cached.index('-r') + 2]
+    del uncached[uncached.index('-r'):uncached.index('-r') + 2]
+    assert cached == uncached
+
+def test_get_aligned_window():
+    state = State()
+    state.set_window(0, 7, 2, 1)
+    minx, miny, maxx, maxy = building.get_mercator_window(state)
+    window = building.get_aligned_window(state, 30)
+    assert [round(edge / 30, 6) % 1 for edge in window] == [0, 0, 0, 0]
+    assert window[0] <= minx < window[0] + 30 and window[1] <= miny < window[1] + 30
+    assert window[2] - 30 < maxx <= window[2] and window[3] - 30 < maxy <= window[3]
+
+def test_split_window():
+    tiles = building.split_window((0, 0, 100, 55), 10, 2, 3)
+    assert len(tiles) == 6
+    assert [tile['index'] for tile in tiles] == list(range(6))
+    # Tiles start from the north-west corner and line up on whole cells
+    assert tiles[0]['bounds'] == [0, 35, 50, 55]
+    assert tiles[1]['bounds'] == [50, 35, 100, 55]
+    assert tiles[5]['bounds'] == [50, -5, 100, 15]
+    assert sum(tile['width'] for tile in tiles[:2]) == 10
+    assert sum(tile['height'] for tile in tiles[::2]) == 6
+
+def test_split_window_skips_empty_tiles():
+    tiles = building.split_window((0, 0, 20, 20), 10, 4, 1)
+    assert len(tiles) == 2
+    assert [tile['column'] for tile in tiles] == [1, 3]
+
+@mock.patch('mapcreator.building.call_command')
+def test_process_height_tiles(mock_call):
+    building.init_build()
+    state = State()
+    state.set_window(0, 0.01, 0.01, 0)
+    state.set_height_tiles(2, 2)
+    status = HeightMapStatus(0, ['test.txt'], state)
+    building.process_heightfiles_with_gdal(status)
+    mosaicpath = path.join(building.BUILD_DIR, building.MOSAIC_HEIGHT_FILENAME)
+    tilepaths = [path.join(building.BUILD_DIR, building.INTERMEDIATE_HEIGHT_TILE_FORMAT.format(i)) for i in range(4)]
+    assert status.current_files == tilepaths
+    assert mock_call.call_args_list[0] == mock.call('gdalbuildvrt {} test.txt'.format(mosaicpath), status, False)
+    assert mock_call.call_count == 5
+    expected_command = 'gdalwarp -of VRT -tr 10 10 -te_srs EPSG:3857 -t_srs EPSG:3857 -r bilinear -te {0[0]} {0[1]} {0[2]} {0[3]} {1} {2}'.format(
+        status.tiles[0]['bounds'], mosaicpath, tilepaths[0]
+    )
+    assert mock_call.call_args_list[1] == mock.call(expected_command, status, False)
+
+    building.translate_heightfiles(status)
+    assert mock_call.call_count == 9
+    manifestpath = path.join(building.FINALIZED_DIR, building.HEIGHT_TILE_MANIFEST_FILENAME)
+    assert status.result_files[-1] == manifestpath
+    assert len(status.result_files) == 9
+    with open(manifestpath) as f:
+        manifest = json.load(f)
+    assert manifest['columns'] == 2 and manifest['rows'] == 2
+    assert [tile['file'] for tile in manifest['tiles']] == ['heightfile{}.bin'.format(i) for i in range(4)]
+    assert manifest['tiles'][3]['header'] == 'heightfile3.hdr'
+
+def write_geographic_dem(fpath):
+    header = EnviRaster.create_header(
+        100, 100, 'float32', '{Geographic Lat/Lon, 1, 1, 0.0, 7.5, 0.025, 0.025, WGS-84, units=Degrees}'
+    )
+    EnviRaster(np.arange(10000, dtype=np.float32).reshape(100, 100), header).save(fpath)
+
+@mock.patch('mapcreator.building.call_command')
+def test_process_heightfiles_natively(mock_call):
+    building.init_build()
+    sourcepath = path.join(building.BUILD_DIR, 'dem.bin')
+    write_geographic_dem(sourcepath)
+    state = State()
+    state.set_window(0, 7, 2, 1)
+    state.set_height_resolution(5000)
+    state.set_height_engine('auto')
+    status = HeightMapStatus(0, [sourcepath], state)
+    building.process_heightfiles_with_gdal(status)
+    outpath = path.join(building.FINALIZED_DIR, building.FINAL_HEIGHT_FILENAME_FORMAT.format(0))
+    assert status.current_files == [outpath]
+    building.translate_heightfiles(status)
+    mock_call.assert_not_called()
+    assert status.result_files == [outpath, path.join(building.FINALIZED_DIR, building.FINAL_HEIGHT_METADATA_FORMAT.format(0))]
+    raster = EnviRaster.load(outpath)
+    assert (raster.samples, raster.lines) == (45, 135)
+    assert raster.get_geotransform()[1] == 5000
+
+@mock.patch('mapcreator.building.call_command')
+def test_process_height_tiles_natively(mock_call):
+    building.init_build()
+    sourcepath = path.join(building.BUILD_DIR, 'dem.bin')
+    write_geographic_dem(sourcepath)
+    state = State()
+    state.set_window(0, 7, 2, 1)
+    state.set_height_resolution(5000)
+    state.set_height_tiles(2, 2)
+    state.set_height_engine('auto')
+    status = HeightMapStatus(0, [sourcepath], state)
+    building.process_heightfiles_with_gdal(status)
+    building.translate_heightfiles(status)
+    mock_call.assert_not_called()
+    assert len(status.tiles) == 4
+    assert status.current_files == [path.join(building.FINALIZED_DIR, building.FINAL_HEIGHT_FILENAME_FORMAT.format(i)) for i in range(4)]
+    assert [EnviRaster.load(f).samples for f in status.current_files] == [tile['width'] for tile in status.tiles]
+    assert path.exists(path.join(building.FINALIZED_DIR, building.HEIGHT_TILE_MANIFEST_FILENAME))
+
+@mock.patch('mapcreator.building.call_command')
+def test_process_heightfiles_with_gdal_engine_chosen(mock_call):
+    building.init_build()
+    sourcepath = path.join(building.BUILD_DIR, 'dem.bin')
+    write_geographic_dem(sourcepath)
+    state = State()
+    state.set_window(0, 7, 2, 1)
+    state.set_height_engine('gdal')
+    status = HeightMapStatus(0, [sourcepath], state)
+    building.process_heightfiles_with_gdal(status)
+    assert status.current_files == [path.join(building.BUILD_DIR, building.INTERMEDIATE_HEIGHT_FILENAME)]
+    assert mock_call.call_count == 2
+
+@mock.patch('mapcreator.building.call_command')
+def test_process_heightfiles_with_gdal_by_default(mock_call):
+    # Existing projects keep GDAL's height files until they opt in to the built-in engine
+    building.init_build()
+    sourcepath = path.join(building.BUILD_DIR, 'dem.bin')
+    write_geographic_dem(sourcepath)
+    state = State()
+    state.set_window(0, 7, 2, 1)
+    status = HeightMapStatus(0, [sourcepath], state)
+    building.process_heightfiles_with_gdal(status)
+    assert status.current_files == [path.join(building.BUILD_DIR, building.INTERMEDIATE_HEIGHT_FILENAME)]
+    assert mock_call.call_count == 2
+
+@mock.patch('mapcreator.building.call_command')
+def test_process_heightfiles_natively_falls_back_to_gdal(mock_call):
+    state = State()
+    state.set_window(0, 7, 2, 1)
+    state.set_height_engine('numpy')
+    status = HeightMapStatus(0, ['test.txt'], state)
+    building.process_heightfiles_with_gdal(status)
+    assert status.current_files == [path.join(building.BUILD_DIR, building.INTERMEDIATE_HEIGHT_FILENAME)]
+    assert 'using GDAL instead' in status.output.getvalue()
+
+def test_write_shading():
+    building.init_build()
+    state = State()
+    state.set_normal_map(1.0)
+    state.set_hillshade(315.0, 45.0)
+    state.set_sky_view(8, 50.0)
+    heightpath = path.join(building.FINALIZED_DIR, building.FINAL_HEIGHT_FILENAME_FORMAT.format(0))
+    header = EnviRaster.create_header(4, 4, 'float32', '{Pseudo Mercator, 1, 1, 0.0, 20.0, 10.0, 10.0, WGS-84}')
+    EnviRaster(np.full((4, 4), 100, dtype=np.float32), header).save(heightpath)
+    status = HeightMapStatus(0, ['test.txt'], state)
+    status.add_result_file(heightpath)
+    building.write_shading(status)
+    normalpath = path.join(building.FINALIZED_DIR, building.FINAL_NORMAL_MAP_FORMAT.format(0))
+    hillshadepath = path.join(building.FINALIZED_DIR, building.FINAL_HILLSHADE_FORMAT.format(0))
+    skyviewpath = path.join(building.FINALIZED_DIR, building.FINAL_SKY_VIEW_FORMAT.format(0))
+    assert status.result_files == [heightpath, normalpath, hillshadepath, skyviewpath]
+    with open(normalpath, 'rb') as f:
+        assert png.decode_png(f.read())[0, 0].tolist() == [128, 128, 255]
+    with open(hillshadepath, 'rb') as f:
+        assert png.decode_png(f.read()).shape == (4, 4)
+    with open(skyviewpath, 'rb') as f:
+        assert png.decode_png(f.read()).tolist() == [[255] * 4] * 4
+
+def test_write_shading_when_not_enabled():
+    building.init_build()
+    status = HeightMapStatus(0, ['test.txt'], State())
+    status.add_result_file('heightfile0.bin')
+    building.write_shading(status)
+    assert status.result_files == ['heightfile0.bin']
+
+def test_write_terrain_meshes():
+    building.init_build()
+    state = State()
+    state.set_terrain_mesh(0.5)
+    heightpath = path.join(building.FINALIZED_DIR, building.FINAL_HEIGHT_FILENAME_FORMAT.format(0))
+    header = EnviRaster.create_header(9, 9, 'float32', '{Pseudo Mercator, 1, 1, 0.0, 90.0, 10.0, 10.0, WGS-84}')
+    EnviRaster(np.full((9, 9), 100, dtype=np.float32), header).save(heightpath)
+    status = HeightMapStatus(0, ['test.txt'], state)
+    status.add_result_file(heightpath)
+    building.write_terrain_meshes(status)
+    vertexpath = path.join(building.FINALIZED_DIR, building.FINAL_MESH_VERTICES_FORMAT.format(0))
+    indexpath = path.join(building.FINALIZED_DIR, building.FINAL_MESH_INDICES_FORMAT.format(0))
+    manifestpath = path.join(building.FINALIZED_DIR, building.MESH_MANIFEST_FILENAME)
+    assert status.result_files == [heightpath, vertexpath, indexpath, manifestpath]
+    with open(manifestpath) as f:
+        manifest = json.load(f)
+    assert manifest['meshes'][0]['triangle_count'] == 2
+    assert manifest['meshes'][0]['dense_triangle_count'] == 128
+    assert manifest['meshes'][0]['index_type'] == 'uint16'
+    assert '-heightfile0.bin mesh: 2 triangles instead of 128 (1.6%), max error 0.5 m' in str(status)
+
+def test_write_contours():
+    building.init_build()
+    state = State()
+    state.set_contours(25.0, 0.25)
+    heightpath = path.join(building.FINALIZED_DIR, building.FINAL_HEIGHT_FILENAME_FORMAT.format(0))
+    header = EnviRaster.create_header(20, 10, 'float32', '{Pseudo Mercator, 1, 1, 0.0, 90.0, 10.0, 10.0, WGS-84}')
+    data = np.tile(np.arange(20, dtype=np.float32) * 10, (10, 1))
+    EnviRaster(data, header).save(heightpath)
+    status = HeightMapStatus(0, ['test.txt'], state)
+    status.add_result_file(heightpath)
+    building.write_contours(status)
+    vertexpath = path.join(building.FINALIZED_DIR, building.FINAL_CONTOURS_FORMAT.format(0))
+    manifestpath = path.join(building.FINALIZED_DIR, building.CONTOURS_MANIFEST_FILENAME)
+    assert status.result_files == [heightpath, vertexpath, manifestpath]
+    with open(manifestpath) as f:
+        manifest = json.load(f)
+    # Straight lines at 25, 50, ... 175 m, simplified to their ends
+    assert [line[0] for line in manifest['contours'][0]['lines']] == [25.0 * i for i in range(1, 8)]
+    assert manifest['contours'][0]['vertex_count'] == 14
+    vertices = np.fromfile(vertexpath, dtype='<f4').reshape(-1, 2)
+    assert sorted(vertices[:2].tolist()) == [[2.5, 0.0], [2.5, 9.0]]
+    assert '-heightfile0.bin contours: 7 lines with 14 vertices every 25.0 m' in str(status)
+
+def test_write_height_lods():
+    building.init_build()
+    state = State()
+    state.set_height_lods(2, 'max')
+    heightpath = path.join(building.FINALIZED_DIR, building.FINAL_HEIGHT_FILENAME_FORMAT.format(0))
+    header = EnviRaster.create_header(4, 4, 'float32', '{Mercator, 1, 1, 0.0, 40.0, 10.0, 10.0, WGS-84}')
+    EnviRaster(np.arange(16, dtype=np.float32).reshape(4, 4), header).save(heightpath)
+    status = HeightMapStatus(0, ['test.txt'], state)
+    status.add_result_file(heightpath)
+    status.add_result_file(path.join(building.FINALIZED_DIR, building.FINAL_HEIGHT_METADATA_FORMAT.format(0)))
+    building.write_height_lods(status)
+    lodpath = path.join(building.FINALIZED_DIR, building.FINAL_HEIGHT_LOD_FORMAT.format(0, 1))
+    manifestpath = path.join(building.FINALIZED_DIR, building.HEIGHT_LOD_MANIFEST_FILENAME)
+    assert status.result_files[2] == lodpath
+    assert status.result_files[-1] == manifestpath
+    assert len(status.result_files) == 7
+    assert EnviRaster.load(lodpath).data.tolist() == [[5, 7], [13, 15]]
+    with open(manifestpath) as f:
+        manifest = json.load(f)
+    assert manifest['reduction'] == 'max'
+    assert [level['samples'] for level in manifest['files'][0]['levels']] == [4, 2, 1]
+
+def test_encode_heightfiles():
+    building.init_build()
+    state = State()
+    state.set_height_encoding('terrain-rgb', None)
+    state.set_height_lods(1, 'mean')
+    heightpath = path.join(building.FINALIZED_DIR, building.FINAL_HEIGHT_FILENAME_FORMAT.format(0))
+    metapath = path.join(building.FINALIZED_DIR, building.FINAL_HEIGHT_METADATA_FORMAT.format(0))
+    header = EnviRaster.create_header(4, 4, 'float32', '{Mercator, 1, 1, 0.0, 40.0, 10.0, 10.0, WGS-84}')
+    EnviRaster(np.arange(16, dtype=np.float32).reshape(4, 4), header).save(heightpath)
+    status = HeightMapStatus(0, ['test.txt'], state)
+    status.add_result_file(heightpath)
+    status.add_result_file(metapath)
+    building.write_height_lods(status)
+    building.encode_heightfiles(status)
+    pngpath = path.join(building.FINALIZED_DIR, 'heightfile0.png')
+    assert status.result_files[:2] == [pngpath, metapath]
+    assert not path.exists(heightpath)
+    assert path.exists(pngpath)
+    assert len(status.encoding_reports) == 2
+    assert 'heightfile0.png as terrain-rgb' in str(status)
+    with open(path.join(building.FINALIZED_DIR, building.HEIGHT_LOD_MANIFEST_FILENAME)) as f:
+        manifest = json.load(f)
+    assert manifest['files'][0]['file'] == 'heightfile0.png'
+    assert manifest['files'][0]['levels'][1]['file'] == 'heightfile0_lod1.png'
+
+def test_write_height_lods_when_not_enabled():
+    building.init_build()
+    status = HeightMapStatus(0, ['test.txt'], State())
+    status.add_result_file('heightfile0.bin')
+    building.write_height_lods(status)
+    assert status.result_files == ['heightfile0.bin']
+
 @mock.patch('mapcreator.building.call_command')
 def test_translate_heightfile(mock_call):
     def add_mock_files(a, b, c):
@@ -188,9 +679,15 @@ def test_process_satellite_with_gdal(mock_call):
     
     status = SatelliteStatus(0, ['test.tif', 'test2.tif'], state)
     building.process_satellite_with_gdal(status)
-    outpath = path.join(building.FINALIZED_DIR, building.INTERMEDIATE_SATELLITE_FORMAT.format(0))
-    expected_command = 'gdalwarp -tr 10 10 -te_srs EPSG:4326 -t_srs EPSG:3857 -r bilinear -te 0 1 2 7 test.tif test2.tif {}'.format(outpath)
-    mock_call.assert_called_once_with(expected_command, status, False)
+    outpath = path.join(building.BUILD_DIR, building.INTERMEDIATE_SATELLITE_FORMAT.format(0))
+    mosaicpath = path.join(building.BUILD_DIR, building.MOSAIC_SATELLITE_FORMAT.format(0))
+    expected_command = 'gdalwarp -of VRT -tr 10 10 -te_srs EPSG:3857 -t_srs EPSG:3857 -r bilinear -te {0[0]} {0[1]} {0[2]} {0[3]} {1} {2}'.format(
+        building.get_aligned_window(state, 10), mosaicpath, outpath
+    )
+    assert mock_call.call_args_list == [
+        mock.call('gdalbuildvrt {} test.tif test2.tif'.format(mosaicpath), status, False),
+        mock.call(expected_command, status, False)
+    ]
     assert status.current_files == [outpath]
 
 @mock.patch('mapcreator.building.call_command')
@@ -201,21 +698,372 @@ def test_process_satellite_with_forced_coordinate_system(mock_call):
     
     status = SatelliteStatus(0, ['test.tif', 'test2.tif'], state)
     building.process_satellite_with_gdal(status)
-    outpath = path.join(building.FINALIZED_DIR, building.INTERMEDIATE_SATELLITE_FORMAT.format(0))
-    expected_command = 'gdalwarp -s_srs EPSG:9876 -tr 10 10 -te_srs EPSG:4326 -t_srs EPSG:3857 -r bilinear -te 0 1 2 7 test.tif test2.tif {}'.format(outpath)
-    mock_call.assert_called_once_with(expected_command, status, False)
+    outpath = path.join(building.BUILD_DIR, building.INTERMEDIATE_SATELLITE_FORMAT.format(0))
+    mosaicpath = path.join(building.BUILD_DIR, building.MOSAIC_SATELLITE_FORMAT.format(0))
+    expected_command = 'gdalwarp -s_srs EPSG:9876 -of VRT -tr 10 10 -te_srs EPSG:3857 -t_srs EPSG:3857 -r bilinear -te {0[0]} {0[1]} {0[2]} {0[3]} {1} {2}'.format(
+        building.get_aligned_window(state, 10), mosaicpath, outpath
+    )
+    assert mock_call.call_args_list == [
+        mock.call('gdalbuildvrt {} test.tif test2.tif'.format(mosaicpath), status, False),
+        mock.call(expected_command, status, False)
+    ]
     assert status.current_files == [outpath]
 
+@mock.patch('mapcreator.building.call_command', side_effect=fake_reprojection)
+def test_process_satellite_with_tile_cache(mock_call):
+    building.init_build()
+    sourcepaths = [path.join(building.BUILD_DIR, name) for name in ('a.tif', 'b.tif')]
+    for sourcepath in sourcepaths:
+        with open(sourcepath, 'w') as f:
+            f.write(sourcepath)
+    state = State()
+    state.set_window(0, 7, 2, 1)
+    state.set_tile_cache(path.join(building.BUILD_DIR, 'tile_cache'), 100)
+    status = SatelliteStatus(0, sourcepaths, state)
+    building.process_satellite_with_gdal(status)
+    assert mock_call.call_count == 5
+    assert all(c[0][0].startswith('gdalwarp ') and ' -tap ' in c[0][0] for c in mock_call.call_args_list[:2])
+    compositepath = path.join(building.BUILD_DIR, building.CACHED_TILES_FORMAT.format('satellite'))
+    assert mock_call.call_args_list[2][0][0].endswith(' ' + compositepath)
+    assert mock_call.call_args_list[3][0][0].startswith('gdalbuildvrt')
+    assert sourcepaths[0] not in mock_call.call_args_list[3][0][0]
+    assert '-Reprojected tile cache: 0 of 2 files reused' in str(status)
+
+def optimized_sources(state, names, pixel_size = 1.0, overviews = (2, 4, 8, 16)):
+    """Writes source files and optimized copies of them, recording the copies in state."""
+    building.init_build()
+    sourcepaths = []
+    for name in names:
+        sourcepath = path.join(building.BUILD_DIR, name)
+        copypath = path.join(building.BUILD_DIR, 'optimized_' + name)
+        for fpath in (sourcepath, copypath):
+            with open(fpath, 'w') as f:
+                f.write(fpath)
+        state.set_optimized_satellite_file(sourcepath, {
+            'path': copypath, 'fingerprint': gdal_util.GdalinfoCache.fingerprint(sourcepath),
+            'pixel_size': pixel_size, 'overviews': list(overviews),
+        })
+        sourcepaths.append(sourcepath)
+    return sourcepaths
+
+@mock.patch('mapcreator.building.call_command')
+def test_process_satellite_with_optimized_sources(mock_call):
+    state = State()
+    state.set_window(0, 7, 2, 1)
+    sourcepaths = optimized_sources(state, ('a.tif', 'b.tif'))
+    status = SatelliteStatus(0, sourcepaths, state)
+    building.process_satellite_with_gdal(status)
+    copypaths = [state.get_optimized_satellite_file(f)['path'] for f in sourcepaths]
+    # 10 m pixels are warped from the 8x overview of 1 m sources, which a mosaic of them wouldn't have
+    assert mock_call.call_count == 1
+    command = mock_call.call_args[0][0]
+    assert command.startswith('gdalwarp -ovr 2 -of VRT ')
+    assert command.endswith('{} {}'.format(' '.join(copypaths), path.join(building.BUILD_DIR, building.INTERMEDIATE_SATELLITE_FORMAT.format(0))))
+    assert '-Optimized sources: 2 of 2 files, warped from overview level 2' in str(status)
+
 @mock.patch('mapcreator.building.call_command')
-def test_translate_satellite_to_png(mock_call):
+def test_process_satellite_with_coarse_optimized_sources(mock_call):
+    state = State()
+    state.set_window(0, 7, 2, 1)
+    status = SatelliteStatus(0, optimized_sources(state, ('a.tif',), pixel_size=8.0), state)
+    building.process_satellite_with_gdal(status)
+    assert mock_call.call_args_list[0][0][0].startswith('gdalwarp -ovr NONE -of VRT ')
+    assert 'warped from the full resolution' in str(status)
+
+@mock.patch('mapcreator.building.call_command')
+def test_process_satellite_with_changed_optimized_source(mock_call):
+    state = State()
+    state.set_window(0, 7, 2, 1)
+    sourcepaths = optimized_sources(state, ('a.tif', 'b.tif'))
+    with open(sourcepaths[1], 'w') as f:
+        f.write('changed source')
+    status = SatelliteStatus(0, sourcepaths, state)
+    building.process_satellite_with_gdal(status)
+    copypath = state.get_optimized_satellite_file(sourcepaths[0])['path']
+    assert mock_call.call_args_list[0][0][0].endswith('{} {}'.format(copypath, sourcepaths[1]))
+    # Not all sources have overviews, so the level is left to GDAL
+    assert ' -ovr ' not in mock_call.call_args_list[1][0][0]
+    assert '-Optimized sources: 1 of 2 files' in str(status)
+
+SATELLITE_IMAGE = (np.arange(3 * 300 * 7) % 256).astype(np.uint8).reshape(3, 300, 7)
+
+def fake_raw_translation(command, buildstatus, debug = False):
+    # Stands in for gdal_translate writing the warped satellite image as raw ENVI
+    if '-of ENVI ' in command:
+        header = EnviRaster.create_header(7, 300, 'uint8', bands=3)
+        EnviRaster(SATELLITE_IMAGE, header).save(command.split()[-1])
+
+@mock.patch('mapcreator.building.call_command', side_effect=fake_raw_translation)
+def test_encode_satellite(mock_call):
+    building.init_build()
     state = State()
     status = SatelliteStatus(0, ['intermediate.tiff'], state)
-    building.translate_satellite_to_png(status)
-    
+    building.encode_satellite(status)
+    rawpath = path.join(building.BUILD_DIR, building.INTERMEDIATE_SATELLITE_RAW_FORMAT.format(0))
     outpath = path.join(building.FINALIZED_DIR, building.FINAL_SATELLITE_FORMAT.format(0))
-    expected_command = 'gdal_translate -of {} {} {}'.format(building.SATELLITE_OUTPUT_FORMAT, 'intermediate.tiff', outpath)
-    mock_call.assert_called_once_with(expected_command, status, False)
+    # Only the warp goes through GDAL, the PNG is encoded in strips by the built-in encoder
+    mock_call.assert_called_once_with('gdal_translate -of ENVI -co INTERLEAVE=BIP intermediate.tiff {}'.format(rawpath), status, False)
     assert status.result_files == [outpath]
+    with open(outpath, 'rb') as f:
+        assert np.array_equal(png.decode_png(f.read()), np.moveaxis(SATELLITE_IMAGE, 0, -1))
+    assert '-heightfile0_satellite.png as png (quality 6): {} bytes, encoded in'.format(path.getsize(outpath)) in str(status)
+
+@mock.patch('mapcreator.building.call_command', side_effect=fake_raw_translation)
+def test_encode_satellite_with_palette(mock_call):
+    building.init_build()
+    state = State()
+    state.set_satellite_palette(16, 'kmeans', False)
+    status = SatelliteStatus(0, ['intermediate.tiff'], state)
+    building.encode_satellite(status)
+    outpath = path.join(building.FINALIZED_DIR, building.FINAL_SATELLITE_FORMAT.format(0))
+    with open(outpath, 'rb') as f:
+        content = f.read()
+    assert b'PLTE' in content
+    decoded = png.decode_png(content)
+    assert decoded.shape == (300, 7, 3)
+    assert len(np.unique(decoded.reshape(-1, 3), axis=0)) <= 16
+    assert '-heightfile0_satellite.png palette: 16 colors (kmeans), ' in str(status)
+    assert '% of the ' in str(status)
+
+@mock.patch('mapcreator.building.call_command', side_effect=fake_raw_translation)
+def test_write_satellite_mipmaps(mock_call):
+    building.init_build()
+    state = State()
+    state.set_satellite_mipmaps('box')
+    status = SatelliteStatus(0, ['intermediate.tiff'], state)
+    building.encode_satellite(status)
+    building.write_satellite_mipmaps(status)
+    manifestpath = path.join(building.FINALIZED_DIR, building.SATELLITE_MIPMAP_MANIFEST_FILENAME)
+    assert status.result_files[-1] == manifestpath
+    with open(manifestpath) as f:
+        manifest = json.load(f)
+    levels = manifest['files'][0]['levels']
+    # 7x300 -> 3x150 -> 1x75 -> ... -> 1x1
+    assert [(level['samples'], level['lines']) for level in levels] == [
+        (7, 300), (3, 150), (1, 75), (1, 37), (1, 18), (1, 9), (1, 4), (1, 2), (1, 1)
+    ]
+    assert levels[0]['file'] == 'heightfile0_satellite.png'
+    assert levels[1]['file'] == 'heightfile0_satellite_mip1.png'
+    with open(path.join(building.FINALIZED_DIR, levels[1]['file']), 'rb') as f:
+        assert png.decode_png(f.read()).shape == (150, 3, 3)
+    assert len(status.result_files) == 10
+    assert '-heightfile0_satellite.png mipmaps: 8 levels (box filter)' in str(status)
+
+@mock.patch('mapcreator.building.call_command', side_effect=fake_raw_translation)
+def test_write_satellite_textures(mock_call):
+    building.init_build()
+    state = State()
+    state.set_satellite_texture('etc2')
+    state.set_satellite_mipmaps('box')
+    status = SatelliteStatus(0, ['intermediate.tiff'], state)
+    building.encode_satellite(status)
+    building.write_satellite_textures(status)
+    outpath = path.join(building.FINALIZED_DIR, building.FINAL_SATELLITE_TEXTURE_FORMAT.format(0))
+    assert status.result_files[-1] == outpath
+    with open(outpath, 'rb') as f:
+        internal_format, samples, lines, levels = gputexture.read_ktx(f.read())
+    assert (internal_format, samples, lines) == (0x9274, 7, 300)
+    # 7x300 is 2x75 blocks, and every mip level down to 1x1 takes at least one block
+    assert len(levels) == 9
+    assert len(levels[0]) == 2 * 75 * 8
+    assert len(levels[-1]) == 8
+    assert '-heightfile0_satellite.ktx as etc2: 9 levels' in str(status)
+
+def test_write_satellite_textures_when_not_enabled():
+    status = SatelliteStatus(0, ['intermediate.tiff'], State())
+    building.write_satellite_textures(status)
+    assert status.result_files == []
+
+def test_write_satellite_mipmaps_when_not_enabled():
+    building.init_build()
+    status = SatelliteStatus(0, ['intermediate.tiff'], State())
+    building.write_satellite_mipmaps(status)
+    assert status.result_files == []
+
+@mock.patch('mapcreator.building.call_command', side_effect=fake_raw_translation)
+def test_encode_satellite_as_jpeg(mock_call):
+    building.init_build()
+    state = State()
+    state.set_satellite_encoding('jpeg', 90)
+    status = SatelliteStatus(0, ['intermediate.tiff'], state)
+    building.encode_satellite(status)
+    outpath = path.join(building.FINALIZED_DIR, 'heightfile0_satellite.jpg')
+    # Without mipmaps or textures there's no raw copy, the warped image is encoded straight away
+    mock_call.assert_called_once_with('gdal_translate -of JPEG -co QUALITY=90 intermediate.tiff {}'.format(outpath), status, False)
+    assert status.result_files == [outpath]
+    assert not path.exists(path.join(building.BUILD_DIR, building.INTERMEDIATE_SATELLITE_RAW_FORMAT.format(0)))
+
+@mock.patch('mapcreator.building.call_command', side_effect=fake_raw_translation)
+def test_encode_satellite_as_jpeg_with_mipmaps(mock_call):
+    building.init_build()
+    state = State()
+    state.set_satellite_encoding('jpeg', 90)
+    state.set_satellite_mipmaps('box')
+    status = SatelliteStatus(0, ['intermediate.tiff'], state)
+    building.encode_satellite(status)
+    rawpath = path.join(building.BUILD_DIR, building.INTERMEDIATE_SATELLITE_RAW_FORMAT.format(0))
+    outpath = path.join(building.FINALIZED_DIR, 'heightfile0_satellite.jpg')
+    assert mock_call.call_args_list[1] == mock.call('gdal_translate -of JPEG -co QUALITY=90 {} {}'.format(rawpath, outpath), status, False)
+
+def test_write_trail_graph():
+    building.init_build()
+    state = State()
+    state.set_window(-112.2, 36.15, -112.0, 36.0)
+    status = OSMStatus(0, ['test.xml'], state)
+    status.osmdata = [OSMData.load(get_resource_path('test_trailgraph_input.xml'))]
+    building.write_trail_graph(status)
+    outpath = path.join(building.FINALIZED_DIR, building.FINAL_TRAIL_GRAPH_FORMAT.format(0))
+    assert status.results == [outpath]
+    assert path.exists(outpath)
+
+def test_write_trail_graph_with_height_tiles():
+    building.init_build()
+    state = State()
+    state.set_window(-112.2, 36.15, -112.0, 36.0)
+    # Two 100 m height tiles meeting at about -112.0994, between the trail nodes at -112.1 and -112.098
+    ulx, uly = vectortiles.lonlat_to_mercator(-112.2, 36.15)
+    for index, height in enumerate((100, 200)):
+        header = EnviRaster.create_header(112, 210, 'float32', format_map_info('Pseudo Mercator', ulx + index * 11200, uly, 100, 100))
+        EnviRaster(np.full((210, 112), height, dtype=np.float32), header).save(
+            path.join(building.FINALIZED_DIR, building.FINAL_HEIGHT_FILENAME_FORMAT.format(index))
+        )
+    status = OSMStatus(0, ['test.xml'], state)
+    status.osmdata = [OSMData.load(get_resource_path('test_trailgraph_input.xml'))]
+    building.write_trail_graph(status)
+    graph = TrailGraph.load(path.join(building.FINALIZED_DIR, building.FINAL_TRAIL_GRAPH_FORMAT.format(0)))
+    assert graph.has_elevation
+    assert not np.isnan(graph.node_elevations).any()
+    assert set(graph.node_elevations) == {100, 200}
+
+def test_write_trail_graph_without_trails_in_window():
+    building.init_build()
+    state = State()
+    state.set_window(10, 11, 11, 10)
+    status = OSMStatus(0, ['test.xml'], state)
+    status.osmdata = [OSMData.load(get_resource_path('test_trailgraph_input.xml'))]
+    building.write_trail_graph(status)
+    assert status.results == []
+
+def test_write_vector_tiles():
+    building.init_build()
+    state = State()
+    state.set_window(-112.11, 36.11, -112.09, 36.09)
+    state.set_vector_tile_zooms(12, 13)
+    status = OSMStatus(0, ['test.xml'], state)
+    status.osmdata = [OSMData.load(get_resource_path('test_trailgraph_input.xml'))]
+    building.write_vector_tiles(status)
+    tiledir = path.join(building.FINALIZED_DIR, building.VECTOR_TILE_DIRNAME)
+    assert status.results
+    assert all(f.startswith(tiledir) for f in status.results)
+    assert building.get_package_name(status.results[0]).startswith(building.VECTOR_TILE_DIRNAME + '/')
+    assert 'tiles/ ({} files)'.format(len(status.results)) in str(status)
+
+def test_write_vector_tiles_when_disabled():
+    state = State()
+    state.set_window(-112.11, 36.11, -112.09, 36.09)
+    status = OSMStatus(0, ['test.xml'], state)
+    status.osmdata = [OSMData.load(get_resource_path('test_trailgraph_input.xml'))]
+    building.write_vector_tiles(status)
+    assert status.results == []
+
+def test_package_name():
+    assert building.get_package_name(path.join(building.FINALIZED_DIR, 'heightfile0.bin')) == 'heightfile0.bin'
+    assert building.get_package_name(path.join(building.FINALIZED_DIR, 'tiles', '1', '2', '3.mvt')) == 'tiles/1/2/3.mvt'
+    assert building.get_package_name(path.join('somewhere', 'else.bin')) == 'else.bin'
+
+@mock.patch('mapcreator.building.call_command')
+def test_process_heightfiles_in_process(mock_call):
+    mock_gdal = mock.MagicMock()
+    with mock.patch('mapcreator.gdal_util.gdal', mock_gdal):
+        gdal_util.reset_engine()
+        state = State()
+        state.set_window(0, 7, 2, 1)
+        state.set_height_system('EPSG:9876')
+        status = HeightMapStatus(0, ['test.txt', 'test2.txt'], state)
+        building.process_heightfiles_with_gdal(status)
+        mock_call.assert_not_called()
+        mock_gdal.WarpOptions.assert_called_once_with(
+            format='VRT', xRes=10, yRes=10, outputBounds=building.get_aligned_window(state, 10), outputBoundsSRS='EPSG:3857',
+            srcSRS='EPSG:9876', dstSRS='EPSG:3857', resampleAlg='bilinear'
+        )
+        assert mock_gdal.Open.call_count == 2
+        mock_gdal.BuildVRT.assert_called_once_with('', [mock_gdal.Open.return_value] * 2)
+        mock_gdal.Warp.assert_called_once_with('', mock_gdal.BuildVRT.return_value, options=mock_gdal.WarpOptions.return_value)
+        assert status.current_files == [mock_gdal.Warp.return_value]
+        building.translate_heightfiles(status)
+        outpath = path.join(building.FINALIZED_DIR, building.FINAL_HEIGHT_FILENAME_FORMAT.format(0))
+        mock_gdal.Translate.assert_called_once_with(outpath, mock_gdal.Warp.return_value, format='ENVI')
+        assert status.result_files[0] == outpath
+        gdal_util.reset_engine()
+
+@mock.patch('mapcreator.building.call_command')
+def test_process_satellite_in_process(mock_call):
+    mock_gdal = mock.MagicMock()
+    with mock.patch('mapcreator.gdal_util.gdal', mock_gdal):
+        gdal_util.reset_engine()
+        state = State()
+        state.set_window(0, 7, 2, 1)
+        warped = mock_gdal.Warp.return_value
+        warped.ReadAsArray.return_value = SATELLITE_IMAGE
+        warped.RasterXSize, warped.RasterYSize, warped.RasterCount = 7, 300, 3
+        status = SatelliteStatus(0, ['test.tif'], state)
+        building.init_build()
+        building.process_satellite_with_gdal(status)
+        building.encode_satellite(status)
+        mock_call.assert_not_called()
+        outpath = path.join(building.FINALIZED_DIR, building.FINAL_SATELLITE_FORMAT.format(0))
+        # The warped pixels are read into memory and encoded there, without a raw copy
+        mock_gdal.Translate.assert_not_called()
+        assert not path.exists(path.join(building.BUILD_DIR, building.INTERMEDIATE_SATELLITE_RAW_FORMAT.format(0)))
+        with open(outpath, 'rb') as f:
+            assert np.array_equal(png.decode_png(f.read()), np.moveaxis(SATELLITE_IMAGE, 0, -1))
+        assert status.result_files == [outpath]
+        gdal_util.reset_engine()
+
+@mock.patch('mapcreator.building.call_command')
+def test_process_optimized_satellite_in_process(mock_call):
+    mock_gdal = mock.MagicMock()
+    with mock.patch('mapcreator.gdal_util.gdal', mock_gdal):
+        gdal_util.reset_engine()
+        state = State()
+        state.set_window(0, 7, 2, 1)
+        status = SatelliteStatus(0, optimized_sources(state, ('a.tif',)), state)
+        building.process_satellite_with_gdal(status)
+        mock_call.assert_not_called()
+        assert mock_gdal.WarpOptions.call_args[1]['options'] == ['-ovr', '2']
+        gdal_util.reset_engine()
+
+def build_stages(state):
+    return (
+        building.pipeline_stages('height', HeightMapStatus(0, [], state), building.HEIGHTMAP_ACTIONS)
+        + building.pipeline_stages('osm', OSMStatus(0, [], state), building.OSM_ACTIONS)
+        + building.pipeline_stages('satellite', SatelliteStatus(0, [], state), building.SATELLITE_ACTIONS)
+    )
+
+def test_pipeline_stages():
+    stages = build_stages(State())
+    names = [stage.name for stage in stages]
+    waits = scheduler.dependencies(stages)
+    # The pipelines only meet at the trail graph, which needs the finished heightmap
+    assert waits[names.index('osm:load_osm')] == set()
+    assert waits[names.index('satellite:check_projection_window')] == set()
+    assert waits[names.index('osm:write_trail_graph')] == {
+        names.index('osm:apply_filters'), names.index('height:encode_heightfiles')
+    }
+    assert stages[names.index('height:write_contours')].inputs == ('height:height files',)
+    assert waits[names.index('satellite:write_satellite_textures')] == {names.index('satellite:encode_satellite')}
+    assert stages[names.index('satellite:check_projection_window')].holds == ('satellite', building.SOURCE_INDEX_RESOURCE)
+
+def test_pipeline_stages_of_undeclared_actions():
+    def first(status, debug):
+        status.add_result_file('first')
+    def second(status, debug):
+        status.add_result_file('second' if debug else 'no debug')
+    status = HeightMapStatus(0, [], State())
+    stages = building.pipeline_stages('height', status, (first, second), True)
+    assert stages[1].inputs == stages[0].outputs == ('height:first',)
+    assert scheduler.run_stages(stages) == []
+    assert status.result_files == ['first', 'second']
 
 def teardown_function(function):
     if path.exists(building.BUILD_DIR):
@@ -33,6 +33,21 @@ def test_status_when_state_exists():
     assert str(DummyState()) in result.output
 
 
+@patch('mapcreator.persistence.state_exists', lambda: True)
+@patch('mapcreator.persistence.state_path', lambda: 'my_persistence_location')
+@patch('mapcreator.gdal_util.GdalinfoCache.load')
+def test_status_shows_source_metadata(mock_load):
+    state = State()
+    state.height_files = ['/data/n37w113.img']
+    mock_load.return_value.get.return_value = 'extent (1, 2) - (3, 4)'
+    runner = CliRunner()
+    with patch('mapcreator.persistence.load_state', lambda: state):
+        result = runner.invoke(cli, ['status'])
+    assert result.exit_code == 0
+    mock_load.return_value.get.assert_called_once_with('/data/n37w113.img')
+    mock_load.return_value.save.assert_called_once_with()
+    assert 'n37w113.img: extent (1, 2) - (3, 4)' in result.output
+
 @patch('mapcreator.persistence.state_exists', lambda: False)
 @patch('mapcreator.persistence.init_state', return_value = DummyState())
 def test_init_when_state_not_exists(mock_init):
@@ -64,6 +79,15 @@ def test_add_height_files(mock_add):
     mock_add.assert_called_once_with(('test1.txt', 'test2.txt'), 'add_height_file')
     assert result.exit_code == 0
 
+@patch('mapcreator.cli.add_files')
+@patch('mapcreator.cli.expand_source_files', return_value=('dem/a.img', 'dem/b.img'))
+def test_add_height_files_in_bulk(mock_expand, mock_add):
+    runner = CliRunner()
+    result = runner.invoke(cli, ['add_height_files', '-d', 'dem', '-p', '*.img', '-m', 'list.txt'])
+    mock_expand.assert_called_once_with((), ('dem',), (), ('list.txt',), '*.img')
+    mock_add.assert_called_once_with(('dem/a.img', 'dem/b.img'), 'add_height_file')
+    assert result.exit_code == 0
+
 @patch('mapcreator.persistence.save_state')
 def test_add_zero_osm_files(mock_save):
     runner = CliRunner()
@@ -237,6 +261,521 @@ def test_set_invalid_satellite_resolution(mock_save, mock_state):
     assert 'ERROR: Invalid resolution' in result.output
 
 
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_probe_threads')
+@patch('mapcreator.persistence.save_state')
+def test_set_probe_threads(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_probe_threads', '16'])
+    mock_state.assert_called_once_with(16)
+    assert mock_save.call_count == 1
+    assert result.exit_code == 0
+    assert 'SUCCESS: Source file probing threads set to 16' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_probe_threads')
+@patch('mapcreator.persistence.save_state')
+def test_set_invalid_probe_threads(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_probe_threads', '0'])
+    mock_state.assert_not_called()
+    assert mock_save.call_count == 0
+    assert result.exit_code == 0
+    assert 'ERROR: Invalid thread count' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_build_workers')
+@patch('mapcreator.persistence.save_state')
+def test_set_build_workers(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_build_workers', '2'])
+    mock_state.assert_called_once_with(2)
+    assert mock_save.call_count == 1
+    assert result.exit_code == 0
+    assert 'SUCCESS: Build workers set to 2' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_build_workers')
+@patch('mapcreator.persistence.save_state')
+def test_set_invalid_build_workers(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_build_workers', '17'])
+    mock_state.assert_not_called()
+    assert mock_save.call_count == 0
+    assert result.exit_code == 0
+    assert 'ERROR: Invalid thread count' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_vector_tile_zooms')
+@patch('mapcreator.persistence.save_state')
+def test_set_vector_tiles(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_vector_tiles', '10', '16'])
+    mock_state.assert_called_once_with(10, 16)
+    assert mock_save.call_count == 1
+    assert result.exit_code == 0
+    assert 'SUCCESS: Vector tiles enabled for zoom levels 10-16' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_vector_tile_zooms')
+@patch('mapcreator.persistence.save_state')
+def test_set_invalid_vector_tiles(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_vector_tiles', '16', '10'])
+    mock_state.assert_not_called()
+    assert mock_save.call_count == 0
+    assert result.exit_code == 0
+    assert 'ERROR: Minimum zoom level' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'clear_vector_tiles')
+@patch('mapcreator.persistence.save_state')
+def test_clear_vector_tiles(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['clear_vector_tiles'])
+    mock_state.assert_called()
+    assert mock_save.call_count == 1
+    assert result.exit_code == 0
+    assert 'SUCCESS: Vector tile output disabled!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_height_tiles')
+@patch('mapcreator.persistence.save_state')
+def test_set_height_tiles(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_height_tiles', '4', '2'])
+    mock_state.assert_called_once_with(4, 2)
+    assert mock_save.call_count == 1
+    assert result.exit_code == 0
+    assert 'SUCCESS: Height files will be built in 4x2 tiles' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_height_tiles')
+@patch('mapcreator.persistence.save_state')
+def test_set_invalid_height_tiles(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_height_tiles', '4', '33'])
+    mock_state.assert_not_called()
+    assert mock_save.call_count == 0
+    assert result.exit_code == 0
+    assert 'ERROR: Invalid tile count 33!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'clear_height_tiles')
+@patch('mapcreator.persistence.save_state')
+def test_clear_height_tiles(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['clear_height_tiles'])
+    mock_state.assert_called()
+    assert mock_save.call_count == 1
+    assert result.exit_code == 0
+    assert 'SUCCESS: Height file tiling cleared!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_height_lods')
+@patch('mapcreator.persistence.save_state')
+def test_set_height_lods(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_height_lods', '4', '--reduction', 'max'])
+    mock_state.assert_called_once_with(4, 'max')
+    assert mock_save.call_count == 1
+    assert result.exit_code == 0
+    assert 'SUCCESS: Height file detail levels set to 4 (max reduction)' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_height_lods')
+@patch('mapcreator.persistence.save_state')
+def test_set_invalid_height_lods(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_height_lods', '0'])
+    mock_state.assert_not_called()
+    assert mock_save.call_count == 0
+    assert result.exit_code == 0
+    assert 'ERROR: Invalid number of detail levels 0!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'clear_height_lods')
+@patch('mapcreator.persistence.save_state')
+def test_clear_height_lods(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['clear_height_lods'])
+    mock_state.assert_called()
+    assert mock_save.call_count == 1
+    assert result.exit_code == 0
+    assert 'SUCCESS: Height file detail levels cleared!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_height_encoding')
+@patch('mapcreator.persistence.save_state')
+def test_set_height_encoding(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_height_encoding', 'int16', '--max-error', '0.5'])
+    mock_state.assert_called_once_with('int16', 0.5)
+    assert mock_save.call_count == 1
+    assert result.exit_code == 0
+    assert 'SUCCESS: Height file encoding set to int16' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_height_encoding')
+@patch('mapcreator.persistence.save_state')
+def test_set_height_encoding_with_invalid_error(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_height_encoding', 'int16', '--max-error', '0'])
+    mock_state.assert_not_called()
+    assert mock_save.call_count == 0
+    assert 'ERROR: Invalid maximum error 0.0!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_normal_map')
+@patch('mapcreator.persistence.save_state')
+def test_set_normal_map(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_normal_map', '--exaggeration', '1.5'])
+    mock_state.assert_called_once_with(1.5)
+    assert mock_save.call_count == 1
+    assert 'SUCCESS: Normal map enabled with vertical exaggeration 1.5' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'clear_normal_map')
+@patch('mapcreator.persistence.save_state')
+def test_clear_normal_map(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['clear_normal_map'])
+    mock_state.assert_called()
+    assert 'SUCCESS: Normal map disabled!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_hillshade')
+@patch('mapcreator.persistence.save_state')
+def test_set_hillshade(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_hillshade', '--azimuth', '270', '--altitude', '30'])
+    mock_state.assert_called_once_with(270.0, 30.0)
+    assert mock_save.call_count == 1
+    assert 'SUCCESS: Hillshade enabled with light from azimuth 270.0 at altitude 30.0' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_hillshade')
+@patch('mapcreator.persistence.save_state')
+def test_set_hillshade_with_invalid_altitude(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_hillshade', '--altitude', '95'])
+    mock_state.assert_not_called()
+    assert mock_save.call_count == 0
+    assert 'ERROR: Invalid altitude 95.0!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'clear_hillshade')
+@patch('mapcreator.persistence.save_state')
+def test_clear_hillshade(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['clear_hillshade'])
+    mock_state.assert_called()
+    assert 'SUCCESS: Hillshade disabled!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_sky_view')
+@patch('mapcreator.persistence.save_state')
+def test_set_sky_view(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_sky_view', '--directions', '32', '--radius', '2000'])
+    mock_state.assert_called_once_with(32, 2000.0)
+    assert mock_save.call_count == 1
+    assert 'SUCCESS: Sky-view factor enabled with 32 directions within 2000.0 m' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_sky_view')
+@patch('mapcreator.persistence.save_state')
+def test_set_sky_view_with_invalid_directions(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_sky_view', '--directions', '2'])
+    mock_state.assert_not_called()
+    assert 'ERROR: Invalid number of directions 2!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'clear_sky_view')
+@patch('mapcreator.persistence.save_state')
+def test_clear_sky_view(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['clear_sky_view'])
+    mock_state.assert_called()
+    assert 'SUCCESS: Sky-view factor disabled!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_satellite_encoding')
+@patch('mapcreator.persistence.save_state')
+def test_set_satellite_encoding(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_satellite_encoding', 'jpeg', '--quality', '85'])
+    mock_state.assert_called_once_with('jpeg', 85)
+    assert mock_save.call_count == 1
+    assert 'SUCCESS: Satellite/aerial image encoding set to jpeg' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_satellite_encoding')
+@patch('mapcreator.persistence.save_state')
+def test_set_satellite_encoding_invalid_quality(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_satellite_encoding', 'png', '--quality', '10'])
+    mock_state.assert_not_called()
+    assert 'ERROR: Invalid quality 10!' in result.output
+    assert '(Should be between 0 and 9 for png)' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'clear_satellite_encoding')
+@patch('mapcreator.persistence.save_state')
+def test_clear_satellite_encoding(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['clear_satellite_encoding'])
+    mock_state.assert_called()
+    assert 'SUCCESS: Satellite/aerial image encoding reset to png!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_satellite_mipmaps')
+@patch('mapcreator.persistence.save_state')
+def test_set_satellite_mipmaps(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_satellite_mipmaps', '--filter', 'lanczos'])
+    mock_state.assert_called_once_with('lanczos')
+    assert mock_save.call_count == 1
+    assert 'SUCCESS: Satellite/aerial image mipmaps enabled with the lanczos filter' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'clear_satellite_mipmaps')
+@patch('mapcreator.persistence.save_state')
+def test_clear_satellite_mipmaps(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['clear_satellite_mipmaps'])
+    mock_state.assert_called()
+    assert 'SUCCESS: Satellite/aerial image mipmaps disabled!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_terrain_mesh')
+@patch('mapcreator.persistence.save_state')
+def test_set_terrain_mesh(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_terrain_mesh', '--max-error', '0.5'])
+    mock_state.assert_called_once_with(0.5)
+    assert mock_save.call_count == 1
+    assert 'SUCCESS: Terrain mesh enabled with maximum error 0.5 m' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'clear_terrain_mesh')
+@patch('mapcreator.persistence.save_state')
+def test_clear_terrain_mesh(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['clear_terrain_mesh'])
+    mock_state.assert_called()
+    assert 'SUCCESS: Terrain mesh disabled!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_contours')
+@patch('mapcreator.persistence.save_state')
+def test_set_contours(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_contours', '10', '--tolerance', '0.5'])
+    mock_state.assert_called_once_with(10.0, 0.5)
+    assert mock_save.call_count == 1
+    assert 'SUCCESS: Contour lines enabled every 10.0 m' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_contours')
+@patch('mapcreator.persistence.save_state')
+def test_set_contours_invalid_interval(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_contours', '0'])
+    mock_state.assert_not_called()
+    assert 'ERROR: Invalid interval 0.0!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'clear_contours')
+@patch('mapcreator.persistence.save_state')
+def test_clear_contours(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['clear_contours'])
+    mock_state.assert_called()
+    assert 'SUCCESS: Contour lines disabled!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_height_engine')
+@patch('mapcreator.persistence.save_state')
+def test_set_height_engine(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_height_engine', 'numpy'])
+    mock_state.assert_called_once_with('numpy')
+    assert mock_save.call_count == 1
+    assert result.exit_code == 0
+    assert 'SUCCESS: Height resampling engine set to numpy' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'clear_height_engine')
+@patch('mapcreator.persistence.save_state')
+def test_clear_height_engine(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['clear_height_engine'])
+    mock_state.assert_called()
+    assert mock_save.call_count == 1
+    assert 'SUCCESS: Height resampling engine reset to gdal!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'clear_height_encoding')
+@patch('mapcreator.persistence.save_state')
+def test_clear_height_encoding(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['clear_height_encoding'])
+    mock_state.assert_called()
+    assert mock_save.call_count == 1
+    assert result.exit_code == 0
+    assert 'SUCCESS: Height file encoding reset to float32!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_resource_budget')
+@patch('mapcreator.persistence.save_state')
+def test_set_resource_budget(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_resource_budget', '--threads', '8', '--memory', '4096'])
+    mock_state.assert_called_once_with(8, 4096)
+    assert mock_save.call_count == 1
+    assert result.exit_code == 0
+    assert 'SUCCESS: Resource budget set to 8 threads and 4096 MB memory' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_resource_budget')
+@patch('mapcreator.persistence.save_state')
+def test_set_empty_resource_budget(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_resource_budget'])
+    mock_state.assert_not_called()
+    assert mock_save.call_count == 0
+    assert result.exit_code == 0
+    assert 'ERROR: Give at least one of --threads and --memory!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'clear_resource_budget')
+@patch('mapcreator.persistence.save_state')
+def test_clear_resource_budget(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['clear_resource_budget'])
+    mock_state.assert_called()
+    assert mock_save.call_count == 1
+    assert result.exit_code == 0
+    assert 'SUCCESS: Resource budget cleared!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_tile_cache')
+@patch('mapcreator.persistence.save_state')
+def test_set_tile_cache(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_tile_cache', '--directory', '/tmp/tiles', '--max-size', '2048'])
+    mock_state.assert_called_once_with('/tmp/tiles', 2048)
+    assert mock_save.call_count == 1
+    assert 'SUCCESS: Reprojected tile cache set to /tmp/tiles (up to 2048 MB)' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_tile_cache')
+@patch('mapcreator.persistence.save_state')
+def test_set_tile_cache_too_small(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_tile_cache', '--max-size', '1'])
+    mock_state.assert_not_called()
+    assert mock_save.call_count == 0
+    assert 'ERROR: Invalid amount of memory 1 MB!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'clear_tile_cache')
+@patch('mapcreator.persistence.save_state')
+def test_clear_tile_cache(mock_save, mock_state): 
+    runner = CliRunner()
+    result = runner.invoke(cli, ['clear_tile_cache'])
+    mock_state.assert_called()
+    assert 'SUCCESS: Reprojected tile cache disabled!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_satellite_palette')
+@patch('mapcreator.persistence.save_state')
+def test_set_satellite_palette(mock_save, mock_state):
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_satellite_palette', '64', '--method', 'median-cut', '--dither'])
+    mock_state.assert_called_once_with(64, 'median-cut', True)
+    assert mock_save.call_count == 1
+    assert 'SUCCESS: Satellite/aerial image palette set to 64 colors (median-cut, dithered)' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_satellite_palette')
+@patch('mapcreator.persistence.save_state')
+def test_set_satellite_palette_invalid(mock_save, mock_state):
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_satellite_palette', '300'])
+    mock_state.assert_not_called()
+    assert mock_save.call_count == 0
+    assert 'ERROR: Invalid number of colors 300!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'clear_satellite_palette')
+@patch('mapcreator.persistence.save_state')
+def test_clear_satellite_palette(mock_save, mock_state):
+    runner = CliRunner()
+    result = runner.invoke(cli, ['clear_satellite_palette'])
+    mock_state.assert_called()
+    assert 'SUCCESS: Satellite/aerial image palette disabled!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_satellite_texture')
+@patch('mapcreator.persistence.save_state')
+def test_set_satellite_texture(mock_save, mock_state):
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_satellite_texture'])
+    mock_state.assert_called_once_with('etc2')
+    assert mock_save.call_count == 1
+    assert 'SUCCESS: Satellite/aerial GPU texture set to etc2' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'set_satellite_texture')
+@patch('mapcreator.persistence.save_state')
+def test_set_satellite_texture_invalid(mock_save, mock_state):
+    runner = CliRunner()
+    result = runner.invoke(cli, ['set_satellite_texture', '--format', 'dxt1'])
+    mock_state.assert_not_called()
+    assert result.exit_code != 0
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'clear_satellite_texture')
+@patch('mapcreator.persistence.save_state')
+def test_clear_satellite_texture(mock_save, mock_state):
+    runner = CliRunner()
+    result = runner.invoke(cli, ['clear_satellite_texture'])
+    mock_state.assert_called()
+    assert 'SUCCESS: Satellite/aerial GPU texture disabled!' in result.output
+
+@patch('mapcreator.persistence.load_state')
+@patch('mapcreator.cli.optimize_satellite_sources', return_value=True)
+def test_optimize_satellite_files(mock_optimize, mock_load):
+    state = State()
+    state.satellite_files = ['/data/a.tif']
+    mock_load.return_value = state
+    runner = CliRunner()
+    result = runner.invoke(cli, ['optimize_satellite_files', '--force'])
+    mock_optimize.assert_called_once_with(state, ['/data/a.tif'], True)
+    assert 'SUCCESS: Satellite/aerial files optimized!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch('mapcreator.cli.optimize_satellite_sources')
+def test_optimize_satellite_files_without_files(mock_optimize):
+    runner = CliRunner()
+    result = runner.invoke(cli, ['optimize_satellite_files'])
+    mock_optimize.assert_not_called()
+    assert 'No satellite/aerial files have been added!' in result.output
+
+@patch('mapcreator.persistence.load_state', lambda: State())
+@patch.object(mapcreator.state.State, 'clear_optimized_satellite_files')
+@patch('mapcreator.persistence.save_state')
+def test_clear_optimized_satellite_files(mock_save, mock_state):
+    runner = CliRunner()
+    result = runner.invoke(cli, ['clear_optimized_satellite_files'])
+    mock_state.assert_called()
+    assert mock_save.call_count == 1
+    assert 'SUCCESS: Optimized satellite/aerial files removed!' in result.output
+
 @patch('mapcreator.persistence.load_state', lambda: State())
 @patch.object(mapcreator.state.State, 'clear_area_colors')
 @patch('mapcreator.persistence.save_state')
@@ -450,3 +989,11 @@ def test_reset_when_state_not_exists(mock_clear):
     assert result.exit_code == 0
     assert 'No project found in current working directory. No need to reset!' in result.output
 
+
+@patch('mapcreator.buildcache.BuildCache.clear')
+def test_clear_build_cache(mock_clear):
+    runner = CliRunner()
+    result = runner.invoke(cli, ['clear_build_cache'])
+    mock_clear.assert_called_once_with()
+    assert result.exit_code == 0
+    assert 'SUCCESS: Build cache removed!' in result.output
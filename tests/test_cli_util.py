@@ -111,9 +111,11 @@ class TestCliUtil:
     def test_add_files(self, mock_save, mock_state, mock_echoes):
         mock_state.return_value = FileAddResult.SUCCESS
         cli_util.add_files(('test1.txt', 'test2.txt'), 'add_height_file')
-        mock_state.assert_any_call('test1.txt')
-        mock_state.assert_any_call('test2.txt')
+        mock_state.assert_any_call('test1.txt', set())
+        mock_state.assert_any_call('test2.txt', set())
         assert mock_state.call_count == 2
+        # The files are looked up in one set for the whole call
+        assert mock_state.call_args_list[0][0][1] is mock_state.call_args_list[1][0][1]
         assert mock_save.call_count == 1
         mock_echoes.success.assert_called()
 
@@ -123,9 +125,9 @@ class TestCliUtil:
     def test_add_files_no_files_exist(self, mock_save, mock_state, mock_echoes):
         mock_state.return_value = FileAddResult.DOESNT_EXIST
         cli_util.add_files(('test1.txt','test2.txt','test3.txt'), 'add_osm_file')
-        mock_state.assert_any_call('test1.txt')
-        mock_state.assert_any_call('test2.txt')
-        mock_state.assert_any_call('test3.txt')
+        mock_state.assert_any_call('test1.txt', set())
+        mock_state.assert_any_call('test2.txt', set())
+        mock_state.assert_any_call('test3.txt', set())
         assert mock_state.call_count == 3
         assert mock_save.call_count == 0 # Don't save if there's no changes
         for i in range(1,3):
@@ -137,7 +139,7 @@ class TestCliUtil:
     def test_add_files_all_already_added(self, mock_save, mock_state, mock_echoes):
         mock_state.return_value = FileAddResult.ALREADY_ADDED
         cli_util.add_files(('test3.txt',), 'add_height_file')
-        mock_state.assert_called_once_with('test3.txt')
+        mock_state.assert_called_once_with('test3.txt', set())
         assert mock_save.call_count == 0
         mock_echoes.warn.assert_any_call('test3.txt has already been added to this project')
 
@@ -145,7 +147,7 @@ class TestCliUtil:
     @patch.object(mapcreator.state.State, 'add_osm_file')
     @patch('mapcreator.persistence.save_state')
     def test_add_files_some_files_ok(self, mock_save, mock_state, mock_echoes):
-        def add_side_effect(filename):
+        def add_side_effect(filename, fset):
             if filename in ('1', '11', '21'):
                 return FileAddResult.SUCCESS
             else:
@@ -217,6 +219,114 @@ class TestCliUtil:
         mock_error.reset_mock()
         assert not cli_util.validate_resolution(0.05, 0.1, 0.5)
         mock_error.assert_called()
-        
-        
-    
\ No newline at end of file
+
+    def test_validate_zoom_range(self, mock_echoes):
+        mock_error = mock_echoes.error
+        assert cli_util.validate_zoom_range(0, 20, 0, 20)
+        assert cli_util.validate_zoom_range(12, 12, 0, 20)
+        mock_error.assert_not_called()
+        assert not cli_util.validate_zoom_range(-1, 10, 0, 20)
+        assert not cli_util.validate_zoom_range(5, 21, 0, 20)
+        assert not cli_util.validate_zoom_range(14, 10, 0, 20)
+        assert mock_error.call_count == 3
+
+    def test_validate_thread_count(self, mock_echoes):
+        mock_error = mock_echoes.error
+        assert cli_util.validate_thread_count(1, 1, 64)
+        assert cli_util.validate_thread_count(64, 1, 64)
+        mock_error.assert_not_called()
+        assert not cli_util.validate_thread_count(0, 1, 64)
+        assert not cli_util.validate_thread_count(65, 1, 64)
+        assert mock_error.call_count == 2
+
+    def test_expand_source_files(self, mock_echoes):
+        import os, shutil
+        from os import path
+        root = '.test_expand_source_files'
+        os.makedirs(path.join(root, 'sub'))
+        try:
+            for name in ('a.img', 'a.img.aux.xml', 'b.tif', path.join('sub', 'c.img')):
+                open(path.join(root, name), 'w').close()
+            with open(path.join(root, 'manifest.txt'), 'w') as f:
+                f.write('# Catalog\nb.tif\n\nsub/c.img # Southern tile\n')
+            assert cli_util.expand_source_files(('x.tif',), [root], pattern='*.img') == (
+                'x.tif', path.join(root, 'a.img'), path.join(root, 'sub', 'c.img')
+            )
+            assert cli_util.expand_source_files((), [root]) == (
+                path.join(root, 'a.img'), path.join(root, 'b.tif'), path.join(root, 'sub', 'c.img')
+            )
+            assert cli_util.expand_source_files((), patterns=[path.join(root, '**', '*.img')]) == (
+                path.join(root, 'a.img'), path.join(root, 'sub', 'c.img')
+            )
+            assert cli_util.glob_files(path.join(root, '**')) == [
+                path.join(root, 'a.img'), path.join(root, 'a.img.aux.xml'), path.join(root, 'b.tif'),
+                path.join(root, 'manifest.txt'), path.join(root, 'sub'), path.join(root, 'sub', 'c.img')
+            ]
+            assert cli_util.expand_source_files((), manifests=[path.join(root, 'manifest.txt')]) == (
+                path.join(root, 'b.tif'), path.join(root, 'sub/c.img')
+            )
+        finally:
+            shutil.rmtree(root)
+
+    @patch('mapcreator.persistence.load_state', lambda: State())
+    @patch('mapcreator.persistence.save_state')
+    def test_add_files_indexes_footprints(self, mock_save, mock_echoes):
+        from mapcreator.gdal_util import Gdalinfo
+        with patch('mapcreator.gdal_util.Gdalinfo.for_file', return_value=Gdalinfo()) as mock_forfile, \
+             patch('mapcreator.sourceindex.SourceIndex.save') as mock_index_save, \
+             patch('mapcreator.gdal_util.GdalinfoCache.save'):
+            cli_util.add_files((__file__,), 'add_height_file')
+            mock_forfile.assert_called_once_with(__file__)
+            mock_index_save.assert_called_once_with()
+            mock_forfile.reset_mock()
+            cli_util.add_files((__file__,), 'add_osm_file')
+            mock_forfile.assert_not_called()
+
+    def test_do_builds_with_cache(self, mock_echoes):
+        import os, shutil
+        from os import path
+        from mapcreator import building
+        from mapcreator.buildcache import BuildCache
+        root = '.test_do_builds'
+        original_finalized_dir = building.FINALIZED_DIR
+        building.FINALIZED_DIR = path.join(root, 'finalized')
+        runs = []
+        def write_file(name):
+            def action(status, debug):
+                runs.append(name)
+                outpath = path.join(building.FINALIZED_DIR, name)
+                with open(outpath, 'w') as f:
+                    f.write(name)
+                status.add_result_file(outpath)
+            return action
+        try:
+            os.makedirs(building.FINALIZED_DIR)
+            source = path.join(root, 'source.txt')
+            with open(source, 'w') as f:
+                f.write('source')
+            state = State()
+            pipelines = [
+                ('height', [source], building.HeightMapStatus, (write_file('heights.bin'),)),
+                ('osm', [source], building.OSMStatus, (write_file('trails.xml'),)),
+            ]
+            cache = BuildCache(path.join(root, 'build_cache'))
+            expected = [path.join(building.FINALIZED_DIR, 'heights.bin'), path.join(building.FINALIZED_DIR, 'trails.xml')]
+            assert cli_util.do_builds(pipelines, state, cache=cache) == (expected, False)
+            assert runs == ['heights.bin', 'trails.xml'] or runs == ['trails.xml', 'heights.bin']
+            shutil.rmtree(building.FINALIZED_DIR)
+            runs[:] = []
+            mock_echoes.reset_mock()
+            assert cli_util.do_builds(pipelines, state, cache=cache) == (expected, False)
+            assert runs == []
+            assert all(path.exists(f) for f in expected)
+            output = ' '.join(call[0][0] for call in mock_echoes.info.call_args_list)
+            assert 'Reusing the cached height build (1 stages)' in output
+            state.add_area_color('forest', 0, 255, 0)
+            mock_echoes.reset_mock()
+            assert cli_util.do_builds(pipelines, state, cache=cache) == (expected, False)
+            assert runs == ['trails.xml']
+            output = ' '.join(call[0][0] for call in mock_echoes.info.call_args_list)
+            assert 'Rebuilding osm (1 stages): area_colors changed' in output
+        finally:
+            building.FINALIZED_DIR = original_finalized_dir
+            shutil.rmtree(root)
@@ -0,0 +1,85 @@
+import numpy as np
+from os import remove
+from mapcreator import contours
+from mapcreator.envi import EnviRaster
+
+def raster(data, nodata = None):
+    return EnviRaster(data.astype(np.float32), EnviRaster.create_header(data.shape[1], data.shape[0], np.float32, nodata=nodata))
+
+def cone(lines = 50, samples = 60):
+    y, x = np.mgrid[0:lines, 0:samples]
+    return 100 - np.hypot(x - 30, y - 25) * 2.0
+
+def test_contour_levels():
+    assert contours.contour_levels(np.array([[3.0, 27.0], [np.nan, 10.0]]), 10).tolist() == [10, 20]
+    assert contours.contour_levels(np.array([[0.0, 20.0]]), 10).tolist() == [10]
+    assert contours.contour_levels(np.full((2, 2), np.nan), 10).tolist() == []
+
+def test_marching_squares_interpolates_crossings():
+    keys, points = contours.marching_squares(np.array([[0.0, 10.0], [0.0, 10.0]]), 2.5)
+    assert keys.shape == (1, 2)
+    assert sorted(points[0].tolist()) == [[0.25, 0.0], [0.25, 1.0]]
+
+def test_marching_squares_saddle_follows_center():
+    heights = np.array([[10.0, 0.0], [0.0, 10.0]])
+    keys, points = contours.marching_squares(heights, 4.0)
+    # The center (5) is above the level, so the low corners are cut off from each other
+    assert sorted(sorted(p) for p in points.tolist()) == [[[0.0, 0.6], [0.4, 1.0]], [[0.6, 0.0], [1.0, 0.4]]]
+    keys, points = contours.marching_squares(heights, 6.0)
+    assert sorted(sorted(p) for p in points.tolist()) == [[[0.0, 0.4], [0.4, 0.0]], [[0.6, 1.0], [1.0, 0.6]]]
+
+def test_join_segments_into_ring():
+    keys, points = contours.marching_squares(cone(), 80.0)
+    polylines = contours.join_segments(keys, points)
+    assert len(polylines) == 1
+    ring = polylines[0]
+    assert len(ring) == len(keys) + 1
+    assert np.array_equal(ring[0], ring[-1])
+    assert np.allclose(np.hypot(ring[:, 0] - 30, ring[:, 1] - 25), 10, atol=0.01)
+
+def test_join_segments_into_open_line():
+    y, x = np.mgrid[0:20, 0:30]
+    keys, points = contours.marching_squares(x + y * 0.5, 12.25)
+    polylines = contours.join_segments(keys, points)
+    assert len(polylines) == 1
+    ends = sorted(polylines[0][[0, -1]].tolist())
+    assert ends == [[2.75, 19.0], [12.25, 0.0]]
+
+def test_simplify():
+    line = np.array([[0.0, 0.0], [1.0, 0.1], [2.0, -0.1], [3.0, 5.0], [4.0, 0.0]])
+    assert contours.simplify(line, 0.5).tolist() == [[0.0, 0.0], [2.0, -0.1], [3.0, 5.0], [4.0, 0.0]]
+    assert len(contours.simplify(line, 0)) == 5
+    ring = contours.join_segments(*contours.marching_squares(cone(), 80.0))[0]
+    simplified = contours.simplify(ring, 0.25)
+    assert 4 < len(simplified) < len(ring) / 2
+    assert np.array_equal(simplified[0], simplified[-1])
+
+def test_trace_contours():
+    lines = contours.trace_contours(raster(cone()), 20)
+    # The 40 m circle is cut by the edges of the grid
+    assert [level for level, polyline in lines].count(40.0) > 1
+    assert [level for level, polyline in lines][-2:] == [60.0, 80.0]
+    for level, polyline in lines:
+        radius = (100 - level) / 2
+        assert np.allclose(np.hypot(polyline[:, 0] - 30, polyline[:, 1] - 25), radius, atol=0.05)
+
+def test_trace_contours_skips_nodata():
+    data = cone()
+    data[:, 30:] = -9999
+    lines = contours.trace_contours(raster(data, nodata=-9999), 20)
+    for level, polyline in lines:
+        assert polyline[:, 0].max() <= 29
+        assert not np.array_equal(polyline[0], polyline[-1])
+
+def test_save_contours():
+    lines = contours.trace_contours(raster(cone()), 20)
+    vertexpath = '.test_contours.vtx'
+    try:
+        table = contours.save_contours(lines, vertexpath)
+        vertices = np.fromfile(vertexpath, dtype='<f4').reshape(-1, 2)
+        assert [row[0] for row in table] == [level for level, polyline in lines]
+        for (level, first, count), (_, polyline) in zip(table, lines):
+            assert np.allclose(vertices[first:first + count], polyline, atol=1e-4)
+        assert len(vertices) == sum(count for level, first, count in table)
+    finally:
+        remove(vertexpath)
@@ -0,0 +1,68 @@
+import shutil
+import numpy as np
+from os import path, mkdir
+from mapcreator import envi
+from mapcreator.envi import EnviRaster
+
+TEMP_DIR = '.test_envi'
+
+GDAL_HEADER = """ENVI
+description = {
+heightfile0.bin}
+samples = 3
+lines = 2
+bands = 1
+header offset = 0
+file type = ENVI Standard
+data type = 2
+interleave = bsq
+byte order = 0
+map info = {Pseudo Mercator, 1, 1, -12500000, 4320000, 10, 10, WGS-84, units=Meters}
+band names = {
+Band 1}
+"""
+
+def setup_function(function):
+    if not path.exists(TEMP_DIR):
+        mkdir(TEMP_DIR)
+
+def test_read_gdal_header():
+    hdrpath = path.join(TEMP_DIR, 'test.hdr')
+    with open(hdrpath, 'w') as f:
+        f.write(GDAL_HEADER)
+    header = envi.read_header(hdrpath)
+    assert header['samples'] == '3'
+    assert header['band names'] == '{\nBand 1}'
+    assert envi.parse_list(header['map info'])[0] == 'Pseudo Mercator'
+
+def test_load_gdal_output():
+    binpath = path.join(TEMP_DIR, 'test.bin')
+    with open(envi.header_path(binpath), 'w') as f:
+        f.write(GDAL_HEADER)
+    np.arange(6, dtype='<i2').tofile(binpath)
+    raster = EnviRaster.load(binpath)
+    assert raster.data.shape == (2, 3)
+    assert raster.data[1, 2] == 5
+    assert raster.get_geotransform() == (-12500000, 10, 4320000, 10)
+    assert raster.get_bounds() == (-12500000, 4319980, -12499970, 4320000)
+
+def test_save_and_load():
+    binpath = path.join(TEMP_DIR, 'test.bin')
+    data = np.random.rand(4, 5).astype(np.float32)
+    header = EnviRaster.create_header(5, 4, np.float32, envi.format_map_info('Pseudo Mercator', 0, 0, 2, 2), nodata = -9999)
+    EnviRaster(data, header).save(binpath)
+    loaded = EnviRaster.load(binpath, mmap = True)
+    assert np.array_equal(loaded.data, data)
+    assert loaded.nodata == -9999
+
+def test_sample_bilinear():
+    data = np.array([[0, 10], [20, 30]], dtype=np.float32)
+    header = EnviRaster.create_header(2, 2, np.float32, envi.format_map_info('Pseudo Mercator', 0, 2, 1, 1))
+    raster = EnviRaster(data, header)
+    values = raster.sample_bilinear(np.array([0.5, 1.0, 1.5, 5.0]), np.array([1.5, 1.0, 0.5, 1.0]))
+    assert np.allclose(values[:3], [0, 15, 30])
+    assert np.isnan(values[3])
+
+def teardown_function(function):
+    if path.exists(TEMP_DIR):
+        shutil.rmtree(TEMP_DIR)
@@ -1,7 +1,30 @@
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from os import path
 from util import get_resource_path
 from mapcreator import gdal_util
 import mock
 PRECISION = 0.0001
+ORIGINAL_GDAL = gdal_util.gdal
+
+def setup_module(module):
+    gdal_util.gdal = None
+
+TEMP_DIR = '.test_gdal_util'
+
+def setup_function(function):
+    if not path.exists(TEMP_DIR):
+        os.mkdir(TEMP_DIR)
+
+def teardown_function(function):
+    if path.exists(TEMP_DIR):
+        shutil.rmtree(TEMP_DIR)
+
+def teardown_module(module):
+    gdal_util.gdal = ORIGINAL_GDAL
+    gdal_util.reset_engine()
 
 @mock.patch('subprocess.Popen')
 def test_gdal_coordinates(mock_popen):
@@ -12,4 +35,301 @@ def test_gdal_coordinates(mock_popen):
     assert abs(gdal_info.maxY - (36.0036116)) < PRECISION
 
     assert abs(gdal_info.maxX - (-112.4328512)) < PRECISION
-    assert abs(gdal_info.minY - (35.9338875)) < PRECISION
\ No newline at end of file
+    assert abs(gdal_info.minY - (35.9338875)) < PRECISION
+
+def test_gdal_coordinates_in_process():
+    with open(get_resource_path('test_satelliteimg_gdalinfo.txt'), 'r') as f:
+        info = json.load(f)
+    mock_gdal = mock.MagicMock()
+    mock_gdal.Info.return_value = info
+    with mock.patch('mapcreator.gdal_util.gdal', mock_gdal):
+        gdal_util.reset_engine()
+        gdal_info = gdal_util.Gdalinfo.for_file('test_satelliteimage.tif')
+        gdal_util.Gdalinfo.for_file('test_satelliteimage.tif')
+        # Probed files aren't kept open
+        assert mock_gdal.Open.call_args_list == [mock.call('test_satelliteimage.tif')] * 2
+        mock_gdal.Info.assert_called_with(mock_gdal.Open.return_value, format='json')
+        assert gdal_util.get_engine().datasets == {}
+        assert abs(gdal_info.minX - (-112.5047533)) < PRECISION
+        assert abs(gdal_info.maxY - (36.0036116)) < PRECISION
+        gdal_util.reset_engine()
+
+def test_engine_opens_datasets_per_thread():
+    mock_gdal = mock.MagicMock()
+    mock_gdal.Open.side_effect = lambda path: mock.MagicMock()
+    with mock.patch('mapcreator.gdal_util.gdal', mock_gdal):
+        gdal_util.reset_engine()
+        engine = gdal_util.get_engine()
+        first = engine.open('a.tif')
+        assert engine.open('a.tif') is first
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            other = executor.submit(engine.open, 'a.tif').result()
+        assert other is not first
+        assert mock_gdal.Open.call_count == 2
+        gdal_util.reset_engine()
+
+def test_engine_warp_to_outpath_takes_one_source():
+    mock_gdal = mock.MagicMock()
+    with mock.patch('mapcreator.gdal_util.gdal', mock_gdal):
+        gdal_util.reset_engine()
+        try:
+            gdal_util.get_engine().warp(['a.tif', 'b.tif'], 10, (0, 0, 1, 1), 'EPSG:4326', 'EPSG:3857', outpath='out.vrt')
+            assert False
+        except ValueError:
+            pass
+        mock_gdal.Warp.assert_not_called()
+        gdal_util.reset_engine()
+
+def test_engine_warps_sources_without_a_mosaic_to_outpath():
+    mock_gdal = mock.MagicMock()
+    with mock.patch('mapcreator.gdal_util.gdal', mock_gdal):
+        gdal_util.reset_engine()
+        gdal_util.get_engine().warp(['a.tif', 'b.tif'], 10, (0, 0, 1, 1), 'EPSG:3857', 'EPSG:3857', outpath='out.vrt', mosaic=False)
+        mock_gdal.BuildVRT.assert_not_called()
+        assert mock_gdal.Warp.call_args[0][0] == 'out.vrt'
+        assert len(mock_gdal.Warp.call_args[0][1]) == 2
+        gdal_util.reset_engine()
+
+def test_engine_optimize_checks_the_overviews():
+    mock_gdal = mock.MagicMock()
+    mock_gdal.CE_None = 0
+    with mock.patch('mapcreator.gdal_util.gdal', mock_gdal):
+        gdal_util.reset_engine()
+        engine = gdal_util.get_engine()
+        mock_gdal.Translate.return_value.BuildOverviews.return_value = 0
+        assert engine.optimize('out.tif', 'a.tif', [], [2, 4], 'average')
+        mock_gdal.Translate.return_value.BuildOverviews.return_value = 3 # CE_Failure
+        assert not engine.optimize('out.tif', 'a.tif', [], [2, 4], 'average')
+        gdal_util.reset_engine()
+
+def test_engine_warps_sources_at_an_overview_level_without_a_mosaic():
+    mock_gdal = mock.MagicMock()
+    with mock.patch('mapcreator.gdal_util.gdal', mock_gdal):
+        gdal_util.reset_engine()
+        gdal_util.get_engine().warp(['a.tif', 'b.tif'], 10, (0, 0, 1, 1), 'EPSG:3857', 'EPSG:3857', overview_level=2)
+        mock_gdal.BuildVRT.assert_not_called()
+        assert mock_gdal.Warp.call_args[0][1] == [mock_gdal.Open.return_value] * 2
+        gdal_util.reset_engine()
+
+def test_engine_cache_is_shared_by_pipelines():
+    mock_gdal = mock.MagicMock()
+    with mock.patch('mapcreator.gdal_util.gdal', mock_gdal):
+        gdal_util.reset_engine()
+        gdal_util.get_engine().reserve_cache(512)
+        gdal_util.get_engine().reserve_cache(256)
+        mock_gdal.SetCacheMax.assert_called_with(768 * 1024 * 1024)
+        gdal_util.reset_engine()
+
+def test_no_engine_without_bindings():
+    assert not gdal_util.has_gdal_bindings()
+    assert gdal_util.get_engine() is None
+
+def mock_gdalinfo_output(mock_popen):
+    with open(get_resource_path('test_satelliteimg_gdalinfo.txt'), 'rb') as f:
+        mock_popen.return_value.__enter__.return_value.communicate.return_value = (f.read(), b'')
+
+@mock.patch('subprocess.Popen')
+def test_gdal_metadata(mock_popen):
+    mock_gdalinfo_output(mock_popen)
+    gdal_info = gdal_util.Gdalinfo.for_file('test_satelliteimage.tif')
+    assert gdal_info.size == [6370, 7640]
+    assert gdal_info.pixel_size == [1.0, -1.0]
+    assert 'UTM' in gdal_info.crs
+    assert len(gdal_info.bands) == 3
+    assert gdal_info.bands[0]['type'] == 'Byte'
+    assert len(gdal_info.bands[0]['overviews']) == 5
+    assert gdal_info.nodata is None
+
+@mock.patch('subprocess.Popen')
+def test_gdalinfo_cache_probes_only_once(mock_popen):
+    mock_gdalinfo_output(mock_popen)
+    fpath = path.join(TEMP_DIR, 'image.tif')
+    cachepath = path.join(TEMP_DIR, 'cache', 'cache.json')
+    open(fpath, 'w').close()
+    cache = gdal_util.GdalinfoCache.load(cachepath)
+    first = cache.get(fpath)
+    cache.save()
+    assert path.exists(cachepath)
+    cache = gdal_util.GdalinfoCache.load(cachepath)
+    second = cache.get(fpath)
+    assert mock_popen.call_count == 1
+    assert second.to_dict() == first.to_dict()
+    assert not cache.changed
+
+@mock.patch('subprocess.Popen')
+def test_gdalinfo_cache_reprobes_changed_file(mock_popen):
+    mock_gdalinfo_output(mock_popen)
+    fpath = path.join(TEMP_DIR, 'image.tif')
+    cache = gdal_util.GdalinfoCache.load(path.join(TEMP_DIR, 'cache.json'))
+    open(fpath, 'w').close()
+    cache.get(fpath)
+    with open(fpath, 'w') as f:
+        f.write('changed')
+    cache.get(fpath)
+    assert mock_popen.call_count == 2
+
+@mock.patch('subprocess.Popen')
+def test_gdalinfo_cache_doesnt_cache_missing_files(mock_popen):
+    mock_gdalinfo_output(mock_popen)
+    cache = gdal_util.GdalinfoCache.load(path.join(TEMP_DIR, 'cache.json'))
+    cache.get(path.join(TEMP_DIR, 'missing.tif'))
+    assert not cache.changed
+    assert cache.entries == {}
+
+def test_gdalinfo_cache_ignores_corrupted_file():
+    cachepath = path.join(TEMP_DIR, 'cache.json')
+    with open(cachepath, 'w') as f:
+        f.write('{not json')
+    assert gdal_util.GdalinfoCache.load(cachepath).entries == {}
+
+def test_gdalinfo_cache_get_many_keeps_order():
+    import time
+    def slow_probe(fpath):
+        # Later files finish first
+        time.sleep(0.01 * (5 - int(fpath[-1])))
+        gdal_info = gdal_util.Gdalinfo()
+        gdal_info.minX = int(fpath[-1])
+        return gdal_info
+    cache = gdal_util.GdalinfoCache.load(path.join(TEMP_DIR, 'cache.json'))
+    files = ['missing{}'.format(i) for i in range(5)]
+    with mock.patch('mapcreator.gdal_util.Gdalinfo.for_file', side_effect=slow_probe) as mock_forfile:
+        infos = cache.get_many(files, 4)
+    assert [info.minX for info in infos] == [0, 1, 2, 3, 4]
+    assert mock_forfile.call_count == 5
+
+def write_geotiff(fpath, width, height, geotransform, epsg, nodata = None):
+    # Minimal little-endian GeoTIFF header with pixel scale, tiepoint and geokey tags
+    import struct
+    ulx, pixel_width, uly, pixel_height = geotransform
+    tags = [
+        (256, 4, [width]), (257, 4, [height]), (258, 3, [16]), (277, 3, [1]), (339, 3, [2]),
+        (33550, 12, [pixel_width, -pixel_height, 0.0]), (33922, 12, [0.0, 0.0, 0.0, ulx, uly, 0.0]),
+        (34735, 3, [1, 1, 0, 2, 1024, 0, 1, 1, 3072, 0, 1, epsg]),
+    ]
+    if nodata is not None:
+        tags.append((42113, 2, nodata))
+    formats = {2: 's', 3: 'H', 4: 'I', 12: 'd'}
+    header = struct.pack('<2sHI', b'II', 42, 8)
+    extra_offset = 8 + 2 + 12 * len(tags) + 4
+    entries = b''
+    extra = b''
+    for tag, valuetype, values in tags:
+        if valuetype == 2:
+            data = values.encode('ascii') + b'\x00'
+            count = len(data)
+        else:
+            data = struct.pack('<' + formats[valuetype] * len(values), *values)
+            count = len(values)
+        if len(data) <= 4:
+            entries += struct.pack('<HHI', tag, valuetype, count) + data.ljust(4, b'\x00')
+        else:
+            entries += struct.pack('<HHII', tag, valuetype, count, extra_offset + len(extra))
+            extra += data
+    with open(fpath, 'wb') as f:
+        f.write(header + struct.pack('<H', len(tags)) + entries + struct.pack('<I', 0) + extra)
+
+def test_native_geotiff_header():
+    fpath = path.join(TEMP_DIR, 'image.tif')
+    write_geotiff(fpath, 6370, 7640, (364380.0, 1.0, 3985300.0, -1.0), 32612, '-9999')
+    gdal_info = gdal_util.read_native_header(fpath)
+    # The same extent gdalinfo reports for the test satellite image
+    assert abs(gdal_info.minX - (-112.5047533)) < PRECISION
+    assert abs(gdal_info.maxY - (36.0036116)) < PRECISION
+    assert abs(gdal_info.maxX - (-112.4328512)) < PRECISION
+    assert abs(gdal_info.minY - (35.9338875)) < PRECISION
+    assert gdal_info.crs == 'EPSG:32612'
+    assert gdal_info.size == [6370, 7640]
+    assert gdal_info.pixel_size == [1.0, -1.0]
+    assert gdal_info.bands[0]['type'] == 'Int16'
+    assert gdal_info.nodata == -9999
+
+@mock.patch('subprocess.Popen')
+def test_native_header_skips_gdalinfo(mock_popen):
+    fpath = path.join(TEMP_DIR, 'image.tif')
+    write_geotiff(fpath, 100, 100, (-113.0, 0.01, 37.0, -0.01), 4326)
+    gdal_info = gdal_util.Gdalinfo.for_file(fpath)
+    assert mock_popen.call_count == 0
+    assert abs(gdal_info.minX - (-113.0)) < PRECISION
+    assert abs(gdal_info.minY - 36.0) < PRECISION
+
+@mock.patch('subprocess.Popen')
+def test_unknown_crs_falls_back_to_gdalinfo(mock_popen):
+    mock_gdalinfo_output(mock_popen)
+    fpath = path.join(TEMP_DIR, 'image.tif')
+    write_geotiff(fpath, 100, 100, (0.0, 1.0, 0.0, -1.0), 2393)
+    assert gdal_util.read_native_header(fpath) is None
+    gdal_info = gdal_util.Gdalinfo.for_file(fpath)
+    assert mock_popen.call_count == 1
+    assert abs(gdal_info.minX - (-112.5047533)) < PRECISION
+
+def write_hfa(fpath, width, height, ulx, uly, pixel_size, datum, nodata):
+    # Minimal ERDAS Imagine file: root -> layer -> (map info, projection -> datum, nodata)
+    import struct
+    def string(s):
+        data = s.encode('ascii') + b'\x00'
+        return struct.pack('<II', len(data), 0) + data
+    datas = {
+        'Layer_1': ('Eimg_Layer', struct.pack('<iiHHii', width, height, 0, 9, 64, 64)),
+        'Map_Info': ('Eprj_MapInfo', string('Geographic (Lat/Lon)') +
+            struct.pack('<II2d', 1, 0, ulx, uly) +
+            struct.pack('<II2d', 1, 0, ulx + (width - 1) * pixel_size, uly - (height - 1) * pixel_size) +
+            struct.pack('<II2d', 1, 0, pixel_size, pixel_size) + string('degrees')),
+        'Projection': ('Eprj_ProParameters', b''),
+        'Datum': ('Eprj_Datum', string(datum)),
+        'Eimg_NonInitializedValue': ('Eimg_NonInitializedValue', struct.pack('<IIiiHHf', 1, 0, 1, 1, 9, 0, nodata)),
+    }
+    tree = [('root', 'root', None), ('Layer_1', 'Eimg_Layer', 'root'), ('Map_Info', None, 'Layer_1'),
+        ('Projection', None, 'Layer_1'), ('Eimg_NonInitializedValue', None, 'Layer_1'), ('Datum', None, 'Projection')]
+    entry_size = 24 + 64 + 32 + 4
+    offsets = dict((name, 44 + i * entry_size) for i, (name, _, _) in enumerate(tree))
+    data_offset = 44 + len(tree) * entry_size
+    content = b''
+    data = b''
+    for name, _, parent in tree:
+        siblings = [n for n, _, p in tree if p == parent]
+        following = siblings[siblings.index(name) + 1:]
+        children = [n for n, _, p in tree if p == name]
+        entrytype, entrydata = datas.get(name, ('root', b''))
+        content += struct.pack('<6I', offsets[following[0]] if following else 0, 0,
+            offsets[parent] if parent else 0, offsets[children[0]] if children else 0,
+            data_offset + len(data) if entrydata else 0, len(entrydata))
+        content += name.encode('ascii').ljust(64, b'\x00') + entrytype.encode('ascii').ljust(32, b'\x00') + b'\x00' * 4
+        data += entrydata
+    with open(fpath, 'wb') as f:
+        f.write(b'EHFA_HEADER_TAG\x00' + struct.pack('<I', 20) + struct.pack('<iIIhI', 1, 0, 44, 128, 0)[:24])
+        f.seek(44)
+        f.write(content + data)
+
+def test_native_hfa_header():
+    fpath = path.join(TEMP_DIR, 'n37w113.img')
+    half_pixel = 0.5 / 10800
+    write_hfa(fpath, 10812, 10812, -113.0005556 + half_pixel, 37.0005556 - half_pixel, 1 / 10800, 'NAD83', -3.4028234e38)
+    gdal_info = gdal_util.Gdalinfo.for_file(fpath)
+    assert gdal_info.crs == 'EPSG:4269'
+    assert abs(gdal_info.minX - (-113.0005556)) < PRECISION
+    assert abs(gdal_info.maxY - 37.0005556) < PRECISION
+    assert abs(gdal_info.maxX - (-111.9994444)) < PRECISION
+    assert abs(gdal_info.minY - 35.9994444) < PRECISION
+    assert gdal_info.size == [10812, 10812]
+    assert gdal_info.bands[0]['type'] == 'Float32'
+    assert gdal_info.nodata < -3e38
+
+def test_native_envi_header():
+    import numpy as np
+    from mapcreator.envi import EnviRaster
+    fpath = path.join(TEMP_DIR, 'height.bin')
+    header = EnviRaster.create_header(20, 10, np.float32, nodata=-1)
+    header['map info'] = '{UTM, 1, 1, 364380, 3985300, 1, 1, 12, North, WGS-84, units=Meters}'
+    EnviRaster(np.zeros((10, 20), dtype=np.float32), header).save(fpath)
+    gdal_info = gdal_util.read_native_header(fpath)
+    assert gdal_info.crs == 'EPSG:32612'
+    assert abs(gdal_info.minX - (-112.5047533)) < PRECISION
+    assert abs(gdal_info.maxY - 36.0027459) < PRECISION
+    assert gdal_info.size == [20, 10]
+    assert gdal_info.nodata == -1
+
+def test_utm_to_lonlat():
+    lon, lat = gdal_util.utm_to_lonlat(500000, 0, 31)
+    assert abs(lon - 3) < 1e-9 and abs(lat) < 1e-9
+    lon, lat = gdal_util.utm_to_lonlat(500000, 10000000, 31, south = True)
+    assert abs(lon - 3) < 1e-9 and abs(lat) < 1e-9
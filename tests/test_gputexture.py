@@ -0,0 +1,74 @@
+import struct
+import numpy as np
+from mapcreator import gputexture
+
+def gradient(lines = 64, samples = 68):
+    y, x = np.mgrid[0:lines, 0:samples]
+    return np.stack([x * 255 // (samples - 1), y * 255 // (lines - 1), 255 - y * 255 // (lines - 1)], axis=-1).astype(np.uint8)
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b) ** 2)
+    return 10 * np.log10(255 ** 2 / mse)
+
+def test_blocks_roundtrip():
+    image = gradient(6, 9)
+    blocks = gputexture.to_blocks(image)
+    assert blocks.shape == (2, 3, 16, 3)
+    # Texels are numbered column by column
+    assert blocks[0, 0, 1].tolist() == image[1, 0].tolist()
+    assert blocks[0, 0, 4].tolist() == image[0, 1].tolist()
+    assert np.array_equal(gputexture.from_blocks(blocks, 6, 9), image)
+
+def test_encode_solid_block():
+    image = np.zeros((4, 4, 3), dtype=np.uint8)
+    image[:, :, 0] = 255
+    data = gputexture.encode_etc2(image)
+    # Differential mode with red 31 and no difference, table 0, and every texel at -2
+    assert data == bytes.fromhex('f8000002ffff0000')
+    assert gputexture.decode_etc2(data, 4, 4)[0, 0].tolist() == [253, 0, 0]
+
+def test_encode_etc2():
+    image = gradient()
+    data = gputexture.encode_etc2(image)
+    assert len(data) == 16 * 17 * 8
+    decoded = gputexture.decode_etc2(data, 68, 64)
+    assert decoded.shape == image.shape
+    assert psnr(decoded, image) > 35
+
+def test_encode_etc2_individual_mode():
+    # Halves too far apart for the differential mode
+    image = np.zeros((4, 4, 3), dtype=np.uint8)
+    image[:, 2:] = 255
+    data = gputexture.encode_etc2(image)
+    assert data[3] & 2 == 0
+    assert np.abs(gputexture.decode_etc2(data, 4, 4).astype(int) - image).max() <= 8
+
+def test_encode_etc2_pads_edges():
+    image = gradient()[:10, :7]
+    data = gputexture.encode_etc2(image)
+    assert len(data) == 3 * 2 * 8
+    assert psnr(gputexture.decode_etc2(data, 7, 10), image) > 30
+
+def test_encode_etc2_grayscale():
+    image = gradient()[:, :, 0]
+    decoded = gputexture.decode_etc2(gputexture.encode_etc2(image), 68, 64)
+    assert np.array_equal(decoded[:, :, 0], decoded[:, :, 2])
+    assert psnr(decoded[:, :, 0], image) > 35
+
+def test_encode_etc2_in_parallel():
+    image = gradient(300, 40)
+    assert gputexture.encode_etc2(image, workers=2) == gputexture.encode_etc2(image)
+
+def test_ktx_bytes():
+    levels = [gputexture.encode_etc2(gradient(8, 12)), gputexture.encode_etc2(gradient(4, 6)[:4, :6])]
+    content = gputexture.ktx_bytes(levels, 12, 8)
+    assert content[:12] == gputexture.KTX_IDENTIFIER
+    assert struct.unpack('<I', content[12:16])[0] == 0x04030201
+    assert gputexture.read_ktx(content) == (0x9274, 12, 8, levels)
+
+def test_unknown_texture_format():
+    try:
+        gputexture.encode_texture(gradient(), 'astc')
+        assert False
+    except ValueError:
+        pass
@@ -0,0 +1,92 @@
+import numpy as np
+import zlib
+import os
+import shutil
+from os import path
+from mapcreator import heightcodec
+from mapcreator.envi import EnviRaster, format_map_info
+
+TEMP_DIR = '.test_heightcodec'
+
+def setup_function(function):
+    if not path.exists(TEMP_DIR):
+        os.mkdir(TEMP_DIR)
+
+def teardown_function(function):
+    if path.exists(TEMP_DIR):
+        shutil.rmtree(TEMP_DIR)
+
+def height_raster(nodata = None):
+    y, x = np.mgrid[0:60, 0:80]
+    data = (1200 + 300 * np.sin(x / 10.0) * np.cos(y / 15.0)).astype(np.float32)
+    header = EnviRaster.create_header(80, 60, np.float32, format_map_info('Mercator', 0.0, 600.0, 10.0, 10.0), nodata=nodata)
+    if nodata is not None:
+        data[5, 7] = nodata
+    return EnviRaster(data, header)
+
+def assert_roundtrip(encoding, max_error = None):
+    raster = height_raster(-9999)
+    encoded = heightcodec.encode(raster, encoding, max_error)
+    decoded = heightcodec.decode(encoded.header, encoded.payload)
+    assert np.isnan(decoded[5, 7])
+    valid = raster.data != -9999
+    error = np.abs(decoded[valid] - raster.data[valid]).max()
+    assert error <= encoded.max_error + 1e-3
+    if max_error is not None:
+        assert error <= max_error + 1e-3
+    return encoded
+
+def test_float32_is_lossless():
+    encoded = assert_roundtrip('float32')
+    assert encoded.max_error == 0
+
+def test_int16_and_uint16():
+    for encoding in ('int16', 'uint16'):
+        encoded = assert_roundtrip(encoding)
+        assert encoded.max_error < 0.01
+        assert len(encoded.payload) == 80 * 60 * 2
+        assert encoded.header['data type'] in ('2', '12')
+
+def test_error_bound():
+    encoded = assert_roundtrip('int16', 0.5)
+    assert abs(encoded.max_error - 0.5) < 1e-9
+    assert_roundtrip('delta-zlib', 0.05)
+    assert_roundtrip('terrain-rgb', 0.01)
+
+def test_error_bound_that_cant_be_kept():
+    try:
+        heightcodec.encode(height_raster(), 'int16', 0.001)
+    except ValueError as e:
+        assert 'error below 0.001' in str(e)
+    else:
+        assert False, 'Expected a ValueError'
+
+def test_delta_zlib_is_smaller():
+    raster = height_raster()
+    raw = zlib.compress(heightcodec.encode(raster, 'float32').payload)
+    encoded = assert_roundtrip('delta-zlib', 0.05)
+    assert len(encoded.payload) < len(raw) / 2
+
+def test_terrain_rgb_png():
+    encoded = assert_roundtrip('terrain-rgb')
+    assert encoded.extension == 'png'
+    assert encoded.payload.startswith(b'\x89PNG')
+    assert abs(encoded.max_error - 0.05) < 1e-9
+
+def test_save_and_load():
+    raster = height_raster(-9999)
+    binpath = path.join(TEMP_DIR, 'heightfile0.bin')
+    written = heightcodec.encode(raster, 'terrain-rgb').save(binpath)
+    assert written == [path.join(TEMP_DIR, 'heightfile0.png'), path.join(TEMP_DIR, 'heightfile0.hdr')]
+    loaded = heightcodec.load(binpath)
+    assert loaded.get_geotransform() == raster.get_geotransform()
+    assert np.isnan(loaded.data[5, 7])
+    assert abs(loaded.data[0, 0] - raster.data[0, 0]) <= 0.05 + 1e-3
+
+def test_benchmark():
+    raster = height_raster()
+    raw_size, encoded_size, load_seconds, decode_seconds = heightcodec.benchmark(raster, heightcodec.encode(raster, 'delta-zlib'))
+    assert encoded_size < raw_size
+    # Both loads inflate a payload of the same grid, so neither takes orders of magnitude longer
+    assert 0 < load_seconds < 1000 * decode_seconds
+    assert 0 < decode_seconds < 1000 * load_seconds
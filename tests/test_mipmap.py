@@ -0,0 +1,43 @@
+import numpy as np
+from mapcreator import mipmap
+
+def test_level_sizes():
+    assert mipmap.level_sizes(8, 8) == [(8, 8), (4, 4), (2, 2), (1, 1)]
+    assert mipmap.level_sizes(5, 3) == [(5, 3), (2, 1), (1, 1)]
+    assert mipmap.level_sizes(1, 1) == [(1, 1)]
+
+def test_box_filter_averages_blocks():
+    image = (np.arange(16, dtype=np.uint8) * 10).reshape(4, 4)
+    levels = mipmap.build_mipmaps(image)
+    assert [level.shape for level in levels] == [(2, 2), (1, 1)]
+    assert levels[0].tolist() == [[25, 45], [105, 125]]
+    assert levels[1].tolist() == [[75]]
+
+def test_box_filter_weighs_odd_sizes_by_area():
+    image = np.array([[0, 30, 60, 90, 120]], dtype=np.uint8)
+    # 2.5 texels per texel: the middle one is shared by both
+    assert mipmap.build_mipmaps(image)[0].tolist() == [[24, 96]]
+    indices, weights = mipmap.filter_weights(5, 2)
+    assert np.allclose(weights.sum(axis=1), 1)
+
+def test_filters_keep_flat_color():
+    image = np.full((64, 48, 3), 77, dtype=np.uint8)
+    for image_filter in mipmap.FILTERS:
+        levels = mipmap.build_mipmaps(image, image_filter)
+        assert levels[-1].shape == (1, 1, 3)
+        assert all(np.all(level == 77) for level in levels)
+
+def test_lanczos_is_sharper_than_box():
+    # A wave of 8 texels, which box filtering dampens more
+    wave = np.round(127.5 + 100 * np.sin(2 * np.pi * np.arange(96) / 8)).astype(np.uint8)
+    image = np.tile(wave, (8, 1))
+    box = mipmap.build_mipmaps(image, 'box')[0][2, 4:-4].astype(np.float64)
+    lanczos = mipmap.build_mipmaps(image, 'lanczos')[0][2, 4:-4].astype(np.float64)
+    assert lanczos.std() > box.std() * 1.05
+
+def test_unknown_filter():
+    try:
+        mipmap.build_mipmaps(np.zeros((4, 4), dtype=np.uint8), 'nearest')
+        assert False
+    except ValueError:
+        pass
@@ -0,0 +1,116 @@
+import os
+import shutil
+from os import path
+from mock import patch, MagicMock
+from mapcreator import optimize, gdal_util
+from mapcreator.gdal_util import Gdalinfo
+
+TEMP_DIR = '.test_optimize'
+COPY_DIR = path.join(TEMP_DIR, 'optimized')
+
+def setup_function(function):
+    if not path.exists(TEMP_DIR):
+        os.mkdir(TEMP_DIR)
+
+def teardown_function(function):
+    if path.exists(TEMP_DIR):
+        shutil.rmtree(TEMP_DIR)
+
+def source(name, content = 'source'):
+    fpath = path.join(TEMP_DIR, name)
+    with open(fpath, 'w') as f:
+        f.write(content)
+    return fpath
+
+def gdal_info(size):
+    info = Gdalinfo()
+    info.minX, info.minY, info.maxX, info.maxY = -112.1, 36.0, -112.0, 36.1
+    info.size = list(size)
+    return info
+
+def fake_run(arguments, output = None):
+    # gdal_translate writes its last argument; gdaladdo updates an existing file
+    if arguments[0] == 'gdal_translate':
+        with open(arguments[-1], 'w') as f:
+            f.write('copy')
+    return True
+
+def fake_failing_addo(arguments, output = None):
+    fake_run(arguments, output)
+    return arguments[0] != 'gdaladdo'
+
+def test_copy_path():
+    a = optimize.copy_path('a/image.tif', COPY_DIR)
+    assert path.dirname(a) == COPY_DIR
+    assert path.basename(a).startswith('image_') and a.endswith('.tif')
+    assert a == optimize.copy_path(path.abspath('a/image.tif'), COPY_DIR)
+    assert a != optimize.copy_path('b/image.tif', COPY_DIR)
+
+def test_overview_factors():
+    assert optimize.overview_factors(512, 300) == []
+    assert optimize.overview_factors(1000, 600) == [2]
+    assert optimize.overview_factors(10000, 12000) == [2, 4, 8, 16, 32]
+    assert optimize.overview_factors(12000 // 32, 1) == []
+
+def test_mercator_pixel_size():
+    # 0.1 degrees of longitude are about 11132 m in EPSG:3857 at any latitude
+    assert abs(optimize.mercator_pixel_size(gdal_info((11132, 11132))) - 1.0) < 0.001
+
+def test_overview_level():
+    factors = [2, 4, 8, 16]
+    assert optimize.overview_level(1.0, 10.0, factors) == 2
+    assert optimize.overview_level(1.0, 8.0, factors) == 2
+    assert optimize.overview_level(1.0, 100.0, factors) == 3
+    assert optimize.overview_level(1.0, 1.5, factors) is None
+    assert optimize.overview_level(1.0, 10.0, []) is None
+
+@patch('mapcreator.optimize.run_command', side_effect=fake_run)
+def test_optimize_source(mock_run):
+    sourcepath = source('image.tif')
+    copy = optimize.optimize_source(sourcepath, gdal_info((2000, 1000)), COPY_DIR)
+    assert copy['path'] == optimize.copy_path(sourcepath, COPY_DIR)
+    assert copy['overviews'] == [2, 4]
+    assert copy['fingerprint'] == optimize.GdalinfoCache.fingerprint(sourcepath)
+    translate, addo = [c[0][0] for c in mock_run.call_args_list]
+    assert translate[:3] == ['gdal_translate', '-of', 'GTiff']
+    assert translate[-2] == sourcepath
+    assert ['-co', 'TILED=YES'] == translate[3:5]
+    assert addo == ['gdaladdo', '-r', 'average', translate[-1], '2', '4']
+    # The copy is renamed into place from a temporary file
+    assert translate[-1] != copy['path']
+    assert os.listdir(COPY_DIR) == [path.basename(copy['path'])]
+    assert optimize.is_current(copy, sourcepath)
+    source('image.tif', 'changed source')
+    assert not optimize.is_current(copy, sourcepath)
+
+@patch('mapcreator.optimize.run_command', return_value=False)
+def test_optimize_source_when_translation_fails(mock_run):
+    sourcepath = source('image.tif')
+    assert optimize.optimize_source(sourcepath, gdal_info((2000, 1000)), COPY_DIR) is None
+    assert mock_run.call_count == 1
+    assert os.listdir(COPY_DIR) == []
+
+@patch('mapcreator.optimize.run_command', side_effect=fake_failing_addo)
+def test_optimize_source_when_overviews_fail(mock_run):
+    sourcepath = source('image.tif')
+    # The copy was written, but without its overviews it isn't used
+    assert optimize.optimize_source(sourcepath, gdal_info((2000, 1000)), COPY_DIR) is None
+    assert mock_run.call_count == 2
+    assert os.listdir(COPY_DIR) == []
+
+@patch('mapcreator.optimize.run_command')
+def test_optimize_source_in_process_when_translation_fails(mock_run):
+    mock_gdal = MagicMock()
+    mock_gdal.Translate.return_value = None
+    with patch('mapcreator.gdal_util.gdal', mock_gdal):
+        gdal_util.reset_engine()
+        sourcepath = source('image.tif')
+        assert optimize.optimize_source(sourcepath, gdal_info((2000, 1000)), COPY_DIR) is None
+        mock_run.assert_not_called()
+        gdal_util.reset_engine()
+
+def test_is_current_without_copy():
+    sourcepath = source('image.tif')
+    assert not optimize.is_current(None, sourcepath)
+    copy = {'path': path.join(COPY_DIR, 'missing.tif'), 'fingerprint': optimize.GdalinfoCache.fingerprint(sourcepath)}
+    assert not optimize.is_current(copy, sourcepath)
@@ -0,0 +1,66 @@
+import numpy as np
+from mapcreator import palette
+
+def gradient(lines = 64, samples = 80):
+    y, x = np.mgrid[0:lines, 0:samples]
+    return np.stack([x * 255 // (samples - 1), y * 255 // (lines - 1), np.full_like(x, 100)], axis=-1).astype(np.uint8)
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b) ** 2)
+    return 10 * np.log10(255 ** 2 / mse)
+
+def test_bayer_matrix():
+    matrix = palette.bayer_matrix(4)
+    assert matrix.shape == (4, 4)
+    assert sorted(((matrix + 0.5) * 16 - 0.5).ravel().tolist()) == list(range(16))
+    assert abs(matrix.mean()) < 1e-9
+
+def test_sample_pixels():
+    pixels = np.arange(30).reshape(10, 3)
+    assert palette.sample_pixels(pixels, 20) is pixels
+    sample = palette.sample_pixels(pixels, 4)
+    assert sample[0].tolist() == [0, 1, 2] and sample[-1].tolist() == [27, 28, 29]
+
+def test_median_cut_exact_colors():
+    colors = np.array([[255, 0, 0], [0, 255, 0], [0, 0, 255], [10, 10, 10]])
+    pixels = np.repeat(colors, 50, axis=0)
+    assert sorted(palette.median_cut(pixels, 4).tolist()) == sorted(colors.tolist())
+    # There are no more colors to split into
+    assert len(palette.median_cut(pixels, 16)) == 4
+
+def test_nearest():
+    colors = np.array([[0, 0, 0], [255, 255, 255], [255, 0, 0]])
+    pixels = np.array([[10, 10, 10], [200, 220, 240], [200, 30, 20]])
+    assert palette.nearest(pixels, colors).tolist() == [0, 1, 2]
+
+def test_quantize():
+    image = gradient()
+    for method in palette.METHODS:
+        indices, colors = palette.quantize(image, 64, method)
+        assert indices.shape == (64, 80) and indices.dtype == np.uint8
+        assert colors.shape[1] == 3 and len(colors) <= 64
+        assert psnr(colors[indices], image) > 28
+    median_cut = palette.quantize(image, 64, 'median-cut')
+    kmeans = palette.quantize(image, 64, 'kmeans')
+    assert psnr(kmeans[1][kmeans[0]], image) >= psnr(median_cut[1][median_cut[0]], image)
+
+def test_quantize_with_dithering():
+    image = gradient()
+    indices, colors = palette.quantize(image, 8, 'kmeans', dither=True)
+    plain = palette.apply_palette(image, colors)
+    # Dithering mixes more colors into flat stretches of the gradient, keeping the mean color
+    assert len(np.unique(indices[:, :8])) >= len(np.unique(plain[:, :8]))
+    assert np.abs(colors[indices].mean(axis=(0, 1)) - image.mean(axis=(0, 1))).max() < 8
+
+def test_quantize_grayscale():
+    image = gradient()[:, :, 0]
+    indices, colors = palette.quantize(image, 16)
+    assert np.all(colors[:, 0] == colors[:, 2])
+
+def test_invalid_palette():
+    for colors, method in ((1, 'kmeans'), (257, 'kmeans'), (16, 'octree')):
+        try:
+            palette.quantize(gradient(), colors, method)
+            assert False
+        except ValueError:
+            pass
@@ -0,0 +1,48 @@
+import zlib
+import numpy as np
+from mapcreator import png
+
+def test_png_roundtrip():
+    rgb = np.random.RandomState(1).randint(0, 256, (7, 5, 3)).astype(np.uint8)
+    assert np.array_equal(png.decode_png(png.encode_png(rgb)), rgb)
+
+def test_png_strips():
+    rgba = np.random.RandomState(0).randint(0, 256, (50, 9, 4)).astype(np.uint8)
+    encoded = png.encode_png_strips(rgba, 6, workers=3, strip_lines=7)
+    assert np.array_equal(png.decode_png(encoded), rgba)
+    # A single strip is the same as the whole image
+    gray = rgba[:, :, 0]
+    assert png.encode_png_strips(gray, 9, strip_lines=50) == png.encode_png(gray)
+
+def test_indexed_png_strips():
+    colors = np.random.RandomState(2).randint(0, 256, (20, 3)).astype(np.uint8)
+    indices = np.random.RandomState(3).randint(0, 20, (30, 11)).astype(np.uint8)
+    encoded = png.encode_png_strips(indices, 6, workers=2, strip_lines=8, palette=colors, filtertype=png.FILTER_NONE)
+    assert b'PLTE' in encoded
+    assert np.array_equal(png.decode_png(encoded), colors[indices])
+    # The filter is independent of the palette
+    filtered = png.encode_png_strips(indices, 6, workers=2, strip_lines=8, palette=colors)
+    assert filtered != encoded
+    assert np.array_equal(png.decode_png(filtered), colors[indices])
+
+def test_png_filters():
+    gray = np.random.RandomState(4).randint(0, 256, (12, 6)).astype(np.uint8)
+    encoded = png.encode_png_strips(gray, filtertype=png.FILTER_NONE)
+    idat = encoded[encoded.index(b'IDAT') + 4:encoded.index(b'IEND') - 8] # Up to the IDAT CRC and the IEND length
+    scanlines = np.frombuffer(zlib.decompress(idat), dtype=np.uint8)
+    assert np.array_equal(scanlines.reshape(12, 7)[:, 0], [png.FILTER_NONE] * 12)
+    assert np.array_equal(png.decode_png(png.encode_png_strips(gray, strip_lines=5, filtertype=png.FILTER_NONE)), gray)
+    try:
+        png.encode_png_strips(gray, filtertype=4) # Paeth
+        assert False
+    except ValueError:
+        pass
+
+def test_adler32_combine():
+    first, second = b'mapcreator' * 100, b'strips' * 12345
+    combined = png.adler32_combine(zlib.adler32(first), zlib.adler32(second), len(second))
+    assert combined == zlib.adler32(first + second)
+
+def test_png_grayscale_roundtrip():
+    gray = np.random.RandomState(5).randint(0, 256, (7, 9)).astype(np.uint8)
+    assert np.array_equal(png.decode_png(png.encode_png(gray)), gray)
@@ -0,0 +1,37 @@
+import numpy as np
+from mapcreator import pyramid
+from mapcreator.envi import EnviRaster, format_map_info
+
+def test_downsample_mean():
+    data = np.arange(16, dtype=np.float32).reshape(4, 4)
+    result = pyramid.downsample(data)
+    assert result.dtype == np.float32
+    assert result.tolist() == [[2.5, 4.5], [10.5, 12.5]]
+
+def test_downsample_min_and_max():
+    data = np.arange(16, dtype=np.float32).reshape(4, 4)
+    assert pyramid.downsample(data, 'min').tolist() == [[0, 2], [8, 10]]
+    assert pyramid.downsample(data, 'max').tolist() == [[5, 7], [13, 15]]
+
+def test_downsample_ignores_nodata():
+    data = np.array([[-9999, 4], [-9999, -9999]], dtype=np.float32)
+    assert pyramid.downsample(data, nodata=-9999).tolist() == [[4]]
+    data = np.full((2, 2), -9999, dtype=np.float32)
+    assert pyramid.downsample(data, nodata=-9999).tolist() == [[-9999]]
+
+def test_downsample_odd_size():
+    data = np.ones((3, 5), dtype=np.float32)
+    result = pyramid.downsample(data)
+    assert result.shape == (2, 3)
+    assert np.all(result == 1)
+
+def test_build_pyramid():
+    header = EnviRaster.create_header(
+        8, 6, np.float32, format_map_info('UTM', 100.0, 200.0, 10.0, 10.0, ('12', 'North', 'WGS-84', 'units=Meters'))
+    )
+    raster = EnviRaster(np.zeros((6, 8), dtype=np.float32), header)
+    levels = pyramid.build_pyramid(raster, 5)
+    # 8x6 -> 4x3 -> 2x2 -> 1x1
+    assert [(level.samples, level.lines) for level in levels] == [(4, 3), (2, 2), (1, 1)]
+    assert levels[1].get_geotransform() == (100.0, 40.0, 200.0, 40.0)
+    assert levels[1].header['map info'].endswith('12, North, WGS-84, units=Meters}')
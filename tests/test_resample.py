@@ -0,0 +1,235 @@
+import struct
+import numpy as np
+from os import path, makedirs
+from shutil import rmtree
+from unittest import mock
+from mapcreator import resample
+from mapcreator.envi import EnviRaster, format_map_info
+from mapcreator.mercator import lonlat_to_mercator, mercator_to_lonlat
+
+TEMP_DIR = '.test_resample'
+
+def setup_function(function):
+    makedirs(TEMP_DIR)
+
+def teardown_function(function):
+    rmtree(TEMP_DIR)
+
+def write_envi(fpath, data, ulx, uly, pixel_size, nodata = None):
+    header = EnviRaster.create_header(
+        data.shape[1], data.shape[0], data.dtype,
+        format_map_info('Geographic Lat/Lon', ulx, uly, pixel_size, pixel_size, ('WGS-84', 'units=Degrees')),
+        nodata=nodata
+    )
+    EnviRaster(data, header).save(fpath)
+
+def write_strip_tiff(fpath, data, ulx, uly, pixel_size, rows_per_strip):
+    # Uncompressed little-endian float32 geographic GeoTIFF, in strips
+    height, width = data.shape
+    strips = [data[r:r + rows_per_strip].astype('<f4').tobytes() for r in range(0, height, rows_per_strip)]
+    tags = [
+        (256, 4, [width]), (257, 4, [height]), (258, 3, [32]), (259, 3, [1]), (277, 3, [1]),
+        (278, 4, [rows_per_strip]), (339, 3, [3]),
+        (33550, 12, [pixel_size, pixel_size, 0.0]), (33922, 12, [0.0, 0.0, 0.0, ulx, uly, 0.0]),
+        (34735, 3, [1, 1, 0, 2, 1024, 0, 1, 2, 2048, 0, 1, 4326]),
+    ]
+    formats = {3: 'H', 4: 'I', 12: 'd'}
+    extra_offset = 8 + 2 + 12 * (len(tags) + 1) + 4
+    pixels = b''.join(strips)
+    strip_offsets = []
+    position = extra_offset
+    for strip in strips:
+        strip_offsets.append(position)
+        position += len(strip)
+    tags.append((273, 4, strip_offsets))
+    tags.sort()
+    extra = pixels
+    entries = b''
+    for tag, valuetype, values in tags:
+        values_data = struct.pack('<' + formats[valuetype] * len(values), *values)
+        if len(values_data) <= 4:
+            entries += struct.pack('<HHI', tag, valuetype, len(values)) + values_data.ljust(4, b'\x00')
+        else:
+            entries += struct.pack('<HHII', tag, valuetype, len(values), extra_offset + len(extra))
+            extra += values_data
+    with open(fpath, 'wb') as f:
+        f.write(struct.pack('<2sHI', b'II', 42, 8) + struct.pack('<H', len(tags)) + entries + struct.pack('<I', 0) + extra)
+
+def plane(lon, lat):
+    return 100 + 50 * (lon - 10) + 20 * (lat - 45)
+
+def plane_source(ulx = 10.0, uly = 46.0, size = 100, pixel_size = 0.01):
+    lons = ulx + (np.arange(size) + 0.5) * pixel_size
+    lats = uly - (np.arange(size) + 0.5) * pixel_size
+    return plane(lons[None, :], lats[:, None]).astype(np.float32)
+
+def mercator_bounds(minlon, minlat, maxlon, maxlat):
+    minx, miny = lonlat_to_mercator(minlon, minlat)
+    maxx, maxy = lonlat_to_mercator(maxlon, maxlat)
+    return (float(minx), float(miny), float(maxx), float(maxy))
+
+def cell_centers(bounds, cellsize, samples, lines):
+    lons, _ = mercator_to_lonlat(bounds[0] + (np.arange(samples) + 0.5) * cellsize, 0)
+    _, lats = mercator_to_lonlat(0, bounds[3] - (np.arange(lines) + 0.5) * cellsize)
+    return lons[None, :], lats[:, None]
+
+def reference_bilinear(data, ulx, uly, pixel_size, lons, lats):
+    # Plain bilinear interpolation between pixel centers, one output cell at a time
+    result = np.zeros((lats.shape[0], lons.shape[1]))
+    for j in range(result.shape[0]):
+        for i in range(result.shape[1]):
+            x = (lons[0, i] - ulx) / pixel_size - 0.5
+            y = (uly - lats[j, 0]) / pixel_size - 0.5
+            c, r = int(np.floor(x)), int(np.floor(y))
+            fx, fy = x - c, y - r
+            result[j, i] = (
+                data[r, c] * (1 - fx) * (1 - fy) + data[r, c + 1] * fx * (1 - fy) +
+                data[r + 1, c] * (1 - fx) * fy + data[r + 1, c + 1] * fx * fy
+            )
+    return result
+
+def test_open_source_envi():
+    fpath = path.join(TEMP_DIR, 'dem.bin')
+    write_envi(fpath, plane_source(), 10.0, 46.0, 0.01, nodata=-9999)
+    source = resample.open_source(fpath)
+    assert (source.ulx, source.uly, source.pixel_width, source.pixel_height) == (10.0, 46.0, 0.01, 0.01)
+    assert (source.samples, source.lines, source.nodata) == (100, 100, -9999)
+    assert np.array_equal(source.read(10, 12, 20, 25), plane_source()[10:12, 20:25])
+
+def test_open_source_strip_tiff():
+    fpath = path.join(TEMP_DIR, 'dem.tif')
+    data = np.random.RandomState(1).rand(10, 7).astype(np.float32)
+    write_strip_tiff(fpath, data, 10.0, 46.0, 0.01, 3)
+    source = resample.open_source(fpath)
+    assert isinstance(source, resample.TiffSource)
+    assert np.array_equal(source.read(0, 10, 0, 7), data)
+    assert np.array_equal(source.read(2, 8, 3, 6), data[2:8, 3:6])
+
+def test_raster_sources_implement_read():
+    try:
+        resample.RasterSource(10.0, 46.0, 0.01, 0.01, 7, 10, np.float32)
+        assert False
+    except TypeError:
+        pass
+
+def test_open_source_leaves_other_files_for_gdal():
+    fpath = path.join(TEMP_DIR, 'dem.txt')
+    with open(fpath, 'w') as f:
+        f.write('not a raster')
+    assert resample.open_source(fpath) is None
+    assert resample.open_mosaic([fpath]) is None
+
+def test_mosaic_draws_later_sources_over_earlier_ones():
+    first = np.ones((4, 4), dtype=np.float32)
+    second = np.full((4, 4), 2, dtype=np.float32)
+    second[0, 0] = -9999
+    mosaic = resample.SourceMosaic([
+        resample.ArraySource(first, ulx=0.0, uly=4.0, pixel_width=1.0, pixel_height=1.0),
+        resample.ArraySource(second, ulx=2.0, uly=6.0, pixel_width=1.0, pixel_height=1.0, nodata=-9999),
+    ])
+    assert (mosaic.samples, mosaic.lines, mosaic.offsets) == (6, 6, [(2, 0), (0, 2)])
+    block = mosaic.read_block(0, 6, 0, 6)
+    assert np.isnan(block[0, 0]) and np.isnan(block[1, 1])
+    assert block[2, 2] == 2 and block[2, 1] == 1 and block[5, 3] == 1 and block[2, 0] == 1
+
+def test_mosaic_requires_a_common_grid():
+    sources = [
+        resample.ArraySource(np.zeros((4, 4)), ulx=0.0, uly=4.0, pixel_width=1.0, pixel_height=1.0),
+        resample.ArraySource(np.zeros((4, 4)), ulx=2.5, uly=4.0, pixel_width=1.0, pixel_height=1.0),
+    ]
+    try:
+        resample.SourceMosaic(sources)
+        assert False
+    except ValueError:
+        pass
+
+def test_resample_matches_bilinear_interpolation():
+    data = np.random.RandomState(0).rand(100, 100).astype(np.float32) * 1000
+    fpath = path.join(TEMP_DIR, 'dem.bin')
+    write_envi(fpath, data, 10.0, 46.0, 0.01)
+    bounds = mercator_bounds(10.2, 45.2, 10.6, 45.7)
+    outpath = path.join(TEMP_DIR, 'out.bin')
+    # Cells smaller than the source pixels, where gdalwarp -r bilinear uses a 2x2 kernel
+    raster = resample.resample_to_envi(resample.open_mosaic([fpath]), bounds, 400, outpath)
+    lons, lats = cell_centers(bounds, 400, raster.samples, raster.lines)
+    expected = reference_bilinear(data, 10.0, 46.0, 0.01, lons, lats)
+    assert np.allclose(EnviRaster.load(outpath).data, expected, atol=1e-2)
+
+def test_resample_reproduces_planes():
+    fpath = path.join(TEMP_DIR, 'dem.bin')
+    write_envi(fpath, plane_source(), 10.0, 46.0, 0.01)
+    bounds = mercator_bounds(10.2, 45.2, 10.8, 45.8)
+    for cellsize in (300, 1000, 4000):
+        outpath = path.join(TEMP_DIR, 'out{}.bin'.format(cellsize))
+        raster = resample.resample_to_envi(resample.open_mosaic([fpath]), bounds, cellsize, outpath)
+        lons, lats = cell_centers(bounds, cellsize, raster.samples, raster.lines)
+        # A widened kernel sampled at whole pixels isn't exactly linear, hence the looser tolerance
+        assert np.allclose(EnviRaster.load(outpath).data, plane(lons, lats), atol=5e-2)
+
+def test_resample_output_header():
+    fpath = path.join(TEMP_DIR, 'dem.bin')
+    write_envi(fpath, plane_source(), 10.0, 46.0, 0.01, nodata=-9999)
+    bounds = mercator_bounds(10.2, 45.2, 10.6, 45.7)
+    outpath = path.join(TEMP_DIR, 'out.bin')
+    resample.resample_to_envi(resample.open_mosaic([fpath]), bounds, 400, outpath)
+    raster = EnviRaster.load(outpath)
+    # As gdalwarp -te -tr computes the size, anchored at the north-west corner
+    assert (raster.samples, raster.lines) == resample.output_size(bounds, 400)
+    assert raster.samples == int((bounds[2] - bounds[0]) / 400 + 0.5)
+    ulx, pixel_width, uly, pixel_height = raster.get_geotransform()
+    assert (ulx, uly, pixel_width, pixel_height) == (bounds[0], bounds[3], 400, 400)
+    assert raster.nodata == -9999
+    assert raster.data.dtype == np.float32
+
+def test_resample_outside_sources_and_nodata():
+    data = plane_source()
+    data[40:60, 40:60] = -9999
+    fpath = path.join(TEMP_DIR, 'dem.bin')
+    write_envi(fpath, data, 10.0, 46.0, 0.01, nodata=-9999)
+    # Half of the window is east of the source
+    bounds = mercator_bounds(10.5, 45.2, 11.5, 45.8)
+    outpath = path.join(TEMP_DIR, 'out.bin')
+    raster = resample.resample_to_envi(resample.open_mosaic([fpath]), bounds, 1000, outpath)
+    lons, lats = cell_centers(bounds, 1000, raster.samples, raster.lines)
+    out = EnviRaster.load(outpath).data
+    assert np.all(out[:, lons[0] > 11.001] == -9999)
+    hole = (np.abs(lons - 10.5) < 0.085) & (np.abs(lats - 45.5) < 0.085)
+    assert np.all(out[np.broadcast_to(hole, out.shape)] == -9999)
+    # Away from the edges of the data, the plane is still reproduced
+    inside = np.broadcast_to((lons < 10.98) & ~((np.abs(lons - 10.5) < 0.115) & (np.abs(lats - 45.5) < 0.115)), out.shape)
+    assert np.all(out[inside] != -9999)
+    assert np.allclose(out[inside], np.broadcast_to(plane(lons, lats), out.shape)[inside], atol=1e-2)
+
+def test_resample_in_strips_gives_the_same_result():
+    data = np.random.RandomState(2).rand(100, 100).astype(np.float32)
+    fpath = path.join(TEMP_DIR, 'dem.bin')
+    write_envi(fpath, data, 10.0, 46.0, 0.01)
+    bounds = mercator_bounds(10.1, 45.1, 10.9, 45.9)
+    mosaic = resample.open_mosaic([fpath])
+    whole = resample.resample_to_envi(mosaic, bounds, 700, path.join(TEMP_DIR, 'whole.bin')).data
+    with mock.patch('mapcreator.resample.STRIP_CELLS', 2000):
+        assert resample.rows_per_strip(whole.shape[1], 3, 1.0, 1.0) < whole.shape[0]
+        strips = resample.resample_to_envi(mosaic, bounds, 700, path.join(TEMP_DIR, 'strips.bin')).data
+    assert np.array_equal(whole, strips)
+
+def test_resample_mosaic_of_tiles_matches_a_single_source():
+    data = plane_source(size=100)
+    west, east = path.join(TEMP_DIR, 'west.bin'), path.join(TEMP_DIR, 'east.tif')
+    write_envi(west, np.ascontiguousarray(data[:, :50]), 10.0, 46.0, 0.01)
+    write_strip_tiff(east, data[:, 50:], 10.5, 46.0, 0.01, 16)
+    whole = path.join(TEMP_DIR, 'whole.bin')
+    write_envi(whole, data, 10.0, 46.0, 0.01)
+    bounds = mercator_bounds(10.2, 45.2, 10.8, 45.8)
+    tiled = resample.resample_to_envi(resample.open_mosaic([west, east]), bounds, 500, path.join(TEMP_DIR, 'a.bin')).data
+    single = resample.resample_to_envi(resample.open_mosaic([whole]), bounds, 500, path.join(TEMP_DIR, 'b.bin')).data
+    assert np.allclose(tiled, single)
+
+def test_resample_integer_sources_are_rounded():
+    data = np.round(plane_source()).astype(np.int16)
+    fpath = path.join(TEMP_DIR, 'dem.bin')
+    write_envi(fpath, data, 10.0, 46.0, 0.01)
+    bounds = mercator_bounds(10.2, 45.2, 10.6, 45.7)
+    raster = resample.resample_to_envi(resample.open_mosaic([fpath]), bounds, 400, path.join(TEMP_DIR, 'out.bin'))
+    lons, lats = cell_centers(bounds, 400, raster.samples, raster.lines)
+    assert raster.data.dtype == np.int16
+    assert np.max(np.abs(raster.data - plane(lons, lats))) <= 1.0
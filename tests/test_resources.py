@@ -0,0 +1,71 @@
+from mapcreator import resources
+from mapcreator.state import State
+
+def window_state():
+    state = State()
+    # About 22 x 27 km
+    state.set_window(-112.2, 36.2, -112.0, 36.0)
+    return state
+
+def test_estimate_output_mb():
+    state = window_state()
+    assert resources.estimate_output_mb(state, 10, resources.HEIGHT_PIXEL_BYTES) == 24
+    assert resources.estimate_output_mb(state, 1, resources.SATELLITE_PIXEL_BYTES) == 1756
+    assert resources.estimate_output_mb(State(), 10, 4) == 0
+
+def test_small_output_uses_one_thread():
+    settings = resources.choose_settings(window_state(), 100, resources.HEIGHT_PIXEL_BYTES, 64, 262144)
+    assert settings.threads == 1
+    assert settings.warp_memory_mb == resources.MIN_WARP_MEMORY_MB
+    assert settings.cache_mb == resources.MIN_CACHE_MB
+
+def test_large_output_scales_with_host():
+    small_host = resources.choose_settings(window_state(), 1, resources.SATELLITE_PIXEL_BYTES, 4, 8192)
+    large_host = resources.choose_settings(window_state(), 1, resources.SATELLITE_PIXEL_BYTES, 64, 262144)
+    assert small_host.threads == 4
+    assert small_host.warp_memory_mb + small_host.cache_mb <= 4096
+    assert large_host.threads == 64
+    # Neither needs to be larger than the output
+    assert large_host.warp_memory_mb == 1756
+    assert large_host.cache_mb == 1756
+
+def test_large_memory_host():
+    # A window of about 20 GB: GDAL would read 20000 as bytes, so the settings are given in bytes
+    state = window_state()
+    settings = resources.choose_settings(state, 0.3, resources.SATELLITE_PIXEL_BYTES, 64, 262144)
+    assert settings.warp_memory_mb > 10000
+    assert settings.warp_memory_bytes() == settings.warp_memory_mb * 1024 * 1024
+    assert '-wm {} '.format(settings.warp_memory_mb * 1024 * 1024) in settings.warp_options()
+    assert 'GDAL_CACHEMAX {} '.format(settings.cache_mb * 1024 * 1024) in settings.config_options()
+
+def test_budget_caps_settings():
+    state = window_state()
+    state.set_resource_budget(2, 1024)
+    settings = resources.choose_settings(state, 1, resources.SATELLITE_PIXEL_BYTES, 64, 262144)
+    assert settings.threads == 2
+    assert settings.warp_memory_mb == 512
+    assert settings.cache_mb == 512
+
+def test_command_line_options():
+    settings = resources.ResourceSettings(4, 256, 512, 1000)
+    assert settings.warp_options() == '-multi -wo NUM_THREADS=4 -wm 268435456 --config GDAL_CACHEMAX 536870912 '
+    assert settings.config_options() == '--config GDAL_CACHEMAX 536870912 '
+    assert '4 warp threads' in str(settings)
+
+def test_worker_count():
+    state = State()
+    assert resources.worker_count(state, 16, 4) == 4
+    assert resources.worker_count(state, 2, 4) == 2
+    state.set_resource_budget(3, None)
+    assert resources.worker_count(state, 16, 64) == 3
+
+def test_settings_shared_between_pipelines():
+    state = window_state()
+    state.set_resource_budget(8, None)
+    alone = resources.choose_settings(state, 1, resources.SATELLITE_PIXEL_BYTES, 64, 8192)
+    state.set_build_share(2)
+    shared = resources.choose_settings(state, 1, resources.SATELLITE_PIXEL_BYTES, 64, 8192)
+    assert (alone.threads, shared.threads) == (8, 4)
+    assert shared.warp_memory_mb + shared.cache_mb <= 2048
+    assert resources.worker_count(state, 16, 64) == 4
+    assert resources.worker_count(state, 16, 1) == 1
@@ -0,0 +1,119 @@
+import numpy as np
+from os import remove
+from mapcreator import rtin
+from mapcreator.envi import EnviRaster
+
+def martini_errors(heights):
+    # A direct port of the triangle by triangle error computation of the Martini library
+    size = heights.shape[0]
+    tile = size - 1
+    triangles = tile * tile * 2 - 2
+    parents = triangles - tile * tile
+    errors = np.zeros((size, size))
+    for i in range(triangles - 1, -1, -1):
+        triangle_id = i + 2
+        ax = ay = bx = by = cx = cy = 0
+        if triangle_id & 1:
+            bx = by = cx = tile
+        else:
+            ax = ay = cy = tile
+        while True:
+            triangle_id >>= 1
+            if triangle_id <= 1: break
+            mx, my = (ax + bx) >> 1, (ay + by) >> 1
+            if triangle_id & 1:
+                bx, by, ax, ay = ax, ay, cx, cy
+            else:
+                ax, ay, bx, by = bx, by, cx, cy
+            cx, cy = mx, my
+        mx, my = (ax + bx) >> 1, (ay + by) >> 1
+        middle = abs((heights[ay, ax] + heights[by, bx]) / 2 - heights[my, mx])
+        if i >= parents:
+            errors[my, mx] = max(errors[my, mx], middle)
+        else:
+            left = errors[(ay + cy) >> 1, (ax + cx) >> 1]
+            right = errors[(by + cy) >> 1, (bx + cx) >> 1]
+            errors[my, mx] = max(errors[my, mx], middle, left, right)
+    return errors
+
+def raster(data, nodata = None):
+    return EnviRaster(data.astype(np.float32), EnviRaster.create_header(data.shape[1], data.shape[0], np.float32, nodata=nodata))
+
+def triangle_positions(mesh):
+    positions = np.stack([mesh.vertices['column'], mesh.vertices['row']], axis=1).astype(np.float64)
+    return positions[mesh.indices.reshape(-1, 3)]
+
+def covered_area(mesh):
+    p = triangle_positions(mesh)
+    u, v = p[:, 1] - p[:, 0], p[:, 2] - p[:, 0]
+    return np.abs(u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]).sum() / 2
+
+def max_mesh_error(mesh, data):
+    # Interpolates every triangle at the grid points it covers
+    worst = 0
+    heights = dict(((int(v['column']), int(v['row'])), float(v['height'])) for v in mesh.vertices)
+    for triangle in triangle_positions(mesh).astype(int):
+        (x0, y0), (x1, y1), (x2, y2) = triangle
+        z = [heights[(x, y)] for x, y in triangle]
+        det = (y1 - y2) * (x0 - x2) + (x2 - x1) * (y0 - y2)
+        for y in range(triangle[:, 1].min(), triangle[:, 1].max() + 1):
+            for x in range(triangle[:, 0].min(), triangle[:, 0].max() + 1):
+                w0 = ((y1 - y2) * (x - x2) + (x2 - x1) * (y - y2)) / det
+                w1 = ((y2 - y0) * (x - x2) + (x0 - x2) * (y - y2)) / det
+                w2 = 1 - w0 - w1
+                if min(w0, w1, w2) < -1e-9: continue
+                worst = max(worst, abs(w0 * z[0] + w1 * z[1] + w2 * z[2] - data[y, x]))
+    return worst
+
+def test_grid_size():
+    assert rtin.grid_size(2, 2) == 3
+    assert rtin.grid_size(17, 5) == 17
+    assert rtin.grid_size(18, 5) == 33
+    assert rtin.grid_size(1900, 2000) == 2049
+
+def test_errors_match_martini():
+    for size in (3, 5, 9, 17, 33):
+        heights = np.random.RandomState(size).rand(size, size) * 100
+        assert np.allclose(rtin.compute_errors(heights), martini_errors(heights))
+
+def test_flat_terrain_is_two_triangles():
+    mesh = rtin.build_mesh(raster(np.full((17, 17), 5.0)), 0.1)
+    assert mesh.triangle_count == 2
+    assert len(mesh.vertices) == 4
+    assert sorted(mesh.vertices['height'].tolist()) == [5.0] * 4
+
+def test_mesh_stays_within_max_error():
+    y, x = np.mgrid[0:33, 0:33]
+    data = np.sin(x / 5.0) * np.cos(y / 7.0) * 20
+    for max_error in (0, 0.5, 2.0):
+        mesh = rtin.build_mesh(raster(data), max_error)
+        assert max_mesh_error(mesh, data.astype(np.float32)) <= max_error + 1e-4
+        assert covered_area(mesh) == 32 * 32
+    noise = np.random.RandomState(1).rand(33, 33)
+    assert rtin.build_mesh(raster(noise), 0).triangle_count == rtin.dense_triangle_count(33, 33)
+    assert rtin.build_mesh(raster(data), 2.0).triangle_count < rtin.dense_triangle_count(33, 33) / 4
+
+def test_mesh_of_a_raster_that_isnt_a_power_of_two():
+    y, x = np.mgrid[0:20, 0:27]
+    data = (x * 0.5 + y * 0.25 + np.where((x - 10) ** 2 + (y - 8) ** 2 < 16, 10, 0)).astype(np.float64)
+    mesh = rtin.build_mesh(raster(data), 1.0)
+    assert mesh.vertices['column'].max() == 26 and mesh.vertices['row'].max() == 19
+    assert covered_area(mesh) == 26 * 19
+    assert max_mesh_error(mesh, data.astype(np.float32)) <= 1.0 + 1e-4
+
+def test_mesh_nodata_is_lowest_height():
+    data = np.full((9, 9), 50.0)
+    data[4, 4] = -9999
+    mesh = rtin.build_mesh(raster(data, nodata=-9999), 0.5)
+    assert mesh.vertices['height'].min() == 50.0
+
+def test_save_mesh():
+    mesh = rtin.build_mesh(raster(np.random.RandomState(0).rand(9, 9) * 10), 0.1)
+    vertexpath, indexpath = '.test_mesh.vtx', '.test_mesh.idx'
+    try:
+        mesh.save(vertexpath, indexpath)
+        assert np.array_equal(np.fromfile(vertexpath, dtype=rtin.VERTEX_DTYPE), mesh.vertices)
+        assert np.array_equal(np.fromfile(indexpath, dtype='<u2'), mesh.indices)
+    finally:
+        remove(vertexpath)
+        remove(indexpath)
@@ -0,0 +1,71 @@
+import threading
+from mapcreator import scheduler
+from mapcreator.scheduler import Stage
+
+def recorder(log, name):
+    def run():
+        log.append(name)
+    return run
+
+def test_dependencies():
+    stages = [
+        Stage('a', None, outputs=['x']),
+        Stage('b', None, inputs=['x', 'source'], outputs=['y']),
+        Stage('c', None, inputs=['x', 'y']),
+    ]
+    assert scheduler.dependencies(stages) == [set(), {0}, {0, 1}]
+
+def test_dependencies_with_cycle():
+    stages = [Stage('a', None, inputs=['y'], outputs=['x']), Stage('b', None, inputs=['x'], outputs=['y'])]
+    try:
+        scheduler.dependencies(stages)
+        assert False
+    except ValueError as e:
+        assert 'a, b' in str(e)
+
+def test_dependencies_with_two_writers():
+    try:
+        scheduler.dependencies([Stage('a', None, outputs=['x']), Stage('b', None, outputs=['x'])])
+        assert False
+    except ValueError:
+        pass
+
+def test_run_stages_in_dependency_order():
+    log = []
+    stages = [
+        Stage('c', recorder(log, 'c'), inputs=['b']),
+        Stage('b', recorder(log, 'b'), inputs=['a'], outputs=['b']),
+        Stage('a', recorder(log, 'a'), outputs=['a']),
+    ]
+    done = []
+    assert scheduler.run_stages(stages, 4, lambda stage: done.append(stage.name)) == []
+    assert log == ['a', 'b', 'c']
+    assert done == log
+
+def test_run_stages_side_by_side():
+    # Each stage waits until the other one has started, which only works if both run at once
+    started = [threading.Event(), threading.Event()]
+    def run(index):
+        started[index].set()
+        assert started[1 - index].wait(5)
+    stages = [Stage('a', lambda: run(0), holds=['a']), Stage('b', lambda: run(1), holds=['b'])]
+    assert scheduler.run_stages(stages, 2) == []
+
+def test_run_stages_holding_a_resource():
+    log = []
+    def run(name):
+        log.append(name + ' start')
+        log.append(name + ' end')
+    stages = [Stage(name, lambda name=name: run(name), holds=['pipeline']) for name in ('a', 'b', 'c')]
+    scheduler.run_stages(stages, 3)
+    assert log == ['a start', 'a end', 'b start', 'b end', 'c start', 'c end']
+
+def test_run_stages_after_a_failure():
+    log = []
+    error = ValueError('Oh no!')
+    def fail():
+        raise error
+    stages = [Stage('a', fail, outputs=['x']), Stage('b', recorder(log, 'b'), inputs=['x'])]
+    failures = scheduler.run_stages(stages)
+    assert failures == [(stages[0], error)]
+    assert log == ['b']
@@ -0,0 +1,97 @@
+import numpy as np
+from unittest import mock
+from mapcreator import shading
+from mapcreator.envi import EnviRaster, format_map_info
+from mapcreator.mercator import lonlat_to_mercator
+
+def height_raster(data, lat = 0.0, cellsize = 10.0, nodata = None):
+    _, uly = lonlat_to_mercator(0, lat)
+    # Centered on the given latitude
+    uly = float(uly) + cellsize * data.shape[0] / 2
+    header = EnviRaster.create_header(
+        data.shape[1], data.shape[0], np.float32, format_map_info('Pseudo Mercator', 0.0, uly, cellsize, cellsize), nodata=nodata
+    )
+    return EnviRaster(data.astype(np.float32), header)
+
+def test_ground_spacing():
+    spacing = shading.ground_spacing(height_raster(np.zeros((3, 3)), lat=60))
+    assert np.allclose(spacing, 5.0, atol=1e-3)
+
+def test_flat_normals():
+    normal_vectors = shading.normals(height_raster(np.full((4, 5), 100.0)))
+    assert np.allclose(normal_vectors, [0, 0, 1])
+    assert shading.encode_normals(normal_vectors)[0, 0].tolist() == [128, 128, 255]
+    assert shading.hillshade(normal_vectors)[0, 0] == 180
+
+def test_slope_normals():
+    # Rising by a meter for every cell eastwards, and at 60 degrees north cells are half as wide on the ground
+    data = np.tile(np.arange(6, dtype=np.float64), (5, 1))
+    for lat, slope in ((0, 0.1), (60, 0.2)):
+        normal_vectors = shading.normals(height_raster(data, lat=lat))
+        expected = np.array([-slope, 0, 1]) / np.sqrt(1 + slope ** 2)
+        assert np.allclose(normal_vectors, expected, atol=1e-3)
+    exaggerated = shading.normals(height_raster(data), exaggeration=2)
+    assert np.allclose(exaggerated[2, 2], np.array([-0.2, 0, 1]) / np.sqrt(1.04), atol=1e-3)
+
+def test_northward_slope_normals():
+    # Rows run southwards, so heights rising row by row slope down to the north
+    data = np.tile(np.arange(5, dtype=np.float64)[:, None], (1, 4))
+    normal_vectors = shading.normals(height_raster(data))
+    assert normal_vectors[2, 2, 1] > 0.09 and abs(normal_vectors[2, 2, 0]) < 1e-9
+
+def test_nodata_is_flat():
+    data = np.tile(np.arange(6, dtype=np.float64) * 10, (5, 1))
+    data[2, 2] = -9999
+    normal_vectors = shading.normals(height_raster(data, nodata=-9999))
+    assert np.allclose(normal_vectors[2, 1:4], [0, 0, 1])
+    assert normal_vectors[0, 2, 0] < -0.5
+
+def test_hillshade_lights_slopes_facing_the_light():
+    data = np.tile(np.arange(6, dtype=np.float64) * 5, (5, 1))
+    facing_west = shading.normals(height_raster(data))
+    facing_east = shading.normals(height_raster(data[:, ::-1]))
+    assert shading.hillshade(facing_west)[2, 2] > shading.hillshade(facing_east)[2, 2]
+    assert shading.hillshade(facing_west, azimuth=90)[2, 2] < shading.hillshade(facing_east, azimuth=90)[2, 2]
+
+def test_encode_decode_normals():
+    normal_vectors = shading.normals(height_raster(np.random.RandomState(0).rand(8, 8) * 50))
+    decoded = shading.decode_normals(shading.encode_normals(normal_vectors))
+    assert np.allclose(decoded, normal_vectors, atol=1.0 / 255)
+
+def test_sky_view_of_flat_terrain():
+    factors = shading.sky_view_factor(height_raster(np.full((10, 10), 100.0)), 8, 50)
+    assert np.allclose(factors, 1)
+    assert shading.encode_sky_view(factors)[0, 0] == 255
+
+def test_sky_view_in_a_valley():
+    # Sides rising by 0.5 m per meter to the east and west
+    data = np.tile(np.abs(np.arange(41) - 20) * 5.0, (41, 1))
+    factors = shading.sky_view_factor(height_raster(data), 16, 150)
+    angles = 2 * np.pi * np.arange(16) / 16
+    expected = 1 - np.mean(np.sin(np.arctan(0.5 * np.abs(np.sin(angles)))))
+    assert abs(factors[20, 20] - expected) < 0.02
+    # Higher up the side, less of the sky is hidden
+    assert factors[20, 20] < factors[20, 25] < 1
+
+def test_sky_view_of_peaks_and_pits():
+    data = np.full((15, 15), 100.0)
+    data[4, 4] = 200
+    data[10, 10] = 0
+    factors = shading.sky_view_factor(height_raster(data), 8, 100)
+    assert factors[4, 4] == 1
+    assert factors[10, 10] < 0.2
+    assert factors[4, 5] < 1
+
+def test_sky_view_nodata_is_open():
+    data = np.full((10, 10), 100.0)
+    data[5, 5] = -9999
+    factors = shading.sky_view_factor(height_raster(data, nodata=-9999), 8, 50)
+    assert np.allclose(factors, 1)
+
+def test_sky_view_in_bands_with_a_process_pool():
+    data = np.random.RandomState(3).rand(40, 30) * 100
+    raster = height_raster(data)
+    whole = shading.sky_view_factor(raster, 8, 60)
+    with mock.patch('mapcreator.shading.SKY_VIEW_BAND_LINES', 7):
+        banded = shading.sky_view_factor(raster, 8, 60, workers=2)
+    assert np.allclose(whole, banded)
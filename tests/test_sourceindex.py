@@ -0,0 +1,71 @@
+import os
+import shutil
+from os import path
+from mapcreator.gdal_util import Gdalinfo
+from mapcreator.sourceindex import SourceIndex
+
+TEMP_DIR = '.test_sourceindex'
+
+def setup_function(function):
+    if not path.exists(TEMP_DIR):
+        os.mkdir(TEMP_DIR)
+
+def teardown_function(function):
+    if path.exists(TEMP_DIR):
+        shutil.rmtree(TEMP_DIR)
+
+def footprint(minx, miny, maxx, maxy):
+    gdal_info = Gdalinfo()
+    gdal_info.minX, gdal_info.minY, gdal_info.maxX, gdal_info.maxY = minx, miny, maxx, maxy
+    return gdal_info
+
+def source(name):
+    fpath = path.join(TEMP_DIR, name)
+    open(fpath, 'w').close()
+    return fpath
+
+def test_query():
+    index = SourceIndex(path.join(TEMP_DIR, 'index.json'))
+    a, b, c = source('a.tif'), source('b.tif'), source('c.tif')
+    index.add(a, footprint(-113, 36, -112, 37))
+    index.add(b, footprint(-112, 36, -111, 37))
+    index.add(c, footprint(10, 60, 11, 61))
+    assert index.query((-112.5, 36.2, -112.2, 36.4)) == {path.abspath(a)}
+    assert index.query((-112.5, 36.2, -111.5, 36.4)) == {path.abspath(a), path.abspath(b)}
+    assert index.query((0, 0, 1, 1)) == set()
+
+def test_select_keeps_unknown_and_changed_files():
+    index = SourceIndex(path.join(TEMP_DIR, 'index.json'))
+    inside, outside, unknown = source('inside.tif'), source('outside.tif'), source('unknown.tif')
+    index.add(inside, footprint(0, 0, 1, 1))
+    index.add(outside, footprint(5, 5, 6, 6))
+    window = (0.2, 0.2, 0.8, 0.8)
+    assert index.select([unknown, outside, inside], window) == [unknown, inside]
+    with open(outside, 'w') as f:
+        f.write('changed')
+    assert index.select([unknown, outside, inside], window) == [unknown, outside, inside]
+
+def test_save_and_load():
+    indexpath = path.join(TEMP_DIR, 'sub', 'index.json')
+    index = SourceIndex(indexpath)
+    a = source('a.tif')
+    index.add(a, footprint(0, 0, 2.5, 1))
+    index.save()
+    loaded = SourceIndex.load(indexpath)
+    assert loaded.contains(a)
+    assert loaded.query((2.2, 0.5, 3, 0.6)) == {path.abspath(a)}
+    assert not loaded.changed
+
+def test_update_moves_footprint():
+    index = SourceIndex(path.join(TEMP_DIR, 'index.json'))
+    a = source('a.tif')
+    index.add(a, footprint(0, 0, 1, 1))
+    index.add(a, footprint(50, 50, 51, 51))
+    assert index.query((0, 0, 1, 1)) == set()
+    assert index.query((50, 50, 51, 51)) == {path.abspath(a)}
+
+def test_corrupted_index_is_ignored():
+    indexpath = path.join(TEMP_DIR, 'index.json')
+    with open(indexpath, 'w') as f:
+        f.write('{not json')
+    assert SourceIndex.load(indexpath).entries == {}
@@ -30,6 +30,16 @@ def test_add_file_when_already_added(mock_exists):
     assert 1 == len(state.height_files)
     assert path.abspath('mylittletestfile') in state.height_files
 
+@patch('os.path.exists', return_value = True)
+def test_add_file_with_file_set(mock_exists):
+    state = State()
+    state.add_height_file('first')
+    fset = set(state.height_files)
+    assert state.add_height_file('second', fset) == FileAddResult.SUCCESS
+    assert state.add_height_file('second', fset) == FileAddResult.ALREADY_ADDED
+    assert state.add_height_file('first', fset) == FileAddResult.ALREADY_ADDED
+    assert fset == set(state.height_files) == {path.abspath('first'), path.abspath('second')}
+
 @patch('os.path.exists', return_value = False)
 def test_add_file_when_doesnt_exist(mock_exists):
     state = State()
@@ -87,3 +97,182 @@ def test_has_satellite_system():
     assert state.has_satellite_system()
 
   
+
+
+def test_has_vector_tiles():
+    state = State()
+    assert not state.has_vector_tiles()
+    state.set_vector_tile_zooms(10, 14)
+    assert state.has_vector_tiles()
+    assert 'zoom levels 10-14' in str(state)
+    state.clear_vector_tiles()
+    assert not state.has_vector_tiles()
+
+def test_probe_threads():
+    state = State()
+    assert state.get_probe_threads() == 8
+    state.set_probe_threads(3)
+    assert state.get_probe_threads() == 3
+
+def test_build_workers():
+    state = State()
+    assert state.get_build_workers() == 3
+    state.set_build_workers(1)
+    assert state.get_build_workers() == 1
+    assert '-Build stages run at once: 1' in str(state)
+
+def test_resource_budget():
+    state = State()
+    assert not state.has_resource_budget()
+    assert state.get_resource_budget() == (None, None)
+    state.set_resource_budget(4, None)
+    assert state.get_resource_budget() == (4, None)
+    assert '-Resource budget: 4 threads, unlimited memory' in str(state)
+    state.clear_resource_budget()
+    assert not state.has_resource_budget()
+
+def test_tile_cache():
+    state = State()
+    assert not state.has_tile_cache()
+    state.set_tile_cache('/tmp/tiles', 1024)
+    assert state.get_tile_cache() == ('/tmp/tiles', 1024)
+    assert '-Reprojected tile cache: /tmp/tiles (up to 1024 MB)' in str(state)
+    state.clear_tile_cache()
+    assert not state.has_tile_cache()
+
+def test_height_tiles():
+    state = State()
+    assert not state.has_height_tiles()
+    assert state.get_height_tiles() == (1, 1)
+    state.set_height_tiles(3, 2)
+    assert state.get_height_tiles() == (3, 2)
+    assert '-Height files are built in 3x2 tiles' in str(state)
+    state.clear_height_tiles()
+    assert not state.has_height_tiles()
+
+def test_height_lods():
+    state = State()
+    assert not state.has_height_lods()
+    state.set_height_lods(3, 'min')
+    assert state.get_height_lods() == (3, 'min')
+    assert '-Height file detail levels: 3 (min reduction)' in str(state)
+    state.clear_height_lods()
+    assert not state.has_height_lods()
+
+def test_height_encoding():
+    state = State()
+    assert not state.has_height_encoding()
+    assert state.get_height_encoding() == ('float32', None)
+    state.set_height_encoding('int16', 0.5)
+    assert state.get_height_encoding() == ('int16', 0.5)
+    assert '-Height file encoding: int16 (max error 0.5 m)' in str(state)
+    state.clear_height_encoding()
+    assert not state.has_height_encoding()
+
+def test_add_file_keeps_dedup_set_in_sync():
+    state = State()
+    fpath = path.abspath(__file__)
+    assert state.add_height_file(fpath) == FileAddResult.SUCCESS
+    assert state.add_height_file(fpath) == FileAddResult.ALREADY_ADDED
+    state.clear_height_files()
+    assert state.add_height_file(fpath) == FileAddResult.SUCCESS
+    assert State.from_dict(state.to_dict()).add_height_file(fpath) == FileAddResult.ALREADY_ADDED
+
+def test_height_engine():
+    state = State()
+    assert not state.has_height_engine()
+    assert state.get_height_engine() == 'gdal'
+    state.set_height_engine('auto')
+    assert state.get_height_engine() == 'auto'
+    assert '-Height resampling engine: auto' in str(state)
+    state.clear_height_engine()
+    assert state.get_height_engine() == 'gdal'
+
+def test_normal_map_and_hillshade():
+    state = State()
+    assert not state.has_normal_map() and not state.has_hillshade()
+    state.set_normal_map(2.0)
+    state.set_hillshade(270.0, 30.0)
+    assert state.get_normal_map() == 2.0
+    assert state.get_hillshade() == (270.0, 30.0)
+    assert '-Normal map: vertical exaggeration 2.0' in str(state)
+    assert '-Hillshade: light from azimuth 270.0 at altitude 30.0' in str(state)
+    state.clear_normal_map()
+    state.clear_hillshade()
+    assert not state.has_normal_map() and not state.has_hillshade()
+
+def test_sky_view():
+    state = State()
+    assert not state.has_sky_view()
+    state.set_sky_view(32, 2000.0)
+    assert state.get_sky_view() == (32, 2000.0)
+    assert '-Sky-view factor: 32 directions within 2000.0 m' in str(state)
+    state.clear_sky_view()
+    assert not state.has_sky_view()
+
+def test_satellite_encoding():
+    state = State()
+    assert not state.has_satellite_encoding()
+    assert state.get_satellite_encoding() == ('png', None)
+    state.set_satellite_encoding('webp', 80)
+    assert state.get_satellite_encoding() == ('webp', 80)
+    assert '-Satellite/aerial image encoding: webp (quality 80)' in str(state)
+    state.clear_satellite_encoding()
+    assert not state.has_satellite_encoding()
+
+def test_satellite_mipmaps():
+    state = State()
+    assert not state.has_satellite_mipmaps()
+    state.set_satellite_mipmaps('lanczos')
+    assert state.get_satellite_mipmaps() == 'lanczos'
+    assert '-Satellite/aerial image mipmaps: lanczos filter' in str(state)
+    state.clear_satellite_mipmaps()
+    assert not state.has_satellite_mipmaps()
+
+def test_terrain_mesh():
+    state = State()
+    assert not state.has_terrain_mesh()
+    state.set_terrain_mesh(0.5)
+    assert state.get_terrain_mesh() == 0.5
+    assert '-Terrain mesh: max error 0.5 m' in str(state)
+    state.clear_terrain_mesh()
+    assert not state.has_terrain_mesh()
+
+def test_contours():
+    state = State()
+    assert not state.has_contours()
+    state.set_contours(10.0, 0.5)
+    assert state.get_contours() == (10.0, 0.5)
+    assert '-Contour lines: every 10.0 m, simplified within 0.5 cells' in str(state)
+    state.clear_contours()
+    assert not state.has_contours()
+
+def test_satellite_palette():
+    state = State()
+    assert not state.has_satellite_palette()
+    state.set_satellite_palette(64, 'median-cut', True)
+    assert state.get_satellite_palette() == (64, 'median-cut', True)
+    assert '-Satellite/aerial image palette: 64 colors (median-cut, dithered)' in str(state)
+    state.clear_satellite_palette()
+    assert not state.has_satellite_palette()
+
+def test_satellite_texture():
+    state = State()
+    assert not state.has_satellite_texture()
+    state.set_satellite_texture('etc2')
+    assert state.get_satellite_texture() == 'etc2'
+    assert '-Satellite/aerial GPU texture: etc2 in KTX' in str(state)
+    state.clear_satellite_texture()
+    assert not state.has_satellite_texture()
+
+def test_optimized_satellite_files():
+    state = State()
+    assert not state.has_optimized_satellite_files()
+    assert state.get_optimized_satellite_file('/data/a.tif') is None
+    copy = {'path': '/copies/a.tif', 'fingerprint': [10, 1.5], 'pixel_size': 1.2, 'overviews': [2, 4]}
+    state.set_optimized_satellite_file('/data/a.tif', copy)
+    assert state.get_optimized_satellite_file('/data/a.tif') == copy
+    assert State.from_dict(state.to_dict()).get_optimized_satellite_file('/data/a.tif') == copy
+    assert '-Optimized satellite/aerial files: 1' in str(state)
+    state.clear_optimized_satellite_files()
+    assert not state.has_optimized_satellite_files()
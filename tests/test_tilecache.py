@@ -0,0 +1,116 @@
+import os
+import time
+import shutil
+from os import path
+from mapcreator.tilecache import TileCache
+
+TEMP_DIR = '.test_tilecache'
+CACHE_DIR = path.join(TEMP_DIR, 'cache')
+
+def setup_function(function):
+    if not path.exists(TEMP_DIR):
+        os.mkdir(TEMP_DIR)
+
+def teardown_function(function):
+    if path.exists(TEMP_DIR):
+        shutil.rmtree(TEMP_DIR)
+
+def source(name, content = 'source'):
+    fpath = path.join(TEMP_DIR, name)
+    with open(fpath, 'w') as f:
+        f.write(content)
+    return fpath
+
+def writer(size):
+    def write(outpath):
+        with open(outpath, 'wb') as f:
+            f.write(b'x' * size)
+    return write
+
+def age(fpath, seconds):
+    when = time.time() - seconds
+    os.utime(fpath, (when, when))
+
+def test_key():
+    cache = TileCache(CACHE_DIR, 1000)
+    a = source('a.tif')
+    key = cache.key(a, 10, None, 'EPSG:3857')
+    assert key == cache.key(path.abspath(a), 10, None, 'EPSG:3857')
+    assert key != cache.key(a, 30, None, 'EPSG:3857')
+    assert key != cache.key(a, 10, 'EPSG:4326', 'EPSG:3857')
+    assert key != cache.key(a, 10, None, 'EPSG:3857', 2)
+    assert key != cache.key(source('b.tif'), 10, None, 'EPSG:3857')
+    source('a.tif', 'changed source')
+    assert key != cache.key(a, 10, None, 'EPSG:3857')
+    assert cache.key(path.join(TEMP_DIR, 'missing.tif'), 10, None, 'EPSG:3857') is None
+
+def test_get_or_put():
+    cache = TileCache(CACHE_DIR, 1000)
+    key = cache.key(source('a.tif'), 10, None, 'EPSG:3857')
+    assert cache.get(key) is None
+    tilepath, cached = cache.get_or_put(key, writer(10))
+    assert not cached
+    assert tilepath == cache.tile_path(key)
+    assert path.getsize(tilepath) == 10
+    assert cache.get_or_put(key, writer(20)) == (tilepath, True)
+    assert path.getsize(tilepath) == 10
+    # Only the finished entry is left in the cache
+    assert os.listdir(path.dirname(tilepath)) == [path.basename(tilepath)]
+
+def test_put_when_nothing_is_written():
+    cache = TileCache(CACHE_DIR, 1000)
+    key = cache.key(source('a.tif'), 10, None, 'EPSG:3857')
+    assert cache.put(key, lambda outpath: None) is None
+    assert cache.get(key) is None
+
+def test_pull_is_kept_from_eviction():
+    cache = TileCache(CACHE_DIR, 1000)
+    key = cache.key(source('a.tif'), 10, None, 'EPSG:3857')
+    outpath = path.join(TEMP_DIR, 'pulled.tif')
+    assert cache.pull(key, writer(10), outpath) == (True, False)
+    assert cache.pull(key, writer(20), outpath) == (True, True)
+    # Another build evicts the entry before this one reads it
+    assert TileCache(CACHE_DIR, 0).evict() == [cache.tile_path(key)]
+    assert cache.get(key) is None
+    assert path.getsize(outpath) == 10
+
+def test_pull_when_evicted_after_get():
+    cache = TileCache(CACHE_DIR, 1000)
+    key = cache.key(source('a.tif'), 10, None, 'EPSG:3857')
+    cache.put(key, writer(10))
+    get = cache.get
+    def get_then_evict(key):
+        tilepath = get(key)
+        TileCache(CACHE_DIR, 0).evict()
+        return tilepath
+    cache.get = get_then_evict
+    outpath = path.join(TEMP_DIR, 'pulled.tif')
+    # The entry is gone by the time it's linked, so it's written again
+    assert cache.pull(key, writer(20), outpath) == (True, False)
+    assert path.getsize(outpath) == 20
+
+def test_evict_least_recently_used():
+    cache = TileCache(CACHE_DIR, 250)
+    keys = [cache.key(source('{}.tif'.format(i)), 10, None, 'EPSG:3857') for i in range(4)]
+    tilepaths = [cache.put(key, writer(100)) for key in keys]
+    for tilepath, seconds in zip(tilepaths, (400, 300, 200, 100)):
+        age(tilepath, seconds)
+    cache.get(keys[0]) # Using an entry makes it the most recent
+    assert cache.size() == 400
+    assert cache.evict(keep=[tilepaths[1]]) == [tilepaths[2], tilepaths[3]]
+    assert cache.size() == 200
+    assert cache.evict() == []
+    assert cache.get(keys[0]) == tilepaths[0]
+    assert cache.get(keys[1]) == tilepaths[1]
+
+def test_stale_temporary_files_are_removed():
+    cache = TileCache(CACHE_DIR, 1000)
+    key = cache.key(source('a.tif'), 10, None, 'EPSG:3857')
+    tilepath = cache.put(key, writer(10))
+    stale, fresh = tilepath + '.stale.tmp', tilepath + '.fresh.tmp'
+    writer(10)(stale)
+    writer(10)(fresh)
+    age(stale, 2 * 24 * 60 * 60)
+    assert cache.size() == 10
+    assert not path.exists(stale)
+    assert path.exists(fresh)
@@ -0,0 +1,90 @@
+import shutil
+import numpy as np
+from os import path, mkdir
+from mapcreator.osm import OSMData, trailFilter
+from mapcreator.envi import EnviRaster, format_map_info
+from mapcreator.mercator import lonlat_to_mercator
+from mapcreator.trailgraph import TrailGraph
+from util import get_resource_path
+
+TEMP_DIR = '.test_trailgraph'
+
+def setup_function(function):
+    if not path.exists(TEMP_DIR):
+        mkdir(TEMP_DIR)
+
+def load_graph(heightmap = None):
+    data = OSMData.load(get_resource_path('test_trailgraph_input.xml'))
+    return TrailGraph.from_osmdata([data], [trailFilter], heightmap)
+
+def edge_set(graph):
+    return set(
+        (graph.node_ids[a], graph.node_ids[b], way) 
+        for a, b, way in zip(graph.edge_from, graph.edge_to, graph.edge_way_ids)
+    )
+
+def test_graph_contains_only_junctions():
+    graph = load_graph()
+    assert sorted(graph.node_ids) == [1, 2, 3, 5]
+    assert edge_set(graph) == {(1, 2, 100), (2, 3, 100), (2, 5, 200)}
+    assert not graph.has_elevation
+
+def test_edge_lengths():
+    graph = load_graph()
+    lengths = dict(((graph.node_ids[a], graph.node_ids[b]), l) for a, b, l in zip(graph.edge_from, graph.edge_to, graph.edge_lengths))
+    assert abs(lengths[(1, 2)] - 111.2) < 0.5
+    assert abs(lengths[(2, 5)] - 2 * 89.9) < 1
+
+def test_csr_adjacency():
+    graph = load_graph()
+    offsets, neighbours, edges = graph.to_csr()
+    assert offsets[-1] == 2 * graph.edge_count()
+    junction = graph.node_index[2]
+    adjacent = set(graph.node_ids[n] for n in neighbours[offsets[junction]:offsets[junction + 1]])
+    assert adjacent == {1, 3, 5}
+    for node in range(graph.node_count()):
+        for n, e in zip(neighbours[offsets[node]:offsets[node + 1]], edges[offsets[node]:offsets[node + 1]]):
+            assert {node, n} == {graph.edge_from[e], graph.edge_to[e]}
+
+def test_elevation_gain_from_heightmap():
+    # Heightmap rising 1 m per 10 m northwards
+    ulx, uly = lonlat_to_mercator(-112.11, 36.11)
+    data = np.tile((np.arange(300, dtype=np.float32)[::-1] * 10)[:, None], (1, 300))
+    header = EnviRaster.create_header(300, 300, np.float32, format_map_info('Pseudo Mercator', ulx, uly, 10, 10))
+    graph = load_graph(EnviRaster(data, header))
+    assert graph.has_elevation
+    for a, b, ascent, descent in zip(graph.edge_from, graph.edge_to, graph.edge_ascents, graph.edge_descents):
+        climb = graph.node_elevations[b] - graph.node_elevations[a]
+        assert abs(ascent - max(climb, 0)) < 0.01
+        assert abs(descent - max(-climb, 0)) < 0.01
+    index = graph.node_index
+    assert graph.node_elevations[index[3]] > graph.node_elevations[index[1]]
+
+def test_elevation_from_height_tiles():
+    ulx, uly = lonlat_to_mercator(-112.11, 36.11)
+    data = np.tile((np.arange(300, dtype=np.float32)[::-1] * 10)[:, None], (1, 300))
+    whole = EnviRaster(data, EnviRaster.create_header(300, 300, np.float32, format_map_info('Pseudo Mercator', ulx, uly, 10, 10)))
+    # The same heightmap as a northern and a southern tile
+    tiles = [
+        EnviRaster(data[:150], EnviRaster.create_header(300, 150, np.float32, format_map_info('Pseudo Mercator', ulx, uly, 10, 10))),
+        EnviRaster(data[150:], EnviRaster.create_header(300, 150, np.float32, format_map_info('Pseudo Mercator', ulx, uly - 1500, 10, 10))),
+    ]
+    expected = load_graph(whole)
+    graph = load_graph(tiles)
+    assert not np.isnan(graph.node_elevations).any()
+    assert np.allclose(graph.node_elevations, expected.node_elevations)
+    assert np.allclose(graph.edge_ascents, expected.edge_ascents)
+
+def test_save_and_load():
+    graph = load_graph()
+    outpath = path.join(TEMP_DIR, 'graph.bin')
+    graph.save(outpath)
+    loaded = TrailGraph.load(outpath)
+    assert loaded.node_ids == graph.node_ids
+    assert loaded.edge_from == graph.edge_from
+    assert loaded.edge_way_ids == graph.edge_way_ids
+    assert np.allclose(loaded.edge_lengths, graph.edge_lengths)
+
+def teardown_function(function):
+    if path.exists(TEMP_DIR):
+        shutil.rmtree(TEMP_DIR)
@@ -0,0 +1,139 @@
+import shutil
+import numpy as np
+from os import path, mkdir
+from mapcreator import vectortiles
+from mapcreator.vectortiles import Feature
+from mapcreator.osm import OSMData, trailFilter
+from util import get_resource_path
+
+TEMP_DIR = '.test_vectortiles'
+
+def setup_function(function):
+    if not path.exists(TEMP_DIR):
+        mkdir(TEMP_DIR)
+
+def decode_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return result, pos
+
+def decode_message(data):
+    fields = []
+    pos = 0
+    while pos < len(data):
+        key, pos = decode_varint(data, pos)
+        field, wiretype = key >> 3, key & 7
+        if wiretype == 0:
+            value, pos = decode_varint(data, pos)
+        elif wiretype == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        else:
+            length, pos = decode_varint(data, pos)
+            value, pos = data[pos:pos + length], pos + length
+        fields.append((field, value))
+    return fields
+
+def decode_packed(data):
+    values = []
+    pos = 0
+    while pos < len(data):
+        value, pos = decode_varint(data, pos)
+        values.append(value)
+    return values
+
+def test_tile_bounds_and_grid():
+    minx, miny, maxx, maxy = vectortiles.tile_bounds(0, 0, 0)
+    assert abs(minx + vectortiles.WORLD_HALF_SIZE) < 1e-6
+    assert abs(maxy - vectortiles.WORLD_HALF_SIZE) < 1e-6
+    bounds = vectortiles.tile_bounds(3, 2, 5)
+    inner = (bounds[0] + 1, bounds[1] + 1, bounds[2] - 1, bounds[3] - 1)
+    assert list(vectortiles.tiles_for_bounds(inner, 3)) == [(2, 5)]
+    assert list(vectortiles.tiles_for_bounds(inner, 4)) == [(4, 10), (4, 11), (5, 10), (5, 11)]
+
+def test_zigzag():
+    assert [vectortiles.zigzag(v) for v in (0, -1, 1, -2, 2)] == [0, 1, 2, 3, 4]
+
+def test_simplify_removes_collinear_points():
+    points = np.array([[0, 0], [1, 0.01], [2, 0], [3, 5]], dtype=float)
+    assert np.array_equal(vectortiles.simplify(points, 0.1), points[[0, 2, 3]])
+    assert np.array_equal(vectortiles.simplify(points, 0), points)
+
+def test_clip_line():
+    points = np.array([[-5, 5], [5, 5], [15, 5], [15, 15], [5, 8]], dtype=float)
+    parts = vectortiles.clip_line(points, (0, 0, 10, 10))
+    assert len(parts) == 2
+    assert np.allclose(parts[0], [[0, 5], [5, 5], [10, 5]])
+    assert np.allclose(parts[1][-1], [5, 8])
+
+def test_clip_polygon():
+    ring = np.array([[-5, -5], [5, -5], [5, 5], [-5, 5], [-5, -5]], dtype=float)
+    clipped = vectortiles.clip_polygon(ring, (0, 0, 10, 10))
+    assert abs(abs(vectortiles.ring_area(clipped)) - 25) < 1e-9
+    assert vectortiles.clip_polygon(ring, (20, 20, 30, 30)) is None
+
+def test_encode_linestring_geometry():
+    geometry = vectortiles.encode_geometry(vectortiles.GEOM_LINESTRING, [np.array([[2, 2], [2, 10], [10, 10]])])
+    assert geometry == [9, 4, 4, 18, 0, 16, 16, 0]
+
+def test_encode_polygon_geometry():
+    ring = np.array([[3, 6], [8, 12], [20, 34], [3, 6]])
+    geometry = vectortiles.encode_geometry(vectortiles.GEOM_POLYGON, [ring])
+    assert geometry == [9, 6, 12, 18, 10, 12, 24, 44, 15]
+
+def test_encoded_tile_structure():
+    bounds = vectortiles.tile_bounds(14, 3000, 6000)
+    coordinates = np.array([[bounds[0] + 10, bounds[3] - 10], [bounds[2] - 10, bounds[1] + 10]])
+    feature = Feature(42, vectortiles.GEOM_LINESTRING, coordinates, {'highway': 'path'})
+    tile = vectortiles.encode_tile([('trails', vectortiles.tile_features([(feature, coordinates)], bounds, 0))])
+    layers = decode_message(tile)
+    assert [field for field, value in layers] == [3]
+    layer = dict((field, value) for field, value in decode_message(layers[0][1]) if field != 2)
+    assert layer[15] == 2
+    assert layer[1] == b'trails'
+    assert layer[3] == b'highway'
+    assert layer[5] == vectortiles.EXTENT
+    features = [value for field, value in decode_message(layers[0][1]) if field == 2]
+    feature_fields = dict(decode_message(features[0]))
+    assert feature_fields[1] == 42
+    assert feature_fields[3] == vectortiles.GEOM_LINESTRING
+    assert decode_packed(feature_fields[2]) == [0, 0]
+
+def test_encoded_tile_without_negative_id():
+    bounds = vectortiles.tile_bounds(14, 3000, 6000)
+    coordinates = np.array([[bounds[0] + 10, bounds[3] - 10], [bounds[2] - 10, bounds[1] + 10]])
+    feature = Feature(-42, vectortiles.GEOM_LINESTRING, coordinates, {'highway': 'path'})
+    tile = vectortiles.encode_tile([('trails', vectortiles.tile_features([(feature, coordinates)], bounds, 0))])
+    layer = decode_message(decode_message(tile)[0][1])
+    features = [value for field, value in layer if field == 2]
+    feature_fields = dict(decode_message(features[0]))
+    assert 1 not in feature_fields
+    assert feature_fields[3] == vectortiles.GEOM_LINESTRING
+
+def test_encode_negative_varint():
+    try:
+        vectortiles.encode_varint(-1)
+        assert False
+    except ValueError:
+        pass
+
+def test_write_pyramid():
+    data = OSMData.load(get_resource_path('test_trailgraph_input.xml'))
+    features = vectortiles.features_from_osmdata([data], [trailFilter], vectortiles.GEOM_LINESTRING)
+    assert [f.id for f in features] == [100, 200]
+    minx, miny = vectortiles.lonlat_to_mercator(-112.11, 36.09)
+    maxx, maxy = vectortiles.lonlat_to_mercator(-112.09, 36.11)
+    written = vectortiles.write_pyramid([('trails', features)], (minx, miny, maxx, maxy), 10, 12, TEMP_DIR)
+    assert path.join(TEMP_DIR, vectortiles.METADATA_FILENAME) in written
+    tiles = [f for f in written if f.endswith('.mvt')]
+    assert len(tiles) >= 3
+    for zoom in (10, 11, 12):
+        assert any(f.startswith(path.join(TEMP_DIR, str(zoom), '')) for f in tiles)
+
+def teardown_function(function):
+    if path.exists(TEMP_DIR):
+        shutil.rmtree(TEMP_DIR)